@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+邀请码批量导入基准测试
+
+在临时SQLite数据库中导入指定数量的合成邀请码，输出耗时和吞吐量（JSON）。
+默认直接调用BulkImporter；--cli 时先把邀请码写入文件，再在子进程中运行
+cli.import_codes，计入读取文件和命令行工具本身的开销。
+
+使用方法:
+python -m benchmarks.import_bench --sizes 1000000,10000000
+python -m benchmarks.import_bench --sizes 100000 --cli
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from models.database import Base
+from services.bulk_importer import BulkImporter, DEFAULT_CHUNK_SIZE
+from services.offer_service import OfferService
+
+
+def synthetic_codes(count: int, duplicate_ratio: float, seed: int = 42):
+    """生成合成邀请码，按比例混入重复邀请码"""
+    rng = random.Random(seed)
+    recent = []
+    for _ in range(count):
+        if recent and rng.random() < duplicate_ratio:
+            yield rng.choice(recent)
+            continue
+        code = "%016X" % rng.getrandbits(64)
+        if len(recent) < 1000:
+            recent.append(code)
+        else:
+            recent[rng.randrange(1000)] = code
+        yield code
+
+
+def run_import_benchmark(size: int, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         duplicate_ratio: float = 0.01, workdir: str = None) -> dict:
+    """在全新的临时数据库中导入size个邀请码并返回计时结果"""
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        db_path = Path(tmp) / "import_bench.db"
+        engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(bind=engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        db = SessionLocal()
+        try:
+            OfferService(db).create_offer("bench", "导入基准测试")
+            started = time.perf_counter()
+            result = BulkImporter(db, chunk_size=chunk_size).import_codes(
+                "bench", synthetic_codes(size, duplicate_ratio)
+            )
+            elapsed = time.perf_counter() - started
+        finally:
+            db.close()
+            engine.dispose()
+
+        return {
+            "name": f"bulk_importer_{size}",
+            "throughput": round(size / elapsed, 1) if elapsed else None,
+            "size": size,
+            "chunk_size": chunk_size,
+            "seconds": round(elapsed, 3),
+            "codes_per_second": round(size / elapsed, 1) if elapsed else None,
+            "new_codes": result["new_codes"],
+            "duplicate_codes": result["duplicate_codes"],
+            "db_bytes": db_path.stat().st_size
+        }
+
+
+def run_cli_import_benchmark(size: int, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                             duplicate_ratio: float = 0.01, workdir: str = None) -> dict:
+    """把size个合成邀请码写入文件，在子进程中运行导入命令并计时"""
+    backend_dir = Path(__file__).parent.parent
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        db_path = Path(tmp) / "import_bench.db"
+        codes_path = Path(tmp) / "codes.txt"
+        with open(codes_path, "w", encoding="utf-8") as f:
+            for code in synthetic_codes(size, duplicate_ratio):
+                f.write(code + "\n")
+
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "cli.import_codes", "--offer", "bench", "--file", str(codes_path),
+             "--chunk-size", str(chunk_size)],
+            cwd=str(backend_dir), env=env, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        elapsed = time.perf_counter() - started
+
+        return {
+            "name": f"cli_import_{size}",
+            "throughput": round(size / elapsed, 1) if elapsed else None,
+            "size": size,
+            "chunk_size": chunk_size,
+            "seconds": round(elapsed, 3),
+            "file_bytes": codes_path.stat().st_size,
+            "db_bytes": db_path.stat().st_size
+        }
+
+
+def run_import_benchmarks(sizes, chunk_size: int = DEFAULT_CHUNK_SIZE, duplicate_ratio: float = 0.01,
+                          workdir: str = None, cli: bool = False) -> dict:
+    """按多个数据量依次运行导入基准测试"""
+    run = run_cli_import_benchmark if cli else run_import_benchmark
+    results = []
+    for size in sizes:
+        click.echo(f"⏱️  导入 {size} 个合成邀请码{'（命令行）' if cli else ''}...", err=True)
+        results.append(run(size, chunk_size, duplicate_ratio, workdir))
+    return {"benchmark": "cli_import" if cli else "import", "results": results}
+
+
+@click.command()
+@click.option('--sizes', default="1000000,10000000", show_default=True, help='逗号分隔的导入数量')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='每个事务写入的邀请码数量')
+@click.option('--duplicate-ratio', default=0.01, show_default=True, help='合成数据中重复邀请码的比例')
+@click.option('--workdir', default=None, help='临时数据库所在目录（默认系统临时目录）')
+@click.option('--cli', is_flag=True, help='通过 cli.import_codes 子进程导入文件')
+def main(sizes: str, chunk_size: int, duplicate_ratio: float, workdir: str = None, cli: bool = False):
+    """运行导入基准测试并以JSON输出结果"""
+    sizes = [int(s) for s in sizes.split(",") if s.strip()]
+    result = run_import_benchmarks(sizes, chunk_size, duplicate_ratio, workdir, cli)
+    click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
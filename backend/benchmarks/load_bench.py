@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+API负载基准测试
+
+在临时SQLite数据库中预置一个offer，然后用异步并发请求压测 /info 和 /claim，
+输出吞吐量和p50/p95/p99延迟（JSON）。应用可以在进程内运行（httpx的ASGI传输，
+不经过网络），也可以启动一个本地uvicorn进程（包含HTTP协议栈开销）。
+
+压测期间关闭按IP限流；防重复申请使用token模式，每个请求携带不同的client_token，
+与真实场景中大量不同客户端各领取一次的路径一致。
+
+使用方法:
+python -m benchmarks.load_bench --requests 2000 --concurrency 50
+python -m benchmarks.load_bench --mode uvicorn --endpoints claim
+python -m benchmarks.load_bench --endpoints claim --sqlite-profile compat
+python -m benchmarks.load_bench --mode uvicorn --endpoints claim --workers 4
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import click
+
+# 添加项目根目录到Python路径
+BACKEND_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.report import latency_summary
+
+MODE_INPROCESS = "inprocess"
+MODE_UVICORN = "uvicorn"
+
+OFFER_NAME = "loadbench"
+
+# SQLite连接配置：production为WAL+连接池，compat为默认的回滚日志+每次新建连接
+SQLITE_PROFILES = ("production", "compat")
+
+# 等待uvicorn启动的最长时间（秒）
+SERVER_START_TIMEOUT = 30
+
+
+def benchmark_env(db_path: Path, claim_pool: bool, sqlite_profile: str = "production") -> dict:
+    """被测应用使用的环境变量"""
+    return {
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "ASYNC_DATABASE_URL": "",
+        "DEBUG": "false",
+        "RATE_LIMIT_ENABLED": "false",
+        "CLAIM_DEDUP_KEY": "token",
+        "CLAIM_POOL_ENABLED": "true" if claim_pool else "false",
+        "CLAIM_POOL_JOURNAL_DIR": str(db_path.parent / "journal"),
+        "SQLITE_PRODUCTION_PROFILE": "true" if sqlite_profile == "production" else "false",
+    }
+
+
+def seed_database(code_count: int):
+    """按当前环境变量建表并导入邀请码（需在设置环境变量之后调用）"""
+    from models.database import SessionLocal, create_tables
+    from services.bulk_importer import BulkImporter
+    from services.offer_service import OfferService
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        OfferService(db).create_offer(OFFER_NAME, "负载基准测试")
+        BulkImporter(db).import_codes(OFFER_NAME, (f"LOAD{i:010d}" for i in range(code_count)))
+    finally:
+        db.close()
+
+
+async def drive(client, endpoint: str, total: int, concurrency: int) -> dict:
+    """以固定并发发送total个请求，返回吞吐量和延迟分布"""
+    latencies = []
+    statuses = Counter()
+    issued = 0
+
+    async def request(seq: int):
+        if endpoint == "info":
+            return await client.get(f"/api/v1/offers/{OFFER_NAME}/info")
+        return await client.post(
+            f"/api/v1/offers/{OFFER_NAME}/claim",
+            json={"user_agent": "LoadBench/1.0", "client_token": f"bench-{seq}"}
+        )
+
+    async def worker():
+        nonlocal issued
+        while issued < total:
+            seq = issued
+            issued += 1
+            start = time.perf_counter()
+            response = await request(seq)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "name": endpoint,
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput": round(total / elapsed, 1) if elapsed else None,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())}
+    }
+    result.update(latency_summary(latencies))
+    return result
+
+
+async def run_inprocess(endpoints, total: int, concurrency: int) -> list:
+    import httpx
+    from main import app
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return [await drive(client, endpoint, total, concurrency) for endpoint in endpoints]
+    finally:
+        await app.router.shutdown()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_uvicorn(endpoints, total: int, concurrency: int, env: dict, workers: int = 1) -> list:
+    import httpx
+
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--no-access-log",
+         "--workers", str(workers)],
+        cwd=str(BACKEND_DIR), env=dict(os.environ, **env),
+        # 服务进程的启动信息同样输出到stderr
+        stdout=sys.__stderr__
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            deadline = time.monotonic() + SERVER_START_TIMEOUT
+            while True:
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise click.ClickException("uvicorn启动失败")
+                await asyncio.sleep(0.1)
+            return [await drive(client, endpoint, total, concurrency) for endpoint in endpoints]
+    finally:
+        server.terminate()
+        server.wait(timeout=SERVER_START_TIMEOUT)
+
+
+def run_load_benchmark(mode: str = MODE_INPROCESS, endpoints=("info", "claim"), total: int = 2000,
+                       concurrency: int = 50, claim_pool: bool = False, workdir: str = None,
+                       sqlite_profile: str = "production", workers: int = 1) -> dict:
+    """在全新的临时数据库上压测，返回JSON可序列化的结果
+
+    进程内模式会在当前进程中导入应用，设置必须在导入前通过环境变量生效，
+    所以同一进程中只能运行一次；需要多次运行时请使用 benchmarks.suite。
+    """
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        env = benchmark_env(Path(tmp) / "load_bench.db", claim_pool, sqlite_profile)
+        # 多个工作进程时按默认配置开启分区领取
+        env["WORKERS"] = str(workers)
+        os.environ.update(env)
+        # 预留足够的邀请码，保证压测期间不会领完（多进程领取池时每个进程各自预留一批）
+        spare = workers * int(os.getenv("CLAIM_POOL_BLOCK_SIZE", "500")) if claim_pool else 0
+        seed_database(total + 1 + spare)
+
+        if mode == MODE_UVICORN:
+            results = asyncio.run(run_uvicorn(endpoints, total, concurrency, env, workers))
+        else:
+            results = asyncio.run(run_inprocess(endpoints, total, concurrency))
+
+    return {
+        "benchmark": "load",
+        "mode": mode,
+        "claim_pool": claim_pool,
+        "sqlite_profile": sqlite_profile,
+        "workers": workers,
+        "results": results
+    }
+
+
+@click.command()
+@click.option('--mode', type=click.Choice([MODE_INPROCESS, MODE_UVICORN]), default=MODE_INPROCESS,
+              show_default=True, help='进程内ASGI调用或本地uvicorn')
+@click.option('--endpoints', default="info,claim", show_default=True, help='逗号分隔的压测接口')
+@click.option('--requests', 'total', default=2000, show_default=True, help='每个接口的请求数')
+@click.option('--concurrency', default=50, show_default=True, help='并发请求数')
+@click.option('--claim-pool', is_flag=True, help='开启领取池')
+@click.option('--workdir', default=None, help='临时数据库所在目录（默认系统临时目录）')
+@click.option('--sqlite-profile', type=click.Choice(SQLITE_PROFILES), default="production",
+              show_default=True, help='SQLite连接配置')
+@click.option('--workers', default=1, show_default=True, help='uvicorn工作进程数（仅uvicorn模式）')
+def main(mode: str, endpoints: str, total: int, concurrency: int, claim_pool: bool, workdir: str = None,
+         sqlite_profile: str = "production", workers: int = 1):
+    """运行API负载基准测试并以JSON输出结果"""
+    names = [name.strip() for name in endpoints.split(",") if name.strip()]
+    unknown = set(names) - {"info", "claim"}
+    if unknown:
+        raise click.ClickException(f"未知的接口: {', '.join(sorted(unknown))}")
+
+    click.echo(f"⏱️  压测 {', '.join(names)}: {total} 个请求, 并发 {concurrency} ({mode})", err=True)
+    # 应用启动时的提示信息输出到stderr，保证stdout只有JSON结果
+    with contextlib.redirect_stdout(sys.stderr):
+        if workers > 1 and mode != MODE_UVICORN:
+            raise click.ClickException("--workers 需要配合 --mode uvicorn 使用")
+        result = run_load_benchmark(mode, names, total, concurrency, claim_pool, workdir, sqlite_profile, workers)
+    click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
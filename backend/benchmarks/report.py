@@ -0,0 +1,86 @@
+"""
+基准测试结果的统计与基线比较
+
+基线是之前某次运行保存下来的JSON结果。比较时按 (benchmark, 名称) 对齐各项结果：
+吞吐量下降或p95延迟上升超过容忍比例即判定为性能回退。
+"""
+
+import json
+import math
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 默认的基线文件
+DEFAULT_BASELINE = Path(__file__).parent / "baselines" / "default.json"
+
+# 默认容忍比例（机器负载会带来一定波动）
+DEFAULT_TOLERANCE = 0.25
+
+
+def percentile(sorted_samples: List[float], p: float) -> float:
+    """最近秩法百分位数，samples需已排序"""
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_samples)))
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+
+def latency_summary(samples_seconds: List[float]) -> dict:
+    """延迟分布（毫秒）"""
+    samples = sorted(samples_seconds)
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3) if samples else 0.0
+    }
+
+
+def _index(report: dict) -> Dict[tuple, dict]:
+    """把一次运行的结果按 (benchmark, 名称) 建立索引"""
+    indexed = {}
+    for run in report.get("runs", []):
+        for result in run.get("results", []):
+            indexed[(run["benchmark"], result["name"])] = result
+    return indexed
+
+
+def compare(report: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> List[dict]:
+    """与基线比较，返回每个可比较指标的结果（regression为True表示回退）"""
+    baseline_index = _index(baseline)
+    comparisons = []
+    for key, result in _index(report).items():
+        base = baseline_index.get(key)
+        if not base:
+            continue
+        # 吞吐量越高越好，p95延迟越低越好
+        for metric, higher_is_better in (("throughput", True), ("p95_ms", False)):
+            current, previous = result.get(metric), base.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            regression = change < -tolerance if higher_is_better else change > tolerance
+            comparisons.append({
+                "benchmark": key[0],
+                "name": key[1],
+                "metric": metric,
+                "baseline": previous,
+                "current": current,
+                "change": round(change, 3),
+                "regression": regression
+            })
+    return comparisons
+
+
+def load_report(path: Path) -> Optional[dict]:
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_report(path: Path, report: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+        f.write("\n")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+热点读接口响应编码微基准测试
+
+比较 /info、/stats 响应体的几种生成方式（不含网络和数据库）：
+- pydantic: 原来的路径，字典经过响应模型校验、jsonable_encoder，再由JSONResponse编码
+- encoded: /info 缓存命中时直接返回缓存中编码好的bytes；/stats 用fast_json直接编码并计算ETag
+- not_modified: If-None-Match 与ETag一致，返回不带响应体的304
+
+使用方法:
+python -m benchmarks.response_bench
+python -m benchmarks.response_bench --iterations 50000
+"""
+
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import click
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from schemas import OfferInfoResponse, StatsResponse
+from services import fast_json
+from services.offer_cache import OfferInfoCache
+
+
+def sample_info() -> dict:
+    return {
+        "name": "bench",
+        "title": "响应编码基准测试",
+        "description": "用于比较响应体生成方式的示例offer",
+        "total_count": 1000000,
+        "remaining_count": 734211,
+        "is_active": True
+    }
+
+
+def sample_stats() -> dict:
+    """与 OfferService.get_offer_stats 结构相同的统计数据（10条最近记录，60+48个分桶）"""
+    now = datetime.now().replace(second=0, microsecond=0)
+    return {
+        "total_codes": 1000000,
+        "used_codes": 265789,
+        "remaining_codes": 734211,
+        "leased_codes": 0,
+        "usage_rate": 0.266,
+        "recent_claims": [
+            {"code": f"AB****{i:02d}", "claimed_at": now - timedelta(seconds=i * 7), "user_ip": f"10.0.0.{i}"}
+            for i in range(10)
+        ],
+        "claims_per_minute": [{"start": now - timedelta(minutes=i), "count": i * 3} for i in range(60, 0, -1)],
+        "claims_per_hour": [{"start": now - timedelta(hours=i), "count": i * 40} for i in range(48, 0, -1)]
+    }
+
+
+def _time(fn, iterations: int) -> dict:
+    fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "throughput": round(iterations / elapsed, 1) if elapsed else None,
+        "us_per_op": round(elapsed / iterations * 1e6, 2)
+    }
+
+
+def run_response_benchmarks(iterations: int = 20000) -> dict:
+    info = sample_info()
+    stats = sample_stats()
+
+    cache = OfferInfoCache(ttl_ms=3600 * 1000)
+    body, etag = cache.put("bench", OfferInfoResponse(data=info).dict())
+    stats_body = fast_json.dumps({"success": True, "message": None, "data": stats})
+    stats_etag = fast_json.make_etag(stats_body)
+    # 两条路径生成的内容一致
+    assert json.loads(JSONResponse(jsonable_encoder(StatsResponse(data=stats))).body) == json.loads(stats_body)
+
+    def json_with_etag(content: bytes, tag: str, if_none_match: str = None) -> Response:
+        headers = {"ETag": tag, "Cache-Control": "no-cache"}
+        if fast_json.etag_matches(if_none_match, tag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=content, media_type="application/json", headers=headers)
+
+    def info_pydantic():
+        return JSONResponse(jsonable_encoder(OfferInfoResponse(data=info)))
+
+    def info_encoded():
+        return json_with_etag(*cache.get_encoded("bench"))
+
+    def info_not_modified():
+        return json_with_etag(*cache.get_encoded("bench"), if_none_match=etag)
+
+    def stats_pydantic():
+        return JSONResponse(jsonable_encoder(StatsResponse(data=stats)))
+
+    def stats_encoded():
+        content = fast_json.dumps({"success": True, "message": None, "data": stats})
+        return json_with_etag(content, fast_json.make_etag(content))
+
+    def stats_not_modified():
+        content = fast_json.dumps({"success": True, "message": None, "data": stats})
+        return json_with_etag(content, fast_json.make_etag(content), if_none_match=stats_etag)
+
+    results = []
+    for name, fn in [
+        ("info_pydantic", info_pydantic),
+        ("info_encoded", info_encoded),
+        ("info_not_modified", info_not_modified),
+        ("stats_pydantic", stats_pydantic),
+        ("stats_encoded", stats_encoded),
+        ("stats_not_modified", stats_not_modified),
+    ]:
+        click.echo(f"⏱️  {name}...", err=True)
+        results.append(dict(name=name, **_time(fn, iterations)))
+
+    baseline = {r["name"].split("_")[0]: r["us_per_op"] for r in results if r["name"].endswith("_pydantic")}
+    for result in results:
+        result["speedup"] = round(baseline[result["name"].split("_")[0]] / result["us_per_op"], 1)
+    return {
+        "benchmark": "responses",
+        "encoder": fast_json.ENCODER,
+        "info_bytes": len(body),
+        "stats_bytes": len(stats_body),
+        "results": results
+    }
+
+
+@click.command()
+@click.option('--iterations', default=20000, show_default=True, help='每种方式的执行次数')
+def main(iterations: int):
+    """运行响应编码微基准测试并以JSON输出结果"""
+    click.echo(json.dumps(run_response_benchmarks(iterations), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
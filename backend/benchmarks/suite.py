@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+基准测试套件
+
+依次运行API负载测试（/info、/claim）和命令行导入测试，把结果汇总为一个JSON报告，
+并与保存的基线比较：吞吐量下降或p95延迟上升超过容忍比例时标记为回退，退出码为1。
+
+基线与机器相关，更换机器或调整参数后请用 --save-baseline 重新生成。
+
+使用方法:
+python -m benchmarks.suite
+python -m benchmarks.suite --output result.json
+python -m benchmarks.suite --save-baseline
+"""
+
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import click
+
+# 添加项目根目录到Python路径
+BACKEND_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.import_bench import run_import_benchmarks
+from benchmarks.load_bench import MODE_INPROCESS, MODE_UVICORN, SQLITE_PROFILES
+from benchmarks.report import DEFAULT_BASELINE, DEFAULT_TOLERANCE, compare, load_report, save_report
+
+
+def run_load(mode: str, total: int, concurrency: int, claim_pool: bool,
+             sqlite_profile: str = "production") -> dict:
+    """在独立进程中运行负载测试（应用配置在导入时读取环境变量，每次运行需要新进程）"""
+    command = [sys.executable, "-m", "benchmarks.load_bench", "--mode", mode,
+               "--requests", str(total), "--concurrency", str(concurrency),
+               "--sqlite-profile", sqlite_profile]
+    if claim_pool:
+        command.append("--claim-pool")
+    output = subprocess.run(command, cwd=str(BACKEND_DIR), check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    return json.loads(output)
+
+
+@click.command()
+@click.option('--mode', type=click.Choice([MODE_INPROCESS, MODE_UVICORN]), default=MODE_INPROCESS,
+              show_default=True, help='负载测试的运行方式')
+@click.option('--requests', 'total', default=2000, show_default=True, help='每个接口的请求数')
+@click.option('--concurrency', default=50, show_default=True, help='并发请求数')
+@click.option('--claim-pool', is_flag=True, help='负载测试开启领取池')
+@click.option('--sqlite-profile', type=click.Choice(SQLITE_PROFILES), default="production",
+              show_default=True, help='负载测试使用的SQLite连接配置')
+@click.option('--import-sizes', default="100000,1000000", show_default=True, help='逗号分隔的导入数量')
+@click.option('--output', '-o', default=None, help='报告输出文件（默认只输出到stdout）')
+@click.option('--baseline', default=str(DEFAULT_BASELINE), show_default=True, help='基线文件')
+@click.option('--save-baseline', is_flag=True, help='把本次结果保存为基线')
+@click.option('--tolerance', default=DEFAULT_TOLERANCE, show_default=True, help='判定回退的容忍比例')
+def main(mode: str, total: int, concurrency: int, claim_pool: bool, sqlite_profile: str, import_sizes: str,
+         output: str = None, baseline: str = None, save_baseline: bool = False,
+         tolerance: float = DEFAULT_TOLERANCE):
+    """运行全部基准测试并与基线比较"""
+    config = {
+        "mode": mode,
+        "requests": total,
+        "concurrency": concurrency,
+        "claim_pool": claim_pool,
+        "sqlite_profile": sqlite_profile,
+        "import_sizes": [int(s) for s in import_sizes.split(",") if s.strip()]
+    }
+
+    click.echo(f"⏱️  负载测试: {total} 个请求, 并发 {concurrency} ({mode})", err=True)
+    runs = [run_load(mode, total, concurrency, claim_pool, sqlite_profile)]
+    if config["import_sizes"]:
+        runs.append(run_import_benchmarks(config["import_sizes"], cli=True))
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": config,
+        "runs": runs
+    }
+
+    baseline_path = Path(baseline)
+    previous = None if save_baseline else load_report(baseline_path)
+    regressions = []
+    if previous:
+        if previous.get("config") != config:
+            click.echo("⚠️  基线的测试参数与本次不同，比较结果仅供参考", err=True)
+        report["baseline"] = str(baseline_path)
+        report["comparisons"] = compare(report, previous, tolerance)
+        regressions = [c for c in report["comparisons"] if c["regression"]]
+
+    if output:
+        save_report(Path(output), report)
+    click.echo(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if save_baseline:
+        save_report(baseline_path, report)
+        click.echo(f"💾 已保存基线: {baseline_path}", err=True)
+    elif not previous:
+        click.echo(f"ℹ️  没有找到基线 {baseline_path}，可以使用 --save-baseline 保存本次结果", err=True)
+
+    for c in regressions:
+        click.echo(f"❌ 性能回退: {c['benchmark']}/{c['name']} {c['metric']} "
+                   f"{c['baseline']} -> {c['current']} ({c['change']:+.1%})", err=True)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
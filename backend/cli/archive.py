@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+已发放邀请码归档工具
+
+把发放超过指定天数的邀请码分批移到 invitation_codes_archive 表，每批一个短事务，
+服务运行期间也可以执行。
+
+使用方法:
+python -m cli.archive                    # 按配置的天数归档
+python -m cli.archive --days 7           # 归档7天前发放的邀请码
+python -m cli.archive --days 7 --dry-run # 只统计待归档数量
+"""
+
+import click
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config.settings import settings
+from models.database import SessionLocal, create_tables
+from services.code_archiver import archive_used_codes, count_archivable
+
+@click.command()
+@click.option('--days', '-d', type=float, default=None, help='归档发放超过该天数的邀请码（默认 CODE_ARCHIVE_AFTER_DAYS）')
+@click.option('--batch-size', '-b', type=int, default=None, help='每批归档的数量（默认 CODE_ARCHIVE_BATCH_SIZE）')
+@click.option('--dry-run', is_flag=True, help='只统计待归档数量，不移动数据')
+def main(days: float = None, batch_size: int = None, dry_run: bool = False):
+    """归档已发放的邀请码"""
+    days = settings.code_archive_after_days if days is None else days
+    batch_size = batch_size or settings.code_archive_batch_size
+    older_than = datetime.now() - timedelta(days=days)
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        if dry_run:
+            count = count_archivable(db, older_than)
+            click.echo(f"ℹ️  {count} 个邀请码发放于 {older_than:%Y-%m-%d %H:%M} 之前，可以归档（未移动）")
+            return
+
+        archived = archive_used_codes(
+            db, older_than, batch_size=batch_size,
+            pause_seconds=settings.code_archive_pause_ms / 1000.0
+        )
+    finally:
+        db.close()
+    click.echo(f"✅ 已归档 {archived} 个发放于 {older_than:%Y-%m-%d %H:%M} 之前的邀请码")
+
+if __name__ == '__main__':
+    main()
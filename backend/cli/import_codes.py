@@ -4,29 +4,94 @@
 
 使用方法:
 python -m cli.import_codes --offer fellou --file codes.txt
+python -m cli.import_codes --offer fellou --file codes.txt.gz --resume
+cat codes.txt | python -m cli.import_codes --offer fellou --file -
+
+支持纯文本、gzip（.gz）和zstd（.zst，需要安装zstandard）文件，按块流式读取，
+每块提交后写入检查点，中断后可用 --resume 从上次提交的位置继续导入。
 """
 
 import click
-import sys
+import gzip
+import io
+import json
 import os
+import sys
+import time
+from datetime import datetime
 from pathlib import Path
 from tqdm import tqdm
-from typing import List
+from typing import List, Optional
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from models.database import SessionLocal, create_tables
 from models.offer import Offer
-from services.code_service import CodeService
+from services.bulk_importer import BulkImporter, DEFAULT_CHUNK_SIZE
 from services.offer_service import OfferService
 
+STDIN_PATH = "-"
+
+# 跳过已导入部分时每次读取的字节数
+SKIP_READ_SIZE = 1024 * 1024
+
+
+def open_code_source(file_path: str):
+    """以二进制流打开邀请码来源，支持标准输入、gzip和zstd"""
+    if file_path == STDIN_PATH:
+        return sys.stdin.buffer
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    if file_path.endswith((".zst", ".zstd")):
+        try:
+            import zstandard
+        except ImportError:
+            raise click.ClickException("读取zstd文件需要安装zstandard: pip install zstandard")
+        # zstd的读取流不支持按行迭代，包一层缓冲读取器
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(file_path, "rb"), closefd=True)
+        )
+    return open(file_path, "rb")
+
+
+class CodeReader:
+    """逐行流式读取邀请码，并记录已读取的（解压后）字节偏移"""
+
+    def __init__(self, stream, offset: int = 0):
+        self.stream = stream
+        self.offset = 0
+        if offset:
+            self._skip_to(offset)
+
+    def _skip_to(self, offset: int):
+        """跳到指定偏移，不支持seek的流通过读取丢弃"""
+        try:
+            self.stream.seek(offset)
+            self.offset = offset
+            return
+        except (AttributeError, OSError, ValueError):
+            pass
+        while self.offset < offset:
+            data = self.stream.read(min(SKIP_READ_SIZE, offset - self.offset))
+            if not data:
+                raise click.ClickException("输入数据比检查点记录的位置短，无法续传")
+            self.offset += len(data)
+
+    def __iter__(self):
+        for line in self.stream:
+            # 先更新偏移再产出，保证每块提交时offset正好位于该块最后一行之后
+            self.offset += len(line)
+            code = line.strip()
+            if code:
+                yield code.decode("utf-8")
+
+
 def read_codes_from_file(file_path: str) -> List[str]:
-    """从文件读取邀请码"""
+    """从文件读取全部邀请码（小文件便捷方法，导入命令使用流式读取）"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            codes = [line.strip() for line in f if line.strip()]
-        return codes
+        with open_code_source(file_path) as stream:
+            return list(CodeReader(stream))
     except FileNotFoundError:
         click.echo(f"❌ 文件不存在: {file_path}", err=True)
         sys.exit(1)
@@ -34,37 +99,85 @@ def read_codes_from_file(file_path: str) -> List[str]:
         click.echo(f"❌ 读取文件失败: {str(e)}", err=True)
         sys.exit(1)
 
+
+def default_checkpoint_path(offer: str, file_path: str) -> Path:
+    return Path(f"{file_path}.{offer}.checkpoint.json")
+
+
+def load_checkpoint(path: Path, offer: str, file_path: str) -> Optional[dict]:
+    """读取检查点，offer或文件不匹配时报错"""
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("offer") != offer or checkpoint.get("file") != os.path.abspath(file_path):
+        raise click.ClickException(f"检查点 {path} 不属于本次导入的offer或文件")
+    if checkpoint.get("file_size") != os.path.getsize(file_path):
+        raise click.ClickException(f"文件在上次导入后发生了变化，无法续传，请删除检查点 {path} 后重新导入")
+    return checkpoint
+
+
+def save_checkpoint(path: Path, checkpoint: dict):
+    """原子写入检查点"""
+    checkpoint["updated_at"] = datetime.now().isoformat()
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
 @click.command()
 @click.option('--offer', '-o', required=True, help='Offer名称，如: fellou')
-@click.option('--file', '-f', required=True, help='邀请码文件路径')
+@click.option('--file', '-f', required=True, help='邀请码文件路径（支持 .gz/.zst，"-" 表示标准输入）')
 @click.option('--title', '-t', help='Offer显示标题（仅在创建新offer时使用）')
 @click.option('--description', '-d', help='Offer描述（仅在创建新offer时使用）')
-def main(offer: str, file: str, title: str = None, description: str = None):
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='每个事务写入的邀请码数量')
+@click.option('--resume', is_flag=True, help='从检查点记录的位置继续导入')
+@click.option('--checkpoint', 'checkpoint_file', help='检查点文件路径（默认: <文件>.<offer>.checkpoint.json）')
+def main(offer: str, file: str, title: str = None, description: str = None,
+         chunk_size: int = DEFAULT_CHUNK_SIZE, resume: bool = False, checkpoint_file: str = None):
     """导入邀请码到指定的offer"""
 
     # 确保数据库表已创建
     create_tables()
 
+    from_stdin = file == STDIN_PATH
+
     # 检查文件是否存在
-    if not os.path.exists(file):
+    if not from_stdin and not os.path.exists(file):
         click.echo(f"❌ 文件不存在: {file}", err=True)
         sys.exit(1)
 
-    # 读取邀请码文件
-    click.echo(f"📖 正在读取文件: {file}")
-    codes = read_codes_from_file(file)
-
-    if not codes:
-        click.echo("❌ 文件中没有找到有效的邀请码", err=True)
+    if from_stdin and resume:
+        click.echo("❌ 标准输入不支持 --resume", err=True)
         sys.exit(1)
 
-    click.echo(f"✅ 发现 {len(codes)} 个邀请码")
+    checkpoint_path = None
+    checkpoint = None
+    if not from_stdin:
+        checkpoint_path = Path(checkpoint_file) if checkpoint_file else default_checkpoint_path(offer, file)
+        if resume:
+            checkpoint = load_checkpoint(checkpoint_path, offer, file)
+            if not checkpoint:
+                click.echo(f"⚠️  未找到检查点 {checkpoint_path}，从头开始导入")
+        elif checkpoint_path.exists():
+            click.echo(f"⚠️  发现上次未完成的导入，如需续传请使用 --resume；本次从头开始导入")
+
+    if not checkpoint:
+        checkpoint = {
+            "offer": offer,
+            "file": os.path.abspath(file) if not from_stdin else None,
+            "file_size": os.path.getsize(file) if not from_stdin else None,
+            "byte_offset": 0,
+            "codes_processed": 0,
+            "new_codes": 0,
+            "duplicate_codes": 0
+        }
 
     # 数据库操作
     db = SessionLocal()
     try:
         offer_service = OfferService(db)
-        code_service = CodeService(db)
 
         # 检查offer是否存在，不存在则创建
         existing_offer = offer_service.get_offer_by_name(offer)
@@ -80,31 +193,60 @@ def main(offer: str, file: str, title: str = None, description: str = None):
             click.echo(f"📂 使用现有offer: {offer}")
 
         # 导入邀请码
-        click.echo(f"⬆️  正在导入邀请码到offer: {offer}")
-
-        # 使用进度条显示导入过程
-        with tqdm(total=len(codes), desc="导入进度", unit="码") as pbar:
-            batch_size = 100  # 批量处理
-            new_codes_total = 0
-            duplicate_codes_total = 0
-
-            for i in range(0, len(codes), batch_size):
-                batch_codes = codes[i:i+batch_size]
-                try:
-                    result = code_service.import_codes(offer, batch_codes)
-                    new_codes_total += result["new_codes"]
-                    duplicate_codes_total += result["duplicate_codes"]
-                except Exception as e:
-                    click.echo(f"\n❌ 导入批次失败: {str(e)}", err=True)
-                    continue
-
-                pbar.update(len(batch_codes))
+        start_offset = checkpoint["byte_offset"]
+        if start_offset:
+            click.echo(f"⏩ 从第 {start_offset} 字节继续导入（已处理 {checkpoint['codes_processed']} 个邀请码）")
+        click.echo(f"⬆️  正在流式导入邀请码到offer: {offer}")
+
+        # 压缩文件和标准输入无法预知解压后的大小，进度条只显示已读字节数
+        total_bytes = None
+        if not from_stdin and not file.endswith((".gz", ".zst", ".zstd")):
+            total_bytes = checkpoint["file_size"]
+
+        stream = open_code_source(file)
+        started = time.monotonic()
+        run_codes = 0
+        try:
+            reader = CodeReader(stream, start_offset)
+            with tqdm(total=total_bytes, initial=start_offset, desc="导入进度",
+                      unit="B", unit_scale=True, unit_divisor=1024) as pbar:
+                def on_chunk(processed: int, new_count: int, duplicate_count: int):
+                    nonlocal run_codes
+                    pbar.update(reader.offset - pbar.n)
+                    run_codes += processed
+                    elapsed = max(time.monotonic() - started, 1e-6)
+                    pbar.set_postfix(codes=checkpoint["codes_processed"] + processed,
+                                     codes_per_s=f"{run_codes / elapsed:,.0f}")
+
+                    checkpoint["byte_offset"] = reader.offset
+                    checkpoint["codes_processed"] += processed
+                    checkpoint["new_codes"] += new_count
+                    checkpoint["duplicate_codes"] += duplicate_count
+                    if checkpoint_path:
+                        save_checkpoint(checkpoint_path, checkpoint)
+
+                BulkImporter(db, chunk_size=chunk_size).import_codes(offer, reader, progress=on_chunk)
+        except Exception as e:
+            click.echo(f"\n❌ 导入中断: {str(e)}", err=True)
+            if checkpoint_path and checkpoint_path.exists():
+                click.echo(f"💾 已提交的进度保存在 {checkpoint_path}，修复问题后使用 --resume 继续导入", err=True)
+            sys.exit(1)
+        finally:
+            if not from_stdin:
+                stream.close()
+
+        if checkpoint_path and checkpoint_path.exists():
+            checkpoint_path.unlink()
+
+        if checkpoint["codes_processed"] == 0:
+            click.echo("❌ 文件中没有找到有效的邀请码", err=True)
+            sys.exit(1)
 
         # 显示结果
         click.echo(f"\n🎉 导入完成!")
-        click.echo(f"   新增邀请码: {new_codes_total}")
-        click.echo(f"   重复跳过: {duplicate_codes_total}")
-        click.echo(f"   处理总数: {len(codes)}")
+        click.echo(f"   新增邀请码: {checkpoint['new_codes']}")
+        click.echo(f"   重复跳过: {checkpoint['duplicate_codes']}")
+        click.echo(f"   处理总数: {checkpoint['codes_processed']}")
 
         # 显示最新统计
         updated_offer = offer_service.get_offer_by_name(offer)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+过期租约回收工具
+
+把两阶段领取中到期未确认的邀请码放回可领取的池子，每批一个短事务，服务运行期间也可以执行
+（服务进程默认每 CLAIM_LEASE_REAP_INTERVAL_SECONDS 秒自动回收一次）。
+
+使用方法:
+python -m cli.leases           # 回收已过期的租约
+python -m cli.leases --dry-run # 只统计已过期的租约数量
+"""
+
+import click
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config.settings import settings
+from models.database import SessionLocal, create_tables
+from services.lease_reaper import count_expired_leases, release_expired_leases
+
+@click.command()
+@click.option('--batch-size', '-b', type=int, default=None, help='每批回收的数量（默认 CLAIM_LEASE_REAP_BATCH_SIZE）')
+@click.option('--dry-run', is_flag=True, help='只统计已过期的租约数量，不放回邀请码')
+def main(batch_size: int = None, dry_run: bool = False):
+    """回收过期租约"""
+    batch_size = batch_size or settings.claim_lease_reap_batch_size
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        if dry_run:
+            click.echo(f"ℹ️  {count_expired_leases(db)} 个租约已过期（未回收）")
+            return
+
+        released = release_expired_leases(db, batch_size=batch_size)
+    finally:
+        db.close()
+    click.echo(f"✅ 已回收 {released} 个过期租约")
+
+if __name__ == '__main__':
+    main()
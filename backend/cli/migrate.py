@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+数据库结构迁移工具
+
+使用方法:
+python -m cli.migrate            # 执行所有尚未执行的迁移
+python -m cli.migrate --status   # 查看迁移状态
+"""
+
+import click
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from models.database import Base, engine
+from models.migrations import MIGRATIONS, applied_versions, migration_lock, run_migrations
+
+@click.command()
+@click.option('--status', is_flag=True, help='只显示迁移状态，不执行')
+def main(status: bool = False):
+    """执行数据库结构迁移"""
+    if status:
+        done = applied_versions(engine)
+        for migration in MIGRATIONS:
+            mark = "✅" if migration.version in done else "⏳"
+            click.echo(f"{mark} {migration.version}: {migration.description}")
+        return
+
+    with migration_lock(engine):
+        Base.metadata.create_all(bind=engine)
+        executed = run_migrations(engine, lock=False)
+    if executed:
+        for version in executed:
+            click.echo(f"✅ 已执行迁移: {version}")
+    else:
+        click.echo("✅ 数据库结构已是最新")
+
+if __name__ == '__main__':
+    main()
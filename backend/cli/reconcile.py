@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+offer计数对账工具
+
+用一条GROUP BY语句重新统计所有offer的邀请码总数和剩余数量，报告与计数列的偏差并修正。
+
+使用方法:
+python -m cli.reconcile              # 对账并修正所有offer
+python -m cli.reconcile --dry-run    # 只报告偏差，不修改
+python -m cli.reconcile --offer demo # 只对账指定offer
+"""
+
+import click
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from models.database import SessionLocal, create_tables
+from services.offer_reconciler import reconcile_offer_counts
+from services.offer_service import OfferService
+
+@click.command()
+@click.option('--offer', '-o', 'offer_name', default=None, help='只对账指定的offer')
+@click.option('--dry-run', is_flag=True, help='只报告偏差，不修改计数')
+def main(offer_name: str = None, dry_run: bool = False):
+    """对账offer的总数和剩余数量"""
+    create_tables()
+    db = SessionLocal()
+    try:
+        offer_ids = None
+        if offer_name:
+            offer = OfferService(db).get_offer_by_name(offer_name)
+            if not offer:
+                click.echo(f"❌ Offer '{offer_name}' 不存在")
+                sys.exit(1)
+            offer_ids = [offer.id]
+
+        drifts = reconcile_offer_counts(db, offer_ids, fix=not dry_run)
+    finally:
+        db.close()
+
+    if not drifts:
+        click.echo("✅ 所有offer的计数一致")
+        return
+
+    for drift in drifts:
+        click.echo(f"⚠️  {drift.name}: 总数 {drift.total_count} -> {drift.expected_total}, "
+                   f"剩余 {drift.remaining_count} -> {drift.expected_remaining}, "
+                   f"租约中 {drift.leased_count} -> {drift.expected_leased}")
+    if dry_run:
+        click.echo(f"ℹ️  发现 {len(drifts)} 个offer计数偏差（未修改）")
+        sys.exit(1)
+    click.echo(f"✅ 已修正 {len(drifts)} 个offer的计数")
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,48 @@ from typing import List
 import os
 from typing import List
 
+# 同步驱动到异步驱动的映射
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def to_async_database_url(database_url: str) -> str:
+    """把同步数据库URL转换为对应异步驱动的URL"""
+    scheme, sep, rest = database_url.partition("://")
+    base = scheme.split("+", 1)[0]
+    if base in ASYNC_DRIVERS:
+        return f"{ASYNC_DRIVERS[base]}{sep}{rest}"
+    return database_url
+
 class Settings:
     """应用配置设置"""
 
     def __init__(self):
         # 数据库配置
         self.database_url = os.getenv("DATABASE_URL", "sqlite:///./invitation_codes.db")
+        # API路由使用的异步连接，未设置时根据DATABASE_URL推导（aiosqlite/asyncpg）
+        self.async_database_url = os.getenv("ASYNC_DATABASE_URL") or to_async_database_url(self.database_url)
+
+        # 连接池配置（SQLite文件库在生产配置下同样使用连接池）
+        self.db_pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+        self.db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+        self.db_pool_timeout = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+        # database is locked 的重试次数和首次退避时间（毫秒，之后按指数增长）
+        self.db_lock_retries = int(os.getenv("DB_LOCK_RETRIES", "5"))
+        self.db_lock_retry_base_ms = int(os.getenv("DB_LOCK_RETRY_BASE_MS", "20"))
+
+        # SQLite生产配置：WAL模式下读不阻塞写，synchronous=NORMAL在WAL下每次提交不再fsync
+        self.sqlite_production_profile = os.getenv("SQLITE_PRODUCTION_PROFILE", "True").lower() in ("true", "1", "yes")
+        self.sqlite_journal_mode = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+        self.sqlite_synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+        self.sqlite_busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+        # 负数表示KiB（-65536 即 64MB 页缓存）
+        self.sqlite_cache_size = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+        self.sqlite_mmap_size = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+        self.sqlite_temp_store = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
 
         # API配置
         self.api_v1_prefix = os.getenv("API_V1_PREFIX", "/api/v1")
@@ -21,5 +57,141 @@ class Settings:
 
         # 安全配置
         self.max_requests_per_ip_per_hour = int(os.getenv("MAX_REQUESTS_PER_IP_PER_HOUR", "10"))
+        # 领取接口按IP限流（memory: 进程内计数；sqlite: 同机多worker共享计数）
+        self.rate_limit_enabled = os.getenv("RATE_LIMIT_ENABLED", "True").lower() in ("true", "1", "yes")
+        self.rate_limit_backend = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+        # 令牌桶容量（允许的突发请求数），0表示与每小时限额相同
+        self.rate_limit_burst = int(os.getenv("RATE_LIMIT_BURST", "0"))
+        self.rate_limit_max_keys = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+        self.rate_limit_sqlite_path = os.getenv("RATE_LIMIT_SQLITE_PATH", "./rate_limit.db")
+        # 批量领取（POST /offers/{name}/claim-batch）：单次最大数量、改用NDJSON流式返回的数量阈值
+        self.claim_batch_max_size = int(os.getenv("CLAIM_BATCH_MAX_SIZE", "1000"))
+        self.claim_batch_stream_threshold = int(os.getenv("CLAIM_BATCH_STREAM_THRESHOLD", "200"))
+        # 每个调用方每小时可批量领取的邀请码数量（0表示不限制），突发容量0表示与每小时配额相同
+        self.claim_batch_quota_per_hour = int(os.getenv("CLAIM_BATCH_QUOTA_PER_HOUR", "10000"))
+        self.claim_batch_quota_burst = int(os.getenv("CLAIM_BATCH_QUOTA_BURST", "0"))
+        # 合作方密钥（格式 名称:密钥,名称:密钥），批量领取须携带X-API-Key，按合作方计算配额；
+        # 未配置时批量领取接口返回404
+        self.claim_batch_api_keys = {
+            key.strip(): name.strip()
+            for name, _, key in (
+                item.partition(":") for item in os.getenv("CLAIM_BATCH_API_KEYS", "").split(",") if ":" in item
+            )
+        }
+        # 防重复申请：每个客户端在每个offer下只发放一个邀请码，重复申请返回已发放的邀请码
+        self.claim_dedup_enabled = os.getenv("CLAIM_DEDUP_ENABLED", "True").lower() in ("true", "1", "yes")
+        # 客户端标识来源（ip: 客户端IP；token: 优先使用请求中的client_token，没有时退回IP）
+        # client_token 由客户端生成、服务端不校验，每次换一个令牌即可重复领取，只适合可信的客户端
+        self.claim_dedup_key = os.getenv("CLAIM_DEDUP_KEY", "ip").lower()
+        # 进程内布隆过滤器的预期容量（领取者数量），超出后误判率上升，多出的查询回落到数据库
+        self.claim_dedup_filter_capacity = int(os.getenv("CLAIM_DEDUP_FILTER_CAPACITY", "1000000"))
+        # 部署在反向代理之后时，按X-Forwarded-For的第一个地址限流
+        self.trust_forwarded_for = os.getenv("TRUST_FORWARDED_FOR", "False").lower() in ("true", "1", "yes")
+        # 两阶段领取：领取时邀请码进入租约，客户端在租约到期前调用确认接口才算发放，
+        # 到期未确认的邀请码由后台任务放回（开启后领取池不参与单个领取）
+        self.claim_lease_enabled = os.getenv("CLAIM_LEASE_ENABLED", "False").lower() in ("true", "1", "yes")
+        self.claim_lease_seconds = float(os.getenv("CLAIM_LEASE_SECONDS", "600"))
+        # 过期租约的回收间隔（秒，0表示不在服务进程中回收，可用 python -m cli.leases 手动执行）和每批数量
+        self.claim_lease_reap_interval_seconds = float(os.getenv("CLAIM_LEASE_REAP_INTERVAL_SECONDS", "10"))
+        self.claim_lease_reap_batch_size = int(os.getenv("CLAIM_LEASE_REAP_BATCH_SIZE", "500"))
+
+        # offer信息缓存配置（strict: 本进程领取后立即失效；lag: 领取时就地扣减，剩余数量最多滞后TTL毫秒；
+        # 两种模式下其他工作进程的领取都要等TTL到期才可见）
+        self.offer_cache_enabled = os.getenv("OFFER_CACHE_ENABLED", "True").lower() in ("true", "1", "yes")
+        self.offer_cache_mode = os.getenv("OFFER_CACHE_MODE", "strict").lower()
+        self.offer_cache_ttl_ms = int(os.getenv("OFFER_CACHE_TTL_MS", "1000"))
+        self.offer_cache_negative_ttl_ms = int(os.getenv("OFFER_CACHE_NEGATIVE_TTL_MS", "5000"))
+        self.offer_cache_max_entries = int(os.getenv("OFFER_CACHE_MAX_ENTRIES", "10000"))
+
+        # 前端静态文件内存缓存：每隔多少秒检查一次文件修改时间，0表示加载后不再检查（文件更新后需重启）
+        self.static_cache_check_seconds = float(os.getenv("STATIC_CACHE_CHECK_SECONDS", "2"))
+
+        # offer页面服务端渲染：页面中直接填入offer标题、描述和剩余数量，浏览器不再请求 /info
+        self.offer_page_ssr = os.getenv("OFFER_PAGE_SSR", "False").lower() in ("true", "1", "yes")
+        # 渲染后页面的缓存时间（秒）：浏览器每次重新验证，CDN等共享缓存可以缓存几秒
+        self.offer_page_max_age = int(os.getenv("OFFER_PAGE_MAX_AGE", "0"))
+        self.offer_page_shared_max_age = int(os.getenv("OFFER_PAGE_SHARED_MAX_AGE", "5"))
+
+        # 工作进程数（python main.py 启动时传给uvicorn）
+        self.workers = int(os.getenv("WORKERS", "1"))
+        # 多进程分区领取：每个进程按offer租用一段互不重叠的邀请码id区间，多进程时默认开启
+        self.claim_partitions_enabled = os.getenv(
+            "CLAIM_PARTITIONS_ENABLED", "True" if self.workers > 1 else "False"
+        ).lower() in ("true", "1", "yes")
+        # 每个分区覆盖的邀请码id数量
+        self.claim_partition_size = int(os.getenv("CLAIM_PARTITION_SIZE", "10000"))
+        # 分区租约时长（秒），进程退出后租约到期即可被其他进程接管
+        self.claim_partition_lease_seconds = float(os.getenv("CLAIM_PARTITION_LEASE_SECONDS", "30"))
+
+        # 领取池配置（每个进程预取一批邀请码在内存中发放，批量回写数据库）
+        self.claim_pool_enabled = os.getenv("CLAIM_POOL_ENABLED", "False").lower() in ("true", "1", "yes")
+        self.claim_pool_block_size = int(os.getenv("CLAIM_POOL_BLOCK_SIZE", "500"))
+        self.claim_pool_low_watermark = int(os.getenv("CLAIM_POOL_LOW_WATERMARK", "100"))
+        self.claim_pool_flush_interval_ms = int(os.getenv("CLAIM_POOL_FLUSH_INTERVAL_MS", "200"))
+        self.claim_pool_flush_batch_size = int(os.getenv("CLAIM_POOL_FLUSH_BATCH_SIZE", "1000"))
+        self.claim_pool_journal_dir = os.getenv("CLAIM_POOL_JOURNAL_DIR", "./claim_pool_journal")
+        # 预留到期时长（秒）：进程退出且没有在同一主机上重启时，预留码在到期后由其他进程放回
+        self.claim_pool_reservation_seconds = float(os.getenv("CLAIM_POOL_RESERVATION_SECONDS", "120"))
+
+        # /stats 中每个offer保留的最近领取记录条数（进程内环形缓冲区）
+        self.claim_stats_recent_size = int(os.getenv("CLAIM_STATS_RECENT_SIZE", "10"))
+
+        # offer计数对账间隔（秒），0表示不在服务进程中定期对账（可用 python -m cli.reconcile 手动执行）
+        self.offer_reconcile_interval_seconds = float(os.getenv("OFFER_RECONCILE_INTERVAL_SECONDS", "300"))
+
+        # 已发放邀请码归档：发放超过指定天数后分批移到 invitation_codes_archive 表
+        # 归档间隔（秒），0表示不在服务进程中定期归档（可用 python -m cli.archive 手动执行）
+        self.code_archive_interval_seconds = float(os.getenv("CODE_ARCHIVE_INTERVAL_SECONDS", "3600"))
+        self.code_archive_after_days = float(os.getenv("CODE_ARCHIVE_AFTER_DAYS", "30"))
+        # 每批（一个写事务）归档的数量，以及批次之间让出写锁的时间
+        self.code_archive_batch_size = int(os.getenv("CODE_ARCHIVE_BATCH_SIZE", "1000"))
+        self.code_archive_pause_ms = int(os.getenv("CODE_ARCHIVE_PAUSE_MS", "20"))
+
+        # offer剩余数量实时推送（/offers/{name}/events，SSE）
+        self.offer_events_enabled = os.getenv("OFFER_EVENTS_ENABLED", "True").lower() in ("true", "1", "yes")
+        # 每秒最多推送次数，期间的多次变化合并为一次
+        self.offer_events_max_rate = float(os.getenv("OFFER_EVENTS_MAX_RATE", "2"))
+        self.offer_events_heartbeat_seconds = float(os.getenv("OFFER_EVENTS_HEARTBEAT_SECONDS", "15"))
+        # 每个进程的最大订阅连接数（另需调高进程的文件描述符上限 ulimit -n）
+        self.offer_events_max_subscribers = int(os.getenv("OFFER_EVENTS_MAX_SUBSCRIBERS", "50000"))
+        # 是否同时提供WebSocket接口（/offers/{name}/ws）
+        self.offer_events_websocket = os.getenv("OFFER_EVENTS_WEBSOCKET", "False").lower() in ("true", "1", "yes")
+
+        # 领取审计日志：领取者IP/User-Agent由后台线程批量写入claim_events表
+        self.claim_audit_flush_interval_ms = int(os.getenv("CLAIM_AUDIT_FLUSH_INTERVAL_MS", "500"))
+        self.claim_audit_batch_size = int(os.getenv("CLAIM_AUDIT_BATCH_SIZE", "1000"))
+        # 数据库不可写时内存中最多保留的事件数，超出后丢弃最旧的
+        self.claim_audit_max_pending = int(os.getenv("CLAIM_AUDIT_MAX_PENDING", "100000"))
+        self.claim_audit_ua_cache_size = int(os.getenv("CLAIM_AUDIT_UA_CACHE_SIZE", "10000"))
+
+        # 按邀请码核验/核销（/codes）：进程内哈希前缀过滤器的位数（2^bits 位，24位占2MB），
+        # 邀请码数量接近 2^bits 时误判（多余的数据库查询）增多，千万级邀请码建议调到27（16MB）
+        self.code_lookup_filter_bits = int(os.getenv("CODE_LOOKUP_FILTER_BITS", "24"))
+        # 读入其他进程新导入邀请码的间隔，以及整体重建过滤器的间隔
+        self.code_lookup_refresh_seconds = float(os.getenv("CODE_LOOKUP_REFRESH_SECONDS", "5"))
+        self.code_lookup_reload_seconds = float(os.getenv("CODE_LOOKUP_RELOAD_SECONDS", "600"))
+        # 批量核验每次最多的邀请码数量
+        self.code_verify_max_batch = int(os.getenv("CODE_VERIFY_MAX_BATCH", "1000"))
+
+        # 日志：请求中只把日志记录放入队列，由后台线程格式化并批量写入（text: 文本；json: 每行一个JSON对象）
+        self.log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+        self.log_format = os.getenv("LOG_FORMAT", "text").lower()
+        # 日志文件路径，为空时写到标准输出
+        self.log_file = os.getenv("LOG_FILE", "")
+        # 队列中最多积压的日志条数，超出后丢弃新的日志（不阻塞请求）
+        self.log_queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+        # 每批最多写入的条数，以及收到第一条后最多等待多久凑满一批
+        self.log_batch_size = int(os.getenv("LOG_BATCH_SIZE", "256"))
+        self.log_flush_interval_ms = int(os.getenv("LOG_FLUSH_INTERVAL_MS", "100"))
+        # 高频成功日志的采样比例（格式 类别=比例,类别=比例），警告和错误不采样；
+        # 每次领取都有审计事件，成功日志默认只保留十分之一
+        self.log_sample_rates = {
+            name.strip(): float(rate)
+            for name, _, rate in (
+                item.partition("=") for item in os.getenv(
+                    "LOG_SAMPLE_RATES", "claim_success=0.1,claim_reused=0.1"
+                ).split(",") if "=" in item
+            )
+        }
 
 settings = Settings()
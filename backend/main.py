@@ -1,23 +1,54 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse, Response
 import os
+import re
 from pathlib import Path
 
 from config.settings import settings
-from models.database import create_tables
-from routers.offers import router as offers_router
+from sqlalchemy import select
+
+from middleware import MetricsMiddleware, RateLimitMiddleware, TimedJSONResponse, create_rate_limit_backend
+from models.database import SessionLocal, create_tables, dispose_async_engine, get_async_sessionmaker
+from models.offer import Offer
+from routers.offers import router as offers_router, claim_batch_quota, load_offer_info
+from routers.codes import router as codes_router
+from services.claim_pool import start_claim_pool, stop_claim_pool, get_claim_pool
+from services.claim_partitions import start_claim_partitions, stop_claim_partitions, get_claim_partitions
+from services import metrics
+from services.offer_cache import offer_info_cache
+from services.claimer_registry import claimer_registry
+from services.claim_audit import claim_audit_log
+from services.claim_stats import claim_stats
+from services.offer_events import offer_event_hub
+from services.offer_reconciler import start_offer_reconciler, stop_offer_reconciler, get_offer_reconciler
+from services.code_archiver import start_code_archiver, stop_code_archiver, get_code_archiver
+from services.lease_reaper import start_lease_reaper, stop_lease_reaper, get_lease_reaper
+from services.static_assets import StaticAssetCache
+from services.offer_page import OfferPageRenderer
+from services.log_pipeline import log_pipeline
+from services.code_index import code_index
 
 # 创建FastAPI应用实例
 app = FastAPI(
     title="邀请码发放系统",
     description="一个支持多项目的邀请码管理和发放系统",
     version="1.0.0",
-    debug=settings.debug
+    debug=settings.debug,
+    default_response_class=TimedJSONResponse
 )
 
-# CORS中间件配置
+# 领取接口按IP限流，被拒绝的请求不会访问数据库
+rate_limit_backend = create_rate_limit_backend(settings)
+if rate_limit_backend is not None:
+    app.add_middleware(
+        RateLimitMiddleware,
+        backend=rate_limit_backend,
+        path_pattern=rf"^{re.escape(settings.api_v1_prefix)}/offers/[^/]+/claim$",
+        trust_forwarded_for=settings.trust_forwarded_for
+    )
+
+# CORS中间件配置（在限流之后添加，位于限流外层，429响应同样带CORS头）
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.cors_origins,
@@ -26,23 +57,96 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求耗时指标（最外层，包含限流拒绝的请求）
+app.add_middleware(MetricsMiddleware)
+
 # 注册API路由
 app.include_router(offers_router, prefix=settings.api_v1_prefix)
+app.include_router(codes_router, prefix=settings.api_v1_prefix)
 
-# 静态文件服务
+# 静态文件服务：文件和压缩版本缓存在内存中，支持ETag/Last-Modified条件请求
 frontend_path = Path(__file__).parent.parent / "frontend"
-if frontend_path.exists():
-    app.mount("/static", StaticFiles(directory=str(frontend_path)), name="static")
+static_assets = StaticAssetCache(str(frontend_path), check_interval=settings.static_cache_check_seconds)
+# 服务端渲染的offer页面（OFFER_PAGE_SSR开启时使用）
+offer_pages = OfferPageRenderer(
+    cache_control=f"public, max-age={settings.offer_page_max_age}, s-maxage={settings.offer_page_shared_max_age}",
+    max_entries=settings.offer_cache_max_entries
+)
+
+def _static_response(request: Request, asset) -> Response:
+    status, headers, body = asset.respond(request.headers)
+    if request.method == "HEAD":
+        body = b""
+    return Response(content=body, status_code=status, headers=headers)
+
+@app.api_route("/static/{file_path:path}", methods=["GET", "HEAD"])
+async def serve_static(file_path: str, request: Request):
+    """前端静态文件"""
+    asset = static_assets.get(file_path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    return _static_response(request, asset)
 
 # 启动时创建数据库表
 @app.on_event("startup")
 async def startup_event():
     """应用启动时的初始化操作"""
+    log_pipeline.start()
     create_tables()
     print("✅ 数据库表创建完成")
+    claim_audit_log.start(SessionLocal)
+    if settings.claim_dedup_enabled:
+        db = SessionLocal()
+        try:
+            count = claimer_registry.load(db)
+        finally:
+            db.close()
+        print(f"✅ 已加载 {count} 个领取者身份")
+    if start_claim_partitions(SessionLocal, settings):
+        print("✅ 多进程分区领取已开启")
+    if settings.claim_pool_enabled:
+        start_claim_pool(SessionLocal, settings)
+        print("✅ 邀请码领取池已开启")
+    # 领取池恢复时会补写已退出进程的发放记录，之后再预热领取统计
+    if settings.workers > 1 or settings.claim_partitions_enabled:
+        # 多进程时内存中只有本进程的领取，/stats 从 claim_events 读取
+        print("✅ 多进程部署，领取统计从数据库读取")
+    else:
+        db = SessionLocal()
+        try:
+            count = claim_stats.load(db)
+        finally:
+            db.close()
+        print(f"✅ 已加载 {count} 条近期领取记录")
+    count = code_index.start(SessionLocal)
+    print(f"✅ 已加载 {count} 个邀请码哈希")
+    start_offer_reconciler(SessionLocal, settings)
+    start_code_archiver(SessionLocal, settings)
+    start_lease_reaper(SessionLocal, settings)
+    if settings.offer_events_enabled:
+        offer_event_hub.start()
     print(f"🚀 邀请码发放系统启动成功")
     print(f"📖 API文档地址: http://localhost:8000/docs")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时回写领取记录并释放预留的邀请码"""
+    await offer_event_hub.stop()
+    stop_lease_reaper()
+    code_index.stop()
+    stop_code_archiver()
+    stop_offer_reconciler()
+    stop_claim_pool()
+    stop_claim_partitions()
+    claim_audit_log.stop()
+    await dispose_async_engine()
+    if rate_limit_backend is not None:
+        rate_limit_backend.close()
+    if claim_batch_quota is not None:
+        claim_batch_quota.close()
+    # 最后停止日志线程，写完关闭过程中产生的日志
+    log_pipeline.stop()
+
 # 根路径重定向到API文档
 @app.get("/")
 async def root():
@@ -55,23 +159,67 @@ async def root():
     }
 
 # 前端路由处理 - 支持单页应用
-@app.get("/offer/{offer_name}")
-async def serve_offer_page(offer_name: str):
-    """服务前端offer页面"""
-    frontend_index = frontend_path / "index.html"
-    if frontend_index.exists():
-        return FileResponse(str(frontend_index))
-    else:
+@app.api_route("/offer/{offer_name}", methods=["GET", "HEAD"])
+async def serve_offer_page(offer_name: str, request: Request):
+    """服务前端offer页面（所有offer共用同一个index.html，从内存缓存返回）
+
+    开启服务端渲染时返回填好offer信息的页面，offer不存在时返回原始页面，由前端提示错误
+    """
+    asset = static_assets.get("index.html")
+    if asset is None:
         raise HTTPException(
             status_code=404,
             detail="前端页面不存在，请确保frontend目录下有index.html文件"
         )
+    if settings.offer_page_ssr:
+        async with get_async_sessionmaker()() as db:
+            encoded = await load_offer_info(offer_name, db)
+        if encoded is not None:
+            asset = offer_pages.get(offer_name, asset, *encoded)
+    return _static_response(request, asset)
 
 # 健康检查接口
 @app.get("/health")
 async def health_check():
     """健康检查"""
-    return {"status": "healthy", "service": "invitation-code-system"}
+    reconciler = get_offer_reconciler()
+    partitions = get_claim_partitions()
+    archiver = get_code_archiver()
+    reaper = get_lease_reaper()
+    return {
+        "status": "healthy",
+        "service": "invitation-code-system",
+        "offer_cache": offer_info_cache.stats(),
+        "claimer_registry": claimer_registry.stats(),
+        "claim_audit": claim_audit_log.stats(),
+        "claim_stats": claim_stats.stats(),
+        "code_index": code_index.stats(),
+        "offer_events": offer_event_hub.stats(),
+        "static_assets": static_assets.stats(),
+        "logging": log_pipeline.stats(),
+        "offer_pages": offer_pages.stats() if settings.offer_page_ssr else None,
+        "offer_reconciler": reconciler.stats() if reconciler else None,
+        "code_archiver": archiver.stats() if archiver else None,
+        "lease_reaper": reaper.stats() if reaper else None,
+        "claim_partitions": partitions.stats() if partitions else None
+    }
+
+# Prometheus指标
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus文本格式的指标，offer剩余数量在每次抓取时从数据库读取"""
+    async with get_async_sessionmaker()() as db:
+        rows = (await db.execute(select(Offer.name, Offer.total_count, Offer.remaining_count, Offer.leased_count))).all()
+    metrics.offer_remaining.replace({(row.name,): row.remaining_count or 0 for row in rows})
+    metrics.offer_total.replace({(row.name,): row.total_count or 0 for row in rows})
+    metrics.offer_leased.replace({(row.name,): row.leased_count or 0 for row in rows})
+
+    claim_pool = get_claim_pool()
+    if claim_pool:
+        metrics.claim_pool_queued.replace(claim_pool.queued_counts())
+    metrics.claim_audit_pending.set(claim_audit_log.pending_count())
+    metrics.offer_events_subscribers.set(offer_event_hub.stats()["subscribers"])
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
@@ -79,5 +227,7 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=settings.debug
+        # 多个工作进程时不能使用自动重载
+        reload=settings.debug and settings.workers <= 1,
+        workers=settings.workers
     )
@@ -0,0 +1,5 @@
+# Middleware module
+from .metrics import MetricsMiddleware, TimedJSONResponse
+from .rate_limit import RateLimitMiddleware, client_ip, create_claim_batch_quota, create_rate_limit_backend
+
+__all__ = ["MetricsMiddleware", "TimedJSONResponse", "RateLimitMiddleware", "client_ip", "create_claim_batch_quota", "create_rate_limit_backend"]
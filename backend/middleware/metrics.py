@@ -0,0 +1,67 @@
+"""
+HTTP请求指标中间件
+
+按路由模板（如 /api/v1/offers/{offer_name}/claim）记录请求耗时，同时记录该请求内
+数据库语句的累计耗时和响应体序列化耗时，便于区分慢在数据库还是慢在编码。
+"""
+
+import time
+
+from fastapi.responses import JSONResponse
+
+from services.metrics import (
+    add_serialization_time,
+    finish_request_timings,
+    http_request_db_duration,
+    http_request_duration,
+    response_serialization_duration,
+    start_request_timings
+)
+
+
+class TimedJSONResponse(JSONResponse):
+    """记录序列化耗时的JSON响应（作为应用的默认响应类）"""
+
+    def render(self, content) -> bytes:
+        start = time.perf_counter()
+        body = super().render(content)
+        add_serialization_time(time.perf_counter() - start)
+        return body
+
+
+class MetricsMiddleware:
+    """记录每个HTTP请求的耗时指标的ASGI中间件"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500, "stream_started": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                # 事件流连接会保持很久，只记录到开始响应为止的耗时
+                if (b"content-type", b"text/event-stream") in [
+                    (name.lower(), value.split(b";")[0]) for name, value in message.get("headers", [])
+                ]:
+                    status["stream_started"] = time.perf_counter()
+            await send(message)
+
+        token = start_request_timings()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = (status["stream_started"] or time.perf_counter()) - start
+            db_time, serialization_time = finish_request_timings(token)
+            # 使用路由模板而不是原始路径，避免offer名称造成标签数量无限增长
+            route = scope.get("route")
+            route_label = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(elapsed, (scope["method"], route_label, str(status["code"])))
+            http_request_db_duration.observe(db_time, (route_label,))
+            response_serialization_duration.observe(serialization_time, (route_label,))
@@ -0,0 +1,252 @@
+"""
+按IP限流中间件
+
+在请求进入路由（以及数据库会话依赖）之前按客户端IP做令牌桶限流，被拒绝的请求
+直接返回429，不会打开数据库连接。令牌桶容量为 RATE_LIMIT_BURST，按
+MAX_REQUESTS_PER_IP_PER_HOUR 匀速补充。
+
+存储后端可替换：
+- memory: 进程内令牌桶，OrderedDict按最近访问排序，检查为O(1)，空闲的键从队头淘汰，
+  总键数有上限；多进程部署时每个进程各自计数
+- sqlite: 独立的SQLite文件作为多进程共享存储（与业务数据库分开），适合单机多worker
+
+同样的令牌桶也用作批量领取的调用方配额（每次按领取数量消耗令牌），见
+create_claim_batch_quota。
+"""
+
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from services.metrics import claim_outcomes
+
+BACKEND_MEMORY = "memory"
+BACKEND_SQLITE = "sqlite"
+
+# 每次请求最多顺带淘汰的空闲键数量，摊销清理开销
+EVICT_BATCH = 32
+
+
+def client_ip(scope, trust_forwarded_for: bool = False) -> str:
+    """请求的客户端IP；部署在反向代理之后时取X-Forwarded-For中的第一个地址"""
+    if trust_forwarded_for:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitBackend:
+    """限流存储后端接口"""
+
+    # 检查是否会阻塞（需要放到线程池中执行）
+    blocking = False
+
+    def hit(self, key: str, now: float, cost: float = 1.0) -> Tuple[bool, float]:
+        """消耗key的cost个令牌，返回 (是否允许, 需要等待的秒数)；cost为负数时退还令牌"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TokenBucket:
+    """令牌桶参数"""
+
+    def __init__(self, capacity: int, per_hour: int):
+        self.capacity = float(max(capacity, 1))
+        self.rate = max(per_hour, 1) / 3600.0
+        # 空闲超过该时间的桶已经补满，与新建的桶等价，可以安全淘汰
+        self.idle_ttl = self.capacity / self.rate
+
+    def take(self, tokens: float, updated_at: float, now: float,
+             cost: float = 1.0) -> Tuple[bool, float, float]:
+        """补充令牌后尝试消耗cost个，返回 (是否允许, 剩余令牌, 需要等待的秒数)"""
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+        if tokens >= cost:
+            return True, min(self.capacity, tokens - cost), 0.0
+        return False, tokens, (cost - tokens) / self.rate
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """进程内令牌桶，键数有上限"""
+
+    def __init__(self, bucket: TokenBucket, max_keys: int = 100000):
+        self.bucket = bucket
+        self.max_keys = max_keys
+        # key -> [令牌数, 上次更新时间]，按最近访问排序
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, now: float, cost: float = 1.0) -> Tuple[bool, float]:
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is None:
+                state = [self.bucket.capacity, now]
+                self._buckets[key] = state
+            else:
+                self._buckets.move_to_end(key)
+
+            allowed, state[0], retry_after = self.bucket.take(state[0], state[1], now, cost)
+            state[1] = now
+            self._evict(now)
+            return allowed, retry_after
+
+    def _evict(self, now: float):
+        """从队头淘汰空闲的键，超出上限时淘汰最久未访问的键"""
+        buckets = self._buckets
+        deadline = now - self.bucket.idle_ttl
+        for _ in range(EVICT_BATCH):
+            if not buckets:
+                break
+            oldest = next(iter(buckets.values()))
+            if oldest[1] >= deadline:
+                break
+            buckets.popitem(last=False)
+        while len(buckets) > self.max_keys:
+            buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """基于SQLite文件的共享令牌桶，同一主机上的多个worker共用计数"""
+
+    blocking = True
+
+    # 每处理多少次请求清理一次空闲的键
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, bucket: TokenBucket, path: str, table: str = "rate_limits"):
+        self.bucket = bucket
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        self._hits = 0
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_updated_at ON {table} (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, now: float, cost: float = 1.0) -> Tuple[bool, float]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT tokens, updated_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row else (self.bucket.capacity, now)
+            allowed, tokens, retry_after = self.bucket.take(tokens, updated_at, now, cost)
+            conn.execute(
+                f"INSERT INTO {self.table} (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now)
+            )
+
+            self._hits += 1
+            if self._hits % self.CLEANUP_EVERY == 0:
+                conn.execute(f"DELETE FROM {self.table} WHERE updated_at < ?", (now - self.bucket.idle_ttl,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RateLimitMiddleware:
+    """对匹配的路由按客户端IP限流的ASGI中间件"""
+
+    def __init__(self, app, backend: RateLimitBackend, path_pattern: str,
+                 methods=("POST",), trust_forwarded_for: bool = False):
+        self.app = app
+        self.backend = backend
+        self.path_re = re.compile(path_pattern)
+        self.methods = set(methods)
+        self.trust_forwarded_for = trust_forwarded_for
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] not in self.methods
+                or not self.path_re.match(scope["path"])):
+            await self.app(scope, receive, send)
+            return
+
+        key = client_ip(scope, self.trust_forwarded_for)
+        now = time.time()
+        if self.backend.blocking:
+            allowed, retry_after = await run_in_threadpool(self.backend.hit, key, now)
+        else:
+            allowed, retry_after = self.backend.hit(key, now)
+
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+        claim_outcomes.inc(("RATE_LIMITED",))
+        await self._reject(send, retry_after)
+
+    async def _reject(self, send, retry_after: float):
+        # 与路由中HTTPException的错误格式保持一致
+        body = json.dumps({
+            "detail": {"error": "请求过于频繁，请稍后再试", "error_code": "RATE_LIMITED"}
+        }, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_rate_limit_backend(settings) -> Optional[RateLimitBackend]:
+    """按配置创建限流后端，未开启时返回None"""
+    if not settings.rate_limit_enabled:
+        return None
+    bucket = TokenBucket(
+        capacity=settings.rate_limit_burst or settings.max_requests_per_ip_per_hour,
+        per_hour=settings.max_requests_per_ip_per_hour
+    )
+    if settings.rate_limit_backend == BACKEND_SQLITE:
+        return SQLiteRateLimitBackend(bucket, settings.rate_limit_sqlite_path)
+    if settings.rate_limit_backend == BACKEND_MEMORY:
+        return MemoryRateLimitBackend(bucket, settings.rate_limit_max_keys)
+    raise ValueError(f"未知的限流后端: {settings.rate_limit_backend}")
+
+
+def create_claim_batch_quota(settings) -> Optional[RateLimitBackend]:
+    """批量领取的调用方配额：每个调用方每小时可领取的邀请码数量，0表示不限制"""
+    if settings.claim_batch_quota_per_hour <= 0:
+        return None
+    bucket = TokenBucket(
+        capacity=settings.claim_batch_quota_burst or settings.claim_batch_quota_per_hour,
+        per_hour=settings.claim_batch_quota_per_hour
+    )
+    if settings.rate_limit_backend == BACKEND_SQLITE:
+        return SQLiteRateLimitBackend(bucket, settings.rate_limit_sqlite_path, table="claim_batch_quotas")
+    return MemoryRateLimitBackend(bucket, settings.rate_limit_max_keys)
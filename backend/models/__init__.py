@@ -1,6 +1,12 @@
 # Models module
 from .offer import Offer
 from .invitation_code import InvitationCode
+from .code_archive import InvitationCodeArchive
+from .code_reservation import CodeReservation
+from .code_lease import CodeLease
+from .code_partition import CodePartitionLease
+from .claimer_identity import ClaimerIdentity
+from .claim_event import ClaimEvent, ClaimCount, UserAgent
 from .database import Base, get_db, create_tables, drop_tables
 
-__all__ = ["Offer", "InvitationCode", "Base", "get_db", "create_tables", "drop_tables"]
+__all__ = ["Offer", "InvitationCode", "InvitationCodeArchive", "CodeReservation", "CodeLease", "CodePartitionLease", "ClaimerIdentity", "ClaimEvent", "ClaimCount", "UserAgent", "Base", "get_db", "create_tables", "drop_tables"]
@@ -0,0 +1,48 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Index
+from models.database import Base
+
+class UserAgent(Base):
+    """User-Agent字典表（同一个User-Agent字符串只存一份）"""
+    __tablename__ = "user_agents"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # User-Agent的SHA-256，定长便于建唯一索引
+    ua_hash = Column(String(64), nullable=False, unique=True)
+    user_agent = Column(Text, nullable=False)
+
+    def __repr__(self):
+        return f"<UserAgent(id={self.id}, user_agent='{self.user_agent[:30]}...')>"
+
+class ClaimEvent(Base):
+    """邀请码领取审计记录（只追加，由后台线程批量写入）"""
+    __tablename__ = "claim_events"
+    __table_args__ = (
+        # 最近领取记录: WHERE offer_id = ? ORDER BY id DESC
+        Index("ix_claim_events_offer_id", "offer_id", "id"),
+        Index("ix_claim_events_code_id", "code_id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # 邀请码可能已移到归档表，不设外键
+    code_id = Column(Integer, nullable=False)
+    offer_id = Column(Integer, ForeignKey("offers.id"), nullable=False)
+    claimed_at = Column(DateTime, nullable=False)
+    user_ip = Column(String(45))
+    user_agent_id = Column(Integer, ForeignKey("user_agents.id"))
+
+    def __repr__(self):
+        return f"<ClaimEvent(code_id={self.code_id}, claimed_at={self.claimed_at})>"
+
+class ClaimCount(Base):
+    """按offer、按分钟/小时累计的领取数量（与审计事件在同一事务内写入，所有进程共享）"""
+    __tablename__ = "claim_counts"
+
+    offer_id = Column(Integer, ForeignKey("offers.id"), primary_key=True)
+    # 分桶宽度（秒）：60 或 3600
+    period = Column(Integer, primary_key=True)
+    # 分桶序号: 领取时间戳 // period
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ClaimCount(offer_id={self.offer_id}, period={self.period}, bucket={self.bucket}, count={self.count})>"
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from models.database import Base
+
+class ClaimerIdentity(Base):
+    """领取者身份表（每个客户端在每个offer下只能领取一个邀请码）"""
+    __tablename__ = "claimer_identities"
+
+    # 主键 (offer_id, client_key) 即查重索引
+    offer_id = Column(Integer, ForeignKey("offers.id"), primary_key=True)
+    # 客户端标识（IP或客户端令牌）的SHA-256，定长便于索引
+    client_key = Column(String(64), primary_key=True)
+    # 邀请码可能已移到归档表，不设外键
+    code_id = Column(Integer, nullable=False)
+    claimed_at = Column(DateTime, default=func.now())
+
+    def __repr__(self):
+        return f"<ClaimerIdentity(offer_id={self.offer_id}, client_key='{self.client_key[:8]}...')>"
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Index
+from models.database import Base
+
+class InvitationCodeArchive(Base):
+    """已发放邀请码归档表（发放超过一定天数后从 invitation_codes 移入，保留原id）"""
+    __tablename__ = "invitation_codes_archive"
+    __table_args__ = (
+        # 导入去重: 归档后的邀请码重新导入时仍视为重复
+        Index("uq_invitation_codes_archive_offer_code", "offer_id", "code", unique=True),
+        # 按邀请码查询（合作方核验/核销）
+        Index("ix_invitation_codes_archive_code_hash", "code_hash"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    offer_id = Column(Integer, nullable=False)
+    code = Column(String(255), nullable=False)
+    code_hash = Column(BigInteger)
+    used_at = Column(DateTime, nullable=False)
+    redeemed_at = Column(DateTime)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<InvitationCodeArchive(code='{self.code[:10]}...', used_at={self.used_at})>"
@@ -0,0 +1,28 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Index
+from sqlalchemy.sql import func
+from models.database import Base
+
+class CodeLease(Base):
+    """领取租约表（两阶段领取：邀请码已交给客户端，等待确认，到期未确认时放回）"""
+    __tablename__ = "code_leases"
+    __table_args__ = (
+        # 回收过期租约: WHERE expires_at < ? ORDER BY expires_at LIMIT ?，只扫描已过期的部分
+        Index("ix_code_leases_expires_at", "expires_at"),
+        # 确认: WHERE token = ?
+        Index("uq_code_leases_token", "token", unique=True),
+    )
+
+    code_id = Column(Integer, ForeignKey("invitation_codes.id"), primary_key=True)
+    offer_id = Column(Integer, ForeignKey("offers.id"), nullable=False)
+    # 确认时出示的随机令牌
+    token = Column(String(64), nullable=False)
+    # 领取时登记了领取者身份时记录，租约过期后一并删除该身份
+    client_key = Column(String(64))
+    # 确认时写入审计事件
+    user_ip = Column(String(45))
+    user_agent = Column(Text)
+    leased_at = Column(DateTime, default=func.now())
+    expires_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<CodeLease(code_id={self.code_id}, expires_at={self.expires_at})>"
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from models.database import Base
+
+class CodePartitionLease(Base):
+    """邀请码分区租约表（多进程部署时每个工作进程租用offer的一段邀请码id区间）
+
+    分区按邀请码id划分: 第block个分区为 [block * 分区大小, (block + 1) * 分区大小)。
+    租约到期未续约（进程已退出）后可被其他进程接管，分区领完后删除租约。
+    """
+    __tablename__ = "code_partition_leases"
+
+    offer_id = Column(Integer, ForeignKey("offers.id"), primary_key=True)
+    block = Column(Integer, primary_key=True)
+    worker_id = Column(String(64), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<CodePartitionLease(offer_id={self.offer_id}, block={self.block}, worker='{self.worker_id}')>"
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from models.database import Base
+
+class CodeReservation(Base):
+    """领取池预留记录表（邀请码被某个工作进程预取但尚未发放）"""
+    __tablename__ = "code_reservations"
+
+    code_id = Column(Integer, ForeignKey("invitation_codes.id"), primary_key=True)
+    offer_id = Column(Integer, ForeignKey("offers.id"), nullable=False, index=True)
+    worker_id = Column(String(64), nullable=False, index=True)
+    reserved_at = Column(DateTime, default=func.now())
+    # 预留到期时间，持有进程按到期时长的三分之一续约；到期未续约（进程已退出）后任何进程都可以释放
+    expires_at = Column(DateTime, index=True)
+
+    def __repr__(self):
+        return f"<CodeReservation(code_id={self.code_id}, worker='{self.worker_id}')>"
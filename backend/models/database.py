@@ -1,13 +1,112 @@
-from sqlalchemy import create_engine, MetaData
+import asyncio
+import logging
+import random
+import time
+
+from sqlalchemy import create_engine, event, MetaData
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from config.settings import settings
+from sqlalchemy.pool import QueuePool
+from config.settings import settings, to_async_database_url
+from services.metrics import instrument_engine
+
+logger = logging.getLogger(__name__)
+
+def is_sqlite_file_url(database_url: str) -> bool:
+    """是否为SQLite文件数据库（内存数据库不适用连接池和WAL）"""
+    return database_url.startswith("sqlite") and ":memory:" not in database_url and database_url.rstrip("/") not in ("sqlite:", "sqlite+aiosqlite:")
+
+def sqlite_pragmas() -> list:
+    """生产配置下每个新连接执行的PRAGMA"""
+    return [
+        f"PRAGMA journal_mode={settings.sqlite_journal_mode}",
+        f"PRAGMA synchronous={settings.sqlite_synchronous}",
+        f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}",
+        f"PRAGMA cache_size={settings.sqlite_cache_size}",
+        f"PRAGMA mmap_size={settings.sqlite_mmap_size}",
+        f"PRAGMA temp_store={settings.sqlite_temp_store}",
+    ]
+
+def apply_sqlite_profile(engine):
+    """在每个新建的SQLite连接上执行生产配置的PRAGMA（异步引擎传入sync_engine）"""
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+def engine_options(database_url: str, async_driver: bool = False) -> dict:
+    """按数据库类型和配置生成create_engine参数"""
+    options = {}
+    if database_url.startswith("sqlite"):
+        if not async_driver:
+            options["connect_args"] = {"check_same_thread": False}
+        if not (settings.sqlite_production_profile and is_sqlite_file_url(database_url)):
+            return options
+        # SQLite文件库默认每次会话新建连接（NullPool），生产配置改为复用连接，
+        # 避免每个请求都重新打开文件并执行PRAGMA
+        if async_driver:
+            from sqlalchemy.pool import AsyncAdaptedQueuePool
+            options["poolclass"] = AsyncAdaptedQueuePool
+        else:
+            options["poolclass"] = QueuePool
+
+    options.update(
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout
+    )
+    return options
+
+def create_db_engine(database_url: str, name: str = "sync"):
+    """创建同步数据库引擎，SQLite文件库按配置启用生产参数"""
+    db_engine = create_engine(database_url, **engine_options(database_url))
+    if settings.sqlite_production_profile and is_sqlite_file_url(database_url):
+        apply_sqlite_profile(db_engine)
+    instrument_engine(db_engine, name)
+    return db_engine
+
+def is_database_locked(error: Exception) -> bool:
+    """是否为SQLite的瞬时锁冲突（database is locked / busy）"""
+    message = str(getattr(error, "orig", error)).lower()
+    return isinstance(error, OperationalError) and ("database is locked" in message or "database is busy" in message)
+
+def _backoff_delay(attempt: int) -> float:
+    base = settings.db_lock_retry_base_ms / 1000.0
+    return base * (2 ** attempt) * (0.5 + random.random())
+
+def retry_on_locked(fn, *args, **kwargs):
+    """执行fn，遇到database is locked时按指数退避重试（fn需自行回滚失败的事务）"""
+    for attempt in range(settings.db_lock_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except OperationalError as e:
+            if not is_database_locked(e) or attempt >= settings.db_lock_retries:
+                raise
+            delay = _backoff_delay(attempt)
+            logger.warning("数据库被锁定，%.0fms后重试（第%d次）", delay * 1000, attempt + 1)
+            time.sleep(delay)
+
+async def async_retry_on_locked(fn, *args, **kwargs):
+    """retry_on_locked的异步版本，退避等待期间不阻塞事件循环"""
+    for attempt in range(settings.db_lock_retries + 1):
+        try:
+            return await fn(*args, **kwargs)
+        except OperationalError as e:
+            if not is_database_locked(e) or attempt >= settings.db_lock_retries:
+                raise
+            delay = _backoff_delay(attempt)
+            logger.warning("数据库被锁定，%.0fms后重试（第%d次）", delay * 1000, attempt + 1)
+            await asyncio.sleep(delay)
 
 # 创建数据库引擎
-engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {}
-)
+engine = create_db_engine(settings.database_url)
 
 # 创建会话类
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -26,9 +125,69 @@ def get_db():
     finally:
         db.close()
 
+# 异步引擎在首次使用时创建，命令行工具不需要安装异步驱动
+_async_engine = None
+_AsyncSessionLocal = None
+
+def get_async_engine():
+    """获取异步数据库引擎"""
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        url = settings.async_database_url
+        _async_engine = create_async_engine(url, **engine_options(url, async_driver=True))
+        if settings.sqlite_production_profile and is_sqlite_file_url(url):
+            apply_sqlite_profile(_async_engine.sync_engine)
+        instrument_engine(_async_engine.sync_engine, "async")
+    return _async_engine
+
+def get_async_sessionmaker():
+    """获取异步会话类"""
+    global _AsyncSessionLocal
+    if _AsyncSessionLocal is None:
+        from sqlalchemy.ext.asyncio import AsyncSession
+        _AsyncSessionLocal = sessionmaker(
+            bind=get_async_engine(),
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False
+        )
+    return _AsyncSessionLocal
+
+async def get_async_db():
+    """获取异步数据库会话"""
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+async def dispose_async_engine():
+    """关闭异步引擎的连接池"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _AsyncSessionLocal = None
+
+def use_database(database_url: str, async_database_url: str = None):
+    """把应用切换到另一个数据库：重建同步引擎，SessionLocal随之绑定到新引擎，异步引擎在下次使用时按新地址创建
+
+    异步引擎需要先用 dispose_async_engine() 关闭。
+    """
+    global engine, _async_engine, _AsyncSessionLocal
+    settings.database_url = database_url
+    settings.async_database_url = async_database_url or to_async_database_url(database_url)
+    engine.dispose()
+    engine = create_db_engine(database_url)
+    SessionLocal.configure(bind=engine)
+    _async_engine = None
+    _AsyncSessionLocal = None
+
 def create_tables():
-    """创建所有表"""
-    Base.metadata.create_all(bind=engine)
+    """创建所有表，并执行尚未执行的结构迁移（多个worker同时启动时在迁移锁内依次执行）"""
+    from models.migrations import migration_lock, run_migrations
+
+    with migration_lock(engine):
+        Base.metadata.create_all(bind=engine)
+        run_migrations(engine, lock=False)
 
 def drop_tables():
     """删除所有表"""
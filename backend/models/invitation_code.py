@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from models.database import Base
@@ -6,14 +6,28 @@ from models.database import Base
 class InvitationCode(Base):
     """邀请码表"""
     __tablename__ = "invitation_codes"
+    __table_args__ = (
+        # 领取查询: WHERE offer_id = ? AND is_used = false ORDER BY id
+        Index("ix_invitation_codes_offer_used_id", "offer_id", "is_used", "id"),
+        # 导入去重: WHERE offer_id = ? AND code = ?，同时在数据库层面保证邀请码不重复
+        Index("uq_invitation_codes_offer_code", "offer_id", "code", unique=True),
+        # 按邀请码查询（合作方核验/核销）: WHERE code_hash IN (...)，定长8字节，比直接索引code小得多
+        Index("ix_invitation_codes_code_hash", "code_hash"),
+        # 归档会删除id最大的行，SQLite需要AUTOINCREMENT才不会把这些id分配给新导入的邀请码
+        # （归档表保留原id，复用的id会让领取者身份、审计事件指向错误的邀请码）
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     offer_id = Column(Integer, ForeignKey("offers.id"), nullable=False)
     code = Column(String(255), nullable=False)
-    is_used = Column(Boolean, default=False, index=True)
+    # 邀请码的64位哈希（services.code_index.code_hash），导入时写入
+    code_hash = Column(BigInteger)
+    is_used = Column(Boolean, default=False)
+    # 发放时间（领取池预留中的邀请码为空）；领取者IP和User-Agent记录在claim_events表
     used_at = Column(DateTime)
-    user_ip = Column(String(45))
-    user_agent = Column(Text)
+    # 合作方核销时间（已发放的邀请码被使用后由合作方回报）
+    redeemed_at = Column(DateTime)
     created_at = Column(DateTime, default=func.now())
 
     # 关系
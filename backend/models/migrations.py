@@ -0,0 +1,624 @@
+"""
+轻量级数据库结构迁移
+
+create_tables() 只会创建缺失的表，已有表上新增的索引、字段需要通过这里的迁移补上。
+每个迁移只执行一次，执行记录保存在 schema_migrations 表中。迁移应当是幂等的，
+并尽量在线执行：PostgreSQL 使用 CREATE INDEX CONCURRENTLY，不阻塞读写；
+SQLite 建索引期间会短暂阻塞写入。
+
+多个worker同时启动时都会执行迁移，run_migrations 在跨进程的迁移锁内检查和执行迁移，
+拿到锁的进程执行，其他进程等待后发现已经执行过直接跳过：PostgreSQL 使用会话级的
+pg_advisory_lock，SQLite 在数据库旁的锁文件（<数据库文件>.migrate-lock）上执行
+BEGIN IMMEDIATE（直接锁数据库会阻塞迁移自己的连接），进程退出时锁随连接释放。
+
+使用方法:
+python -m cli.migrate
+"""
+
+import logging
+import sqlite3
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, bindparam, false, func, inspect, select, text
+from sqlalchemy.schema import DropConstraint, ForeignKeyConstraint
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.invitation_code import InvitationCode
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple("Migration", ["version", "description", "upgrade"])
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", String(100), primary_key=True),
+    Column("description", String(255)),
+    Column("applied_at", DateTime)
+)
+
+# pg_advisory_lock 的锁编号（同一数据库内的其他应用不应使用相同的编号）
+MIGRATION_LOCK_KEY = 7324580019
+
+# 等待其他进程完成迁移的最长时间（秒），SQLite锁文件的busy timeout
+MIGRATION_LOCK_TIMEOUT = 600
+
+# 单条语句中IN列表的最大长度（兼容旧版SQLite的参数个数限制）
+IN_CHUNK_SIZE = 500
+
+
+def has_index(engine, table_name: str, index_name: str) -> bool:
+    """判断表上是否已有指定名称的索引"""
+    return any(index["name"] == index_name for index in inspect(engine).get_indexes(table_name))
+
+
+def create_index_online(engine, index) -> bool:
+    """在线创建模型中声明的索引，已存在时跳过，返回是否新建"""
+    table_name = index.table.name
+    if has_index(engine, table_name, index.name):
+        return False
+
+    unique = "UNIQUE " if index.unique else ""
+    columns = ", ".join(column.name for column in index.columns)
+    with engine.connect() as conn:
+        # MySQL不支持 CREATE INDEX IF NOT EXISTS，只依靠迁移锁
+        if_not_exists = "" if conn.dialect.name == "mysql" else "IF NOT EXISTS "
+        if conn.dialect.name == "postgresql":
+            # CONCURRENTLY 不阻塞读写，但不能在事务内执行
+            conn.execution_options(isolation_level="AUTOCOMMIT").exec_driver_sql(
+                f"CREATE {unique}INDEX CONCURRENTLY {if_not_exists}{index.name} ON {table_name} ({columns})"
+            )
+        else:
+            with conn.begin():
+                conn.exec_driver_sql(f"CREATE {unique}INDEX {if_not_exists}{index.name} ON {table_name} ({columns})")
+    logger.info("已创建索引 %s", index.name)
+    return True
+
+
+def drop_index_if_exists(engine, table_name: str, index_name: str) -> bool:
+    """删除索引，不存在时跳过"""
+    if not has_index(engine, table_name, index_name):
+        return False
+
+    with engine.connect() as conn:
+        if conn.dialect.name == "mysql":
+            sql = f"DROP INDEX {index_name} ON {table_name}"
+        else:
+            sql = f"DROP INDEX {index_name}"
+        with conn.begin():
+            conn.exec_driver_sql(sql)
+    logger.info("已删除索引 %s", index_name)
+    return True
+
+
+def _index(name: str):
+    return next(index for index in InvitationCode.__table__.indexes if index.name == name)
+
+
+def _remove_duplicate_codes(engine) -> int:
+    """删除同一offer下重复的邀请码，为唯一索引做准备
+
+    每组重复中保留一条：优先保留已使用的，其次保留id最小的。
+    """
+    codes = InvitationCode.__table__
+    from models.code_reservation import CodeReservation
+    reservations = CodeReservation.__table__
+
+    with engine.connect() as conn:
+        groups = conn.execute(
+            select(codes.c.offer_id, codes.c.code)
+            .group_by(codes.c.offer_id, codes.c.code)
+            .having(func.count() > 1)
+        ).fetchall()
+
+        doomed = []
+        affected_offers = set()
+        for offer_id, code in groups:
+            rows = conn.execute(
+                select(codes.c.id, codes.c.is_used)
+                .where(codes.c.offer_id == offer_id, codes.c.code == code)
+            ).fetchall()
+            rows.sort(key=lambda row: (not row.is_used, row.id))
+            doomed.extend(row.id for row in rows[1:])
+            affected_offers.add(offer_id)
+
+        if not doomed:
+            return 0
+
+        with conn.begin():
+            for i in range(0, len(doomed), IN_CHUNK_SIZE):
+                ids = doomed[i:i + IN_CHUNK_SIZE]
+                conn.execute(reservations.delete().where(reservations.c.code_id.in_(ids)))
+                conn.execute(codes.delete().where(codes.c.id.in_(ids)))
+
+    # 删除重复行后重新计算受影响offer的计数
+    _recount_offers(engine, affected_offers)
+
+    logger.warning("删除了 %s 个重复邀请码（涉及 %s 个offer）", len(doomed), len(affected_offers))
+    return len(doomed)
+
+
+def _recount_offers(engine, offer_ids):
+    """按邀请码表重新计算offer的总数和剩余数量（未使用 + 领取池预留）
+
+    只读写本迁移执行时已有的字段：归档表和 leased_count 由后续迁移增加，这里不能使用对账服务。
+    """
+    from models.code_reservation import CodeReservation
+    from models.offer import Offer
+    offers = Offer.__table__
+    codes = InvitationCode.__table__
+    reservations = CodeReservation.__table__
+
+    total = select(func.count()).where(codes.c.offer_id == offers.c.id).scalar_subquery()
+    unused = select(func.count()).where(
+        codes.c.offer_id == offers.c.id, codes.c.is_used == false()
+    ).scalar_subquery()
+    reserved = select(func.count()).where(reservations.c.offer_id == offers.c.id).scalar_subquery()
+    offer_ids = list(offer_ids)
+    with engine.begin() as conn:
+        for i in range(0, len(offer_ids), IN_CHUNK_SIZE):
+            conn.execute(
+                offers.update()
+                .where(offers.c.id.in_(offer_ids[i:i + IN_CHUNK_SIZE]))
+                .values(total_count=total, remaining_count=unused + reserved, updated_at=datetime.now())
+            )
+
+
+def _claim_and_import_indexes(engine):
+    """为领取和导入查询建立复合索引，并保证 (offer_id, code) 唯一"""
+    create_index_online(engine, _index("ix_invitation_codes_offer_used_id"))
+    if not has_index(engine, "invitation_codes", "uq_invitation_codes_offer_code"):
+        _remove_duplicate_codes(engine)
+        create_index_online(engine, _index("uq_invitation_codes_offer_code"))
+    # 旧的 is_used 单列索引已被复合索引覆盖，删除以减少每次领取的写放大
+    drop_index_if_exists(engine, "invitation_codes", "ix_invitation_codes_is_used")
+
+
+def has_column(engine, table_name: str, column_name: str) -> bool:
+    return any(column["name"] == column_name for column in inspect(engine).get_columns(table_name))
+
+
+# 回填审计事件时每批处理的邀请码数量
+BACKFILL_BATCH_SIZE = 5000
+
+# 从邀请码表移到 claim_events 的审计字段
+LEGACY_AUDIT_COLUMNS = ("user_ip", "user_agent")
+
+
+def _move_audit_to_claim_events(engine):
+    """把邀请码行上的领取者IP/User-Agent回填到 claim_events，然后删除这两列
+
+    按id分批回填，每批一个事务；已有审计事件的邀请码会跳过，中断后重新执行是安全的。
+    数据库不支持 DROP COLUMN（SQLite 3.35 之前）时改为清空这两列。
+    """
+    from models.claim_event import ClaimEvent, UserAgent
+    from services.claim_audit import ClaimAuditEvent, UserAgentInterner, insert_claim_events
+
+    ClaimEvent.__table__.create(bind=engine, checkfirst=True)
+    UserAgent.__table__.create(bind=engine, checkfirst=True)
+    present = [c for c in LEGACY_AUDIT_COLUMNS if has_column(engine, "invitation_codes", c)]
+    if not present:
+        return
+
+    codes = Table("invitation_codes", MetaData(), autoload_with=engine)
+    events = ClaimEvent.__table__
+    interner = UserAgentInterner()
+    last_id = 0
+    backfilled = 0
+    while True:
+        db = Session(bind=engine)
+        try:
+            rows = db.execute(
+                select(codes.c.id, codes.c.offer_id, codes.c.used_at,
+                       *[codes.c[c] for c in present])
+                .where(codes.c.id > last_id, codes.c.used_at.isnot(None))
+                .order_by(codes.c.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            ids = [row.id for row in rows]
+            existing = set()
+            for i in range(0, len(ids), IN_CHUNK_SIZE):
+                existing.update(r[0] for r in db.execute(
+                    select(events.c.code_id).where(events.c.code_id.in_(ids[i:i + IN_CHUNK_SIZE]))
+                ))
+            batch = [
+                ClaimAuditEvent(row.id, row.offer_id, row.used_at,
+                                row._mapping.get("user_ip"), row._mapping.get("user_agent"))
+                for row in rows if row.id not in existing
+            ]
+            if batch:
+                # 领取计数由 0008 按审计事件统一回填
+                interner.remember(insert_claim_events(db, batch, interner, count=False))
+                backfilled += len(batch)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    logger.info("回填了 %s 条领取审计事件", backfilled)
+
+    with engine.connect() as conn:
+        drop_column = conn.dialect.name != "sqlite" or conn.dialect.dbapi.sqlite_version_info >= (3, 35, 0)
+        with conn.begin():
+            for column in present:
+                if drop_column:
+                    conn.exec_driver_sql(f"ALTER TABLE invitation_codes DROP COLUMN {column}")
+                else:
+                    conn.exec_driver_sql(f"UPDATE invitation_codes SET {column} = NULL WHERE {column} IS NOT NULL")
+    logger.info("已从邀请码表移除审计字段: %s", ", ".join(present))
+
+
+# 引用已发放邀请码id的表，邀请码归档后这些引用不再能用外键约束（预留中的邀请码不会被归档）
+CODE_REFERENCING_TABLES = ("claim_events", "claimer_identities")
+
+
+def _code_archive(engine):
+    """创建邀请码归档表，并删除其他表上引用 invitation_codes.id 的外键约束
+
+    SQLite 默认不检查外键，且不支持单独删除约束，只需建表。
+    """
+    from models.code_archive import InvitationCodeArchive
+
+    InvitationCodeArchive.__table__.create(bind=engine, checkfirst=True)
+    if engine.dialect.name == "sqlite":
+        return
+
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name in CODE_REFERENCING_TABLES:
+            if not inspector.has_table(table_name):
+                continue
+            for fk in inspector.get_foreign_keys(table_name):
+                if fk["referred_table"] != "invitation_codes" or not fk.get("name"):
+                    continue
+                table = Table(table_name, MetaData())
+                conn.execute(DropConstraint(ForeignKeyConstraint(
+                    fk["constrained_columns"],
+                    [f"invitation_codes.{column}" for column in fk["referred_columns"]],
+                    name=fk["name"],
+                    table=table
+                )))
+                logger.info("已删除外键约束 %s.%s", table_name, fk["name"])
+
+
+def _add_offer_leased_count(engine):
+    """为 offers 表增加租约中数量的计数列，已存在时跳过"""
+    if has_column(engine, "offers", "leased_count"):
+        return
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE offers ADD COLUMN leased_count INTEGER DEFAULT 0")
+    logger.info("已为offers表增加 leased_count 字段")
+
+
+def _code_leases(engine):
+    """创建领取租约表，并为 offers 表增加租约中数量的计数列"""
+    from models.code_lease import CodeLease
+
+    CodeLease.__table__.create(bind=engine, checkfirst=True)
+    _add_offer_leased_count(engine)
+
+
+# 为邀请码哈希补充的字段
+CODE_LOOKUP_COLUMNS = ("code_hash", "redeemed_at")
+
+
+def _backfill_code_hashes(engine, table_name: str) -> int:
+    """按id分批为 code_hash 为空的邀请码计算哈希，每批一个事务，中断后重新执行是安全的"""
+    from services.code_index import code_hash
+
+    table = Table(table_name, MetaData(), autoload_with=engine)
+    update = (
+        table.update()
+        .where(table.c.id == bindparam("row_id"))
+        .values(code_hash=bindparam("hash_value"))
+    )
+    last_id = 0
+    backfilled = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.code)
+                .where(table.c.id > last_id, table.c.code_hash.is_(None))
+                .order_by(table.c.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            conn.execute(update, [{"row_id": row.id, "hash_value": code_hash(row.code)} for row in rows])
+        last_id = rows[-1].id
+        backfilled += len(rows)
+    return backfilled
+
+
+def _code_hash_index(engine):
+    """邀请码表和归档表增加 code_hash（回填后建索引）与核销时间 redeemed_at"""
+    from models.code_archive import InvitationCodeArchive
+
+    InvitationCodeArchive.__table__.create(bind=engine, checkfirst=True)
+    for model in (InvitationCode, InvitationCodeArchive):
+        table_name = model.__tablename__
+        with engine.begin() as conn:
+            for column in CODE_LOOKUP_COLUMNS:
+                if not has_column(engine, table_name, column):
+                    column_type = model.__table__.c[column].type.compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column} {column_type}")
+                    logger.info("已为 %s 增加 %s 字段", table_name, column)
+        backfilled = _backfill_code_hashes(engine, table_name)
+        if backfilled:
+            logger.info("为 %s 回填了 %s 个邀请码哈希", table_name, backfilled)
+        create_index_online(engine, next(
+            index for index in model.__table__.indexes if index.name == f"ix_{table_name}_code_hash"
+        ))
+
+
+# 引用邀请码id、带领取时间的表：(表名, 领取时间列)
+CODE_CLAIM_REFERENCES = (("claim_events", "claimed_at"), ("claimer_identities", "claimed_at"))
+# 只引用原表中邀请码的表（预留中、租约中的邀请码不会被归档）
+CODE_HOT_REFERENCES = ("code_reservations", "code_leases")
+
+
+def _renumber_archived_id_collisions(conn, inspector) -> int:
+    """为与归档表id冲突的邀请码分配新id，返回处理的数量
+
+    冲突的邀请码都是在同id的邀请码归档之后导入的：领取时间不早于其导入时间的领取者身份和
+    审计事件属于新导入的邀请码，改指向新id；更早的仍指向归档表中的邀请码。
+    """
+    rows = conn.exec_driver_sql(
+        "SELECT c.id, c.created_at FROM invitation_codes c "
+        "JOIN invitation_codes_archive a ON a.id = c.id ORDER BY c.id"
+    ).fetchall()
+    if not rows:
+        return 0
+
+    next_id = conn.exec_driver_sql(
+        "SELECT max(coalesce((SELECT max(id) FROM invitation_codes), 0), "
+        "coalesce((SELECT max(id) FROM invitation_codes_archive), 0))"
+    ).scalar()
+    for old_id, created_at in rows:
+        next_id += 1
+        conn.exec_driver_sql("UPDATE invitation_codes SET id = ? WHERE id = ?", (next_id, old_id))
+        for table_name in CODE_HOT_REFERENCES:
+            if inspector.has_table(table_name):
+                conn.exec_driver_sql(f"UPDATE {table_name} SET code_id = ? WHERE code_id = ?", (next_id, old_id))
+        if created_at is None:
+            continue
+        for table_name, claimed_at in CODE_CLAIM_REFERENCES:
+            if inspector.has_table(table_name):
+                conn.exec_driver_sql(
+                    f"UPDATE {table_name} SET code_id = ? WHERE code_id = ? AND {claimed_at} >= ?",
+                    (next_id, old_id, created_at)
+                )
+    return len(rows)
+
+
+def _codes_autoincrement(engine):
+    """SQLite上以AUTOINCREMENT重建邀请码表，之后导入的邀请码不再复用已归档邀请码的id
+
+    没有AUTOINCREMENT时SQLite按当前最大id分配新id，归档删除id最大的行后这些id会被重新分配，
+    与归档表的主键冲突（之后的归档失败），领取者身份也会指向错误的邀请码。
+    先修复已经冲突的id，再重建表（复制数据、重建索引），最后把 sqlite_sequence 设为
+    原表和归档表id的最大值。其他数据库的自增序列不会复用id，跳过。
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    from sqlalchemy.schema import CreateTable
+    from models.code_archive import InvitationCodeArchive
+
+    InvitationCodeArchive.__table__.create(bind=engine, checkfirst=True)
+    codes = InvitationCode.__table__
+    inspector = inspect(engine)
+    existing = {column["name"] for column in inspector.get_columns("invitation_codes")}
+    columns = ", ".join(column.name for column in codes.columns if column.name in existing)
+
+    with engine.connect() as conn:
+        # 重建时删除旧表，外键检查不能在事务内关闭
+        foreign_keys = conn.exec_driver_sql("PRAGMA foreign_keys").scalar()
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        try:
+            with conn.begin():
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                renumbered = _renumber_archived_id_collisions(conn, inspector)
+                if renumbered:
+                    logger.warning("为 %s 个与归档表id冲突的邀请码分配了新id", renumbered)
+
+                table_sql = conn.exec_driver_sql(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'invitation_codes'"
+                ).scalar()
+                if "AUTOINCREMENT" not in table_sql.upper():
+                    create_sql = str(CreateTable(codes).compile(dialect=engine.dialect)).replace(
+                        "CREATE TABLE invitation_codes ", "CREATE TABLE invitation_codes_rebuild ", 1
+                    )
+                    conn.exec_driver_sql(create_sql)
+                    conn.exec_driver_sql(
+                        f"INSERT INTO invitation_codes_rebuild ({columns}) SELECT {columns} FROM invitation_codes"
+                    )
+                    conn.exec_driver_sql("DROP TABLE invitation_codes")
+                    conn.exec_driver_sql("ALTER TABLE invitation_codes_rebuild RENAME TO invitation_codes")
+                    for index in codes.indexes:
+                        index.create(conn)
+                    logger.info("已以AUTOINCREMENT重建邀请码表")
+
+                max_id = conn.exec_driver_sql(
+                    "SELECT max(coalesce((SELECT max(id) FROM invitation_codes), 0), "
+                    "coalesce((SELECT max(id) FROM invitation_codes_archive), 0))"
+                ).scalar()
+                conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'invitation_codes'")
+                conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('invitation_codes', ?)", (max_id,))
+        finally:
+            conn.exec_driver_sql(f"PRAGMA foreign_keys={int(bool(foreign_keys))}")
+
+
+def _reservation_expiry(engine):
+    """领取池预留表增加到期时间 expires_at 及其索引（已有的预留按预留时间判断是否到期）"""
+    from models.code_reservation import CodeReservation
+
+    table = CodeReservation.__table__
+    table.create(bind=engine, checkfirst=True)
+    if not has_column(engine, "code_reservations", "expires_at"):
+        column_type = table.c.expires_at.type.compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"ALTER TABLE code_reservations ADD COLUMN expires_at {column_type}")
+        logger.info("已为code_reservations表增加 expires_at 字段")
+    create_index_online(engine, next(
+        index for index in table.indexes if index.name == "ix_code_reservations_expires_at"
+    ))
+
+
+def _claim_counts(engine):
+    """创建按分钟/小时累计的领取计数表 claim_counts，按统计时间窗口内的审计事件回填
+
+    回填在一个事务中先清空再累加，中断后重新执行是安全的。
+    """
+    from models.claim_event import ClaimCount, ClaimEvent
+    from services.claim_stats import HOUR_BUCKETS, add_claim_counts
+
+    ClaimCount.__table__.create(bind=engine, checkfirst=True)
+    events = ClaimEvent.__table__
+    cutoff = datetime.now() - timedelta(hours=HOUR_BUCKETS)
+    last_id = 0
+    backfilled = 0
+    db = Session(bind=engine)
+    try:
+        db.execute(ClaimCount.__table__.delete())
+        while True:
+            rows = db.execute(
+                select(events.c.id, events.c.offer_id, events.c.claimed_at)
+                .where(events.c.id > last_id, events.c.claimed_at >= cutoff)
+                .order_by(events.c.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            add_claim_counts(db, rows)
+            backfilled += len(rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    logger.info("按 %s 条审计事件回填了领取计数", backfilled)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        "0001_claim_and_import_indexes",
+        "邀请码表复合索引 (offer_id, is_used, id) 与唯一索引 (offer_id, code)",
+        _claim_and_import_indexes
+    ),
+    Migration(
+        "0002_claim_events",
+        "领取者IP/User-Agent移到批量写入的 claim_events 表（User-Agent去重存入 user_agents）",
+        _move_audit_to_claim_events
+    ),
+    Migration(
+        "0003_code_archive",
+        "已发放邀请码归档表 invitation_codes_archive，删除引用邀请码id的外键约束",
+        _code_archive
+    ),
+    Migration(
+        "0004_code_leases",
+        "两阶段领取的租约表 code_leases，offers 表增加 leased_count",
+        _code_leases
+    ),
+    Migration(
+        "0005_code_hash",
+        "邀请码表和归档表增加定长哈希 code_hash 及其索引（按邀请码查询），以及核销时间 redeemed_at",
+        _code_hash_index
+    ),
+    Migration(
+        "0006_codes_autoincrement",
+        "SQLite邀请码表改为AUTOINCREMENT，归档后不再复用id（修复已与归档表冲突的id）",
+        _codes_autoincrement
+    ),
+    Migration(
+        "0007_reservation_expiry",
+        "领取池预留表 code_reservations 增加到期时间 expires_at，进程退出后由其他进程回收",
+        _reservation_expiry
+    ),
+    Migration(
+        "0008_claim_counts",
+        "按分钟/小时累计的领取计数表 claim_counts，/stats 在多进程部署时读取计数而不是扫描审计事件",
+        _claim_counts
+    ),
+]
+
+
+def applied_versions(engine) -> set:
+    """已执行的迁移版本"""
+    schema_migrations.create(bind=engine, checkfirst=True)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(select(schema_migrations.c.version))}
+
+
+@contextmanager
+def migration_lock(engine):
+    """跨进程的迁移锁，同一时间只有一个进程在执行迁移（不可重入）
+
+    PostgreSQL 使用会话级的 pg_advisory_lock，MySQL 使用 GET_LOCK；SQLite 在数据库旁的锁文件上
+    执行 BEGIN IMMEDIATE。锁都随连接释放，持有锁的进程异常退出时不会残留。内存数据库不加锁。
+    """
+    dialect = engine.dialect.name
+    if dialect in ("postgresql", "mysql"):
+        if dialect == "postgresql":
+            acquire, release = "SELECT pg_advisory_lock(:key)", "SELECT pg_advisory_unlock(:key)"
+        else:
+            acquire, release = "SELECT GET_LOCK(:key, -1)", "SELECT RELEASE_LOCK(:key)"
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.execute(text(acquire), {"key": MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text(release), {"key": MIGRATION_LOCK_KEY})
+    elif dialect == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        lock = sqlite3.connect(f"{engine.url.database}.migrate-lock", timeout=MIGRATION_LOCK_TIMEOUT,
+                               isolation_level=None)
+        try:
+            lock.execute("BEGIN IMMEDIATE")
+            yield
+        finally:
+            lock.close()
+    else:
+        yield
+
+
+def run_migrations(engine, lock: bool = True) -> List[str]:
+    """按顺序执行尚未执行的迁移，返回本次执行的版本列表
+
+    lock为False时调用方需已持有 migration_lock()。
+    """
+    if lock:
+        with migration_lock(engine):
+            return run_migrations(engine, lock=False)
+
+    # 拿到锁之后再读取执行记录，等待期间其他进程执行过的迁移不会重复执行
+    done = applied_versions(engine)
+    executed = []
+    for migration in MIGRATIONS:
+        if migration.version in done:
+            continue
+
+        logger.info("执行迁移 %s: %s", migration.version, migration.description)
+        migration.upgrade(engine)
+        try:
+            with engine.begin() as conn:
+                conn.execute(schema_migrations.insert().values(
+                    version=migration.version,
+                    description=migration.description,
+                    applied_at=datetime.now()
+                ))
+        except IntegrityError:
+            # 未加锁的旧版本进程同时完成了同一个迁移
+            pass
+        executed.append(migration.version)
+    return executed
@@ -13,6 +13,8 @@ class Offer(Base):
     description = Column(Text)
     total_count = Column(Integer, default=0)
     remaining_count = Column(Integer, default=0)
+    # 租约中（已交给客户端、等待确认）的邀请码数量；已发放数量 = 总数 - 剩余 - 租约中
+    leased_count = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -0,0 +1,141 @@
+import logging
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from config.settings import settings
+from models.database import get_async_db
+from services.async_code_service import AsyncCodeService
+from services.code_index import CodeStatus
+from services import fast_json
+from services.metrics import add_serialization_time, code_lookups, code_redeem_requests
+from schemas import CodeStatusResponse, CodeVerifyRequest, CodeVerifyResponse
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/codes", tags=["codes"])
+
+
+def _require_partner(request: Request) -> str:
+    """须携带合作方密钥（CLAIM_BATCH_API_KEYS）中的X-API-Key，返回合作方名称
+
+    邀请码状态（尤其是未发放）和核销不能对匿名调用方开放，未配置合作方密钥时接口返回404。
+    """
+    if not settings.claim_batch_api_keys:
+        raise HTTPException(status_code=404, detail="邀请码核验未开启")
+    partner = settings.claim_batch_api_keys.get(request.headers.get("x-api-key", ""))
+    if partner is None:
+        raise HTTPException(status_code=401, detail={"error": "缺少或无效的API密钥", "error_code": "UNAUTHORIZED"})
+    return partner
+
+
+def _status_data(code: str, status: Optional[CodeStatus]) -> dict:
+    if status is None:
+        return {"code": code, "valid": False}
+    return {
+        "code": code,
+        "valid": True,
+        "status": status.status,
+        "offer": status.offer,
+        "issued_at": status.issued_at,
+        "redeemed_at": status.redeemed_at
+    }
+
+
+def _json(content) -> Response:
+    """核验结果随时可能变化，不缓存"""
+    start = time.perf_counter()
+    body = fast_json.dumps(content)
+    add_serialization_time(time.perf_counter() - start)
+    return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-store"})
+
+
+@router.get("/{code}", response_model=CodeStatusResponse)
+async def get_code_status(
+    code: str,
+    request: Request,
+    offer: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """核验一个邀请码：是否有效、所属offer、是否已发放/核销
+
+    进程内过滤器判定一定不存在的邀请码直接返回404，不访问数据库。
+    """
+    _require_partner(request)
+    code = code.strip()
+    try:
+        found = (await AsyncCodeService(db).verify_codes([code], offer)).get(code) if code else None
+    except Exception as e:
+        logger.error("核验邀请码时发生错误: %s", e)
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+    if found is None:
+        code_lookups.inc(("not_found",))
+        raise HTTPException(status_code=404, detail={"error": "邀请码不存在", "error_code": "CODE_NOT_FOUND"})
+    code_lookups.inc(("found",))
+    return _json(CodeStatusResponse(data=_status_data(code, found)).dict())
+
+
+@router.post("/verify", response_model=CodeVerifyResponse)
+async def verify_codes(
+    verify_request: CodeVerifyRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """批量核验邀请码，结果与请求中的顺序一致，不存在的邀请码 valid 为 false"""
+    _require_partner(request)
+    codes = [code.strip() for code in verify_request.codes]
+    if not codes or len(codes) > settings.code_verify_max_batch:
+        raise HTTPException(status_code=400, detail={
+            "error": f"邀请码数量须在1到{settings.code_verify_max_batch}之间",
+            "error_code": "INVALID_COUNT"
+        })
+
+    try:
+        found = await AsyncCodeService(db).verify_codes([code for code in codes if code], verify_request.offer)
+    except Exception as e:
+        logger.error("批量核验邀请码时发生错误: %s", e)
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+    code_lookups.inc(("found",), amount=len(found))
+    code_lookups.inc(("not_found",), amount=len(set(codes)) - len(found))
+    results = [_status_data(code, found.get(code)) for code in codes]
+    return _json(CodeVerifyResponse(data={
+        "count": len(results),
+        "valid_count": sum(1 for result in results if result["valid"]),
+        "results": results
+    }).dict())
+
+
+@router.post("/{code}/redeem", response_model=CodeStatusResponse)
+async def redeem_code(
+    code: str,
+    request: Request,
+    offer: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """核销一个已发放的邀请码，同一个邀请码只能核销一次"""
+    partner = _require_partner(request)
+    code = code.strip()
+    try:
+        redeemed = await AsyncCodeService(db).redeem_code(code, offer)
+    except ValueError as e:
+        error_msg = str(e)
+        if "不存在" in error_msg:
+            status_code, error_code = 404, "CODE_NOT_FOUND"
+        elif "已核销" in error_msg:
+            status_code, error_code = 409, "ALREADY_REDEEMED"
+        else:
+            status_code, error_code = 400, "CODE_NOT_ISSUED"
+        code_redeem_requests.inc((error_code,))
+        raise HTTPException(status_code=status_code, detail={"error": error_msg, "error_code": error_code})
+    except Exception as e:
+        code_redeem_requests.inc(("INTERNAL_ERROR",))
+        logger.error("核销邀请码时发生错误: %s", e)
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+    code_redeem_requests.inc(("success",))
+    logger.info("邀请码已核销: offer=%s, partner=%s", redeemed.offer, partner, extra={"sample": "code_redeemed"})
+    return _json(CodeStatusResponse(data=_status_data(code, redeemed)).dict())
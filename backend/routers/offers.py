@@ -1,27 +1,100 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-from models.database import get_db
-from services.offer_service import OfferService
-from services.code_service import CodeService
+import asyncio
+import json
+import math
+import time
+
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.websockets import WebSocketDisconnect
+from middleware import TimedJSONResponse, client_ip, create_claim_batch_quota
+from sqlalchemy.ext.asyncio import AsyncSession
+from config.settings import settings
+from models.database import get_async_db
+from services.async_offer_service import AsyncOfferService
+from services.async_code_service import AsyncCodeService
+from services.claim_pool import get_claim_pool
+from services.claimer_registry import make_client_key
+from services.code_service import ClaimResult
+from services.offer_cache import offer_info_cache, MISS
+from services import fast_json
+from services.metrics import add_serialization_time, claim_outcomes, claim_batch_codes, claim_batch_requests
+from services.offer_events import offer_event_hub, format_sse, TooManySubscribers
 from schemas import (
     OfferInfoResponse,
     ClaimRequest,
     ClaimResponse,
+    ClaimLeaseResponse,
+    ClaimConfirmRequest,
+    ClaimBatchRequest,
+    ClaimBatchResponse,
     StatsResponse,
     ErrorResponse
 )
 import logging
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
+# 日志由 services.log_pipeline 配置（后台线程批量写入），这里只记录
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/offers", tags=["offers"])
 
+# 批量领取的调用方配额（按领取数量消耗令牌）
+claim_batch_quota = create_claim_batch_quota(settings)
+
+# NDJSON响应每次写出的行数
+NDJSON_CHUNK_LINES = 500
+
+def _encode_json(content) -> tuple:
+    """编码动态响应，返回 (JSON bytes, ETag)"""
+    start = time.perf_counter()
+    body = fast_json.dumps(content)
+    add_serialization_time(time.perf_counter() - start)
+    return body, fast_json.make_etag(body)
+
+def _json_with_etag(request: Request, body: bytes, etag: str) -> Response:
+    """返回编码好的JSON响应，请求的If-None-Match与ETag一致时返回304"""
+    # 客户端每次都要重新验证，内容没变时只传输响应头
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if fast_json.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def load_offer_info(offer_name: str, db: AsyncSession):
+    """返回offer信息编码好的 (JSON bytes, ETag)，offer不存在时返回None
+
+    先查进程内缓存，命中时不访问数据库；未命中（offer变化或过期）时查询并校验、编码一次。
+    """
+    cached = offer_info_cache.get_encoded(offer_name)
+    if cached is not MISS:
+        return cached
+
+    # 回源期间发生领取或修改时，读到的旧数据不写入缓存
+    version = offer_info_cache.version(offer_name)
+    offer_service = AsyncOfferService(db)
+    offer = await offer_service.get_offer_by_name(offer_name)
+
+    if not offer:
+        offer_info_cache.put(offer_name, None, version)
+        return None
+
+    # 构建OfferInfo对象
+    offer_info = {
+        "name": offer.name,
+        "title": offer.title,
+        "description": offer.description,
+        "total_count": offer.total_count,
+        "remaining_count": offer.remaining_count,
+        "is_active": offer.is_active
+    }
+
+    payload = OfferInfoResponse(data=offer_info).dict()
+    return offer_info_cache.put(offer_name, payload, version)
+
 @router.get("/{offer_name}/info", response_model=OfferInfoResponse)
 async def get_offer_info(
     offer_name: str,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取offer信息"""
     try:
@@ -29,28 +102,15 @@ async def get_offer_info(
         if not offer_name or offer_name.strip() == "":
             raise HTTPException(status_code=400, detail="Offer名称不能为空")
 
-        offer_service = OfferService(db)
-        offer = offer_service.get_offer_by_name(offer_name.strip())
-
-        if not offer:
+        encoded = await load_offer_info(offer_name.strip(), db)
+        if encoded is None:
             raise HTTPException(status_code=404, detail="邀请码项目不存在")
-
-        # 构建OfferInfo对象
-        offer_info = {
-            "name": offer.name,
-            "title": offer.title,
-            "description": offer.description,
-            "total_count": offer.total_count,
-            "remaining_count": offer.remaining_count,
-            "is_active": offer.is_active
-        }
-
-        return OfferInfoResponse(data=offer_info)
+        return _json_with_etag(request, *encoded)
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"获取offer信息失败: {str(e)}")
+        logger.error("获取offer信息失败: %s", e)
         raise HTTPException(status_code=500, detail="服务器内部错误")
 
 @router.post("/{offer_name}/claim", response_model=ClaimResponse)
@@ -58,7 +118,7 @@ async def claim_invitation_code(
     offer_name: str,
     request: Request,
     claim_request: ClaimRequest = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """申请邀请码"""
     try:
@@ -75,33 +135,203 @@ async def claim_invitation_code(
         if not user_agent:
             user_agent = request.headers.get("user-agent", "")
 
-        # 申请邀请码
-        code_service = CodeService(db)
-        code = code_service.claim_code(offer_name.strip(), user_ip, user_agent)
+        # 防重复申请：按真实连接IP（或客户端令牌）识别客户端，不使用请求体中可伪造的user_ip
+        client_key = None
+        if settings.claim_dedup_enabled:
+            client_key = make_client_key(
+                client_ip(request.scope, settings.trust_forwarded_for),
+                claim_request.client_token if claim_request else None,
+                settings.claim_dedup_key
+            )
+
+        # 两阶段领取：邀请码进入租约，返回确认用的令牌
+        if settings.claim_lease_enabled:
+            lease = await AsyncCodeService(db).lease_code(
+                offer_name.strip(), settings.claim_lease_seconds, user_ip, user_agent, client_key
+            )
+            claim_outcomes.inc(("reused" if lease.reused else "leased",))
+            logger.info("邀请码进入租约: offer=%s, ip=%s, reused=%s", offer_name, user_ip, lease.reused,
+                        extra={"sample": "claim_reused" if lease.reused else "claim_success"})
+            content = ClaimLeaseResponse(data={
+                "code": lease.code,
+                "message": "您已领取过邀请码" if lease.reused else "请在租约到期前确认使用邀请码",
+                "lease_token": lease.lease_token,
+                "lease_expires_at": lease.lease_expires_at
+            }).dict()
+            return Response(content=_encode_json(content)[0], media_type="application/json")
+
+        # 申请邀请码（开启领取池时直接从内存队列发放）
+        # 领取池补充时用同步会话预留、遇到锁冲突时sleep退避并持有线程锁，放到线程池中执行，不阻塞事件循环
+        claim_pool = get_claim_pool()
+        if client_key and claim_pool:
+            result = await run_in_threadpool(claim_pool.claim_once, offer_name.strip(), client_key, user_ip, user_agent)
+        elif client_key:
+            result = await AsyncCodeService(db).claim_once(offer_name.strip(), client_key, user_ip, user_agent)
+        elif claim_pool:
+            code = await run_in_threadpool(claim_pool.claim, offer_name.strip(), user_ip, user_agent)
+            result = ClaimResult(code, False)
+        else:
+            code_service = AsyncCodeService(db)
+            result = ClaimResult(await code_service.claim_code(offer_name.strip(), user_ip, user_agent), False)
 
-        logger.info(f"邀请码申请成功: offer={offer_name}, ip={user_ip}")
+        claim_outcomes.inc(("reused" if result.reused else "success",))
+        if result.reused:
+            logger.info("重复申请，返回已发放的邀请码: offer=%s, ip=%s", offer_name, user_ip, extra={"sample": "claim_reused"})
+            return ClaimResponse(data={
+                "code": result.code,
+                "message": "您已领取过邀请码"
+            })
+
+        logger.info("邀请码申请成功: offer=%s, ip=%s", offer_name, user_ip, extra={"sample": "claim_success"})
 
         return ClaimResponse(data={
-            "code": code,
+            "code": result.code,
             "message": "邀请码获取成功"
         })
 
     except ValueError as e:
         error_msg = str(e)
         error_code = "NO_CODES_AVAILABLE" if "已用完" in error_msg else "INVALID_OFFER"
-        logger.warning(f"邀请码申请失败: offer={offer_name}, error={error_msg}")
+        claim_outcomes.inc((error_code,))
+        logger.warning("邀请码申请失败: offer=%s, error=%s", offer_name, error_msg)
         raise HTTPException(status_code=400, detail={"error": error_msg, "error_code": error_code})
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"申请邀请码时发生错误: {str(e)}")
+        claim_outcomes.inc(("INTERNAL_ERROR",))
+        logger.error("申请邀请码时发生错误: %s", e)
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+@router.post("/{offer_name}/claim/confirm", response_model=ClaimResponse)
+async def confirm_invitation_code(
+    offer_name: str,
+    confirm_request: ClaimConfirmRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """确认两阶段领取的租约，邀请码正式发放"""
+    try:
+        code = await AsyncCodeService(db).confirm_lease(offer_name.strip(), confirm_request.lease_token)
+    except ValueError as e:
+        claim_outcomes.inc(("LEASE_NOT_FOUND",))
+        raise HTTPException(status_code=400, detail={"error": str(e), "error_code": "LEASE_NOT_FOUND"})
+    except Exception as e:
+        logger.error("确认租约时发生错误: %s", e)
         raise HTTPException(status_code=500, detail="服务器内部错误")
 
+    claim_outcomes.inc(("confirmed",))
+    return ClaimResponse(data={
+        "code": code,
+        "message": "邀请码获取成功"
+    })
+
+def _batch_caller(request: Request) -> str:
+    """批量领取的调用方标识（合作方名称）；未配置合作方密钥时批量领取不开放"""
+    if not settings.claim_batch_api_keys:
+        claim_batch_requests.inc(("DISABLED",))
+        raise HTTPException(status_code=404, detail="批量领取未开启")
+    partner = settings.claim_batch_api_keys.get(request.headers.get("x-api-key", ""))
+    if partner is None:
+        claim_batch_requests.inc(("UNAUTHORIZED",))
+        raise HTTPException(status_code=401, detail={"error": "缺少或无效的API密钥", "error_code": "UNAUTHORIZED"})
+    return f"partner:{partner}"
+
+async def _charge_quota(caller: str, cost: int):
+    """消耗（cost为负数时退还）调用方配额，超出配额时返回429"""
+    if claim_batch_quota is None or cost == 0:
+        return
+    if claim_batch_quota.blocking:
+        allowed, retry_after = await run_in_threadpool(claim_batch_quota.hit, caller, time.time(), cost)
+    else:
+        allowed, retry_after = claim_batch_quota.hit(caller, time.time(), cost)
+    if not allowed:
+        claim_batch_requests.inc(("QUOTA_EXCEEDED",))
+        raise HTTPException(
+            status_code=429,
+            detail={"error": "批量领取配额已用完，请稍后再试", "error_code": "QUOTA_EXCEEDED"},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+def _ndjson_response(codes):
+    """每行一个 {"code": ...} 的NDJSON流，分块写出，大批量时不必一次性序列化整个响应"""
+    async def lines():
+        for i in range(0, len(codes), NDJSON_CHUNK_LINES):
+            yield "".join(
+                json.dumps({"code": code}, ensure_ascii=False) + "\n"
+                for code in codes[i:i + NDJSON_CHUNK_LINES]
+            ).encode("utf-8")
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Claim-Count": str(len(codes)), "Cache-Control": "no-store"}
+    )
+
+@router.post("/{offer_name}/claim-batch", response_model=ClaimBatchResponse)
+async def claim_invitation_codes_batch(
+    offer_name: str,
+    batch_request: ClaimBatchRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """合作方批量申请邀请码：一个事务内用一条集合更新领取count个邀请码
+
+    数量达到 CLAIM_BATCH_STREAM_THRESHOLD 或请求头 Accept 包含 application/x-ndjson 时
+    以NDJSON流式返回，否则返回 {"count": N, "codes": [...]}。
+    """
+    caller = _batch_caller(request)
+    offer_name = offer_name.strip()
+    if not offer_name:
+        raise HTTPException(status_code=400, detail="Offer名称不能为空")
+    count = batch_request.count
+    if count <= 0 or count > settings.claim_batch_max_size:
+        claim_batch_requests.inc(("INVALID_COUNT",))
+        raise HTTPException(status_code=400, detail={
+            "error": f"领取数量须在1到{settings.claim_batch_max_size}之间",
+            "error_code": "INVALID_COUNT"
+        })
+
+    # 先按请求数量扣除配额，领取失败或只领到一部分时退还
+    await _charge_quota(caller, count)
+    user_agent = batch_request.user_agent or request.headers.get("user-agent", "")
+    try:
+        codes = await AsyncCodeService(db).claim_batch(
+            offer_name, count, client_ip(request.scope, settings.trust_forwarded_for),
+            user_agent, batch_request.allow_partial
+        )
+    except ValueError as e:
+        await _charge_quota(caller, -count)
+        error_msg = str(e)
+        if "不足" in error_msg:
+            error_code = "INSUFFICIENT_CODES"
+        elif "已用完" in error_msg:
+            error_code = "NO_CODES_AVAILABLE"
+        else:
+            error_code = "INVALID_OFFER"
+        claim_batch_requests.inc((error_code,))
+        logger.warning("批量申请失败: offer=%s, caller=%s, count=%d, error=%s", offer_name, caller, count, error_msg)
+        raise HTTPException(status_code=400, detail={"error": error_msg, "error_code": error_code})
+    except Exception as e:
+        await _charge_quota(caller, -count)
+        claim_batch_requests.inc(("INTERNAL_ERROR",))
+        logger.error("批量申请邀请码时发生错误: %s", e)
+        raise HTTPException(status_code=500, detail="服务器内部错误")
+
+    await _charge_quota(caller, len(codes) - count)
+    claim_batch_requests.inc(("success",))
+    claim_batch_codes.inc(amount=len(codes))
+    logger.info("批量申请成功: offer=%s, caller=%s, count=%d", offer_name, caller, len(codes))
+
+    if len(codes) >= settings.claim_batch_stream_threshold or \
+            "application/x-ndjson" in request.headers.get("accept", ""):
+        return _ndjson_response(codes)
+    return TimedJSONResponse(content={"success": True, "data": {"count": len(codes), "codes": codes}})
+
 @router.get("/{offer_name}/stats", response_model=StatsResponse)
 async def get_offer_stats(
     offer_name: str,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取offer统计信息（管理员接口）"""
     try:
@@ -109,16 +339,80 @@ async def get_offer_stats(
         if not offer_name or offer_name.strip() == "":
             raise HTTPException(status_code=400, detail="Offer名称不能为空")
 
-        offer_service = OfferService(db)
-        stats = offer_service.get_offer_stats(offer_name.strip())
+        offer_service = AsyncOfferService(db)
+        stats = await offer_service.get_offer_stats(offer_name.strip())
 
         if not stats:
             raise HTTPException(status_code=404, detail="邀请码项目不存在")
 
-        return StatsResponse(data=stats)
+        # 统计数据由服务层按StatsData的结构构建，直接编码，不再经过响应模型
+        return _json_with_etag(request, *_encode_json({"success": True, "message": None, "data": stats}))
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"获取统计信息失败: {str(e)}")
+        logger.error("获取统计信息失败: %s", e)
         raise HTTPException(status_code=500, detail="服务器内部错误")
+
+@router.get("/{offer_name}/events")
+async def offer_events(offer_name: str, request: Request):
+    """订阅offer剩余数量（Server-Sent Events），数量变化时推送，空闲时定期发送心跳"""
+    if not settings.offer_events_enabled:
+        raise HTTPException(status_code=404, detail="实时推送未开启")
+    offer_name = offer_name.strip()
+    if not offer_name:
+        raise HTTPException(status_code=400, detail="Offer名称不能为空")
+    if offer_event_hub.is_full():
+        raise HTTPException(status_code=503, detail="订阅连接数已达上限")
+
+    initial = await offer_event_hub.snapshot(offer_name)
+    if initial is None:
+        raise HTTPException(status_code=404, detail="邀请码项目不存在")
+
+    async def event_stream():
+        # 断线后浏览器3秒后自动重连
+        yield b"retry: 3000\n\n"
+        try:
+            async for payload in offer_event_hub.stream(offer_name, initial):
+                yield format_sse(payload, offer_event_hub.version(offer_name))
+        except TooManySubscribers:
+            return
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # 关闭nginx的响应缓冲，事件立即送达
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+if settings.offer_events_websocket:
+    @router.websocket("/{offer_name}/ws")
+    async def offer_events_ws(websocket: WebSocket, offer_name: str):
+        """WebSocket版本的剩余数量订阅，消息格式与SSE的data相同"""
+        offer_name = offer_name.strip()
+        if offer_event_hub.is_full():
+            await websocket.close(code=1013)
+            return
+        initial = await offer_event_hub.snapshot(offer_name)
+        if initial is None:
+            await websocket.close(code=4404)
+            return
+        await websocket.accept()
+
+        async def send_updates():
+            async for payload in offer_event_hub.stream(offer_name, initial):
+                if payload is not None:
+                    await websocket.send_json(payload)
+
+        sender = asyncio.ensure_future(send_updates())
+        try:
+            # 客户端不需要发送消息，接收循环只用于发现断开
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sender.cancel()
@@ -32,6 +32,8 @@ class OfferInfoResponse(BaseResponse):
 class ClaimRequest(BaseModel):
     user_ip: Optional[str] = None
     user_agent: Optional[str] = None
+    # 客户端令牌（浏览器指纹或Cookie中的随机令牌），CLAIM_DEDUP_KEY=token时用于防重复申请
+    client_token: Optional[str] = None
 
 class ClaimData(BaseModel):
     code: str
@@ -41,22 +43,87 @@ class ClaimResponse(BaseResponse):
     success: bool = True
     data: ClaimData
 
+# 两阶段领取（CLAIM_LEASE_ENABLED）：领取时返回租约令牌，到期前确认才算发放
+class ClaimLeaseData(ClaimData):
+    # 重复领取返回之前的邀请码时为空
+    lease_token: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+
+class ClaimLeaseResponse(BaseResponse):
+    success: bool = True
+    data: ClaimLeaseData
+
+class ClaimConfirmRequest(BaseModel):
+    lease_token: str
+
+class ClaimBatchRequest(BaseModel):
+    count: int
+    user_agent: Optional[str] = None
+    # 剩余数量不足时是否领取全部剩余的邀请码（默认整批失败，不领取任何邀请码）
+    allow_partial: bool = False
+
+class ClaimBatchData(BaseModel):
+    count: int
+    codes: List[str]
+
+class ClaimBatchResponse(BaseResponse):
+    success: bool = True
+    data: ClaimBatchData
+
 # 统计信息相关模型
 class RecentClaim(BaseModel):
     code: str  # 脱敏后的邀请码
     claimed_at: datetime
-    user_ip: str
+    user_ip: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class ClaimBucket(BaseModel):
+    start: datetime
+    count: int
+
 class StatsData(BaseModel):
     total_codes: int
     used_codes: int
     remaining_codes: int
+    # 租约中（已交给客户端、等待确认）的数量
+    leased_codes: int = 0
     usage_rate: float
     recent_claims: List[RecentClaim] = []
+    # 最近60分钟每分钟、最近48小时每小时的领取数量（从旧到新）
+    claims_per_minute: List[ClaimBucket] = []
+    claims_per_hour: List[ClaimBucket] = []
 
 class StatsResponse(BaseResponse):
     success: bool = True
     data: StatsData
+
+# 合作方按邀请码核验/核销（/codes）
+class CodeStatusData(BaseModel):
+    code: str
+    valid: bool
+    # available: 未发放；pending: 预留或租约中；issued: 已发放；redeemed: 已核销；邀请码不存在时为空
+    status: Optional[str] = None
+    offer: Optional[str] = None
+    issued_at: Optional[datetime] = None
+    redeemed_at: Optional[datetime] = None
+
+class CodeStatusResponse(BaseResponse):
+    success: bool = True
+    data: CodeStatusData
+
+class CodeVerifyRequest(BaseModel):
+    codes: List[str]
+    # 只在该offer中查找（默认查找全部offer）
+    offer: Optional[str] = None
+
+class CodeVerifyData(BaseModel):
+    count: int
+    valid_count: int
+    # 与请求中的顺序一致
+    results: List[CodeStatusData]
+
+class CodeVerifyResponse(BaseResponse):
+    success: bool = True
+    data: CodeVerifyData
@@ -0,0 +1,117 @@
+import asyncio
+from typing import Dict, List, Optional
+from sqlalchemy import select, func, false
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.invitation_code import InvitationCode
+from models.database import async_retry_on_locked
+from services.code_service import CodeService, ClaimResult, LeaseResult
+from services.code_index import code_index, CodeStatus
+
+# SQLite同一时间只允许一个写事务，进程内先排队，避免大量连接同时忙等写锁
+_sqlite_write_lock: Optional[asyncio.Lock] = None
+
+def _get_sqlite_write_lock() -> asyncio.Lock:
+    global _sqlite_write_lock
+    if _sqlite_write_lock is None:
+        _sqlite_write_lock = asyncio.Lock()
+    return _sqlite_write_lock
+
+class AsyncCodeService:
+    """邀请码相关业务逻辑（异步版本，供API路由使用）
+
+    领取和导入的事务逻辑复用同步的CodeService，通过run_sync在异步驱动上执行，
+    数据库IO期间不会阻塞事件循环。
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def claim_code(self, offer_name: str, user_ip: str = None, user_agent: str = None) -> Optional[str]:
+        """申请一个邀请码"""
+        def claim(db):
+            return CodeService(db).claim_code(offer_name, user_ip, user_agent)
+
+        if self.db.bind.dialect.name == "sqlite":
+            # 其他进程（CLI导入、领取池回写）持有写锁超过busy_timeout时退避重试
+            async with _get_sqlite_write_lock():
+                return await async_retry_on_locked(self.db.run_sync, claim)
+        return await self.db.run_sync(claim)
+
+    async def claim_once(self, offer_name: str, client_key: str, user_ip: str = None,
+                         user_agent: str = None) -> ClaimResult:
+        """每个客户端只领取一个邀请码，重复领取时返回之前发放的邀请码"""
+        def claim(db):
+            return CodeService(db).claim_once(offer_name, client_key, user_ip, user_agent)
+
+        if self.db.bind.dialect.name == "sqlite":
+            # 其他进程（CLI导入、领取池回写）持有写锁超过busy_timeout时退避重试
+            async with _get_sqlite_write_lock():
+                return await async_retry_on_locked(self.db.run_sync, claim)
+        return await self.db.run_sync(claim)
+
+    async def lease_code(self, offer_name: str, lease_seconds: float, user_ip: str = None,
+                         user_agent: str = None, client_key: str = None) -> LeaseResult:
+        """领取一个邀请码并加上租约"""
+        def lease(db):
+            return CodeService(db).lease_code(offer_name, lease_seconds, user_ip, user_agent, client_key)
+
+        if self.db.bind.dialect.name == "sqlite":
+            async with _get_sqlite_write_lock():
+                return await async_retry_on_locked(self.db.run_sync, lease)
+        return await self.db.run_sync(lease)
+
+    async def confirm_lease(self, offer_name: str, lease_token: str) -> str:
+        """确认租约"""
+        def confirm(db):
+            return CodeService(db).confirm_lease(offer_name, lease_token)
+
+        if self.db.bind.dialect.name == "sqlite":
+            async with _get_sqlite_write_lock():
+                return await async_retry_on_locked(self.db.run_sync, confirm)
+        return await self.db.run_sync(confirm)
+
+    async def claim_batch(self, offer_name: str, count: int, user_ip: str = None, user_agent: str = None,
+                          allow_partial: bool = False) -> List[str]:
+        """一次领取多个邀请码"""
+        def claim(db):
+            return CodeService(db).claim_batch(offer_name, count, user_ip, user_agent, allow_partial)
+
+        if self.db.bind.dialect.name == "sqlite":
+            async with _get_sqlite_write_lock():
+                return await async_retry_on_locked(self.db.run_sync, claim)
+        return await self.db.run_sync(claim)
+
+    async def verify_codes(self, codes: List[str], offer_name: str = None) -> Dict[str, CodeStatus]:
+        """按邀请码查询状态；过滤器判定全部不存在时不访问数据库"""
+        candidates = code_index.candidates(codes)
+        if not candidates:
+            return {}
+        return await self.db.run_sync(lambda db: code_index.find(db, candidates, offer_name))
+
+    async def redeem_code(self, code: str, offer_name: str = None) -> CodeStatus:
+        """核销一个已发放的邀请码"""
+        # 一定不存在的邀请码不排队等待写锁
+        if not code_index.candidates([code]):
+            raise ValueError("邀请码不存在")
+
+        def redeem(db):
+            return CodeService(db).redeem_code(code, offer_name)
+
+        if self.db.bind.dialect.name == "sqlite":
+            async with _get_sqlite_write_lock():
+                return await async_retry_on_locked(self.db.run_sync, redeem)
+        return await self.db.run_sync(redeem)
+
+    async def import_codes(self, offer_name: str, codes: List[str]) -> dict:
+        """导入邀请码到指定offer"""
+        return await self.db.run_sync(lambda db: CodeService(db).import_codes(offer_name, codes))
+
+    async def get_available_count(self, offer_id: int) -> int:
+        """获取可用邀请码数量"""
+        result = await self.db.execute(
+            select(func.count()).select_from(InvitationCode).where(
+                InvitationCode.offer_id == offer_id,
+                InvitationCode.is_used == false()
+            )
+        )
+        return result.scalar_one()
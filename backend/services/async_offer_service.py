@@ -0,0 +1,30 @@
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.offer import Offer
+from services.offer_service import OfferService
+
+class AsyncOfferService:
+    """Offer相关业务逻辑（异步版本，供API路由使用）"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_offer_by_name(self, name: str) -> Optional[Offer]:
+        """根据名称获取offer"""
+        result = await self.db.execute(select(Offer).where(Offer.name == name))
+        return result.scalars().first()
+
+    async def create_offer(self, name: str, title: str, description: str = None) -> Offer:
+        """创建新的offer"""
+        return await self.db.run_sync(
+            lambda db: OfferService(db).create_offer(name, title, description)
+        )
+
+    async def update_offer_stats(self, offer_id: int):
+        """更新offer的统计信息"""
+        await self.db.run_sync(lambda db: OfferService(db).update_offer_stats(offer_id))
+
+    async def get_offer_stats(self, offer_name: str) -> dict:
+        """获取offer的详细统计信息"""
+        return await self.db.run_sync(lambda db: OfferService(db).get_offer_stats(offer_name))
@@ -0,0 +1,135 @@
+"""
+集合化批量导入邀请码
+
+与逐条查询去重相比：
+- 同一批次内用字典在内存中去重
+- 与数据库已有邀请码的去重通过反连接（NOT EXISTS）一次完成，
+  走 (offer_id, code) 唯一索引（已归档的邀请码同样参与去重）
+- 新邀请码用 INSERT ... SELECT 整批写入
+- offer计数按实际新增数量增量更新，不再执行COUNT
+- 同时写入邀请码的64位哈希 code_hash（按邀请码查询用），并加入本进程的哈希前缀过滤器
+"""
+
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import BigInteger, Column, MetaData, String, Table, select, literal, false, exists
+from sqlalchemy.orm import Session
+
+from models.offer import Offer
+from models.invitation_code import InvitationCode
+from models.code_archive import InvitationCodeArchive
+from services.offer_cache import offer_info_cache
+from services.code_index import code_hash, code_index
+
+# 默认每个事务处理的邀请码数量
+DEFAULT_CHUNK_SIZE = 50000
+
+codes_table = InvitationCode.__table__
+archive_table = InvitationCodeArchive.__table__
+offers_table = Offer.__table__
+
+
+def _temp_table(metadata: MetaData, name: str) -> Table:
+    return Table(
+        name, metadata,
+        Column("code", String(255), primary_key=True),
+        Column("code_hash", BigInteger),
+        prefixes=["TEMPORARY"]
+    )
+
+
+class BulkImporter:
+    """按块批量导入邀请码，每块一个事务"""
+
+    def __init__(self, db: Session, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.db = db
+        self.chunk_size = chunk_size
+
+    def import_codes(self, offer_name: str, codes: Iterable[str],
+                     progress: Optional[Callable[[int, int, int], None]] = None) -> dict:
+        """导入邀请码到指定offer
+
+        progress 在每块提交后调用，参数为 (本块处理行数, 本块新增数, 本块重复数)。
+        """
+        offer = self.db.query(Offer).filter(Offer.name == offer_name).first()
+        if not offer:
+            raise ValueError(f"Offer '{offer_name}' 不存在，请先创建")
+        offer_id = offer.id
+        self.db.commit()
+
+        new_codes = 0
+        duplicate_codes = 0
+        total_processed = 0
+
+        # 临时表只在当前连接内可见，所以整个导入过程使用同一个连接
+        with self.db.get_bind().connect() as conn:
+            metadata = MetaData()
+            chunk = _temp_table(metadata, "import_chunk")
+            metadata.create_all(conn)
+            try:
+                iterator = iter(codes)
+                while True:
+                    lines = list(islice(iterator, self.chunk_size))
+                    if not lines:
+                        break
+
+                    stripped = [code.strip() for code in lines]
+                    unique = [code for code in dict.fromkeys(stripped) if code]
+                    non_empty = sum(1 for code in stripped if code)
+
+                    inserted = self._import_chunk(conn, offer_id, chunk, unique) if unique else 0
+
+                    new_codes += inserted
+                    duplicate_codes += non_empty - inserted
+                    total_processed += len(lines)
+                    if progress:
+                        progress(len(lines), inserted, non_empty - inserted)
+            finally:
+                metadata.drop_all(conn)
+                offer_info_cache.on_change(offer_name)
+
+        return {
+            "new_codes": new_codes,
+            "duplicate_codes": duplicate_codes,
+            "total_processed": total_processed
+        }
+
+    def _import_chunk(self, conn, offer_id: int, chunk: Table, codes: list) -> int:
+        """在一个事务内写入一块已去重的邀请码，返回新增数量"""
+        now = datetime.now()
+        rows = [{"code": code, "code_hash": code_hash(code)} for code in codes]
+        with conn.begin():
+            conn.execute(chunk.insert(), rows)
+
+            existing = codes_table.alias("existing")
+            archived = archive_table.alias("archived")
+            not_exists = ~exists().where(
+                existing.c.offer_id == offer_id,
+                existing.c.code == chunk.c.code
+            ) & ~exists().where(
+                archived.c.offer_id == offer_id,
+                archived.c.code == chunk.c.code
+            )
+            result = conn.execute(codes_table.insert().from_select(
+                ["offer_id", "code", "code_hash", "is_used", "created_at"],
+                select(literal(offer_id), chunk.c.code, chunk.c.code_hash, false(), literal(now)).where(not_exists)
+            ))
+            inserted = result.rowcount
+            conn.execute(chunk.delete())
+
+            if inserted:
+                conn.execute(
+                    offers_table.update()
+                    .where(offers_table.c.id == offer_id)
+                    .values(
+                        total_count=offers_table.c.total_count + inserted,
+                        remaining_count=offers_table.c.remaining_count + inserted,
+                        updated_at=now
+                    )
+                )
+        # 重复的邀请码本来就在过滤器中，整块加入即可
+        if inserted:
+            code_index.add(row["code_hash"] for row in rows)
+        return inserted
@@ -0,0 +1,270 @@
+"""
+邀请码领取审计日志
+
+领取事务只把 invitation_codes 行标记为 is_used 并写入 used_at；领取者IP和
+User-Agent作为审计事件放入内存队列，由后台线程批量追加到 claim_events 表。
+User-Agent字符串写入 user_agents 字典表，事件中只保存其id。
+
+后台线程未启动时（命令行工具、脚本）事件在记录时用调用方的会话同步写入。进程异常退出会丢失
+最多一个回写周期内尚未写入的审计事件，邀请码的发放状态不受影响。
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models.claim_event import ClaimEvent, UserAgent
+from services import metrics
+from services.claim_stats import add_claim_counts
+
+logger = logging.getLogger(__name__)
+
+events_table = ClaimEvent.__table__
+user_agents_table = UserAgent.__table__
+
+ClaimAuditEvent = namedtuple("ClaimAuditEvent", ["code_id", "offer_id", "claimed_at", "user_ip", "user_agent"])
+
+# 单条语句中IN列表的最大长度（兼容旧版SQLite的参数个数限制）
+IN_CHUNK_SIZE = 500
+
+
+def ua_hash(user_agent: str) -> str:
+    return hashlib.sha256(user_agent.encode("utf-8")).hexdigest()
+
+
+def _insert_ignoring_duplicates(db: Session):
+    """User-Agent字典表的插入语句，多个进程同时写入同一个User-Agent时忽略重复行"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite" and sqlite3.sqlite_version_info >= (3, 24, 0):
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(user_agents_table).on_conflict_do_nothing(index_elements=["ua_hash"])
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(user_agents_table).on_conflict_do_nothing(index_elements=["ua_hash"])
+    if dialect in ("mysql", "mariadb"):
+        return user_agents_table.insert().prefix_with("IGNORE")
+    return user_agents_table.insert()
+
+
+class UserAgentInterner:
+    """User-Agent字符串到字典表id的映射，进程内LRU缓存常见的User-Agent"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._ids: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 缓存所属的数据库，切换数据库（测试、迁移工具）时清空
+        self._bind_url = None
+
+    def intern(self, db: Session, agents: Iterable[str]) -> Dict[str, int]:
+        """返回User-Agent到id的映射，缺失的写入字典表（不提交事务）
+
+        新写入的id在事务提交后才能缓存，由调用方提交后调用remember。其他进程同时
+        写入同一个User-Agent时忽略重复行（不支持的数据库上会触发唯一约束冲突，
+        调用方回滚后重试即可）。
+        """
+        result = {}
+        missing = {}
+        bind_url = str(db.get_bind().url)
+        with self._lock:
+            if bind_url != self._bind_url:
+                self._ids.clear()
+                self._bind_url = bind_url
+            for agent in set(a for a in agents if a):
+                agent_id = self._ids.get(agent)
+                if agent_id is None:
+                    missing[ua_hash(agent)] = agent
+                else:
+                    self._ids.move_to_end(agent)
+                    result[agent] = agent_id
+        if not missing:
+            return result
+
+        hashes = list(missing)
+        found = {}
+        for i in range(0, len(hashes), IN_CHUNK_SIZE):
+            found.update(db.execute(
+                select(user_agents_table.c.ua_hash, user_agents_table.c.id)
+                .where(user_agents_table.c.ua_hash.in_(hashes[i:i + IN_CHUNK_SIZE]))
+            ).fetchall())
+        new = [{"ua_hash": h, "user_agent": missing[h]} for h in hashes if h not in found]
+        if new:
+            db.execute(_insert_ignoring_duplicates(db), new)
+            for i in range(0, len(new), IN_CHUNK_SIZE):
+                found.update(db.execute(
+                    select(user_agents_table.c.ua_hash, user_agents_table.c.id)
+                    .where(user_agents_table.c.ua_hash.in_([row["ua_hash"] for row in new[i:i + IN_CHUNK_SIZE]]))
+                ).fetchall())
+
+        result.update((missing[h], agent_id) for h, agent_id in found.items())
+        return result
+
+    def remember(self, mapping: Dict[str, int]):
+        """事务提交后缓存新写入的User-Agent"""
+        with self._lock:
+            self._ids.update(mapping)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+def insert_claim_events(db: Session, events: List[ClaimAuditEvent], interner: "UserAgentInterner" = None,
+                        count: bool = True) -> Dict[str, int]:
+    """批量写入审计事件（不提交事务），返回本次用到的User-Agent映射
+
+    count为True时同时累加 claim_counts 中的分钟/小时领取数量。
+    """
+    interner = interner or claim_audit_log.interner
+    agent_ids = interner.intern(db, (e.user_agent for e in events))
+    if events:
+        db.execute(events_table.insert(), [
+            {
+                "code_id": e.code_id,
+                "offer_id": e.offer_id,
+                "claimed_at": e.claimed_at,
+                "user_ip": e.user_ip,
+                "user_agent_id": agent_ids.get(e.user_agent) if e.user_agent else None
+            }
+            for e in events
+        ])
+        if count:
+            add_claim_counts(db, events)
+    return agent_ids
+
+
+class ClaimAuditLog:
+    """审计事件的内存队列与后台批量写入线程"""
+
+    def __init__(self, session_factory=None, flush_interval_ms: int = 500, batch_size: int = 1000,
+                 max_pending: int = 100000, ua_cache_size: int = 10000):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.interner = UserAgentInterner(ua_cache_size)
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, session_factory):
+        """启动后台写入线程"""
+        self.session_factory = session_factory
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="claim-audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程并写入剩余事件"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def record(self, db: Session, code_id: int, offer_id: int, claimed_at: datetime,
+               user_ip: str = None, user_agent: str = None):
+        """记录一次领取（领取事务提交之后调用）
+
+        后台线程未启动时直接用db写入并提交；写入失败只记录日志，不影响已完成的领取。
+        """
+        event = ClaimAuditEvent(code_id, offer_id, claimed_at, user_ip, user_agent)
+        if self._thread is None:
+            try:
+                self._write(db, [event])
+            except Exception as e:
+                logger.error("审计事件写入失败: %s", e)
+            return
+
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                # 数据库长时间不可写时丢弃最旧的事件，避免内存无限增长
+                self._pending.popleft()
+                metrics.claim_audit_dropped.inc()
+            self._pending.append(event)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> bool:
+        """写入队列中的全部事件，失败的批次放回队列，全部成功返回True"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._pending = list(self._pending), deque()
+            for i in range(0, len(events), self.batch_size):
+                try:
+                    self._write_batch(events[i:i + self.batch_size])
+                except Exception as e:
+                    logger.error("审计事件写入失败，稍后重试: %s", e)
+                    with self._lock:
+                        self._pending.extendleft(reversed(events[i:]))
+                    return False
+            return True
+
+    def _write_batch(self, events: List[ClaimAuditEvent]):
+        db = self.session_factory()
+        try:
+            self._write(db, events)
+        finally:
+            db.close()
+
+    def _write(self, db: Session, events: List[ClaimAuditEvent]):
+        try:
+            agent_ids = insert_claim_events(db, events, self.interner)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        self.interner.remember(agent_ids)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("审计日志后台任务失败: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "pending": self.pending_count()
+        }
+
+
+def _create_audit_log() -> ClaimAuditLog:
+    from config.settings import settings
+    return ClaimAuditLog(
+        flush_interval_ms=settings.claim_audit_flush_interval_ms,
+        batch_size=settings.claim_audit_batch_size,
+        max_pending=settings.claim_audit_max_pending,
+        ua_cache_size=settings.claim_audit_ua_cache_size
+    )
+
+
+claim_audit_log = _create_audit_log()
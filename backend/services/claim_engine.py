@@ -0,0 +1,401 @@
+"""
+邀请码原子领取引擎
+
+根据数据库方言选择领取策略，保证同一个邀请码只会被发放一次：
+- SQLite 3.35+: BEGIN IMMEDIATE + 单条 UPDATE ... RETURNING
+- 旧版SQLite: BEGIN IMMEDIATE + 查询后按主键更新（写锁已持有，不会冲突）
+- PostgreSQL: UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING
+- MySQL/MariaDB: SELECT ... FOR UPDATE SKIP LOCKED 后按主键更新
+- 其他数据库: 带 is_used 条件的乐观更新，冲突时重试
+
+两阶段领取（租约）复用同样的选取逻辑：邀请码标记为 is_used 但不写 used_at，同时写入
+code_leases，确认时才写入 used_at 和审计事件；到期未确认的租约由 services.lease_reaper 放回。
+"""
+
+import secrets
+import sqlite3
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select, text, true, false
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.offer import Offer
+from models.invitation_code import InvitationCode
+from models.code_reservation import CodeReservation
+from models.code_lease import CodeLease
+from models.claimer_identity import ClaimerIdentity
+from services.claim_audit import ClaimAuditEvent, claim_audit_log, insert_claim_events
+from services.claim_stats import claim_stats
+
+ClaimedCode = namedtuple("ClaimedCode", ["id", "offer_id", "code"])
+LeasedCode = namedtuple("LeasedCode", ["id", "offer_id", "code", "token", "expires_at"])
+
+# 邀请码id区间 [起始, 结束)
+IdRange = Tuple[int, int]
+
+codes_table = InvitationCode.__table__
+offers_table = Offer.__table__
+reservations_table = CodeReservation.__table__
+leases_table = CodeLease.__table__
+identities_table = ClaimerIdentity.__table__
+
+STRATEGY_SQLITE_RETURNING = "sqlite_returning"
+STRATEGY_SQLITE_LOCKED = "sqlite_locked"
+STRATEGY_RETURNING_SKIP_LOCKED = "returning_skip_locked"
+STRATEGY_SKIP_LOCKED = "skip_locked"
+STRATEGY_OPTIMISTIC = "optimistic"
+
+# 乐观更新策略的最大重试次数
+OPTIMISTIC_MAX_RETRIES = 10
+
+# 按主键更新时单条语句中IN列表的最大长度（兼容旧版SQLite的参数个数限制）
+IN_CHUNK_SIZE = 500
+
+_SQLITE_MARK_SQL = """
+    UPDATE invitation_codes
+    SET {assignments}
+    WHERE id IN (
+        SELECT c.id FROM invitation_codes AS c
+        JOIN offers AS o ON o.id = c.offer_id
+        WHERE o.name = :offer_name AND o.is_active = 1 AND c.is_used = 0{range_filter}
+        LIMIT :limit
+    )
+    RETURNING id, offer_id, code
+"""
+
+
+def select_strategy(dialect) -> str:
+    """根据数据库方言选择领取策略"""
+    name = dialect.name
+    if name == "sqlite":
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            return STRATEGY_SQLITE_RETURNING
+        return STRATEGY_SQLITE_LOCKED
+    if name == "postgresql":
+        return STRATEGY_RETURNING_SKIP_LOCKED
+    if name in ("mysql", "mariadb"):
+        return STRATEGY_SKIP_LOCKED
+    return STRATEGY_OPTIMISTIC
+
+
+class ClaimerAlreadyClaimed(Exception):
+    """该客户端已经在这个offer下领取过邀请码（领取事务已回滚）"""
+
+
+class ClaimEngine:
+    """在一个事务内选取并标记邀请码，同时维护offer剩余数量"""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.strategy = select_strategy(db.get_bind().dialect)
+
+    def claim(self, offer_name: str, user_ip: str = None, user_agent: str = None,
+              client_key: str = None, id_range: IdRange = None) -> Optional[ClaimedCode]:
+        """领取一个邀请码并提交事务，没有可用邀请码（或offer不可用）时返回None
+
+        传入client_key时在同一事务内登记领取者身份，该客户端已领取过时回滚并抛出
+        ClaimerAlreadyClaimed。领取者IP和User-Agent在提交后交给审计日志，不写入邀请码行。
+        传入id_range时只在该id区间 [起始, 结束) 内选取（多进程分区领取）。
+        """
+        now = datetime.now()
+        values = {
+            "is_used": True,
+            "used_at": now
+        }
+        try:
+            claimed = self._mark(offer_name, 1, values, id_range)
+            if not claimed:
+                self.db.rollback()
+                return None
+
+            if client_key:
+                self._register_claimer(claimed[0], client_key, now)
+            self._decrement_remaining(claimed[0].offer_id, 1, now)
+            self.db.commit()
+        except ClaimerAlreadyClaimed:
+            raise
+        except Exception:
+            self.db.rollback()
+            raise
+
+        claim_stats.record(claimed[0].offer_id, claimed[0].code, now, user_ip)
+        claim_audit_log.record(self.db, claimed[0].id, claimed[0].offer_id, now, user_ip, user_agent)
+        return claimed[0]
+
+    def claim_batch(self, offer_name: str, count: int, user_ip: str = None, user_agent: str = None,
+                    allow_partial: bool = False) -> List[ClaimedCode]:
+        """在一个事务内领取count个邀请码并提交
+
+        用一条集合更新标记邀请码，审计事件在同一事务内批量写入。可用数量不足count时
+        回滚并返回空列表；allow_partial为True时改为领取全部剩余的邀请码。
+        """
+        now = datetime.now()
+        try:
+            claimed = self._mark(offer_name, count, {"is_used": True, "used_at": now})
+            if not claimed or (len(claimed) < count and not allow_partial):
+                self.db.rollback()
+                return []
+
+            self._decrement_remaining(claimed[0].offer_id, len(claimed), now)
+            agent_ids = insert_claim_events(self.db, [
+                ClaimAuditEvent(item.id, item.offer_id, now, user_ip, user_agent)
+                for item in claimed
+            ])
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        claim_audit_log.interner.remember(agent_ids)
+        for item in claimed:
+            claim_stats.record(item.offer_id, item.code, now, user_ip)
+        return claimed
+
+    def lease(self, offer_name: str, lease_seconds: float, user_ip: str = None, user_agent: str = None,
+              client_key: str = None, id_range: IdRange = None) -> Optional[LeasedCode]:
+        """领取一个邀请码并加上租约，提交事务，没有可用邀请码时返回None
+
+        邀请码标记为 is_used（不写used_at），剩余数量减1、租约中数量加1；确认（confirm）后
+        才算发放。client_key 和 id_range 的含义与 claim 相同。
+        """
+        now = datetime.now()
+        try:
+            claimed = self._mark(offer_name, 1, {"is_used": True}, id_range)
+            if not claimed:
+                self.db.rollback()
+                return None
+
+            item = claimed[0]
+            if client_key:
+                self._register_claimer(item, client_key, now)
+            leased = LeasedCode(item.id, item.offer_id, item.code, secrets.token_urlsafe(24),
+                                now + timedelta(seconds=lease_seconds))
+            self.db.execute(leases_table.insert().values(
+                code_id=item.id,
+                offer_id=item.offer_id,
+                token=leased.token,
+                client_key=client_key,
+                user_ip=user_ip,
+                user_agent=user_agent,
+                leased_at=now,
+                expires_at=leased.expires_at
+            ))
+            self._update_counts(item.offer_id, now, remaining=-1, leased=1)
+            self.db.commit()
+        except ClaimerAlreadyClaimed:
+            raise
+        except Exception:
+            self.db.rollback()
+            raise
+        return leased
+
+    def confirm(self, offer_name: str, token: str) -> Optional[ClaimedCode]:
+        """确认租约并提交事务，租约不存在、已过期或不属于该offer时返回None"""
+        now = datetime.now()
+        try:
+            if self.strategy in (STRATEGY_SQLITE_RETURNING, STRATEGY_SQLITE_LOCKED):
+                self._begin_immediate()
+            lease = self.db.execute(
+                select(leases_table.c.code_id, leases_table.c.offer_id, codes_table.c.code,
+                       leases_table.c.user_ip, leases_table.c.user_agent)
+                .select_from(
+                    leases_table
+                    .join(codes_table, codes_table.c.id == leases_table.c.code_id)
+                    .join(offers_table, offers_table.c.id == leases_table.c.offer_id)
+                )
+                .where(
+                    leases_table.c.token == token,
+                    leases_table.c.expires_at >= now,
+                    offers_table.c.name == offer_name
+                )
+            ).first()
+            # 删除租约的行数保证并发的确认和回收只有一方成功
+            if lease is None or self.db.execute(
+                leases_table.delete().where(
+                    leases_table.c.code_id == lease.code_id,
+                    leases_table.c.token == token
+                )
+            ).rowcount != 1:
+                self.db.rollback()
+                return None
+
+            self.db.execute(
+                codes_table.update()
+                .where(codes_table.c.id == lease.code_id)
+                .values(used_at=now)
+            )
+            self._update_counts(lease.offer_id, now, leased=-1)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        claim_stats.record(lease.offer_id, lease.code, now, lease.user_ip)
+        claim_audit_log.record(self.db, lease.code_id, lease.offer_id, now, lease.user_ip, lease.user_agent)
+        return ClaimedCode(lease.code_id, lease.offer_id, lease.code)
+
+    def reserve(self, offer_name: str, count: int, worker_id: str,
+                id_range: IdRange = None, expires_at: datetime = None) -> List[ClaimedCode]:
+        """为领取池预留一批邀请码并提交事务
+
+        预留的邀请码被标记为 is_used 以避开其他领取者，但不扣减剩余数量，
+        真正发放后由领取池批量回写时再扣减。expires_at 为预留的到期时间，由领取池续约。
+        """
+        try:
+            reserved = self._mark(offer_name, count, {"is_used": True}, id_range)
+            if not reserved:
+                self.db.rollback()
+                return []
+
+            now = datetime.now()
+            self.db.execute(reservations_table.insert(), [
+                {
+                    "code_id": item.id,
+                    "offer_id": item.offer_id,
+                    "worker_id": worker_id,
+                    "reserved_at": now,
+                    "expires_at": expires_at
+                }
+                for item in reserved
+            ])
+            self.db.commit()
+            return reserved
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def _mark(self, offer_name: str, limit: int, values: dict,
+              id_range: IdRange = None) -> List[ClaimedCode]:
+        """按当前策略选取最多limit个未使用邀请码并写入values，不提交事务"""
+        if self.strategy in (STRATEGY_SQLITE_RETURNING, STRATEGY_SQLITE_LOCKED):
+            self._begin_immediate()
+
+        if self.strategy == STRATEGY_SQLITE_RETURNING:
+            return self._mark_sqlite_returning(offer_name, limit, values, id_range)
+        if self.strategy == STRATEGY_RETURNING_SKIP_LOCKED:
+            return self._mark_returning_skip_locked(offer_name, limit, values, id_range)
+        if self.strategy == STRATEGY_OPTIMISTIC:
+            return self._mark_optimistic(offer_name, limit, values, id_range)
+        # SQLITE_LOCKED 已持有写锁，SKIP_LOCKED 已锁定选中的行，两者都可以直接按主键更新
+        return self._mark_select_then_update(
+            offer_name, limit, values, id_range,
+            skip_locked=self.strategy == STRATEGY_SKIP_LOCKED
+        )
+
+    def _begin_immediate(self):
+        """SQLite下以BEGIN IMMEDIATE开启事务，在读取前就拿到写锁，避免锁升级死锁"""
+        conn = self.db.connection()
+        dbapi_conn = conn.connection.dbapi_connection
+        # aiosqlite适配层把原始连接包在_connection中
+        raw_conn = getattr(dbapi_conn, "_connection", dbapi_conn)
+        if not raw_conn.in_transaction:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def _pick_query(self, offer_name: str, limit: int, id_range: IdRange = None):
+        """选取offer下未使用邀请码的查询"""
+        c = codes_table.alias("c")
+        o = offers_table.alias("o")
+        query = (
+            select(c.c.id, c.c.offer_id, c.c.code)
+            .select_from(c.join(o, o.c.id == c.c.offer_id))
+            .where(
+                o.c.name == offer_name,
+                o.c.is_active == true(),
+                c.c.is_used == false()
+            )
+            .limit(limit)
+        )
+        if id_range is not None:
+            query = query.where(c.c.id >= id_range[0], c.c.id < id_range[1])
+        return query, c
+
+    def _mark_sqlite_returning(self, offer_name, limit, values, id_range=None) -> List[ClaimedCode]:
+        assignments = ", ".join(f"{column} = :{column}" for column in values)
+        params = dict(values, offer_name=offer_name, limit=limit)
+        range_filter = ""
+        if id_range is not None:
+            range_filter = " AND c.id >= :range_start AND c.id < :range_end"
+            params.update(range_start=id_range[0], range_end=id_range[1])
+        rows = self.db.execute(
+            text(_SQLITE_MARK_SQL.format(assignments=assignments, range_filter=range_filter)),
+            params
+        ).fetchall()
+        return [ClaimedCode(*row) for row in rows]
+
+    def _mark_returning_skip_locked(self, offer_name, limit, values, id_range=None) -> List[ClaimedCode]:
+        pick, c = self._pick_query(offer_name, limit, id_range)
+        pick = pick.with_only_columns([c.c.id]).with_for_update(skip_locked=True, of=c)
+        stmt = (
+            codes_table.update()
+            .where(codes_table.c.id.in_(pick))
+            .values(**values)
+            .returning(codes_table.c.id, codes_table.c.offer_id, codes_table.c.code)
+        )
+        return [ClaimedCode(*row) for row in self.db.execute(stmt).fetchall()]
+
+    def _mark_select_then_update(self, offer_name, limit, values, id_range=None,
+                                 skip_locked: bool = False) -> List[ClaimedCode]:
+        pick, c = self._pick_query(offer_name, limit, id_range)
+        if skip_locked:
+            pick = pick.with_for_update(skip_locked=True, of=c)
+        rows = [ClaimedCode(*row) for row in self.db.execute(pick).fetchall()]
+        for i in range(0, len(rows), IN_CHUNK_SIZE):
+            self.db.execute(
+                codes_table.update()
+                .where(codes_table.c.id.in_([row.id for row in rows[i:i + IN_CHUNK_SIZE]]))
+                .values(**values)
+            )
+        return rows
+
+    def _mark_optimistic(self, offer_name, limit, values, id_range=None) -> List[ClaimedCode]:
+        marked = []
+        for _ in range(OPTIMISTIC_MAX_RETRIES):
+            pick, _c = self._pick_query(offer_name, limit - len(marked), id_range)
+            rows = self.db.execute(pick).fetchall()
+            if not rows:
+                return marked
+
+            for row in rows:
+                result = self.db.execute(
+                    codes_table.update()
+                    .where(codes_table.c.id == row.id, codes_table.c.is_used == false())
+                    .values(**values)
+                )
+                if result.rowcount == 1:
+                    marked.append(ClaimedCode(*row))
+
+            if len(marked) >= limit:
+                return marked
+
+        if marked:
+            return marked
+        raise RuntimeError("邀请码领取冲突过多，请稍后重试")
+
+    def _register_claimer(self, claimed: ClaimedCode, client_key: str, now: datetime):
+        """登记领取者身份，主键冲突说明该客户端已领取过"""
+        try:
+            self.db.execute(identities_table.insert().values(
+                offer_id=claimed.offer_id,
+                client_key=client_key,
+                code_id=claimed.id,
+                claimed_at=now
+            ))
+        except IntegrityError:
+            self.db.rollback()
+            raise ClaimerAlreadyClaimed()
+
+    def _decrement_remaining(self, offer_id: int, count: int, now: datetime):
+        """在同一事务内扣减offer剩余数量"""
+        self._update_counts(offer_id, now, remaining=-count)
+
+    def _update_counts(self, offer_id: int, now: datetime, remaining: int = 0, leased: int = 0):
+        """在同一事务内按增量修改offer的剩余数量和租约中数量"""
+        values = {"updated_at": now}
+        if remaining:
+            values["remaining_count"] = offers_table.c.remaining_count + remaining
+        if leased:
+            values["leased_count"] = func.coalesce(offers_table.c.leased_count, 0) + leased
+        self.db.execute(offers_table.update().where(offers_table.c.id == offer_id).values(**values))
@@ -0,0 +1,301 @@
+"""
+多进程部署时按邀请码id分区领取
+
+多个工作进程同时领取同一个offer时，都会选中同一批"第一个未使用"的邀请码，在行锁
+或写锁上互相等待。开启分区后每个进程按offer租用一段互不重叠的id区间（分区），
+只在自己的分区内领取（以及为领取池预留），进程之间不再争抢同一批行。
+
+- 分区: 第block个分区为 [block * 分区大小, (block + 1) * 分区大小)，租约记录在
+  code_partition_leases 表中，主键 (offer_id, block) 保证同一分区只有一个持有者
+- 再平衡: 分区内领完后删除租约，从最小的未使用邀请码开始查找下一个没有被其他进程
+  持有的分区；所有分区都被占用时退回在整个offer中领取，不会因分区而领取失败
+- 回收: 后台线程按租约时长的三分之一续约，进程退出后租约到期，其他进程可以直接接管
+
+接口领取在 AsyncSession.run_sync 中调用 claim 并传入当前会话，租用和删除租约都通过这个
+会话执行，不会在事件循环线程上另开同步连接；领取池在自己的线程中预留，不传会话。
+
+分区只用于减少冲突，邀请码不会被重复发放仍由领取引擎的原子更新保证。
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import func, false, select, true
+from sqlalchemy.exc import IntegrityError
+
+from models.offer import Offer
+from models.invitation_code import InvitationCode
+from models.code_partition import CodePartitionLease
+
+logger = logging.getLogger(__name__)
+
+offers_table = Offer.__table__
+codes_table = InvitationCode.__table__
+leases_table = CodePartitionLease.__table__
+
+# 单次领取中最多切换分区的次数，超过后在整个offer中领取
+MAX_REBALANCES = 3
+
+
+class ClaimPartitions:
+    """当前进程持有的分区租约"""
+
+    def __init__(self, session_factory, worker_id: str, partition_size: int = 10000,
+                 lease_seconds: float = 30.0):
+        self.session_factory = session_factory
+        self.worker_id = worker_id
+        self.partition_size = partition_size
+        self.lease_seconds = lease_seconds
+        # offer名称 -> (offer_id, block)
+        self._leases: Dict[str, Tuple[int, int]] = {}
+        self._acquire_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.acquired = 0
+        self.drained = 0
+        self.fallbacks = 0
+
+    # ---- 生命周期 ----
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="claim-partitions", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止续约并释放全部租约"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        db = self.session_factory()
+        try:
+            db.execute(leases_table.delete().where(leases_table.c.worker_id == self.worker_id))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error("释放分区租约失败: %s", e)
+        finally:
+            db.close()
+        self._leases = {}
+
+    # ---- 领取 ----
+
+    def claim(self, offer_name: str, fn: Callable, db=None):
+        """在本进程的分区内调用 fn(id_range) 领取，结果为空表示分区已领完
+
+        分区领完后换一个分区重试；没有可租用的分区时调用 fn(None) 在整个offer中领取。
+        传入db时用这个会话租用和删除分区租约，否则新开一个会话。
+        """
+        for _ in range(MAX_REBALANCES):
+            lease = self._current(offer_name, db)
+            if lease is None:
+                break
+            result = fn(self._id_range(lease[1]))
+            if result:
+                return result
+            self._drain(offer_name, lease, db)
+        self.fallbacks += 1
+        return fn(None)
+
+    def _id_range(self, block: int) -> Tuple[int, int]:
+        return block * self.partition_size, (block + 1) * self.partition_size
+
+    def _current(self, offer_name: str, db=None) -> Optional[Tuple[int, int]]:
+        lease = self._leases.get(offer_name)
+        if lease is not None:
+            return lease
+        # 传入的会话在事件循环线程上通过异步驱动执行，等待IO时其他请求会继续运行，
+        # 不能阻塞等待线程锁；其他请求正在租用分区时本次直接在整个offer中领取
+        if not self._acquire_lock.acquire(blocking=db is None):
+            return None
+        try:
+            lease = self._leases.get(offer_name)
+            if lease is None:
+                lease = self._acquire(offer_name, db)
+                if lease is not None:
+                    self._leases[offer_name] = lease
+            return lease
+        finally:
+            self._acquire_lock.release()
+
+    def _acquire(self, offer_name: str, db=None) -> Optional[Tuple[int, int]]:
+        """从最小的未使用邀请码开始，租用第一个没有被其他进程持有的分区"""
+        own_session = db is None
+        if own_session:
+            db = self.session_factory()
+        try:
+            offer_id = db.execute(
+                select(offers_table.c.id).where(
+                    offers_table.c.name == offer_name,
+                    offers_table.c.is_active == true()
+                )
+            ).scalar()
+            if offer_id is None:
+                return None
+
+            now = datetime.now()
+            taken = {
+                row[0] for row in db.execute(
+                    select(leases_table.c.block).where(
+                        leases_table.c.offer_id == offer_id,
+                        leases_table.c.worker_id != self.worker_id,
+                        leases_table.c.expires_at >= now
+                    )
+                )
+            }
+            start = 0
+            for _ in range(len(taken) + MAX_REBALANCES):
+                first_unused = db.execute(
+                    select(func.min(codes_table.c.id)).where(
+                        codes_table.c.offer_id == offer_id,
+                        codes_table.c.is_used == false(),
+                        codes_table.c.id >= start
+                    )
+                ).scalar()
+                db.rollback()
+                if first_unused is None:
+                    return None
+
+                block = first_unused // self.partition_size
+                start = (block + 1) * self.partition_size
+                if block not in taken and self._try_lease(db, offer_id, block, now):
+                    self.acquired += 1
+                    logger.info("租用分区: offer=%s, block=%s, worker=%s", offer_name, block, self.worker_id)
+                    return offer_id, block
+                taken.add(block)
+            return None
+        finally:
+            if own_session:
+                db.close()
+
+    def _try_lease(self, db, offer_id: int, block: int, now: datetime) -> bool:
+        """租用分区：接管已到期的租约或新建租约，被其他进程抢先时返回False"""
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        try:
+            updated = db.execute(
+                leases_table.update()
+                .where(
+                    leases_table.c.offer_id == offer_id,
+                    leases_table.c.block == block,
+                    (leases_table.c.expires_at < now) | (leases_table.c.worker_id == self.worker_id)
+                )
+                .values(worker_id=self.worker_id, expires_at=expires_at)
+            ).rowcount
+            if not updated:
+                db.execute(leases_table.insert().values(
+                    offer_id=offer_id, block=block, worker_id=self.worker_id, expires_at=expires_at
+                ))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+        except Exception:
+            db.rollback()
+            raise
+
+    def _drain(self, offer_name: str, lease: Tuple[int, int], db=None):
+        """分区已领完：删除租约，下次领取时租用新的分区"""
+        # 只在锁内修改字典，不在锁内访问数据库
+        with self._acquire_lock:
+            if self._leases.get(offer_name) != lease:
+                # 其他线程已经切换了分区
+                return
+            del self._leases[offer_name]
+        self.drained += 1
+        own_session = db is None
+        if own_session:
+            db = self.session_factory()
+        try:
+            db.execute(leases_table.delete().where(
+                leases_table.c.offer_id == lease[0],
+                leases_table.c.block == lease[1],
+                leases_table.c.worker_id == self.worker_id
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error("删除分区租约失败: %s", e)
+        finally:
+            if own_session:
+                db.close()
+
+    # ---- 续约 ----
+
+    def renew(self):
+        """续约本进程的全部租约，丢弃已被其他进程接管的租约"""
+        db = self.session_factory()
+        try:
+            db.execute(
+                leases_table.update()
+                .where(leases_table.c.worker_id == self.worker_id)
+                .values(expires_at=datetime.now() + timedelta(seconds=self.lease_seconds))
+            )
+            db.commit()
+            held = {
+                (row[0], row[1]) for row in db.execute(
+                    select(leases_table.c.offer_id, leases_table.c.block)
+                    .where(leases_table.c.worker_id == self.worker_id)
+                )
+            }
+            db.rollback()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        with self._acquire_lock:
+            for name, lease in list(self._leases.items()):
+                if lease not in held:
+                    del self._leases[name]
+
+    def _run(self):
+        while not self._stopping.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except Exception as e:
+                logger.error("分区租约续约失败: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "partition_size": self.partition_size,
+            "leases": len(self._leases),
+            "acquired": self.acquired,
+            "drained": self.drained,
+            "fallbacks": self.fallbacks
+        }
+
+
+_partitions: Optional[ClaimPartitions] = None
+
+
+def start_claim_partitions(session_factory, settings) -> Optional[ClaimPartitions]:
+    """按配置启动分区领取，未开启时返回None"""
+    global _partitions
+    if not settings.claim_partitions_enabled:
+        return None
+    from services.claim_pool import make_worker_id
+    _partitions = ClaimPartitions(
+        session_factory,
+        make_worker_id(),
+        partition_size=settings.claim_partition_size,
+        lease_seconds=settings.claim_partition_lease_seconds
+    )
+    _partitions.start()
+    return _partitions
+
+
+def stop_claim_partitions():
+    global _partitions
+    if _partitions is not None:
+        _partitions.stop()
+        _partitions = None
+
+
+def get_claim_partitions() -> Optional[ClaimPartitions]:
+    """获取全局分区租约，未开启时返回None"""
+    return _partitions
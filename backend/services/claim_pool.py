@@ -0,0 +1,617 @@
+"""
+进程内邀请码领取池
+
+开启后每个工作进程按offer一次性预留一批未使用邀请码，从内存队列中直接发放，
+发放记录（used_at，以及claim_events中的领取者IP/User-Agent）由后台线程批量回写数据库。
+
+可靠性保证：
+- 每次发放前先追加写入本进程的日志文件（journal），进程崩溃后由同一主机上
+  后续启动的进程回放日志、补写发放记录，再释放剩余的预留码，不会重复发放
+- 预留带到期时间，后台线程按到期时长的三分之一续约。进程退出后没有在同一主机上重启
+  （多主机部署、缩容）时，预留到期后由任意进程的后台线程放回可领取状态
+- 正常关闭时回写所有发放记录并释放尚未发放的预留码
+
+到期回收时无法回放其他主机上的日志：崩溃前最后一个回写周期内已发放、尚未回写的邀请码
+会被放回并可能再次发放，到期时长应远大于回写间隔。持有进程续约时丢弃已被回收的预留码。
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, bindparam
+
+from models.offer import Offer
+from models.database import retry_on_locked
+from services.offer_cache import offer_info_cache
+from services.claimer_registry import claimer_registry, insert_identities
+from services.claim_stats import claim_stats
+from services.claim_audit import ClaimAuditEvent, claim_audit_log, insert_claim_events
+from services.code_service import ClaimResult
+from services.claim_partitions import get_claim_partitions
+from services.claim_engine import (
+    ClaimEngine,
+    ClaimedCode,
+    codes_table,
+    offers_table,
+    reservations_table
+)
+
+logger = logging.getLogger(__name__)
+
+# offer邀请码用完后，在此时间内不再查询数据库补充
+EXHAUSTED_BACKOFF_SECONDS = 1.0
+
+# 按客户端串行化领取的分段锁数量
+CLIENT_LOCK_STRIPES = 64
+
+# 单条语句中IN列表的最大长度（兼容旧版SQLite的参数个数限制）
+IN_CHUNK_SIZE = 500
+
+
+# 本次启动的随机标识：容器重启后新进程的主机名和进程号可能与上一次完全相同，
+# 只凭进程号会把上一个进程遗留的日志和预留当成自己的
+BOOT_NONCE = uuid.uuid4().hex[:8]
+
+
+def make_worker_id() -> str:
+    """生成当前工作进程的标识: 主机名:进程号:启动标识"""
+    return f"{socket.gethostname()[:40]}:{os.getpid()}:{BOOT_NONCE}"
+
+
+def _split_worker_id(worker_id: str) -> Tuple[str, str, str]:
+    """拆分工作进程标识为 (主机名, 进程号, 启动标识)，兼容旧格式 主机名:进程号"""
+    parts = worker_id.split(":")
+    host = parts[0][:40]
+    pid = parts[1] if len(parts) > 1 else ""
+    nonce = parts[2] if len(parts) > 2 else ""
+    return host, pid, nonce
+
+
+def _pid_alive(pid: int) -> bool:
+    """判断本机上的进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class _OfferPool:
+    """单个offer的预留邀请码队列"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.codes = deque()
+        self.lock = threading.Lock()
+        self.refill_lock = threading.Lock()
+        self.exhausted_until = 0.0
+
+
+class ClaimPool:
+    """预取邀请码并在内存中发放，发放记录异步批量回写"""
+
+    def __init__(self, session_factory, block_size: int = 500, low_watermark: int = 100,
+                 flush_interval_ms: int = 200, flush_batch_size: int = 1000,
+                 journal_dir: str = "./claim_pool_journal", reservation_seconds: float = 120.0):
+        self.session_factory = session_factory
+        self.block_size = block_size
+        self.low_watermark = low_watermark
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_batch_size = flush_batch_size
+        self.journal_dir = Path(journal_dir)
+        self.reservation_seconds = reservation_seconds
+        self.worker_id = make_worker_id()
+
+        self._pools: Dict[str, _OfferPool] = {}
+        self._pools_lock = threading.Lock()
+        self._pending: List[list] = []
+        self._pending_lock = threading.Lock()
+        self._journal = None
+        self._journal_path: Optional[Path] = None
+        self._journal_seq = 0
+        self._retained_journals: List[Path] = []
+        # 已发放但身份尚未回写数据库的客户端: (offer名称, client_key) -> 邀请码
+        self._issued_clients: Dict[tuple, str] = {}
+        self._client_by_code_id: Dict[int, tuple] = {}
+        self._client_locks = [threading.Lock() for _ in range(CLIENT_LOCK_STRIPES)]
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- 生命周期 ----
+
+    def start(self):
+        """恢复已退出进程遗留的预留码，然后启动后台回写线程"""
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.recover()
+        self.release_expired()
+        self._rotate_journal()
+        self._thread = threading.Thread(target=self._run, name="claim-pool-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """回写所有发放记录，并释放尚未发放的预留码"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+
+        flushed = self.flush()
+
+        unissued = []
+        with self._pools_lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            with pool.lock:
+                unissued.extend(item.id for item in pool.codes)
+                pool.codes.clear()
+        if unissued:
+            db = self.session_factory()
+            try:
+                self._release(db, self.worker_id, unissued)
+            finally:
+                db.close()
+
+        with self._pending_lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+            # 回写失败时保留日志文件，由下次启动的进程回放
+            if flushed:
+                for path in self._retained_journals + [self._journal_path]:
+                    if path and path.exists():
+                        path.unlink()
+                self._retained_journals = []
+
+    # ---- 发放 ----
+
+    def claim(self, offer_name: str, user_ip: str = None, user_agent: str = None) -> str:
+        """从内存队列发放一个邀请码"""
+        return self._issue(offer_name, user_ip, user_agent)
+
+    def claim_once(self, offer_name: str, client_key: str, user_ip: str = None,
+                   user_agent: str = None) -> ClaimResult:
+        """每个客户端只发放一个邀请码，重复领取时返回已发放的邀请码
+
+        同一客户端的并发请求由分段锁串行化；身份随发放记录批量回写，
+        回写前由本进程内存中的映射负责查重。
+        """
+        key = (offer_name, client_key)
+        with self._client_locks[hash(key) % CLIENT_LOCK_STRIPES]:
+            code = self._issued_clients.get(key)
+            if code is not None:
+                return ClaimResult(code, True)
+
+            if claimer_registry.might_contain(offer_name, client_key):
+                db = self.session_factory()
+                try:
+                    code = claimer_registry.find_code(db, offer_name, client_key)
+                finally:
+                    db.close()
+                if code is not None:
+                    return ClaimResult(code, True)
+
+            code = self._issue(offer_name, user_ip, user_agent, client_key)
+            claimer_registry.add(offer_name, client_key)
+            return ClaimResult(code, False)
+
+    def _issue(self, offer_name: str, user_ip: str = None, user_agent: str = None,
+               client_key: str = None) -> str:
+        pool = self._pools.get(offer_name)
+        while True:
+            item = None
+            if pool is not None:
+                with pool.lock:
+                    if pool.codes:
+                        item = pool.codes.popleft()
+            if item is not None:
+                break
+            pool = self._refill(offer_name, pool)
+
+        issued_at = datetime.now()
+        record = [item.id, item.offer_id, issued_at.isoformat(), user_ip, user_agent]
+        if client_key:
+            record.append(client_key)
+        with self._pending_lock:
+            self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._pending.append(record)
+            pending_count = len(self._pending)
+            if client_key:
+                self._issued_clients[(offer_name, client_key)] = item.code
+                self._client_by_code_id[item.id] = (offer_name, client_key)
+
+        if pending_count >= self.flush_batch_size or len(pool.codes) < self.low_watermark:
+            self._wake.set()
+        offer_info_cache.on_claim(offer_name)
+        claim_stats.record(item.offer_id, item.code, issued_at, user_ip)
+        return item.code
+
+    def queued_counts(self) -> Dict[tuple, int]:
+        """各offer内存队列中待发放的邀请码数量"""
+        with self._pools_lock:
+            pools = list(self._pools.values())
+        return {(pool.name,): len(pool.codes) for pool in pools}
+
+    def _refill(self, offer_name: str, pool: Optional[_OfferPool]) -> _OfferPool:
+        """同步补充队列，没有可用邀请码时抛出ValueError"""
+        if pool is None:
+            # 首次领取时先用临时队列，确认offer有可用邀请码后再登记，避免无效名称占用内存
+            pool = _OfferPool(offer_name)
+
+        with pool.refill_lock:
+            # 等待期间其他线程可能已经补充完成
+            with pool.lock:
+                if pool.codes:
+                    return pool
+            if time.monotonic() < pool.exhausted_until:
+                raise ValueError("邀请码已用完")
+
+            reserved = self._reserve(offer_name)
+            if not reserved:
+                pool.exhausted_until = time.monotonic() + EXHAUSTED_BACKOFF_SECONDS
+                self._raise_unavailable(offer_name)
+
+            with self._pools_lock:
+                registered = self._pools.setdefault(offer_name, pool)
+            with registered.lock:
+                registered.codes.extend(reserved)
+            return registered
+
+    def _reserve(self, offer_name: str) -> List[ClaimedCode]:
+        def reserve(id_range=None):
+            db = self.session_factory()
+            try:
+                return ClaimEngine(db).reserve(
+                    offer_name, self.block_size, self.worker_id, id_range,
+                    expires_at=datetime.now() + timedelta(seconds=self.reservation_seconds)
+                )
+            finally:
+                db.close()
+
+        # 多进程部署开启分区时只从本进程租用的分区预留
+        partitions = get_claim_partitions()
+        if partitions is None:
+            return retry_on_locked(reserve)
+        return partitions.claim(offer_name, lambda id_range: retry_on_locked(reserve, id_range))
+
+    def _raise_unavailable(self, offer_name: str):
+        db = self.session_factory()
+        try:
+            offer = db.query(Offer).filter(
+                Offer.name == offer_name,
+                Offer.is_active == True
+            ).first()
+        finally:
+            db.close()
+
+        if not offer:
+            raise ValueError("邀请码项目不存在或已停用")
+        raise ValueError("邀请码已用完")
+
+    # ---- 回写 ----
+
+    def _run(self):
+        renew_interval = self.reservation_seconds / 3
+        next_renew = time.monotonic() + renew_interval
+        while not self._stopping.is_set():
+            self._wake.wait(min(self.flush_interval, renew_interval))
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.monotonic() >= next_renew:
+                    next_renew = time.monotonic() + renew_interval
+                    self.renew()
+                    self.release_expired()
+                self._prefetch()
+            except Exception as e:
+                logger.error("领取池后台任务失败: %s", e)
+
+    def _prefetch(self):
+        """为低于水位线的队列提前预留邀请码，减少请求路径上的同步补充"""
+        with self._pools_lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            if len(pool.codes) >= self.low_watermark or time.monotonic() < pool.exhausted_until:
+                continue
+            # 请求线程正在同步补充时跳过
+            if not pool.refill_lock.acquire(blocking=False):
+                continue
+            try:
+                reserved = self._reserve(pool.name)
+                if not reserved:
+                    pool.exhausted_until = time.monotonic() + EXHAUSTED_BACKOFF_SECONDS
+                    continue
+                with pool.lock:
+                    pool.codes.extend(reserved)
+            finally:
+                pool.refill_lock.release()
+
+    def flush(self) -> bool:
+        """批量回写已发放的记录，全部成功返回True"""
+        with self._pending_lock:
+            records, self._pending = self._pending, []
+            if not records:
+                return True
+            finished_journal = self._journal_path
+            if not self._stopping.is_set():
+                self._rotate_journal()
+
+        db = self.session_factory()
+        try:
+            for i in range(0, len(records), self.flush_batch_size):
+                try:
+                    self._write_issued(db, records[i:i + self.flush_batch_size], self.worker_id)
+                except Exception as e:
+                    logger.error("领取池回写失败，稍后重试: %s", e)
+                    with self._pending_lock:
+                        self._pending[:0] = records[i:]
+                        self._retained_journals.append(finished_journal)
+                    return False
+        finally:
+            db.close()
+
+        with self._pending_lock:
+            done = self._retained_journals
+            self._retained_journals = []
+            # 身份已写入数据库，之后由过滤器和数据库负责查重
+            for r in records:
+                client = self._client_by_code_id.pop(r[0], None)
+                if client is not None:
+                    self._issued_clients.pop(client, None)
+        for path in done + [finished_journal]:
+            if path != self._journal_path and path.exists():
+                path.unlink()
+        return True
+
+    def _rotate_journal(self):
+        """切换到新的日志分段文件（调用方需持有_pending_lock或处于启动阶段）"""
+        if self._journal:
+            self._journal.close()
+        self._journal_seq += 1
+        # 日志目录位于本机磁盘，文件名只需区分进程号、启动标识和分段序号
+        _, pid, nonce = _split_worker_id(self.worker_id)
+        self._journal_path = self.journal_dir / f"{pid}.{nonce}.{self._journal_seq}.journal"
+        self._journal = open(self._journal_path, "a", encoding="utf-8", buffering=1)
+
+    @staticmethod
+    def _write_issued(db, records: List[list], worker_id: str) -> int:
+        """写入发放记录（及领取者身份）并删除对应预留、扣减剩余数量
+
+        只处理仍由该进程预留的邀请码，所以重复回放同一段日志是安全的。
+        """
+        reserved = set()
+        for ids in _chunks([r[0] for r in records], IN_CHUNK_SIZE):
+            reserved.update(row[0] for row in db.execute(
+                select(reservations_table.c.code_id).where(
+                    reservations_table.c.worker_id == worker_id,
+                    reservations_table.c.code_id.in_(ids)
+                )
+            ))
+        records = [r for r in records if r[0] in reserved]
+        if not records:
+            return 0
+
+        try:
+            db.execute(
+                codes_table.update()
+                .where(codes_table.c.id == bindparam("b_id"))
+                .values(used_at=bindparam("b_used_at")),
+                [{"b_id": r[0], "b_used_at": datetime.fromisoformat(r[2])} for r in records]
+            )
+            # 审计事件与发放记录在同一事务内写入，日志回放时同样只写一次
+            agent_ids = insert_claim_events(db, [
+                ClaimAuditEvent(r[0], r[1], datetime.fromisoformat(r[2]), r[3], r[4])
+                for r in records
+            ])
+            for ids in _chunks([r[0] for r in records], IN_CHUNK_SIZE):
+                db.execute(reservations_table.delete().where(reservations_table.c.code_id.in_(ids)))
+            insert_identities(db, [
+                (r[1], r[5], r[0], datetime.fromisoformat(r[2]))
+                for r in records if len(r) > 5 and r[5]
+            ])
+
+            issued_per_offer = defaultdict(int)
+            for r in records:
+                issued_per_offer[r[1]] += 1
+            now = datetime.now()
+            for offer_id, count in issued_per_offer.items():
+                db.execute(
+                    offers_table.update()
+                    .where(offers_table.c.id == offer_id)
+                    .values(
+                        remaining_count=offers_table.c.remaining_count - count,
+                        updated_at=now
+                    )
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        claim_audit_log.interner.remember(agent_ids)
+        return len(records)
+
+    # ---- 释放与恢复 ----
+
+    @staticmethod
+    def _release(db, worker_id: str, code_ids: List[int] = None):
+        """把预留码放回可领取状态；code_ids为空时释放该进程的全部预留"""
+        try:
+            if code_ids is None:
+                owned = select(reservations_table.c.code_id).where(
+                    reservations_table.c.worker_id == worker_id
+                )
+                db.execute(codes_table.update().where(codes_table.c.id.in_(owned)).values(is_used=False))
+                db.execute(reservations_table.delete().where(reservations_table.c.worker_id == worker_id))
+            else:
+                for ids in _chunks(code_ids, IN_CHUNK_SIZE):
+                    db.execute(codes_table.update().where(codes_table.c.id.in_(ids)).values(is_used=False))
+                    db.execute(reservations_table.delete().where(
+                        reservations_table.c.worker_id == worker_id,
+                        reservations_table.c.code_id.in_(ids)
+                    ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    def renew(self):
+        """续约本进程的全部预留，从队列中丢弃已被其他进程回收的预留码"""
+        with self._pools_lock:
+            pools = list(self._pools.values())
+        # 续约前已在队列中的邀请码；之后补充的预留一定仍由本进程持有
+        queued = {}
+        for pool in pools:
+            with pool.lock:
+                queued[pool.name] = {item.id for item in pool.codes}
+
+        db = self.session_factory()
+        try:
+            db.execute(
+                reservations_table.update()
+                .where(reservations_table.c.worker_id == self.worker_id)
+                .values(expires_at=datetime.now() + timedelta(seconds=self.reservation_seconds))
+            )
+            db.commit()
+            held = {row[0] for row in db.execute(
+                select(reservations_table.c.code_id).where(reservations_table.c.worker_id == self.worker_id)
+            )}
+            db.rollback()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        for pool in pools:
+            lost = queued[pool.name] - held
+            if not lost:
+                continue
+            with pool.lock:
+                pool.codes = deque(item for item in pool.codes if item.id not in lost)
+            logger.warning("领取池的预留已被回收: offer=%s, 丢弃 %s 个邀请码", pool.name, len(lost))
+
+    def release_expired(self) -> int:
+        """释放到期未续约的预留码（任意进程遗留的），返回释放的数量
+
+        先在同一事务内把到期的预留转到一次性的标识下，持有进程此后的续约不会再命中这些行。
+        迁移前写入的预留没有到期时间，按预留时间加到期时长判断。
+        """
+        now = datetime.now()
+        marker = f"expired:{uuid.uuid4().hex}"
+        expired = (reservations_table.c.expires_at < now) | (
+            reservations_table.c.expires_at.is_(None)
+            & (reservations_table.c.reserved_at < now - timedelta(seconds=self.reservation_seconds))
+        )
+        db = self.session_factory()
+        try:
+            try:
+                count = db.execute(
+                    reservations_table.update().where(expired).values(worker_id=marker)
+                ).rowcount
+            except Exception:
+                db.rollback()
+                raise
+            if not count:
+                db.rollback()
+                return 0
+            self._release(db, marker)
+        finally:
+            db.close()
+        logger.warning("领取池释放了 %s 个到期未续约的预留码", count)
+        return count
+
+    def recover(self):
+        """回放本机已退出进程的日志，并释放它们遗留的预留码
+
+        进程号与当前进程相同、启动标识不同的是重启前的上一个进程，它一定已经退出。
+        """
+        hostname, own_pid, own_nonce = _split_worker_id(self.worker_id)
+        # (进程号, 启动标识) -> 日志分段；旧格式的文件名为 进程号.序号.journal
+        journals = defaultdict(list)
+        for path in self.journal_dir.glob("*.journal"):
+            parts = path.name.split(".")
+            if len(parts) == 4:
+                journals[(parts[0], parts[1])].append(path)
+            elif len(parts) == 3:
+                journals[(parts[0], "")].append(path)
+
+        db = self.session_factory()
+        try:
+            worker_ids = {}
+            for (worker_id,) in db.execute(select(reservations_table.c.worker_id).distinct()):
+                host, pid, nonce = _split_worker_id(worker_id)
+                if host == hostname:
+                    worker_ids[(pid, nonce)] = worker_id
+            for pid, nonce in journals:
+                worker_ids.setdefault(
+                    (pid, nonce), f"{hostname}:{pid}:{nonce}" if nonce else f"{hostname}:{pid}"
+                )
+
+            for (pid, nonce), worker_id in worker_ids.items():
+                if (pid, nonce) == (own_pid, own_nonce) or not pid.isdigit():
+                    continue
+                if pid != own_pid and _pid_alive(int(pid)):
+                    continue
+
+                paths = sorted(journals.get((pid, nonce), []), key=lambda p: int(p.name.split(".")[-2]))
+                replayed = 0
+                for path in paths:
+                    with open(path, "r", encoding="utf-8") as f:
+                        records = [json.loads(line) for line in f if line.strip()]
+                    for batch in _chunks(records, self.flush_batch_size):
+                        replayed += self._write_issued(db, batch, worker_id)
+
+                self._release(db, worker_id)
+                for path in paths:
+                    path.unlink()
+                logger.info("领取池已恢复进程 %s: 补写发放记录 %s 条，释放剩余预留码", worker_id, replayed)
+        finally:
+            db.close()
+
+
+_claim_pool: Optional[ClaimPool] = None
+
+
+def start_claim_pool(session_factory, settings) -> ClaimPool:
+    """按配置创建并启动全局领取池"""
+    global _claim_pool
+    _claim_pool = ClaimPool(
+        session_factory,
+        block_size=settings.claim_pool_block_size,
+        low_watermark=settings.claim_pool_low_watermark,
+        flush_interval_ms=settings.claim_pool_flush_interval_ms,
+        flush_batch_size=settings.claim_pool_flush_batch_size,
+        journal_dir=settings.claim_pool_journal_dir,
+        reservation_seconds=settings.claim_pool_reservation_seconds
+    )
+    _claim_pool.start()
+    return _claim_pool
+
+
+def stop_claim_pool():
+    """停止全局领取池"""
+    global _claim_pool
+    if _claim_pool is not None:
+        _claim_pool.stop()
+        _claim_pool = None
+
+
+def get_claim_pool() -> Optional[ClaimPool]:
+    """获取全局领取池，未开启时返回None"""
+    return _claim_pool
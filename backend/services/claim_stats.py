@@ -0,0 +1,300 @@
+"""
+进程内领取统计：最近领取记录与按时间分桶的领取数量
+
+每个offer保存固定长度的最近领取记录（环形缓冲区），以及最近60分钟的每分钟、
+最近48小时的每小时领取数量（按时间取模的固定槽位，过期的槽位在写入时清零）。
+领取路径在发放时记录，服务启动时从 claim_events 表预热，/stats 直接读取内存，
+不需要查询邀请码表。
+
+多进程部署（WORKERS>1 或开启分区领取）时每个进程只能看到自己发放的邀请码，服务启动时
+不预热，/stats 改为从数据库读取：最近记录按 (offer_id, id) 索引读取 claim_events 的最后几行，
+分桶计数读取所有进程共享的 claim_counts 表（写入审计事件时在同一事务内累加，
+每个offer最多读取 60 + 48 行），读取量与领取数量无关。
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+MINUTE_BUCKETS = 60
+HOUR_BUCKETS = 48
+
+# 分桶宽度（秒）：每分钟、每小时
+MINUTE = 60
+HOUR = 3600
+
+# 预热时按id倒序读取审计事件，越过时间窗口后再多读这段时间，覆盖领取池延迟回写的记录
+WARMUP_SLACK = timedelta(hours=1)
+
+
+def mask_code(code: str) -> str:
+    """脱敏处理邀请码"""
+    return f"***{code[-6:]}" if len(code) > 6 else "***"
+
+
+class TimeBuckets:
+    """固定槽位的时间分桶计数，槽位按 时间戳 // 宽度 取模复用"""
+
+    def __init__(self, width_seconds: int, count: int):
+        self.width = width_seconds
+        self.count = count
+        self._counts = [0] * count
+        self._stamps = [-1] * count
+
+    def add(self, timestamp: float, amount: int = 1):
+        index = int(timestamp // self.width)
+        slot = index % self.count
+        if self._stamps[slot] != index:
+            if self._stamps[slot] > index:
+                # 比槽位中现有数据更旧，已超出时间窗口
+                return
+            self._stamps[slot] = index
+            self._counts[slot] = 0
+        self._counts[slot] += amount
+
+    def series(self, now: float) -> List[dict]:
+        """从旧到新返回时间窗口内每个桶的起始时间和数量"""
+        current = int(now // self.width)
+        result = []
+        for index in range(current - self.count + 1, current + 1):
+            slot = index % self.count
+            count = self._counts[slot] if self._stamps[slot] == index else 0
+            result.append({"start": datetime.fromtimestamp(index * self.width), "count": count})
+        return result
+
+
+class _OfferClaimStats:
+    def __init__(self, recent_size: int):
+        self.recent = deque(maxlen=recent_size)
+        self.minutes = TimeBuckets(60, MINUTE_BUCKETS)
+        self.hours = TimeBuckets(3600, HOUR_BUCKETS)
+        self.lock = threading.Lock()
+
+
+class ClaimStats:
+    """按offer id保存的领取统计"""
+
+    def __init__(self, recent_size: int = 10):
+        self.recent_size = recent_size
+        self._offers: Dict[int, _OfferClaimStats] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def _get(self, offer_id: int) -> _OfferClaimStats:
+        stats = self._offers.get(offer_id)
+        if stats is None:
+            with self._lock:
+                stats = self._offers.setdefault(offer_id, _OfferClaimStats(self.recent_size))
+        return stats
+
+    def record(self, offer_id: int, code: str, claimed_at: datetime, user_ip: str = None):
+        """记录一次发放（领取事务提交或领取池发放之后调用）"""
+        stats = self._get(offer_id)
+        timestamp = claimed_at.timestamp()
+        with stats.lock:
+            stats.recent.appendleft({
+                "code": mask_code(code),
+                "claimed_at": claimed_at,
+                "user_ip": user_ip
+            })
+            stats.minutes.add(timestamp)
+            stats.hours.add(timestamp)
+
+    def recent_claims(self, offer_id: int) -> List[dict]:
+        stats = self._offers.get(offer_id)
+        if stats is None:
+            return []
+        with stats.lock:
+            return list(stats.recent)
+
+    def series(self, offer_id: int, now: Optional[float] = None) -> dict:
+        """每分钟（最近60分钟）和每小时（最近48小时）的领取数量"""
+        now = time.time() if now is None else now
+        stats = self._offers.get(offer_id)
+        if stats is None:
+            stats = _OfferClaimStats(0)
+        with stats.lock:
+            return {
+                "claims_per_minute": stats.minutes.series(now),
+                "claims_per_hour": stats.hours.series(now)
+            }
+
+    def load(self, db: Session, batch_size: int = 10000) -> int:
+        """从 claim_events 预热最近领取记录和时间窗口内的分桶计数，返回读取的事件数
+
+        替换内存中已有的数据，需在开始处理领取请求之前调用。
+        """
+        from models.claim_event import ClaimEvent
+        from services.code_archiver import with_archived_codes
+
+        events = ClaimEvent.__table__
+        # 时间窗口之外补充最近记录时，邀请码可能已归档
+        with_codes, code_column = with_archived_codes(events, events.c.code_id)
+        cutoff = datetime.now() - timedelta(hours=HOUR_BUCKETS)
+        offers: Dict[int, _OfferClaimStats] = {}
+        # 每个offer已读到的最小事件id，补充最近记录时从这里继续往前读
+        oldest_ids: Dict[int, int] = {}
+        loaded = 0
+
+        query = (
+            select(events.c.id, events.c.offer_id, events.c.claimed_at, events.c.user_ip, code_column)
+            .select_from(with_codes)
+            .order_by(events.c.id.desc())
+        )
+        for event_id, offer_id, claimed_at, user_ip, code in db.execute(query.execution_options(yield_per=batch_size)):
+            if claimed_at < cutoff - WARMUP_SLACK:
+                break
+            loaded += 1
+            oldest_ids[offer_id] = event_id
+            stats = offers.get(offer_id)
+            if stats is None:
+                stats = offers[offer_id] = _OfferClaimStats(self.recent_size)
+            if len(stats.recent) < self.recent_size:
+                stats.recent.append({"code": mask_code(code), "claimed_at": claimed_at, "user_ip": user_ip})
+            timestamp = claimed_at.timestamp()
+            stats.minutes.add(timestamp)
+            stats.hours.add(timestamp)
+        db.rollback()
+
+        # 时间窗口内领取较少的offer，最近记录按offer单独往前补充
+        for offer_id in self._offers_without_recent(db, offers):
+            stats = offers.setdefault(offer_id, _OfferClaimStats(self.recent_size))
+            query = (
+                select(events.c.claimed_at, events.c.user_ip, code_column)
+                .select_from(with_codes)
+                .where(events.c.offer_id == offer_id)
+                .order_by(events.c.id.desc())
+                .limit(self.recent_size - len(stats.recent))
+            )
+            if offer_id in oldest_ids:
+                query = query.where(events.c.id < oldest_ids[offer_id])
+            rows = db.execute(query).fetchall()
+            for claimed_at, user_ip, code in rows:
+                stats.recent.append({"code": mask_code(code), "claimed_at": claimed_at, "user_ip": user_ip})
+        db.rollback()
+
+        with self._lock:
+            self._offers = offers
+            self.loaded = True
+        return loaded
+
+    def series_from_db(self, db: Session, offer_id: int, now: Optional[float] = None) -> dict:
+        """从 claim_counts 读取与 series() 结构相同的分桶计数（多进程部署时使用）"""
+        from models.claim_event import ClaimCount
+
+        counts = ClaimCount.__table__
+        now = time.time() if now is None else now
+        stats = _OfferClaimStats(0)
+        for period, buckets in ((MINUTE, stats.minutes), (HOUR, stats.hours)):
+            rows = db.execute(
+                select(counts.c.bucket, counts.c.count).where(
+                    counts.c.offer_id == offer_id,
+                    counts.c.period == period,
+                    counts.c.bucket > int(now // period) - buckets.count
+                )
+            )
+            for bucket, count in rows:
+                buckets.add(bucket * period, count)
+        return {
+            "claims_per_minute": stats.minutes.series(now),
+            "claims_per_hour": stats.hours.series(now)
+        }
+
+    def _offers_without_recent(self, db: Session, offers: Dict[int, _OfferClaimStats]) -> List[int]:
+        from models.offer import Offer
+        offer_ids = [row[0] for row in db.execute(select(Offer.__table__.c.id))]
+        return [offer_id for offer_id in offer_ids
+                if offer_id not in offers or len(offers[offer_id].recent) < self.recent_size]
+
+    def clear(self):
+        with self._lock:
+            self._offers = {}
+            self.loaded = False
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "offers": len(self._offers)
+        }
+
+
+def _upsert_counts(db: Session, table):
+    """累加计数的插入语句：已有的分桶在原值上增加，不支持的数据库返回None"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite" and sqlite3.sqlite_version_info >= (3, 24, 0):
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.offer_id, table.c.period, table.c.bucket],
+        set_={"count": table.c.count + statement.excluded.count}
+    )
+
+
+def add_claim_counts(db: Session, events) -> int:
+    """按分钟和小时累加领取数量（不提交事务），events 需带 offer_id 和 claimed_at，返回写入的分桶数"""
+    from models.claim_event import ClaimCount
+
+    table = ClaimCount.__table__
+    totals = defaultdict(int)
+    for event in events:
+        timestamp = event.claimed_at.timestamp()
+        for period in (MINUTE, HOUR):
+            totals[(event.offer_id, period, int(timestamp // period))] += 1
+    if not totals:
+        return 0
+
+    # 按主键顺序写入，多个进程同时累加时加锁顺序一致
+    rows = [
+        {"offer_id": offer_id, "period": period, "bucket": bucket, "count": count}
+        for (offer_id, period, bucket), count in sorted(totals.items())
+    ]
+    upsert = _upsert_counts(db, table)
+    if upsert is not None:
+        db.execute(upsert, rows)
+        return len(rows)
+    # 其他数据库先更新再插入，并发插入同一分桶时触发主键冲突，由调用方回滚后重试
+    for row in rows:
+        key = and_(table.c.offer_id == row["offer_id"], table.c.period == row["period"],
+                   table.c.bucket == row["bucket"])
+        if not db.execute(table.update().where(key).values(count=table.c.count + row["count"])).rowcount:
+            db.execute(table.insert().values(**row))
+    return len(rows)
+
+
+def prune_claim_counts(db: Session, now: Optional[float] = None) -> int:
+    """删除时间窗口之外的分桶并提交，返回删除的行数"""
+    from models.claim_event import ClaimCount
+
+    table = ClaimCount.__table__
+    now = time.time() if now is None else now
+    try:
+        deleted = db.execute(table.delete().where(or_(
+            and_(table.c.period == MINUTE, table.c.bucket <= int(now // MINUTE) - MINUTE_BUCKETS),
+            and_(table.c.period == HOUR, table.c.bucket <= int(now // HOUR) - HOUR_BUCKETS)
+        ))).rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return deleted
+
+
+def _create_claim_stats() -> ClaimStats:
+    from config.settings import settings
+    return ClaimStats(recent_size=settings.claim_stats_recent_size)
+
+
+claim_stats = _create_claim_stats()
@@ -0,0 +1,190 @@
+"""
+领取者身份登记：同一个客户端在同一个offer下只能领取一个邀请码
+
+权威数据保存在 claimer_identities 表中，主键 (offer_id, client_key) 在领取事务内
+写入，由数据库保证唯一。进程内的布隆过滤器挡在查询前面：过滤器回答"一定没有领取过"
+时直接进入领取流程，不再查询数据库；回答"可能领取过"时才按主键查询已发放的邀请码。
+
+布隆过滤器在启动时从数据库加载；其他进程新增的身份不在本进程的过滤器中，
+这种情况下领取事务写入身份时会触发主键冲突，回滚后返回已有的邀请码。
+"""
+
+import hashlib
+import logging
+import math
+import threading
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from models.offer import Offer
+from models.claimer_identity import ClaimerIdentity
+from services.code_archiver import with_archived_codes
+
+logger = logging.getLogger(__name__)
+
+identities_table = ClaimerIdentity.__table__
+
+KEY_SOURCE_IP = "ip"
+KEY_SOURCE_TOKEN = "token"
+
+# 启动时加载身份的批大小
+LOAD_BATCH_SIZE = 10000
+
+# 单条语句中IN列表的最大长度（兼容旧版SQLite的参数个数限制）
+IN_CHUNK_SIZE = 500
+
+
+def make_client_key(user_ip: str = None, client_token: str = None, source: str = KEY_SOURCE_IP) -> Optional[str]:
+    """生成定长的客户端标识；token模式下优先使用客户端令牌（浏览器指纹或Cookie），没有时退回IP"""
+    if source == KEY_SOURCE_TOKEN and client_token:
+        raw = f"token:{client_token}"
+    elif user_ip:
+        raw = f"ip:{user_ip}"
+    else:
+        return None
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class BloomFilter:
+    """定长位数组布隆过滤器"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # 双重哈希: h1 + i * h2
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class ClaimerRegistry:
+    """领取者身份的进程内过滤器与数据库查询"""
+
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._filter = BloomFilter(capacity, error_rate)
+        self._lock = threading.Lock()
+        # 未加载前过滤器不完整，只能回答"可能领取过"
+        self.loaded = False
+        self.filter_skips = 0
+        self.lookups = 0
+
+    @staticmethod
+    def _item(offer_name: str, client_key: str) -> str:
+        return f"{offer_name}\0{client_key}"
+
+    def load(self, db: Session) -> int:
+        """从数据库加载全部领取者身份"""
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        query = (
+            select(Offer.name, ClaimerIdentity.client_key)
+            .join(Offer, Offer.id == ClaimerIdentity.offer_id)
+            .execution_options(yield_per=LOAD_BATCH_SIZE)
+        )
+        for offer_name, client_key in db.execute(query):
+            bloom.add(self._item(offer_name, client_key))
+        with self._lock:
+            self._filter = bloom
+            self.loaded = True
+        if bloom.count > self.capacity:
+            logger.warning("领取者身份数量 %s 超过过滤器容量 %s，误判率会上升", bloom.count, self.capacity)
+        return bloom.count
+
+    def add(self, offer_name: str, client_key: str):
+        with self._lock:
+            self._filter.add(self._item(offer_name, client_key))
+
+    def might_contain(self, offer_name: str, client_key: str) -> bool:
+        if not self.loaded:
+            return True
+        with self._lock:
+            found = self._item(offer_name, client_key) in self._filter
+        if not found:
+            self.filter_skips += 1
+        return found
+
+    def find_code(self, db: Session, offer_name: str, client_key: str) -> Optional[str]:
+        """按主键查询该客户端已领取的邀请码（邀请码可能已归档）"""
+        self.lookups += 1
+        offers = Offer.__table__
+        from_clause, code = with_archived_codes(
+            identities_table.join(offers, offers.c.id == identities_table.c.offer_id),
+            identities_table.c.code_id
+        )
+        return db.execute(
+            select(code)
+            .select_from(from_clause)
+            .where(offers.c.name == offer_name, identities_table.c.client_key == client_key)
+        ).scalar()
+
+    def lookup(self, db: Session, offer_name: str, client_key: str) -> Optional[str]:
+        """过滤器判定可能领取过时查询已有的邀请码"""
+        if not self.might_contain(offer_name, client_key):
+            return None
+        return self.find_code(db, offer_name, client_key)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "identities": self._filter.count,
+            "filter_skips": self.filter_skips,
+            "lookups": self.lookups
+        }
+
+
+def insert_identities(db: Session, rows: Iterable[Tuple[int, str, int, datetime]]) -> int:
+    """批量写入领取者身份 (offer_id, client_key, code_id, claimed_at)，跳过已存在的，不提交事务"""
+    rows = list(rows)
+    inserted = 0
+    for i in range(0, len(rows), IN_CHUNK_SIZE):
+        chunk = rows[i:i + IN_CHUNK_SIZE]
+        existing = set(db.execute(
+            select(identities_table.c.offer_id, identities_table.c.client_key).where(
+                tuple_(identities_table.c.offer_id, identities_table.c.client_key).in_(
+                    [(row[0], row[1]) for row in chunk]
+                )
+            )
+        ).fetchall())
+        seen = set(existing)
+        values = []
+        for offer_id, client_key, code_id, claimed_at in chunk:
+            if (offer_id, client_key) in seen:
+                continue
+            seen.add((offer_id, client_key))
+            values.append({
+                "offer_id": offer_id,
+                "client_key": client_key,
+                "code_id": code_id,
+                "claimed_at": claimed_at
+            })
+        if values:
+            db.execute(identities_table.insert(), values)
+            inserted += len(values)
+    return inserted
+
+
+def _create_registry() -> ClaimerRegistry:
+    from config.settings import settings
+    return ClaimerRegistry(capacity=settings.claim_dedup_filter_capacity)
+
+
+claimer_registry = _create_registry()
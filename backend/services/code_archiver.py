@@ -0,0 +1,222 @@
+"""
+已发放邀请码归档（冷热分离）
+
+领取只关心未使用的邀请码，但已发放的行会一直留在 invitation_codes 中，长期运行的offer
+累积大量已发放的行，拖慢领取查询、对账统计和备份。归档任务把发放时间早于阈值的邀请码
+分批移到 invitation_codes_archive 表（保留原id）：
+
+- 分批: 先在读事务中按主键顺序找出一批待归档的id区间，再在一个短写事务中
+  INSERT ... SELECT 到归档表并从原表删除，每批之间让出写锁，不会长时间阻塞领取
+- 条件: 已发放（is_used 且 used_at 非空）、发放时间早于阈值，领取池预留中的邀请码
+  （used_at 为空）不会被归档
+- 计数: offer的总数包含已归档的邀请码，归档不修改 offers 表的计数列
+
+按邀请码id查询邀请码文本的地方（最近领取记录、领取者已领取的邀请码）通过
+with_archived_codes() 同时读取原表和归档表；对账的总数和导入去重也会计入归档表，
+归档对调用方透明。
+
+使用方法:
+python -m cli.archive --days 30           # 归档30天前发放的邀请码
+python -m cli.archive --days 30 --dry-run # 只统计待归档数量
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func, literal, select, true
+from sqlalchemy.orm import Session
+
+from models.database import retry_on_locked
+from models.invitation_code import InvitationCode
+from models.code_archive import InvitationCodeArchive
+from models.code_reservation import CodeReservation
+
+logger = logging.getLogger(__name__)
+
+codes_table = InvitationCode.__table__
+archive_table = InvitationCodeArchive.__table__
+reservations_table = CodeReservation.__table__
+
+# 每批归档的邀请码数量（一个写事务）
+DEFAULT_BATCH_SIZE = 1000
+
+
+def with_archived_codes(from_clause, code_id_column):
+    """在from_clause上按邀请码id同时外连接原表和归档表
+
+    返回 (新的from子句, 邀请码文本列)。两个连接都走主键，邀请码不在任何一张表中时文本为空。
+    """
+    hot = codes_table.alias("hot_code")
+    cold = archive_table.alias("archived_code")
+    joined = (
+        from_clause
+        .outerjoin(hot, hot.c.id == code_id_column)
+        .outerjoin(cold, cold.c.id == code_id_column)
+    )
+    return joined, func.coalesce(hot.c.code, cold.c.code).label("code")
+
+
+def _archivable(cutoff: datetime):
+    """可归档邀请码的条件"""
+    return [
+        codes_table.c.is_used == true(),
+        codes_table.c.used_at.isnot(None),
+        codes_table.c.used_at < cutoff,
+        ~codes_table.c.id.in_(select(reservations_table.c.code_id))
+    ]
+
+
+def count_archivable(db: Session, older_than: datetime) -> int:
+    """统计发放时间早于older_than、可以归档的邀请码数量"""
+    count = db.execute(select(func.count()).select_from(codes_table).where(*_archivable(older_than))).scalar()
+    db.rollback()
+    return count or 0
+
+
+def archive_used_codes(db: Session, older_than: datetime, batch_size: int = DEFAULT_BATCH_SIZE,
+                       pause_seconds: float = 0.0, stop: threading.Event = None) -> int:
+    """把发放时间早于older_than的邀请码分批移到归档表，返回归档数量
+
+    每批一个事务，中断后重新执行是安全的。stop被设置时在当前批次完成后停止。
+    """
+    conditions = _archivable(older_than)
+    last_id = 0
+    archived = 0
+    while stop is None or not stop.is_set():
+        # 读事务中确定本批的id区间，写事务只持有很短的时间
+        ids = [row[0] for row in db.execute(
+            select(codes_table.c.id)
+            .where(codes_table.c.id > last_id, *conditions)
+            .order_by(codes_table.c.id)
+            .limit(batch_size)
+        )]
+        db.rollback()
+        if not ids:
+            break
+
+        in_range = [codes_table.c.id > last_id, codes_table.c.id <= ids[-1], *conditions]
+        archived += retry_on_locked(_move_batch, db, in_range)
+        last_id = ids[-1]
+        if pause_seconds:
+            time.sleep(pause_seconds)
+
+    if archived:
+        logger.info("归档了 %s 个已发放的邀请码（发放时间早于 %s）", archived, older_than.strftime("%Y-%m-%d %H:%M"))
+    return archived
+
+
+def _move_batch(db: Session, conditions: list) -> int:
+    """在一个事务内把满足条件的邀请码复制到归档表并从原表删除"""
+    try:
+        if db.get_bind().dialect.name == "sqlite":
+            # 先拿写锁，两条语句看到的是同一批行
+            db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+        db.execute(archive_table.insert().from_select(
+            ["id", "offer_id", "code", "code_hash", "used_at", "redeemed_at", "created_at", "archived_at"],
+            select(
+                codes_table.c.id, codes_table.c.offer_id, codes_table.c.code, codes_table.c.code_hash,
+                codes_table.c.used_at, codes_table.c.redeemed_at, codes_table.c.created_at, literal(datetime.now())
+            ).where(*conditions)
+        ))
+        moved = db.execute(codes_table.delete().where(*conditions)).rowcount
+        db.commit()
+        return moved
+    except Exception:
+        db.rollback()
+        raise
+
+
+class CodeArchiver:
+    """按固定间隔在后台线程中归档已发放的邀请码"""
+
+    def __init__(self, session_factory, interval_seconds: float, after_days: float,
+                 batch_size: int = DEFAULT_BATCH_SIZE, pause_seconds: float = 0.0):
+        self.session_factory = session_factory
+        self.interval = interval_seconds
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.archived = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_archived = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="code-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self) -> int:
+        db = self.session_factory()
+        try:
+            archived = archive_used_codes(
+                db,
+                datetime.now() - timedelta(days=self.after_days),
+                batch_size=self.batch_size,
+                pause_seconds=self.pause_seconds,
+                stop=self._stopping
+            )
+        finally:
+            db.close()
+        self.runs += 1
+        self.archived += archived
+        self.last_run_at = datetime.now()
+        self.last_archived = archived
+        return archived
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("邀请码归档失败: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "after_days": self.after_days,
+            "runs": self.runs,
+            "archived": self.archived,
+            "last_run_at": self.last_run_at.isoformat(timespec="seconds") if self.last_run_at else None,
+            "last_archived": self.last_archived
+        }
+
+
+_archiver: Optional[CodeArchiver] = None
+
+
+def start_code_archiver(session_factory, settings) -> Optional[CodeArchiver]:
+    """按配置启动全局的定期归档，间隔为0时不启动"""
+    global _archiver
+    if settings.code_archive_interval_seconds <= 0:
+        return None
+    _archiver = CodeArchiver(
+        session_factory,
+        settings.code_archive_interval_seconds,
+        settings.code_archive_after_days,
+        batch_size=settings.code_archive_batch_size,
+        pause_seconds=settings.code_archive_pause_ms / 1000.0
+    )
+    _archiver.start()
+    return _archiver
+
+
+def stop_code_archiver():
+    global _archiver
+    if _archiver is not None:
+        _archiver.stop()
+        _archiver = None
+
+
+def get_code_archiver() -> Optional[CodeArchiver]:
+    return _archiver
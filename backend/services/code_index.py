@@ -0,0 +1,269 @@
+"""
+按邀请码查询：定长哈希索引与进程内哈希前缀过滤器
+
+合作方需要高频核验"这个邀请码是否有效、是否已使用"，但 code 是不定长的 String(255)，
+只有 (offer_id, code) 唯一索引，不带offer的查询无法走索引。
+
+- 每个邀请码保存一个64位哈希 code_hash（导入时写入），原表和归档表都在 code_hash 上建索引，
+  查询 WHERE code_hash IN (...) AND code IN (...)，索引项定长8字节
+- 进程内的前缀过滤器是一个 2^bits 位的位图，以哈希的高 bits 位为下标：位为0时邀请码一定不存在，
+  直接拒绝，不访问数据库；位为1时才查询数据库（前缀相同的其他邀请码会造成少量多余的查询）
+- 过滤器在启动时从两张表加载全部哈希；本进程导入的邀请码立即加入，其他进程（CLI导入）
+  新增的邀请码由后台线程按id增量读取（邀请码id只增不减，归档后也不会复用），最多延迟一个刷新间隔；
+  另按较长的间隔整体重建，补上PostgreSQL上提交顺序与id顺序不一致时漏读的行
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import func, select, true
+from sqlalchemy.orm import Session
+
+from models.offer import Offer
+from models.invitation_code import InvitationCode
+from models.code_archive import InvitationCodeArchive
+
+logger = logging.getLogger(__name__)
+
+codes_table = InvitationCode.__table__
+archive_table = InvitationCodeArchive.__table__
+offers_table = Offer.__table__
+
+# 邀请码状态
+STATUS_AVAILABLE = "available"  # 未发放
+STATUS_PENDING = "pending"      # 领取池预留中或租约中，尚未确认发放
+STATUS_ISSUED = "issued"        # 已发放，未核销
+STATUS_REDEEMED = "redeemed"    # 已核销
+
+# 加载哈希的批大小
+LOAD_BATCH_SIZE = 10000
+
+# 单条语句中IN列表的最大长度（兼容旧版SQLite的参数个数限制）
+IN_CHUNK_SIZE = 500
+
+CodeStatus = namedtuple("CodeStatus", ["code", "offer", "status", "issued_at", "redeemed_at", "id", "archived"])
+
+_SIGN_OFFSET = 1 << 64
+
+
+def code_hash(code: str) -> int:
+    """邀请码的64位哈希（有符号，可存入BIGINT）"""
+    digest = hashlib.blake2b(code.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class HashPrefixFilter:
+    """以哈希高位为下标的定长位图"""
+
+    def __init__(self, prefix_bits: int):
+        self.prefix_bits = prefix_bits
+        self._shift = 64 - prefix_bits
+        self.bits = bytearray(max(1, (1 << prefix_bits) >> 3))
+        self.count = 0
+
+    def _position(self, value: int) -> int:
+        return (value % _SIGN_OFFSET) >> self._shift
+
+    def add(self, value: int):
+        pos = self._position(value)
+        self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, value: int) -> bool:
+        pos = self._position(value)
+        return bool(self.bits[pos >> 3] & (1 << (pos & 7)))
+
+
+class CodeIndex:
+    """邀请码哈希的进程内过滤器，以及后台增量刷新线程"""
+
+    def __init__(self, prefix_bits: int = 24, refresh_seconds: float = 5, reload_seconds: float = 600):
+        self.prefix_bits = prefix_bits
+        self.refresh_seconds = refresh_seconds
+        self.reload_seconds = reload_seconds
+        self._filter = HashPrefixFilter(prefix_bits)
+        self._lock = threading.Lock()
+        # 未加载前过滤器不完整，所有邀请码都要查询数据库
+        self.loaded = False
+        # 已读入过滤器的原表最大id，增量刷新从这里继续
+        self.last_id = 0
+        self._loaded_at = 0.0
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.rejected = 0
+        self.lookups = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def load(self, db: Session) -> int:
+        """从原表和归档表加载全部邀请码哈希，返回数量
+
+        先读原表再读归档表：加载期间被归档的邀请码至少会在其中一次读取中出现。
+        """
+        prefix_filter = HashPrefixFilter(self.prefix_bits)
+        last_id = db.execute(select(func.max(codes_table.c.id))).scalar() or 0
+        for table in (codes_table, archive_table):
+            query = (
+                select(table.c.code_hash)
+                .where(table.c.code_hash.isnot(None))
+                .execution_options(yield_per=LOAD_BATCH_SIZE)
+            )
+            for (value,) in db.execute(query):
+                prefix_filter.add(value)
+        db.rollback()
+        with self._lock:
+            self._filter = prefix_filter
+            self.last_id = last_id
+            self.loaded = True
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+        return prefix_filter.count
+
+    def refresh(self, db: Session) -> int:
+        """读入其他进程新导入的邀请码（原表中id大于last_id的行），返回新增数量"""
+        if time.monotonic() - self._loaded_at >= self.reload_seconds:
+            self.load(db)
+            return 0
+
+        added = 0
+        while True:
+            rows = db.execute(
+                select(codes_table.c.id, codes_table.c.code_hash)
+                .where(codes_table.c.id > self.last_id, codes_table.c.code_hash.isnot(None))
+                .order_by(codes_table.c.id)
+                .limit(LOAD_BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            with self._lock:
+                for row in rows:
+                    self._filter.add(row.code_hash)
+                self.last_id = rows[-1].id
+            added += len(rows)
+        db.rollback()
+        return added
+
+    def add(self, hashes: Iterable[int]):
+        """本进程导入的邀请码立即加入过滤器"""
+        with self._lock:
+            for value in hashes:
+                self._filter.add(value)
+
+    def candidates(self, codes: Iterable[str]) -> Dict[str, int]:
+        """返回可能存在的邀请码及其哈希，过滤器判定一定不存在的直接排除"""
+        result = {}
+        for code in codes:
+            if code in result:
+                continue
+            value = code_hash(code)
+            if self.loaded and value not in self._filter:
+                self.rejected += 1
+                continue
+            result[code] = value
+        return result
+
+    def find(self, db: Session, candidates: Dict[str, int], offer_name: str = None) -> Dict[str, CodeStatus]:
+        """查询通过过滤器的邀请码，统计查询数和过滤器误判（查询后不存在）的数量"""
+        found = find_codes(db, candidates, offer_name)
+        self.lookups += len(candidates)
+        self.misses += len(candidates) - len(found)
+        return found
+
+    def start(self, session_factory):
+        """加载过滤器并启动后台刷新线程"""
+        db = session_factory()
+        try:
+            count = self.load(db)
+        finally:
+            db.close()
+        if self.refresh_seconds > 0:
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(session_factory,), name="code-index", daemon=True
+            )
+            self._thread.start()
+        return count
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, session_factory):
+        while not self._stopping.wait(self.refresh_seconds):
+            db = session_factory()
+            try:
+                self.refresh(db)
+            except Exception as e:
+                logger.error("刷新邀请码过滤器失败: %s", e)
+            finally:
+                db.close()
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "hashes": self._filter.count,
+            "filter_bytes": len(self._filter.bits),
+            "rejected": self.rejected,
+            "lookups": self.lookups,
+            "misses": self.misses,
+            "reloads": self.reloads
+        }
+
+
+def _status(is_used: bool, used_at: Optional[datetime], redeemed_at: Optional[datetime]) -> str:
+    if redeemed_at is not None:
+        return STATUS_REDEEMED
+    if used_at is not None:
+        return STATUS_ISSUED
+    return STATUS_PENDING if is_used else STATUS_AVAILABLE
+
+
+def find_codes(db: Session, candidates: Dict[str, int], offer_name: str = None) -> Dict[str, CodeStatus]:
+    """按哈希索引查询邀请码的状态（原表和归档表），返回 邀请码 -> CodeStatus
+
+    同一个邀请码存在于多个offer时取最早导入的一个；offer_name 不为空时只在该offer中查找。
+    """
+    found: Dict[str, CodeStatus] = {}
+    items = list(candidates.items())
+    for i in range(0, len(items), IN_CHUNK_SIZE):
+        chunk = items[i:i + IN_CHUNK_SIZE]
+        hashes = [value for _, value in chunk]
+        codes = [code for code, _ in chunk]
+        for table, archived in ((codes_table, False), (archive_table, True)):
+            # 归档表中都是已发放的邀请码
+            is_used = true().label("is_used") if archived else table.c.is_used
+            query = (
+                select(table.c.id, table.c.code, offers_table.c.name, is_used, table.c.used_at, table.c.redeemed_at)
+                .join(offers_table, offers_table.c.id == table.c.offer_id)
+                .where(table.c.code_hash.in_(hashes), table.c.code.in_(codes))
+            )
+            if offer_name:
+                query = query.where(offers_table.c.name == offer_name)
+            for row in db.execute(query):
+                current = found.get(row.code)
+                if current is not None and current.id < row.id:
+                    continue
+                found[row.code] = CodeStatus(
+                    row.code, row.name, _status(bool(row.is_used), row.used_at, row.redeemed_at),
+                    row.used_at, row.redeemed_at, row.id, archived
+                )
+    return found
+
+
+def _create_code_index() -> CodeIndex:
+    from config.settings import settings
+    return CodeIndex(
+        prefix_bits=settings.code_lookup_filter_bits,
+        refresh_seconds=settings.code_lookup_refresh_seconds,
+        reload_seconds=settings.code_lookup_reload_seconds
+    )
+
+
+code_index = _create_code_index()
@@ -1,9 +1,22 @@
-from typing import List, Optional
+from collections import namedtuple
+from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import func
 from datetime import datetime
 from models.offer import Offer
 from models.invitation_code import InvitationCode
+from models.code_archive import InvitationCodeArchive
+from services.claim_engine import ClaimEngine, ClaimerAlreadyClaimed
+from services.claimer_registry import claimer_registry
+from services.claim_partitions import get_claim_partitions
+from services.bulk_importer import BulkImporter
+from services.offer_cache import offer_info_cache
+from services.code_index import code_index, CodeStatus, STATUS_ISSUED, STATUS_REDEEMED
+
+# reused为True表示该客户端之前已领取过，返回的是已发放的邀请码
+ClaimResult = namedtuple("ClaimResult", ["code", "reused"])
+# 两阶段领取的结果；reused为True时返回的是之前领取的邀请码，不带新的租约
+LeaseResult = namedtuple("LeaseResult", ["code", "reused", "lease_token", "lease_expires_at"])
 
 class CodeService:
     """邀请码相关业务逻辑"""
@@ -13,7 +26,97 @@ class CodeService:
 
     def claim_code(self, offer_name: str, user_ip: str = None, user_agent: str = None) -> Optional[str]:
         """申请一个邀请码"""
-        # 查找offer
+        # 选取并标记邀请码、扣减剩余数量在同一个原子事务内完成
+        claimed = self._claim(offer_name, user_ip, user_agent)
+        if claimed:
+            offer_info_cache.on_claim(offer_name)
+            return claimed.code
+        self._raise_unavailable(offer_name)
+
+    def claim_once(self, offer_name: str, client_key: str, user_ip: str = None,
+                   user_agent: str = None) -> ClaimResult:
+        """每个客户端只领取一个邀请码，重复领取时返回之前发放的邀请码"""
+        code = claimer_registry.lookup(self.db, offer_name, client_key)
+        if code is not None:
+            return ClaimResult(code, True)
+
+        try:
+            claimed = self._claim(offer_name, user_ip, user_agent, client_key)
+        except ClaimerAlreadyClaimed:
+            # 其他进程（或过滤器加载前）已登记了该客户端
+            claimer_registry.add(offer_name, client_key)
+            return ClaimResult(claimer_registry.find_code(self.db, offer_name, client_key), True)
+
+        if claimed:
+            claimer_registry.add(offer_name, client_key)
+            offer_info_cache.on_claim(offer_name)
+            return ClaimResult(claimed.code, False)
+        self._raise_unavailable(offer_name)
+
+    def lease_code(self, offer_name: str, lease_seconds: float, user_ip: str = None,
+                   user_agent: str = None, client_key: str = None) -> LeaseResult:
+        """两阶段领取的第一步：领取一个邀请码并加上租约，需在租约到期前确认
+
+        传入client_key时每个客户端只领取一个邀请码（租约过期后可以重新领取）。
+        """
+        if client_key:
+            code = claimer_registry.lookup(self.db, offer_name, client_key)
+            if code is not None:
+                return LeaseResult(code, True, None, None)
+
+        try:
+            leased = self._claim(offer_name, user_ip, user_agent, client_key, lease_seconds)
+        except ClaimerAlreadyClaimed:
+            claimer_registry.add(offer_name, client_key)
+            return LeaseResult(claimer_registry.find_code(self.db, offer_name, client_key), True, None, None)
+
+        if leased:
+            if client_key:
+                claimer_registry.add(offer_name, client_key)
+            offer_info_cache.on_claim(offer_name)
+            return LeaseResult(leased.code, False, leased.token, leased.expires_at)
+        self._raise_unavailable(offer_name)
+
+    def confirm_lease(self, offer_name: str, lease_token: str) -> str:
+        """两阶段领取的第二步：确认租约，邀请码正式发放"""
+        confirmed = ClaimEngine(self.db).confirm(offer_name, lease_token)
+        if confirmed is None:
+            raise ValueError("租约不存在或已过期")
+        return confirmed.code
+
+    def _claim(self, offer_name: str, user_ip: str = None, user_agent: str = None,
+               client_key: str = None, lease_seconds: float = None):
+        """领取一个邀请码（传入lease_seconds时加上租约）；多进程部署开启分区时只在本进程租用的分区内选取"""
+        def claim(id_range=None):
+            engine = ClaimEngine(self.db)
+            if lease_seconds is not None:
+                return engine.lease(offer_name, lease_seconds, user_ip, user_agent, client_key, id_range)
+            return engine.claim(offer_name, user_ip, user_agent, client_key, id_range)
+
+        partitions = get_claim_partitions()
+        if partitions is None:
+            return claim()
+        # 分区租约通过当前会话读写，接口领取时不另开同步连接
+        return partitions.claim(offer_name, claim, self.db)
+
+    def claim_batch(self, offer_name: str, count: int, user_ip: str = None, user_agent: str = None,
+                    allow_partial: bool = False) -> List[str]:
+        """一次领取多个邀请码（合作方批量发放）"""
+        claimed = ClaimEngine(self.db).claim_batch(offer_name, count, user_ip, user_agent, allow_partial)
+        if claimed:
+            offer_info_cache.on_claim(offer_name, len(claimed))
+            return [item.code for item in claimed]
+
+        available = self.db.query(Offer.remaining_count).filter(
+            Offer.name == offer_name,
+            Offer.is_active == True
+        ).scalar()
+        if available:
+            raise ValueError(f"剩余邀请码不足，当前剩余{available}个")
+        self._raise_unavailable(offer_name)
+
+    def _raise_unavailable(self, offer_name: str):
+        """领取失败时再区分是offer不可用还是邀请码已用完"""
         offer = self.db.query(Offer).filter(
             Offer.name == offer_name,
             Offer.is_active == True
@@ -22,76 +125,54 @@ class CodeService:
         if not offer:
             raise ValueError("邀请码项目不存在或已停用")
 
-        # 查找未使用的邀请码
-        unused_code = self.db.query(InvitationCode).filter(
-            InvitationCode.offer_id == offer.id,
-            InvitationCode.is_used == False
-        ).first()
-
-        if not unused_code:
-            raise ValueError("邀请码已用完")
-
-        # 标记为已使用
-        unused_code.is_used = True
-        unused_code.used_at = datetime.now()
-        unused_code.user_ip = user_ip
-        unused_code.user_agent = user_agent
-
-        # 更新offer的剩余数量
-        offer.remaining_count -= 1
-        offer.updated_at = datetime.now()
-
-        self.db.commit()
-
-        return unused_code.code
+        raise ValueError("邀请码已用完")
+
+    def verify_codes(self, codes: List[str], offer_name: str = None) -> Dict[str, CodeStatus]:
+        """按邀请码查询状态，返回存在的邀请码 -> CodeStatus
+
+        过滤器判定一定不存在的邀请码不查询数据库；offer_name 不为空时只在该offer中查找。
+        """
+        candidates = code_index.candidates(codes)
+        if not candidates:
+            return {}
+        return code_index.find(self.db, candidates, offer_name)
+
+    def redeem_code(self, code: str, offer_name: str = None) -> CodeStatus:
+        """合作方核销一个已发放的邀请码，返回核销后的状态
+
+        用带条件的UPDATE（redeemed_at 为空）保证同一个邀请码只会被核销一次；
+        查询后被归档的邀请码重新查询一次，在归档表中核销。
+        """
+        for _ in range(2):
+            found = self.verify_codes([code], offer_name).get(code)
+            # 查询和核销分开两个事务，核销本身由UPDATE的条件保证
+            self.db.rollback()
+            if found is None:
+                raise ValueError("邀请码不存在")
+            if found.status == STATUS_REDEEMED:
+                raise ValueError("邀请码已核销")
+            if found.status != STATUS_ISSUED:
+                raise ValueError("邀请码尚未发放")
+
+            table = (InvitationCodeArchive if found.archived else InvitationCode).__table__
+            now = datetime.now()
+            try:
+                updated = self.db.execute(
+                    table.update()
+                    .where(table.c.id == found.id, table.c.used_at.isnot(None), table.c.redeemed_at.is_(None))
+                    .values(redeemed_at=now)
+                ).rowcount
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+            if updated:
+                return found._replace(status=STATUS_REDEEMED, redeemed_at=now)
+        raise ValueError("邀请码已核销")
 
     def import_codes(self, offer_name: str, codes: List[str]) -> dict:
         """导入邀请码到指定offer"""
-        # 查找或创建offer
-        offer = self.db.query(Offer).filter(Offer.name == offer_name).first()
-        if not offer:
-            raise ValueError(f"Offer '{offer_name}' 不存在，请先创建")
-
-        new_codes = 0
-        duplicate_codes = 0
-
-        for code in codes:
-            code = code.strip()
-            if not code:
-                continue
-
-            # 检查是否已存在
-            existing = self.db.query(InvitationCode).filter(
-                InvitationCode.offer_id == offer.id,
-                InvitationCode.code == code
-            ).first()
-
-            if existing:
-                duplicate_codes += 1
-                continue
-
-            # 创建新的邀请码
-            invitation_code = InvitationCode(
-                offer_id=offer.id,
-                code=code,
-                is_used=False
-            )
-            self.db.add(invitation_code)
-            new_codes += 1
-
-        # 提交事务
-        self.db.commit()
-
-        # 更新offer统计
-        from services.offer_service import OfferService
-        offer_service = OfferService(self.db)
-        offer_service.update_offer_stats(offer.id)
-
-        return {
-            "new_codes": new_codes,
-            "duplicate_codes": duplicate_codes,
-            "total_processed": len(codes)
-        }
+        return BulkImporter(self.db).import_codes(offer_name, codes)
 
     def get_available_count(self, offer_id: int) -> int:
         """获取可用邀请码数量"""
@@ -0,0 +1,56 @@
+"""
+响应体JSON编码与ETag
+
+热点读接口（/info、/stats）直接把字典编码为bytes，跳过pydantic响应模型的校验和
+FastAPI的jsonable_encoder。安装了orjson时使用orjson（比标准库json快数倍），
+否则退回标准库json，两者输出的内容相同：紧凑格式、不转义非ASCII字符、
+datetime编码为ISO 8601字符串。
+
+ETag由响应体的哈希生成，内容不变时ETag不变，不依赖进程内状态，多进程部署时
+同一内容在各个进程上的ETag相同。
+"""
+
+import hashlib
+import json
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 当前使用的编码器名称（健康检查、基准测试中展示）
+ENCODER = "orjson" if orjson is not None else "json"
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """把响应内容编码为JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def make_etag(body: bytes) -> str:
+    """由响应体生成强ETag"""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 请求头是否匹配etag（按弱比较，支持多个值和 *）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
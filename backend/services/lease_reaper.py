@@ -0,0 +1,200 @@
+"""
+过期租约回收
+
+两阶段领取时，邀请码交给客户端后处于租约中（is_used 但 used_at 为空，code_leases 中有记录），
+客户端在租约到期前确认才算发放。回收任务把到期未确认的邀请码放回可领取的池子：
+
+- 只读取 code_leases 上 expires_at 索引中已过期的部分（ORDER BY expires_at LIMIT），
+  不扫描邀请码表；按批在短写事务中处理，每批之间让出写锁
+- 每批: 删除租约、把邀请码标记回未使用、删除领取时登记的领取者身份（该客户端可以重新领取），
+  按offer把剩余数量加回、租约中数量减去
+- PostgreSQL/MySQL 上用 SKIP LOCKED 跳过正在被确认的租约；确认和回收都以删除租约的行数为准，
+  同一个租约只会有一方成功
+
+使用方法:
+python -m cli.leases           # 回收已过期的租约
+python -m cli.leases --dry-run # 只统计已过期的租约数量
+"""
+
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import false, func, select
+from sqlalchemy.orm import Session
+
+from models.database import retry_on_locked
+from models.offer import Offer
+from models.invitation_code import InvitationCode
+from models.code_lease import CodeLease
+from models.claimer_identity import ClaimerIdentity
+from services.offer_cache import offer_info_cache
+
+logger = logging.getLogger(__name__)
+
+offers_table = Offer.__table__
+codes_table = InvitationCode.__table__
+leases_table = CodeLease.__table__
+identities_table = ClaimerIdentity.__table__
+
+# 每批回收的租约数量（一个写事务，同时也不超过旧版SQLite的参数个数限制）
+DEFAULT_BATCH_SIZE = 500
+
+
+def count_expired_leases(db: Session, now: datetime = None) -> int:
+    """已过期但尚未回收的租约数量"""
+    return db.execute(
+        select(func.count()).select_from(leases_table).where(leases_table.c.expires_at < (now or datetime.now()))
+    ).scalar()
+
+
+def release_expired_leases(db: Session, now: datetime = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                           stop: threading.Event = None) -> int:
+    """分批回收在now之前到期的租约，返回放回的邀请码数量"""
+    now = now or datetime.now()
+    released = 0
+    while stop is None or not stop.is_set():
+        count = retry_on_locked(_release_batch, db, now, batch_size)
+        released += count
+        if count < batch_size:
+            break
+
+    if released:
+        logger.info("回收了 %d 个过期租约", released)
+        offer_info_cache.on_change()
+    return released
+
+
+def _release_batch(db: Session, now: datetime, batch_size: int) -> int:
+    """在一个事务内回收一批过期租约"""
+    try:
+        dialect = db.get_bind().dialect.name
+        query = (
+            select(leases_table.c.code_id, leases_table.c.offer_id, leases_table.c.client_key)
+            .where(leases_table.c.expires_at < now)
+            .order_by(leases_table.c.expires_at)
+            .limit(batch_size)
+        )
+        if dialect == "sqlite":
+            # 先拿写锁，读取和删除看到的是同一批租约
+            db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+        elif dialect in ("postgresql", "mysql", "mariadb"):
+            query = query.with_for_update(skip_locked=True)
+        rows = db.execute(query).fetchall()
+        if not rows:
+            db.rollback()
+            return 0
+
+        ids = [row.code_id for row in rows]
+        db.execute(leases_table.delete().where(leases_table.c.code_id.in_(ids)))
+        db.execute(
+            codes_table.update()
+            .where(codes_table.c.id.in_(ids), codes_table.c.used_at.is_(None))
+            .values(is_used=false())
+        )
+
+        client_keys = defaultdict(list)
+        for row in rows:
+            if row.client_key:
+                client_keys[row.offer_id].append(row.client_key)
+        for offer_id, keys in client_keys.items():
+            db.execute(identities_table.delete().where(
+                identities_table.c.offer_id == offer_id,
+                identities_table.c.client_key.in_(keys)
+            ))
+
+        for offer_id, count in Counter(row.offer_id for row in rows).items():
+            db.execute(
+                offers_table.update()
+                .where(offers_table.c.id == offer_id)
+                .values(
+                    remaining_count=offers_table.c.remaining_count + count,
+                    leased_count=func.coalesce(offers_table.c.leased_count, 0) - count,
+                    updated_at=now
+                )
+            )
+        db.commit()
+        return len(rows)
+    except Exception:
+        db.rollback()
+        raise
+
+
+class LeaseReaper:
+    """按固定间隔在后台线程中回收过期租约"""
+
+    def __init__(self, session_factory, interval_seconds: float, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.interval = interval_seconds
+        self.batch_size = batch_size
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.released = 0
+        self.last_run_at: Optional[datetime] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="lease-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self) -> int:
+        db = self.session_factory()
+        try:
+            released = release_expired_leases(db, batch_size=self.batch_size, stop=self._stopping)
+        finally:
+            db.close()
+        self.runs += 1
+        self.released += released
+        self.last_run_at = datetime.now()
+        return released
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("过期租约回收失败: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "released": self.released,
+            "last_run_at": self.last_run_at.isoformat(timespec="seconds") if self.last_run_at else None
+        }
+
+
+_reaper: Optional[LeaseReaper] = None
+
+
+def start_lease_reaper(session_factory, settings) -> Optional[LeaseReaper]:
+    """按配置启动全局的过期租约回收，间隔为0时不启动"""
+    global _reaper
+    if settings.claim_lease_reap_interval_seconds <= 0:
+        return None
+    _reaper = LeaseReaper(
+        session_factory,
+        settings.claim_lease_reap_interval_seconds,
+        batch_size=settings.claim_lease_reap_batch_size
+    )
+    _reaper.start()
+    return _reaper
+
+
+def stop_lease_reaper():
+    global _reaper
+    if _reaper is not None:
+        _reaper.stop()
+        _reaper = None
+
+
+def get_lease_reaper() -> Optional[LeaseReaper]:
+    return _reaper
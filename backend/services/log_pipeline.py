@@ -0,0 +1,242 @@
+"""
+异步日志
+
+请求处理中（事件循环里）调用 logger.info 只做两件事：按采样比例过滤，把日志记录放入内存队列；
+日志消息的格式化（msg % args）和写入都由后台线程完成，写文件或标准输出不会增加领取接口的延迟。
+
+- 日志调用使用 %s 占位符（logger.info("...: offer=%s", offer_name)），未启用的级别和
+  被采样丢弃的日志不会格式化消息
+- 后台线程收到第一条日志后最多等待 flush_interval 凑成一批，一次写入、一次flush
+- 高频的成功日志通过 extra={"sample": "类别"} 标记，按配置的比例保留（每N条保留1条）；
+  警告和错误总是保留
+- 队列满时丢弃新的日志并计数，不阻塞调用方
+- 进程退出前 stop() 写完队列中的全部日志（也注册了atexit）
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from services import fast_json
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# LogRecord自带的属性，JSON格式只额外输出通过extra传入的字段
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+_STOP = object()
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，extra传入的字段作为顶层字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return fast_json.dumps(entry).decode("utf-8")
+
+
+class SamplingFilter(logging.Filter):
+    """按类别采样带 sample 标记的日志，比例为1（或未配置）时全部保留，为0时全部丢弃"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # 类别 -> 每多少条保留1条（0表示全部丢弃）
+        self.intervals = {
+            name: (0 if rate <= 0 else max(1, round(1 / rate)))
+            for name, rate in rates.items() if rate < 1
+        }
+        self._counters: Dict[str, int] = {}
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        name = getattr(record, "sample", None)
+        if name is None or record.levelno >= logging.WARNING:
+            return True
+        interval = self.intervals.get(name)
+        if interval is None:
+            return True
+        if interval:
+            count = self._counters.get(name, 0)
+            self._counters[name] = count + 1
+            if count % interval == 0:
+                return True
+        self.dropped += 1
+        return False
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """只把日志记录放入队列，不在调用方线程格式化消息（标准QueueHandler会先格式化）"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 异常的traceback引用调用栈，放入队列前先转为文本（只在出错时发生）
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """日志队列与后台批量写入线程"""
+
+    def __init__(self, level: str = "INFO", fmt: str = "text", path: str = "", queue_size: int = 10000,
+                 batch_size: int = 256, flush_interval_ms: int = 100, sample_rates: Dict[str, float] = None):
+        self.level = level
+        self.formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.handler = LazyQueueHandler(self.queue)
+        self.sampler = SamplingFilter(sample_rates or {})
+        self.handler.addFilter(self.sampler)
+        self._stream = None
+        self._thread: Optional[threading.Thread] = None
+        self._write_lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, stream=None):
+        """接管根日志记录器的输出并启动后台写入线程，stream 默认为日志文件或标准输出"""
+        if self._thread is not None:
+            return
+        if stream is not None:
+            self._stream = stream
+        elif self.path:
+            self._stream = open(self.path, "a", encoding="utf-8")
+        else:
+            self._stream = sys.stdout
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """停止后台线程，写入队列中剩余的日志"""
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        logging.getLogger().removeHandler(self.handler)
+        self.flush()
+        if self._stream is not None and self.path and self._stream is not sys.stdout:
+            self._stream.close()
+        self._stream = None
+        atexit.unregister(self.stop)
+
+    def flush(self):
+        """在调用方线程写入队列中的全部日志"""
+        batch = []
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not _STOP:
+                batch.append(record)
+        if batch:
+            self._write(batch)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    self._write(batch)
+                    return
+                batch.append(record)
+            self._write(batch)
+
+    def _write(self, batch: List[logging.LogRecord]):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                self.handler.handleError(record)
+        if not lines:
+            return
+        with self._write_lock:
+            try:
+                self._stream.write("\n".join(lines) + "\n")
+                self._stream.flush()
+            except Exception:
+                self.handler.handleError(batch[0])
+                return
+            self.written += len(lines)
+            self.batches += 1
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "pending": self.queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "sampled_out": self.sampler.dropped,
+            "dropped": self.handler.dropped
+        }
+
+
+def _create_log_pipeline() -> LogPipeline:
+    from config.settings import settings
+    return LogPipeline(
+        level=settings.log_level,
+        fmt=settings.log_format,
+        path=settings.log_file,
+        queue_size=settings.log_queue_size,
+        batch_size=settings.log_batch_size,
+        flush_interval_ms=settings.log_flush_interval_ms,
+        sample_rates=settings.log_sample_rates
+    )
+
+
+log_pipeline = _create_log_pipeline()
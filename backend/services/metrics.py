@@ -0,0 +1,322 @@
+"""
+进程内指标收集，按Prometheus文本格式输出（/metrics）
+
+记录路径不加锁：每个线程把计数写入自己的分片（threading.local中的dict），
+只有线程第一次记录时登记分片需要加锁；导出时再把所有分片合并。事件循环线程、
+线程池和领取池后台线程各自写自己的分片，高并发下不会在指标上互相等待。
+"""
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Metric:
+    """指标基类，values按标签值元组索引"""
+
+    type_name = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str,
+                 labelnames: Tuple[str, ...] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _label_str(self, labels: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self, merged: dict) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1.0):
+        shard = self.registry.shard()
+        key = (self, labels)
+        shard[key] = shard.get(key, 0.0) + amount
+
+    def render(self, merged: dict) -> List[str]:
+        return [f"{self.name}{self._label_str(labels)} {_number(value)}"
+                for labels, value in sorted(merged.items())]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, labels: tuple = ()):
+        shard = self.registry.shard()
+        key = (self, labels)
+        state = shard.get(key)
+        if state is None:
+            # 各分桶的计数（最后一个是+Inf）、总和、次数
+            state = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            shard[key] = state
+        state[bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def time(self, labels: tuple = ()):
+        return _Timer(self, labels)
+
+    def render(self, merged: dict) -> List[str]:
+        lines = []
+        for labels, state in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else _number(bound))
+                lines.append(f"{self.name}_bucket{self._label_str(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_str(labels)} {_number(state[-2])}")
+            lines.append(f"{self.name}_count{self._label_str(labels)} {state[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """瞬时值，直接覆盖写入（不分片）"""
+
+    type_name = "gauge"
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        super().__init__(registry, name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, labels: tuple = ()):
+        self._values[labels] = value
+
+    def replace(self, values: Dict[tuple, float]):
+        """整体替换所有标签的值（用于导出前刷新的指标）"""
+        self._values = dict(values)
+
+    def render(self, merged: dict) -> List[str]:
+        return [f"{self.name}{self._label_str(labels)} {_number(value)}"
+                for labels, value in sorted(self._values.items())]
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._shards: List[dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def shard(self) -> dict:
+        """当前线程的分片"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return Counter(self, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return Histogram(self, name, documentation, labelnames, buckets)
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return Gauge(self, name, documentation, labelnames)
+
+    def _merge(self) -> Dict[_Metric, dict]:
+        with self._lock:
+            shards = list(self._shards)
+        merged: Dict[_Metric, dict] = {}
+        for shard in shards:
+            # dict.items()转list在CPython中是原子的，分片所属线程同时写入也不会出错
+            for (metric, labels), value in list(shard.items()):
+                values = merged.setdefault(metric, {})
+                if isinstance(value, list):
+                    total = values.get(labels)
+                    values[labels] = [a + b for a, b in zip(total, value)] if total else list(value)
+                else:
+                    values[labels] = values.get(labels, 0.0) + value
+        return merged
+
+    def render(self) -> str:
+        """Prometheus文本格式（0.0.4）"""
+        merged = self._merge()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render(merged.get(metric, {})))
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP请求耗时（按路由模板）", ("method", "route", "status")
+)
+http_request_db_duration = registry.histogram(
+    "http_request_db_seconds", "单个请求内数据库语句的累计耗时", ("route",)
+)
+response_serialization_duration = registry.histogram(
+    "response_serialization_seconds", "响应体序列化耗时", ("route",)
+)
+claim_outcomes = registry.counter(
+    "claim_requests_total", "邀请码申请结果（success/reused/错误码）", ("outcome",)
+)
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "单条数据库语句耗时", ("engine",)
+)
+db_pool_checkouts = registry.counter(
+    "db_pool_checkouts_total", "连接池签出次数", ("engine",)
+)
+db_pool_checkout_wait = registry.histogram(
+    "db_pool_checkout_seconds", "获取连接的耗时（等待空闲连接或新建连接）", ("engine",)
+)
+db_pool_checkins = registry.counter(
+    "db_pool_checkins_total", "连接池归还次数（与签出次数之差即当前占用的连接数）", ("engine",)
+)
+offer_remaining = registry.gauge(
+    "offer_remaining_codes", "各offer剩余可领取的邀请码数量", ("offer",)
+)
+offer_total = registry.gauge(
+    "offer_total_codes", "各offer的邀请码总数", ("offer",)
+)
+offer_leased = registry.gauge(
+    "offer_leased_codes", "各offer租约中（等待确认）的邀请码数量", ("offer",)
+)
+claim_pool_queued = registry.gauge(
+    "claim_pool_queued_codes", "领取池内存队列中待发放的邀请码数量", ("offer",)
+)
+claim_audit_pending = registry.gauge(
+    "claim_audit_pending_events", "等待后台批量写入的领取审计事件数量"
+)
+offer_count_drift = registry.counter(
+    "offer_count_drift_total", "对账发现offer计数与实际数量不一致的次数", ("offer",)
+)
+claim_batch_requests = registry.counter(
+    "claim_batch_requests_total", "批量领取请求结果", ("outcome",)
+)
+claim_batch_codes = registry.counter(
+    "claim_batch_codes_total", "批量领取发放的邀请码数量"
+)
+offer_events_subscribers = registry.gauge(
+    "offer_events_subscribers", "当前进程订阅offer剩余数量推送的连接数"
+)
+code_lookups = registry.counter(
+    "code_lookups_total", "按邀请码核验的结果（found/not_found）", ("outcome",)
+)
+code_redeem_requests = registry.counter(
+    "code_redeem_requests_total", "邀请码核销请求结果（success/错误码）", ("outcome",)
+)
+claim_audit_dropped = registry.counter(
+    "claim_audit_dropped_total", "待写入队列已满时丢弃的审计事件数量"
+)
+
+
+# ---- 单个请求内的分项耗时 ----
+
+# 当前请求累计的 [数据库耗时, 序列化耗时]，可变列表便于在事件回调中原地累加
+_request_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timings():
+    """在请求开始时调用，返回用于结束计时的token"""
+    return _request_timings.set([0.0, 0.0])
+
+
+def finish_request_timings(token) -> Tuple[float, float]:
+    """结束计时，返回 (数据库耗时, 序列化耗时)"""
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+    return timings[0], timings[1]
+
+
+def add_serialization_time(elapsed: float):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[1] += elapsed
+
+
+# ---- 数据库引擎埋点 ----
+
+def instrument_engine(engine, name: str):
+    """为同步引擎（异步引擎传入sync_engine）注册语句耗时和连接池事件"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["_query_start"].pop()
+        db_query_duration.observe(elapsed, (name,))
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[0] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("_query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    pool = engine.pool
+
+    @event.listens_for(pool, "checkout")
+    def _checkout(dbapi_conn, record, proxy):
+        db_pool_checkouts.inc((name,))
+
+    @event.listens_for(pool, "checkin")
+    def _checkin(dbapi_conn, record):
+        db_pool_checkins.inc((name,))
+
+    # 连接池没有"开始签出"事件，包装取连接的方法来测量等待时间
+    do_get = pool._do_get
+
+    def _timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - start, (name,))
+
+    pool._do_get = _timed_do_get
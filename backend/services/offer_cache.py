@@ -0,0 +1,193 @@
+"""
+offer信息的进程内读穿透缓存
+
+缓存 GET /offers/{name}/info 序列化后的响应，按offer名称索引，不存在的名称也会
+短暂缓存（负缓存），避免落地页刷新和无效名称反复查询数据库。每个条目同时保存编码好的
+JSON bytes和ETag，只在offer变化后第一次读取时重新编码，命中时不再序列化。
+
+两种一致性模式：
+- strict: 本进程内的领取、导入、修改立即使缓存失效，下一次读取回源数据库
+- lag: 本进程内的领取直接在缓存上扣减 remaining_count，条目在 TTL 到期前不回源，
+  剩余数量最多滞后 TTL 毫秒
+
+两种模式都只对本进程内的变化生效：其他工作进程的领取、领取池回写、命令行导入只能等条目
+过期后才能读到，strict 是"本进程内严格"，跨进程的剩余数量最多滞后 TTL 毫秒。
+
+每个offer有一个版本号，失效和领取时加一。回源前先用 version() 取得版本号，写入时带上，
+期间发生过失效的写入会被丢弃，不会把失效前读到的旧数据写回缓存。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from services import fast_json
+from services.metrics import add_serialization_time
+
+MODE_STRICT = "strict"
+MODE_LAG = "lag"
+
+# get() 未命中时的返回值（None 表示命中了负缓存）
+MISS = object()
+
+
+class OfferInfoCache:
+    """offer信息缓存，带TTL、负缓存和LRU容量上限"""
+
+    def __init__(self, enabled: bool = True, mode: str = MODE_STRICT, ttl_ms: int = 1000,
+                 negative_ttl_ms: int = 5000, max_entries: int = 10000):
+        if mode not in (MODE_STRICT, MODE_LAG):
+            raise ValueError(f"未知的缓存模式: {mode}")
+        self.enabled = enabled
+        self.mode = mode
+        self.ttl = ttl_ms / 1000.0
+        self.negative_ttl = negative_ttl_ms / 1000.0
+        self.max_entries = max_entries
+
+        # name -> [过期时间, 响应内容或None, (JSON bytes, ETag)或None]
+        self._entries = OrderedDict()
+        # name -> 版本号（只记录发生过失效或领取的offer），invalidate() 全部失效时整体加一
+        self._versions = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.encodes = 0
+        self.stale_puts = 0
+
+    def _lookup(self, name: str):
+        """查找未过期的条目并更新命中统计，调用方需持有锁"""
+        entry = self._entries.get(name)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(name)
+        if entry[1] is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def get(self, name: str):
+        """返回缓存的响应内容；负缓存返回None；未命中返回MISS"""
+        if not self.enabled:
+            return MISS
+        with self._lock:
+            entry = self._lookup(name)
+            return MISS if entry is None else entry[1]
+
+    def get_encoded(self, name: str):
+        """返回缓存的 (JSON bytes, ETag)；负缓存返回None；未命中返回MISS"""
+        if not self.enabled:
+            return MISS
+        with self._lock:
+            entry = self._lookup(name)
+            if entry is None:
+                return MISS
+            if entry[1] is None:
+                return None
+            if entry[2] is None:
+                # 写入后或lag模式扣减剩余数量后的第一次读取
+                entry[2] = self._encode(entry[1])
+            return entry[2]
+
+    def _encode(self, payload: dict) -> Tuple[bytes, str]:
+        start = time.perf_counter()
+        body = fast_json.dumps(payload)
+        add_serialization_time(time.perf_counter() - start)
+        self.encodes += 1
+        return body, fast_json.make_etag(body)
+
+    def version(self, name: str) -> Tuple[int, int]:
+        """offer当前的版本号，回源读取前取得，写入时传给 put()"""
+        with self._lock:
+            return self._epoch, self._versions.get(name, 0)
+
+    def _bump(self, name: str = None):
+        """offer（或全部）发生了变化，调用方需持有锁"""
+        if name is None:
+            self._epoch += 1
+            self._versions.clear()
+        else:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def put(self, name: str, payload: Optional[dict],
+            version: Tuple[int, int] = None) -> Optional[Tuple[bytes, str]]:
+        """写入响应内容，payload为None表示offer不存在；返回编码好的 (JSON bytes, ETag)
+
+        传入回源前取得的version时，期间offer发生过变化则不写入缓存（仍返回编码结果）。
+        """
+        encoded = self._encode(payload) if payload is not None else None
+        if not self.enabled:
+            return encoded
+        ttl = self.ttl if payload is not None else self.negative_ttl
+        with self._lock:
+            if version is not None and version != (self._epoch, self._versions.get(name, 0)):
+                self.stale_puts += 1
+                return encoded
+            self._entries[name] = [time.monotonic() + ttl, payload, encoded]
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return encoded
+
+    def invalidate(self, name: str = None):
+        """使指定offer（或全部）的缓存失效"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+            self._bump(name)
+            self.invalidations += 1
+
+    def on_claim(self, name: str, count: int = 1):
+        """本进程发放了邀请码"""
+        if self.mode == MODE_STRICT:
+            self.invalidate(name)
+            return
+        with self._lock:
+            # 正在回源的读取可能读到领取前的数量，不能再写入
+            self._bump(name)
+            entry = self._entries.get(name)
+            if entry is not None and entry[1] is not None:
+                data = entry[1]["data"]
+                data["remaining_count"] = max(data["remaining_count"] - count, 0)
+                entry[2] = None
+
+    def on_change(self, name: str = None):
+        """offer信息或邀请码数量发生了变化（导入、创建等）"""
+        self.invalidate(name)
+
+    def stats(self) -> dict:
+        """命中统计"""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "mode": self.mode,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "encodes": self.encodes,
+            "stale_puts": self.stale_puts,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0.0
+        }
+
+
+def _create_cache() -> OfferInfoCache:
+    from config.settings import settings
+    return OfferInfoCache(
+        enabled=settings.offer_cache_enabled,
+        mode=settings.offer_cache_mode,
+        ttl_ms=settings.offer_cache_ttl_ms,
+        negative_ttl_ms=settings.offer_cache_negative_ttl_ms,
+        max_entries=settings.offer_cache_max_entries
+    )
+
+
+offer_info_cache = _create_cache()
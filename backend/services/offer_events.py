@@ -0,0 +1,200 @@
+"""
+offer剩余数量的实时推送（SSE / WebSocket）
+
+每个工作进程有一个发布协程：有订阅者时按 OFFER_EVENTS_MAX_RATE 的频率用一条查询
+读取所有被订阅offer的计数，数值变化时更新该offer的频道。其他worker的领取也会在
+下一个周期被读到，多次变化合并为一次推送。
+
+频道只保存最新的数据和版本号，订阅者等待频道的asyncio.Event；发布时替换Event并
+唤醒所有等待者，每个空闲连接只占用一个挂起的协程，不需要独立的消息队列。
+"""
+
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import select
+
+from models.offer import Offer
+
+logger = logging.getLogger(__name__)
+
+offers_table = Offer.__table__
+
+# 单条语句中IN列表的最大长度（兼容旧版SQLite的参数个数限制）
+IN_CHUNK_SIZE = 500
+
+
+class TooManySubscribers(Exception):
+    """本进程的订阅连接数已达上限"""
+
+
+class _Channel:
+    __slots__ = ("payload", "version", "event", "subscribers")
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self.version = 0
+        self.event = asyncio.Event()
+        self.subscribers = 0
+
+
+def offer_event_payload(row) -> dict:
+    return {
+        "name": row.name,
+        "total_count": row.total_count or 0,
+        "remaining_count": row.remaining_count or 0,
+        "is_active": bool(row.is_active)
+    }
+
+
+def format_sse(payload: Optional[dict], version: int = None) -> bytes:
+    """SSE消息；payload为None时输出心跳注释，防止代理关闭空闲连接"""
+    if payload is None:
+        return b": ping\n\n"
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    event_id = f"id: {version}\n" if version is not None else ""
+    return f"event: remaining\n{event_id}data: {data}\n\n".encode("utf-8")
+
+
+class OfferEventHub:
+    """按offer名称组织的订阅频道与发布协程"""
+
+    def __init__(self, max_rate: float = 2.0, heartbeat_seconds: float = 15.0,
+                 max_subscribers: int = 50000):
+        self.interval = 1.0 / max_rate
+        self.heartbeat = heartbeat_seconds
+        self.max_subscribers = max_subscribers
+        self._channels: Dict[str, _Channel] = {}
+        self._subscribers = 0
+        self._task: Optional[asyncio.Task] = None
+        self.published = 0
+
+    # ---- 生命周期 ----
+
+    def start(self):
+        """在当前事件循环中启动发布协程"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # ---- 订阅 ----
+
+    async def snapshot(self, offer_name: str) -> Optional[dict]:
+        """offer的当前数据：已有订阅时直接使用频道中的数据，否则查询数据库"""
+        channel = self._channels.get(offer_name)
+        if channel is not None:
+            return channel.payload
+        rows = await self._fetch([offer_name])
+        return rows.get(offer_name)
+
+    async def stream(self, offer_name: str, initial: dict) -> AsyncIterator[Optional[dict]]:
+        """先产出当前数据，之后每次变化产出最新数据；超过心跳间隔没有变化时产出None"""
+        channel = self._subscribe(offer_name, initial)
+        try:
+            version = None
+            while True:
+                if channel.version != version:
+                    version = channel.version
+                    yield channel.payload
+                    continue
+                try:
+                    await asyncio.wait_for(channel.event.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self._unsubscribe(offer_name, channel)
+
+    def version(self, offer_name: str) -> int:
+        channel = self._channels.get(offer_name)
+        return channel.version if channel else 0
+
+    def _subscribe(self, offer_name: str, initial: dict) -> _Channel:
+        if self._subscribers >= self.max_subscribers:
+            raise TooManySubscribers()
+        channel = self._channels.get(offer_name)
+        if channel is None:
+            channel = self._channels[offer_name] = _Channel(initial)
+        channel.subscribers += 1
+        self._subscribers += 1
+        self.start()
+        return channel
+
+    def _unsubscribe(self, offer_name: str, channel: _Channel):
+        channel.subscribers -= 1
+        self._subscribers -= 1
+        if channel.subscribers == 0 and self._channels.get(offer_name) is channel:
+            del self._channels[offer_name]
+
+    def is_full(self) -> bool:
+        return self._subscribers >= self.max_subscribers
+
+    # ---- 发布 ----
+
+    def publish(self, offer_name: str, payload: dict):
+        """数据有变化时更新频道并唤醒所有订阅者"""
+        channel = self._channels.get(offer_name)
+        if channel is None or channel.payload == payload:
+            return
+        channel.payload = payload
+        channel.version += 1
+        event, channel.event = channel.event, asyncio.Event()
+        event.set()
+        self.published += 1
+
+    async def poll_once(self):
+        names = [name for name, channel in self._channels.items() if channel.subscribers]
+        if not names:
+            return
+        for name, payload in (await self._fetch(names)).items():
+            self.publish(name, payload)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logger.error("读取offer计数失败: %s", e)
+
+    async def _fetch(self, names: List[str]) -> Dict[str, dict]:
+        from models.database import get_async_sessionmaker
+
+        result = {}
+        async with get_async_sessionmaker()() as db:
+            for i in range(0, len(names), IN_CHUNK_SIZE):
+                rows = (await db.execute(
+                    select(offers_table.c.name, offers_table.c.total_count,
+                           offers_table.c.remaining_count, offers_table.c.is_active)
+                    .where(offers_table.c.name.in_(names[i:i + IN_CHUNK_SIZE]))
+                )).all()
+                result.update((row.name, offer_event_payload(row)) for row in rows)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self._subscribers,
+            "channels": len(self._channels),
+            "published": self.published
+        }
+
+
+def _create_hub() -> OfferEventHub:
+    from config.settings import settings
+    return OfferEventHub(
+        max_rate=settings.offer_events_max_rate,
+        heartbeat_seconds=settings.offer_events_heartbeat_seconds,
+        max_subscribers=settings.offer_events_max_subscribers
+    )
+
+
+offer_event_hub = _create_hub()
@@ -0,0 +1,138 @@
+"""
+offer页面服务端渲染
+
+开启 OFFER_PAGE_SSR 后，/offer/{name} 返回的页面中已经填好了offer的标题、描述和剩余数量，
+并内嵌了 /info 接口的响应（window.__OFFER_INFO__），浏览器打开页面后不需要再请求一次 /info。
+
+- index.html 只解析一次，拆分为固定片段和几个插槽（标题、描述、数量、进度条、内嵌数据），
+  渲染时按顺序拼接，不做模板解析
+- 每个offer渲染好的页面按 (模板ETag, offer信息ETag) 缓存，只有页面文件或offer信息变化时
+  才重新渲染；offer信息直接使用offer信息缓存中编码好的响应体
+- 渲染结果复用 StaticAsset：预先生成压缩版本、ETag、304，返回较短的共享缓存时间（s-maxage），
+  CDN可以在几秒内直接返回页面
+"""
+
+import html
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from services.static_assets import StaticAsset
+
+# 插槽名称 -> 匹配需要替换的内容的正则（第2个分组为被替换的内容）
+SLOTS = (
+    ("page_title", re.compile(r"(<title>)(.*?)(</title>)", re.S)),
+    ("title", re.compile(r'(id="offerTitle"[^>]*>)(.*?)(<)', re.S)),
+    ("description", re.compile(r'(id="offerDescription"[^>]*>)(.*?)(<)', re.S)),
+    ("progress", re.compile(r'(id="progressFill"[^>]*style="width:\s*)([0-9.]+%)(")', re.S)),
+    ("remaining", re.compile(r'(id="remainingCount"[^>]*>)(.*?)(<)', re.S)),
+    ("total", re.compile(r'(id="totalCount"[^>]*>)(.*?)(<)', re.S)),
+    ("info", re.compile(r"()(<!-- offer-info -->)()")),
+)
+
+DEFAULT_DESCRIPTION = "获取您的专属邀请码"
+
+
+class OfferPageTemplate:
+    """拆分好的页面模板，render 只做字符串拼接"""
+
+    def __init__(self, page: str):
+        found = []
+        for name, pattern in SLOTS:
+            match = pattern.search(page)
+            if match:
+                found.append((match.start(2), match.end(2), name))
+        found.sort()
+
+        # parts[i] 之后是 slots[i]，最后一个片段之后没有插槽
+        self.parts: List[str] = []
+        self.slots: List[str] = []
+        position = 0
+        for start, end, name in found:
+            if start < position:
+                continue
+            self.parts.append(page[position:start])
+            self.slots.append(name)
+            position = end
+        self.parts.append(page[position:])
+
+    def render(self, info: dict, info_body: bytes) -> bytes:
+        """info 为offer信息，info_body 为 /info 接口编码好的响应体"""
+        total = info.get("total_count") or 0
+        remaining = info.get("remaining_count") or 0
+        percentage = remaining / total * 100 if total > 0 else 0
+        # 防止offer信息中的 "</script>" 提前结束脚本
+        inline = info_body.decode("utf-8").replace("<", "\\u003c")
+        values = {
+            "page_title": html.escape(f"{info.get('title') or info.get('name')} - 邀请码领取"),
+            "title": html.escape(info.get("title") or ""),
+            "description": html.escape(info.get("description") or DEFAULT_DESCRIPTION),
+            "progress": f"{percentage:g}%",
+            "remaining": str(remaining),
+            "total": str(total),
+            "info": f"<script>window.__OFFER_INFO__ = {inline};</script>",
+        }
+        chunks = []
+        for part, slot in zip(self.parts, self.slots):
+            chunks.append(part)
+            chunks.append(values[slot])
+        chunks.append(self.parts[-1])
+        return "".join(chunks).encode("utf-8")
+
+
+class OfferPageRenderer:
+    """按offer缓存渲染好的页面"""
+
+    def __init__(self, cache_control: str, max_entries: int = 1000):
+        self.cache_control = cache_control
+        self.max_entries = max_entries
+        # (模板ETag, 拆分好的模板)，页面文件变化后替换
+        self._template: Optional[Tuple[str, OfferPageTemplate]] = None
+        # offer名称 -> (模板ETag, offer信息ETag, StaticAsset)
+        self._pages: "OrderedDict[str, Tuple[str, str, StaticAsset]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.renders = 0
+
+    def _template_for(self, page: StaticAsset) -> Tuple[str, OfferPageTemplate]:
+        template_etag = page.variants[None][1]
+        template = self._template
+        if template is None or template[0] != template_etag:
+            template = (template_etag, OfferPageTemplate(page.variants[None][0].decode("utf-8")))
+            self._template = template
+        return template
+
+    def get(self, offer_name: str, page: StaticAsset, info_body: bytes, info_etag: str) -> StaticAsset:
+        """返回offer的渲染结果，page 为 index.html，info_body/info_etag 为offer信息缓存中的响应"""
+        template_etag, template = self._template_for(page)
+        with self._lock:
+            entry = self._pages.get(offer_name)
+            if entry is not None and entry[0] == template_etag and entry[1] == info_etag:
+                self._pages.move_to_end(offer_name)
+                self.hits += 1
+                return entry[2]
+
+        info = _decode_info(info_body)
+        body = template.render(info, info_body)
+        asset = StaticAsset(page.path, body, time.time(), page.content_type, self.cache_control)
+        with self._lock:
+            self._pages[offer_name] = (template_etag, info_etag, asset)
+            self._pages.move_to_end(offer_name)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+            self.renders += 1
+        return asset
+
+    def stats(self) -> dict:
+        return {
+            "pages": len(self._pages),
+            "hits": self.hits,
+            "renders": self.renders
+        }
+
+
+def _decode_info(info_body: bytes) -> dict:
+    return json.loads(info_body).get("data") or {}
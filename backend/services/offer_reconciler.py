@@ -0,0 +1,232 @@
+"""
+offer计数对账
+
+offers 表上的 total_count / remaining_count / leased_count 由导入、领取、领取池回写和
+租约的确认与回收增量维护。
+对账用一条 GROUP BY 语句重新统计所有offer的邀请码总数和剩余数量，与计数列比较，
+发现偏差时记录日志并按差值修正。
+
+剩余数量 = 未使用的邀请码 + 领取池预留但尚未发放的邀请码（预留时已标记 is_used，
+回写发放记录时才扣减计数）。租约中的邀请码已扣减剩余数量，计入 leased_count。
+总数包含已移到归档表的邀请码。
+
+定期对账时顺带删除 claim_counts 中超出统计时间窗口的分桶。
+
+统计和计数在同一条语句中读取（同一个快照），修正时按差值增减而不是直接覆盖，
+对账期间并发的领取和导入不会被覆盖掉。
+
+使用方法:
+python -m cli.reconcile           # 对账并修正
+python -m cli.reconcile --dry-run # 只报告偏差
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import case, false, func, select
+from sqlalchemy.orm import Session
+
+from models.offer import Offer
+from models.invitation_code import InvitationCode
+from models.code_reservation import CodeReservation
+from models.code_archive import InvitationCodeArchive
+from models.code_lease import CodeLease
+from services import metrics
+from services.claim_stats import prune_claim_counts
+from services.offer_cache import offer_info_cache
+
+logger = logging.getLogger(__name__)
+
+offers_table = Offer.__table__
+codes_table = InvitationCode.__table__
+reservations_table = CodeReservation.__table__
+archive_table = InvitationCodeArchive.__table__
+leases_table = CodeLease.__table__
+
+OfferDrift = namedtuple("OfferDrift", [
+    "offer_id", "name", "total_count", "expected_total", "remaining_count", "expected_remaining",
+    "leased_count", "expected_leased"
+])
+
+
+def _counts_query(offer_ids: Optional[Iterable[int]] = None):
+    """一次扫描统计每个offer的总数、未使用数、预留数、归档数和租约数，并带出当前计数列"""
+    code_counts = (
+        select(
+            codes_table.c.offer_id,
+            func.count().label("total"),
+            func.sum(case((codes_table.c.is_used == false(), 1), else_=0)).label("unused")
+        )
+        .group_by(codes_table.c.offer_id)
+        .subquery()
+    )
+    reserved_counts = (
+        select(reservations_table.c.offer_id, func.count().label("reserved"))
+        .group_by(reservations_table.c.offer_id)
+        .subquery()
+    )
+    archived_counts = (
+        select(archive_table.c.offer_id, func.count().label("archived"))
+        .group_by(archive_table.c.offer_id)
+        .subquery()
+    )
+    leased_counts = (
+        select(leases_table.c.offer_id, func.count().label("leased"))
+        .group_by(leases_table.c.offer_id)
+        .subquery()
+    )
+    query = (
+        select(
+            offers_table.c.id,
+            offers_table.c.name,
+            offers_table.c.total_count,
+            offers_table.c.remaining_count,
+            offers_table.c.leased_count,
+            func.coalesce(code_counts.c.total, 0) + func.coalesce(archived_counts.c.archived, 0),
+            func.coalesce(code_counts.c.unused, 0),
+            func.coalesce(reserved_counts.c.reserved, 0),
+            func.coalesce(leased_counts.c.leased, 0)
+        )
+        .select_from(
+            offers_table
+            .outerjoin(code_counts, code_counts.c.offer_id == offers_table.c.id)
+            .outerjoin(reserved_counts, reserved_counts.c.offer_id == offers_table.c.id)
+            .outerjoin(archived_counts, archived_counts.c.offer_id == offers_table.c.id)
+            .outerjoin(leased_counts, leased_counts.c.offer_id == offers_table.c.id)
+        )
+    )
+    if offer_ids is not None:
+        query = query.where(offers_table.c.id.in_(list(offer_ids)))
+    return query
+
+
+def find_drift(db: Session, offer_ids: Optional[Iterable[int]] = None) -> List[OfferDrift]:
+    """返回计数与实际数量不一致的offer"""
+    drifts = []
+    rows = db.execute(_counts_query(offer_ids))
+    for offer_id, name, total, remaining, leased, actual_total, unused, reserved, actual_leased in rows:
+        expected_remaining = int(unused) + int(reserved)
+        if (total or 0) != actual_total or (remaining or 0) != expected_remaining \
+                or (leased or 0) != actual_leased:
+            drifts.append(OfferDrift(offer_id, name, total or 0, int(actual_total),
+                                     remaining or 0, expected_remaining, leased or 0, int(actual_leased)))
+    return drifts
+
+
+def reconcile_offer_counts(db: Session, offer_ids: Optional[Iterable[int]] = None,
+                           fix: bool = True) -> List[OfferDrift]:
+    """对账并（fix为True时）修正计数，返回发现的偏差"""
+    drifts = find_drift(db, offer_ids)
+    db.rollback()
+    if not drifts:
+        return drifts
+
+    for drift in drifts:
+        logger.warning(
+            "offer计数偏差: offer=%s, total %s -> %s, remaining %s -> %s, leased %s -> %s",
+            drift.name, drift.total_count, drift.expected_total, drift.remaining_count,
+            drift.expected_remaining, drift.leased_count, drift.expected_leased
+        )
+        metrics.offer_count_drift.inc((drift.name,))
+    if not fix:
+        return drifts
+
+    now = datetime.now()
+    try:
+        for drift in drifts:
+            db.execute(
+                offers_table.update()
+                .where(offers_table.c.id == drift.offer_id)
+                .values(
+                    total_count=func.coalesce(offers_table.c.total_count, 0)
+                    + (drift.expected_total - drift.total_count),
+                    remaining_count=func.coalesce(offers_table.c.remaining_count, 0)
+                    + (drift.expected_remaining - drift.remaining_count),
+                    leased_count=func.coalesce(offers_table.c.leased_count, 0)
+                    + (drift.expected_leased - drift.leased_count),
+                    updated_at=now
+                )
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    offer_info_cache.on_change()
+    return drifts
+
+
+class OfferReconciler:
+    """按固定间隔在后台线程中对账"""
+
+    def __init__(self, session_factory, interval_seconds: float):
+        self.session_factory = session_factory
+        self.interval = interval_seconds
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_drift_count = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="offer-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self) -> List[OfferDrift]:
+        db = self.session_factory()
+        try:
+            drifts = reconcile_offer_counts(db)
+            prune_claim_counts(db)
+        finally:
+            db.close()
+        self.runs += 1
+        self.last_run_at = datetime.now()
+        self.last_drift_count = len(drifts)
+        return drifts
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("offer计数对账失败: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "last_run_at": self.last_run_at.isoformat(timespec="seconds") if self.last_run_at else None,
+            "last_drift_count": self.last_drift_count
+        }
+
+
+_reconciler: Optional[OfferReconciler] = None
+
+
+def start_offer_reconciler(session_factory, settings) -> Optional[OfferReconciler]:
+    """按配置启动全局的定期对账，间隔为0时不启动"""
+    global _reconciler
+    if settings.offer_reconcile_interval_seconds <= 0:
+        return None
+    _reconciler = OfferReconciler(session_factory, settings.offer_reconcile_interval_seconds)
+    _reconciler.start()
+    return _reconciler
+
+
+def stop_offer_reconciler():
+    global _reconciler
+    if _reconciler is not None:
+        _reconciler.stop()
+        _reconciler = None
+
+
+def get_offer_reconciler() -> Optional[OfferReconciler]:
+    return _reconciler
@@ -1,8 +1,11 @@
 from typing import Optional
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from models.offer import Offer
-from models.invitation_code import InvitationCode
-from sqlalchemy.sql import func
+from models.claim_event import ClaimEvent
+from services.offer_cache import offer_info_cache
+from services.claim_stats import claim_stats, mask_code
+from services.code_archiver import with_archived_codes
 
 class OfferService:
     """Offer相关业务逻辑"""
@@ -26,27 +29,13 @@ class OfferService:
         self.db.add(offer)
         self.db.commit()
         self.db.refresh(offer)
+        offer_info_cache.on_change(name)
         return offer
 
     def update_offer_stats(self, offer_id: int):
-        """更新offer的统计信息"""
-        # 获取总数和剩余数
-        total_count = self.db.query(InvitationCode).filter(
-            InvitationCode.offer_id == offer_id
-        ).count()
-
-        remaining_count = self.db.query(InvitationCode).filter(
-            InvitationCode.offer_id == offer_id,
-            InvitationCode.is_used == False
-        ).count()
-
-        # 更新offer统计
-        self.db.query(Offer).filter(Offer.id == offer_id).update({
-            "total_count": total_count,
-            "remaining_count": remaining_count,
-            "updated_at": func.now()
-        })
-        self.db.commit()
+        """重新统计offer的总数和剩余数量（导入和领取时计数已增量维护，这里用于修正偏差）"""
+        from services.offer_reconciler import reconcile_offer_counts
+        reconcile_offer_counts(self.db, [offer_id])
 
     def get_offer_stats(self, offer_name: str) -> dict:
         """获取offer的详细统计信息"""
@@ -54,29 +43,42 @@ class OfferService:
         if not offer:
             return None
 
-        # 获取最近的申请记录（最多10条）
-        recent_claims = self.db.query(InvitationCode).filter(
-            InvitationCode.offer_id == offer.id,
-            InvitationCode.is_used == True
-        ).order_by(InvitationCode.used_at.desc()).limit(10).all()
+        if claim_stats.loaded:
+            # 单进程服务中由内存环形缓冲区和分桶提供，不查询数据库
+            recent_claims_data = claim_stats.recent_claims(offer.id)
+            series = claim_stats.series(offer.id)
+        else:
+            # 多进程部署时内存中只有本进程的领取，从审计事件读取
+            recent_claims_data = self._recent_claims_from_db(offer.id, claim_stats.recent_size)
+            series = claim_stats.series_from_db(self.db, offer.id)
 
-        # 脱敏处理邀请码
-        recent_claims_data = []
-        for claim in recent_claims:
-            code_masked = f"***{claim.code[-6:]}" if len(claim.code) > 6 else "***"
-            recent_claims_data.append({
-                "code": code_masked,
-                "claimed_at": claim.used_at,
-                "user_ip": claim.user_ip
-            })
-
-        usage_rate = offer.total_count - offer.remaining_count
-        usage_rate = usage_rate / offer.total_count if offer.total_count > 0 else 0
+        leased_codes = offer.leased_count or 0
+        used_codes = offer.total_count - offer.remaining_count - leased_codes
+        usage_rate = used_codes / offer.total_count if offer.total_count > 0 else 0.0
 
         return {
             "total_codes": offer.total_count,
-            "used_codes": offer.total_count - offer.remaining_count,
+            "used_codes": used_codes,
             "remaining_codes": offer.remaining_count,
+            "leased_codes": leased_codes,
             "usage_rate": round(usage_rate, 3),
-            "recent_claims": recent_claims_data
+            "recent_claims": recent_claims_data,
+            **series
         }
+
+    def _recent_claims_from_db(self, offer_id: int, limit: int = 10) -> list:
+        """最近的申请记录（审计事件由后台批量写入，可能滞后一个回写周期）"""
+        events = ClaimEvent.__table__
+        from_clause, code = with_archived_codes(events, events.c.code_id)
+        recent_claims = self.db.execute(
+            select(events.c.claimed_at, events.c.user_ip, code)
+            .select_from(from_clause)
+            .where(events.c.offer_id == offer_id)
+            .order_by(events.c.id.desc())
+            .limit(limit)
+        ).fetchall()
+
+        return [
+            {"code": mask_code(claim.code), "claimed_at": claim.claimed_at, "user_ip": claim.user_ip}
+            for claim in recent_claims
+        ]
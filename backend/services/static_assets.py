@@ -0,0 +1,195 @@
+"""
+前端静态文件的内存缓存
+
+后端的 /offer/{name}、/static/* 和 frontend/server.py 共用这里的缓存，只依赖标准库
+（安装了brotli时额外生成br压缩版本），前端服务器不需要安装后端依赖。
+
+- 文件第一次被请求时读入内存，同时预先生成gzip（以及br）压缩版本，之后的请求
+  不再读盘、不再压缩；按 check_interval 秒检查一次修改时间，文件变化后重新加载
+- ETag 由文件内容的哈希生成（不同压缩版本的ETag带不同后缀），同时返回 Last-Modified，
+  If-None-Match / If-Modified-Since 命中时返回304
+- 文件名带内容哈希的资源（如 app.3f9a8b7c.js）内容不会变化，返回一年的
+  immutable 缓存；其他文件（包括index.html）每次都要重新验证
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 文件名中的内容哈希: name.<8位以上十六进制>.ext
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_CONTROL_REVALIDATE = "no-cache"
+
+# 小于这个大小的文件压缩后收益很小，不生成压缩版本
+MIN_COMPRESS_SIZE = 256
+# 超过这个大小的文件不缓存在内存中
+MAX_CACHED_SIZE = 10 * 1024 * 1024
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/javascript", "application/json", "application/xml", "image/svg+xml"
+)
+
+ENCODING_BROTLI = "br"
+ENCODING_GZIP = "gzip"
+
+
+class StaticAsset:
+    """一个已加载到内存的文件及其压缩版本"""
+
+    def __init__(self, path: str, body: bytes, mtime: float, content_type: str, cache_control: str):
+        self.path = path
+        self.mtime = mtime
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.last_modified = formatdate(int(mtime), usegmt=True)
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+
+        # 编码 -> (内容, ETag)，None表示不压缩
+        self.variants: Dict[Optional[str], Tuple[bytes, str]] = {None: (body, f'"{digest}"')}
+        if len(body) >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants[ENCODING_GZIP] = (compressed, f'"{digest}-gz"')
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.variants[ENCODING_BROTLI] = (compressed, f'"{digest}-br"')
+
+    def choose_encoding(self, accept_encoding: str) -> Optional[str]:
+        """按 Accept-Encoding 选择压缩版本，优先br，其次gzip"""
+        accepted = _parse_accept_encoding(accept_encoding)
+        for encoding in (ENCODING_BROTLI, ENCODING_GZIP):
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return None
+
+    def not_modified(self, etag: str, if_none_match: str = None, if_modified_since: str = None) -> bool:
+        """条件请求是否命中（有If-None-Match时忽略If-Modified-Since）"""
+        if if_none_match:
+            if if_none_match.strip() == "*":
+                return True
+            candidates = [c.strip() for c in if_none_match.split(",")]
+            return any((c[2:] if c.startswith("W/") else c) == etag for c in candidates)
+        if if_modified_since:
+            try:
+                return int(self.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+        return False
+
+    def respond(self, headers) -> Tuple[int, Dict[str, str], bytes]:
+        """根据请求头生成 (状态码, 响应头, 响应体)，headers 需支持 get(小写名称)"""
+        encoding = self.choose_encoding(headers.get("accept-encoding"))
+        body, etag = self.variants[encoding]
+        response_headers = {
+            "ETag": etag,
+            "Last-Modified": self.last_modified,
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding"
+        }
+        if self.not_modified(etag, headers.get("if-none-match"), headers.get("if-modified-since")):
+            return 304, response_headers, b""
+        response_headers["Content-Type"] = self.content_type
+        response_headers["Content-Length"] = str(len(body))
+        if encoding:
+            response_headers["Content-Encoding"] = encoding
+        return 200, response_headers, body
+
+
+def _parse_accept_encoding(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def content_type_for(path: str) -> str:
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+class StaticAssetCache:
+    """某个目录下静态文件的内存缓存，多线程和协程中都可以直接调用"""
+
+    def __init__(self, root: str, check_interval: float = 2.0):
+        self.root = os.path.realpath(root)
+        self.check_interval = check_interval
+        # 相对路径 -> (下次检查修改时间的时间, StaticAsset)
+        self._assets: Dict[str, Tuple[float, StaticAsset]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def get(self, relative_path: str) -> Optional[StaticAsset]:
+        """返回文件（不存在、不在目录内或过大时返回None）"""
+        # 规范化后再作为缓存键，"./a/../index.html" 之类的写法不会产生新的条目
+        relative_path = os.path.normpath(relative_path.lstrip("/"))
+        if relative_path.split(os.sep)[0] == "..":
+            return None
+        now = time.monotonic()
+        entry = self._assets.get(relative_path)
+        if entry is not None and (self.check_interval <= 0 or entry[0] > now):
+            self.hits += 1
+            return entry[1]
+
+        path = os.path.realpath(os.path.join(self.root, relative_path))
+        if not path.startswith(self.root + os.sep):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._drop(relative_path)
+            return None
+        if not os.path.isfile(path) or stat.st_size > MAX_CACHED_SIZE:
+            return None
+
+        if entry is not None and entry[1].mtime == stat.st_mtime:
+            # 文件没有变化，只推迟下次检查
+            asset = entry[1]
+            self.hits += 1
+        else:
+            with open(path, "rb") as f:
+                body = f.read()
+            cache_control = CACHE_CONTROL_IMMUTABLE if HASHED_NAME.search(path) else CACHE_CONTROL_REVALIDATE
+            asset = StaticAsset(path, body, stat.st_mtime, content_type_for(path), cache_control)
+            self.loads += 1
+        with self._lock:
+            self._assets[relative_path] = (now + self.check_interval, asset)
+        return asset
+
+    def _drop(self, relative_path: str):
+        with self._lock:
+            self._assets.pop(relative_path, None)
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._assets),
+            "hits": self.hits,
+            "loads": self.loads,
+            "brotli": brotli is not None
+        }
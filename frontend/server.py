@@ -1,64 +1,66 @@
 #!/usr/bin/env python3
 """
-简单的前端服务器，支持单页应用路由
+前端服务器，支持单页应用路由
+
+- 多线程处理请求（ThreadingHTTPServer），并支持HTTP/1.1长连接
+- 文件缓存在内存中并预先压缩（gzip，安装了brotli时还有br），带ETag/Last-Modified，
+  条件请求返回304；与后端共用 backend/services/static_assets.py
 """
 
 import os
-import mimetypes
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, unquote
 import re
+import sys
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, unquote
+
+STATIC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 添加backend目录到路径（static_assets只依赖标准库）
+sys.path.insert(0, os.path.join(os.path.dirname(STATIC_DIR), "backend"))
+
+from services.static_assets import StaticAssetCache
+
+# /offer/{name} 页面都返回index.html
+SPA_ROUTE = re.compile(r'^/offer/[a-zA-Z0-9_-]+/?$')
+
+static_assets = StaticAssetCache(STATIC_DIR, check_interval=float(os.getenv("STATIC_CACHE_CHECK_SECONDS", "2")))
 
 class SinglePageAppHandler(BaseHTTPRequestHandler):
     """支持SPA路由的HTTP请求处理器"""
 
-    def __init__(self, *args, **kwargs):
-        self.static_dir = os.path.dirname(os.path.abspath(__file__))
-        super().__init__(*args, **kwargs)
+    protocol_version = "HTTP/1.1"
 
     def do_GET(self):
         """处理GET请求"""
-        parsed_path = urlparse(self.path)
-        path = unquote(parsed_path.path)
+        path = unquote(urlparse(self.path).path)
 
         # 如果路径匹配 /offer/* 格式，返回index.html
-        if re.match(r'^/offer/[a-zA-Z0-9_-]+/?$', path):
-            self.serve_spa_route()
-            return
+        if path.startswith('/offer/') and SPA_ROUTE.match(path):
+            path = '/index.html'
 
         # 处理静态文件
         if path == '/' or path == '':
             path = '/index.html'
 
-        # 构建文件路径
-        file_path = os.path.join(self.static_dir, path.lstrip('/'))
-
-        # 检查文件是否存在
-        if os.path.isfile(file_path):
-            self.serve_static_file(file_path)
-        else:
+        asset = static_assets.get(path)
+        if asset is None:
             self.send_404()
+            return
+        self.serve_static_file(asset)
 
-    def serve_spa_route(self):
-        """为SPA路由提供index.html"""
-        index_path = os.path.join(self.static_dir, 'index.html')
-        self.serve_static_file(index_path)
+    def do_HEAD(self):
+        """处理HEAD请求（与GET相同，但不发送响应体）"""
+        self.do_GET()
 
-    def serve_static_file(self, file_path):
-        """提供静态文件"""
+    def serve_static_file(self, asset):
+        """从内存缓存提供静态文件"""
         try:
-            with open(file_path, 'rb') as file:
-                content = file.read()
-
-            # 获取MIME类型
-            mime_type, _ = mimetypes.guess_type(file_path)
-            if mime_type is None:
-                mime_type = 'application/octet-stream'
+            status, headers, body = asset.respond(self.headers)
 
             # 发送响应
-            self.send_response(200)
-            self.send_header('Content-Type', mime_type)
-            self.send_header('Content-Length', str(len(content)))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
 
             # CORS headers for development
             self.send_header('Access-Control-Allow-Origin', '*')
@@ -66,17 +68,28 @@ class SinglePageAppHandler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
 
             self.end_headers()
-            self.wfile.write(content)
+            if self.command != 'HEAD':
+                self.wfile.write(body)
 
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已断开
+            self.close_connection = True
         except Exception as e:
-            print(f"Error serving file {file_path}: {e}")
+            print(f"Error serving file {asset.path}: {e}")
             self.send_500()
 
-    def send_404(self):
-        """发送404错误"""
-        self.send_response(404)
+    def send_html(self, status, html):
+        """发送HTML错误页面"""
+        body = html.encode('utf-8')
+        self.send_response(status)
         self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_404(self):
+        """发送404错误"""
 
         error_html = """
         <!DOCTYPE html>
@@ -92,14 +105,10 @@ class SinglePageAppHandler(BaseHTTPRequestHandler):
         </body>
         </html>
         """
-        self.wfile.write(error_html.encode('utf-8'))
+        self.send_html(404, error_html)
 
     def send_500(self):
         """发送500错误"""
-        self.send_response(500)
-        self.send_header('Content-Type', 'text/html; charset=utf-8')
-        self.end_headers()
-
         error_html = """
         <!DOCTYPE html>
         <html>
@@ -113,7 +122,7 @@ class SinglePageAppHandler(BaseHTTPRequestHandler):
         </body>
         </html>
         """
-        self.wfile.write(error_html.encode('utf-8'))
+        self.send_html(500, error_html)
 
     def do_OPTIONS(self):
         """处理OPTIONS请求（CORS预检）"""
@@ -121,12 +130,13 @@ class SinglePageAppHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
 def run_server(port=3000):
     """启动服务器"""
     server_address = ('', port)
-    httpd = HTTPServer(server_address, SinglePageAppHandler)
+    httpd = ThreadingHTTPServer(server_address, SinglePageAppHandler)
 
     print(f"🌐 前端服务器启动成功")
     print(f"📍 地址: http://localhost:{port}")
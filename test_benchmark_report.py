@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+基准测试报告测试
+1. 百分位数计算
+2. 与基线比较时正确标记吞吐量下降和p95延迟上升
+
+使用方法:
+python test_benchmark_report.py
+"""
+
+import sys
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from benchmarks.report import compare, latency_summary, percentile
+
+
+def make_report(info_throughput: float, claim_p95: float) -> dict:
+    return {"runs": [{"benchmark": "load", "results": [
+        {"name": "info", "throughput": info_throughput, "p95_ms": 5.0},
+        {"name": "claim", "throughput": 200.0, "p95_ms": claim_p95},
+    ]}]}
+
+
+def test_percentiles():
+    samples = [i / 1000 for i in range(1, 101)]
+    assert percentile(samples, 50) == 0.05
+    assert percentile(samples, 99) == 0.099
+    assert percentile([], 95) == 0.0
+    summary = latency_summary(samples)
+    assert summary["p95_ms"] == 95.0 and summary["max_ms"] == 100.0, summary
+
+
+def test_compare_flags_regressions():
+    baseline = make_report(info_throughput=1000.0, claim_p95=100.0)
+
+    steady = compare(make_report(900.0, 110.0), baseline, tolerance=0.25)
+    assert steady and not any(c["regression"] for c in steady), steady
+
+    slower = compare(make_report(600.0, 200.0), baseline, tolerance=0.25)
+    flagged = {(c["name"], c["metric"]) for c in slower if c["regression"]}
+    assert flagged == {("info", "throughput"), ("claim", "p95_ms")}, flagged
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("百分位数", test_percentiles),
+        ("基线比较", test_compare_flags_regressions),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 基准测试报告测试通过！")
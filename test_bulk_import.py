@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+集合化批量导入测试
+1. 临时表反连接去重：批次内重复、空行、原表和归档表中已有的邀请码都不会再次写入，其他offer的同名邀请码不算重复
+2. 每块一个事务，块提交后offer的总数和剩余数量已按本块新增数量增加
+3. 导入后计数与对账统计的实际数量一致，新邀请码写入了 code_hash
+
+使用方法:
+python test_bulk_import.py
+"""
+
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from models.code_archive import InvitationCodeArchive
+from models.invitation_code import InvitationCode
+from models.offer import Offer
+from services.bulk_importer import BulkImporter
+from services.code_archiver import archive_used_codes
+from services.code_index import code_hash
+from services.code_service import CodeService
+from services.offer_reconciler import find_drift, reconcile_offer_counts
+from services.offer_service import OfferService
+from test_claim_concurrency import make_session_factory, seed_offer
+
+
+def offer_counts(SessionLocal, offer_name: str):
+    db = SessionLocal()
+    try:
+        offer = db.query(Offer).filter(Offer.name == offer_name).first()
+        return offer.total_count, offer.remaining_count
+    finally:
+        db.close()
+
+
+def test_anti_join_dedup_against_hot_and_archive():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "import.db"))
+        # 原表中有 CODE000000~CODE000009，其中前4个发放后归档
+        seed_offer(SessionLocal, "bulk", 10)
+        seed_offer(SessionLocal, "other", 0)
+        db = SessionLocal()
+        try:
+            archived = [CodeService(db).claim_code("bulk") for _ in range(4)]
+            assert archive_used_codes(db, datetime.now() + timedelta(seconds=1)) == 4
+            assert db.query(InvitationCodeArchive).count() == 4
+            assert find_drift(db) == []
+        finally:
+            db.close()
+
+        lines = [
+            "NEW0001", " NEW0002 ", "", "NEW0001",  # 批次内重复、空行和首尾空白
+            archived[0], archived[3],               # 已归档
+            "CODE000005", "CODE000009",             # 仍在原表中
+            "NEW0003", "NEW0002", "NEW0004", "   ",
+        ]
+        chunks = []
+
+        def progress(processed, inserted, duplicates):
+            # 块提交后立即可以读到更新后的计数
+            chunks.append((processed, inserted, duplicates, offer_counts(SessionLocal, "bulk")))
+
+        db = SessionLocal()
+        try:
+            result = BulkImporter(db, chunk_size=4).import_codes("bulk", lines, progress=progress)
+            other = BulkImporter(db, chunk_size=4).import_codes("other", ["NEW0001", archived[0]])
+        finally:
+            db.close()
+
+        assert result == {"new_codes": 4, "duplicate_codes": 6, "total_processed": 12}, result
+        # 第1块: NEW0001 NEW0002 新增，空行不计，块内重复1个；第2块全部重复；
+        # 第3块: NEW0003 NEW0004 新增，NEW0002与第1块重复
+        assert [c[:3] for c in chunks] == [(4, 2, 1), (4, 0, 4), (4, 2, 1)], chunks
+        assert [c[3] for c in chunks] == [(12, 8), (12, 8), (14, 10)], chunks
+        assert other["new_codes"] == 2
+
+        db = SessionLocal()
+        try:
+            bulk_id = db.query(Offer.id).filter(Offer.name == "bulk").scalar()
+            hot = [row.code for row in db.query(InvitationCode).filter(InvitationCode.offer_id == bulk_id)]
+            assert len(hot) == len(set(hot)) == 10
+            assert not set(hot) & set(archived)
+            assert {"NEW0001", "NEW0002", "NEW0003", "NEW0004"} <= set(hot)
+            new_rows = db.query(InvitationCode).filter(InvitationCode.code.like("NEW%")).all()
+            assert all(row.code_hash == code_hash(row.code) for row in new_rows)
+
+            assert find_drift(db) == []
+            assert reconcile_offer_counts(db) == []
+        finally:
+            db.close()
+        assert offer_counts(SessionLocal, "bulk") == (14, 10)
+        assert offer_counts(SessionLocal, "other") == (2, 2)
+
+
+def test_counters_match_reconciler_after_claims():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "import.db"))
+        db = SessionLocal()
+        try:
+            OfferService(db).create_offer("mixed", "导入后领取")
+            BulkImporter(db, chunk_size=7).import_codes("mixed", (f"M{i % 40:04d}" for i in range(60)))
+            claimed = [CodeService(db).claim_code("mixed") for _ in range(15)]
+            BulkImporter(db, chunk_size=7).import_codes("mixed", claimed + [f"M{i:04d}" for i in range(40, 50)])
+            assert find_drift(db) == []
+            assert reconcile_offer_counts(db) == []
+        finally:
+            db.close()
+        assert offer_counts(SessionLocal, "mixed") == (50, 35)
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("原表与归档表反连接去重", test_anti_join_dedup_against_hot_and_archive),
+        ("导入后计数与对账一致", test_counters_match_reconciler_after_claims),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 批量导入测试通过！")
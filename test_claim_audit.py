@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+领取审计日志测试
+1. 后台线程未启动时，领取后立即写入审计事件，User-Agent去重存储
+2. 后台线程运行时，审计事件在内存中排队，批量写入后统计接口能看到最近的领取者
+3. 领取池回写发放记录时同时写入审计事件
+4. 旧数据库迁移：邀请码行上的IP/User-Agent回填到 claim_events，并移除这两列
+
+使用方法:
+python test_claim_audit.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from sqlalchemy import create_engine, inspect
+
+from models.claim_event import ClaimEvent, UserAgent
+from models.migrations import run_migrations
+from services import claim_engine
+from services.claim_audit import ClaimAuditLog, claim_audit_log
+from services.claim_pool import ClaimPool
+from services.code_service import CodeService
+from services.offer_service import OfferService
+from test_claim_concurrency import make_session_factory, seed_offer
+from test_indexes import LEGACY_SCHEMA
+
+
+def counts(SessionLocal):
+    db = SessionLocal()
+    try:
+        return db.query(ClaimEvent).count(), db.query(UserAgent).count()
+    finally:
+        db.close()
+
+
+def test_inline_write_without_writer():
+    assert not claim_audit_log.running
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "audit.db"))
+        seed_offer(SessionLocal, "inline", 10)
+        db = SessionLocal()
+        try:
+            for i in range(3):
+                CodeService(db).claim_code("inline", f"10.0.0.{i}", "AuditTest/1.0")
+            CodeService(db).claim_code("inline", "10.0.0.9", None)
+        finally:
+            db.close()
+        assert counts(SessionLocal) == (4, 1), f"审计记录数量错误: {counts(SessionLocal)}"
+
+
+def test_batched_writer():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "audit.db"))
+        seed_offer(SessionLocal, "batched", 20)
+        audit = ClaimAuditLog(flush_interval_ms=60000, batch_size=1000)
+        audit.start(SessionLocal)
+        # 让领取引擎使用测试中的审计日志实例
+        claim_engine.claim_audit_log = audit
+        try:
+            db = SessionLocal()
+            try:
+                for i in range(5):
+                    CodeService(db).claim_code("batched", f"10.0.1.{i}", f"Agent/{i % 2}")
+            finally:
+                db.close()
+            assert audit.pending_count() == 5
+            assert counts(SessionLocal)[0] == 0, "后台线程运行时不应同步写入"
+        finally:
+            claim_engine.claim_audit_log = claim_audit_log
+            audit.stop()
+
+        assert counts(SessionLocal) == (5, 2)
+        db = SessionLocal()
+        try:
+            recent = OfferService(db).get_offer_stats("batched")["recent_claims"]
+        finally:
+            db.close()
+        assert [claim["user_ip"] for claim in recent] == [f"10.0.1.{i}" for i in reversed(range(5))]
+
+
+def test_claim_pool_writes_events():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "audit.db"))
+        seed_offer(SessionLocal, "pooled", 30)
+        pool = ClaimPool(SessionLocal, block_size=10, low_watermark=2,
+                         flush_interval_ms=20, journal_dir=str(Path(tmp) / "journal"))
+        pool.start()
+        try:
+            for i in range(12):
+                pool.claim("pooled", f"10.0.2.{i}", "PoolAgent/1.0")
+        finally:
+            pool.stop()
+        assert counts(SessionLocal) == (12, 1), f"审计记录数量错误: {counts(SessionLocal)}"
+
+
+def test_legacy_audit_columns_migrated():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/legacy.db")
+        with engine.begin() as conn:
+            for statement in LEGACY_SCHEMA:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql("INSERT INTO offers (id, name, title) VALUES (1, 'demo', 'Demo')")
+            for i in range(10):
+                used = i < 6
+                conn.exec_driver_sql(
+                    "INSERT INTO invitation_codes (offer_id, code, is_used, used_at, user_ip, user_agent) "
+                    "VALUES (1, ?, ?, ?, ?, ?)",
+                    (f"OLD{i}", used, "2024-01-01 00:00:00" if used else None,
+                     f"10.1.0.{i}" if used else None, f"Legacy/{i % 3}" if used else None)
+                )
+
+        run_migrations(engine)
+
+        columns = {column["name"] for column in inspect(engine).get_columns("invitation_codes")}
+        assert not columns & {"user_ip", "user_agent"}, f"旧审计字段未移除: {columns}"
+        with engine.connect() as conn:
+            events = conn.exec_driver_sql(
+                "SELECT e.user_ip, u.user_agent FROM claim_events e "
+                "LEFT JOIN user_agents u ON u.id = e.user_agent_id ORDER BY e.code_id"
+            ).fetchall()
+            agents = conn.exec_driver_sql("SELECT COUNT(*) FROM user_agents").scalar()
+        assert [tuple(row) for row in events] == [(f"10.1.0.{i}", f"Legacy/{i % 3}") for i in range(6)]
+        assert agents == 3
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("未启动后台线程时同步写入", test_inline_write_without_writer),
+        ("后台批量写入", test_batched_writer),
+        ("领取池写入审计事件", test_claim_pool_writes_events),
+        ("旧审计字段迁移", test_legacy_audit_columns_migrated),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 领取审计日志测试通过！")
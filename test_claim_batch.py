@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+批量领取测试
+1. 一个事务内领取N个邀请码：计数扣减、审计事件写入；数量不足时整批失败，allow_partial时领取剩余全部
+2. 令牌桶按数量消耗令牌，退还的令牌不超过容量
+3. 接口：小批量返回JSON，大批量以NDJSON流式返回；超出调用方配额返回429，失败的请求退还配额
+4. 接口只对合作方开放：未配置合作方密钥时返回404，密钥缺少或无效时返回401
+
+使用方法:
+python test_claim_batch.py
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import httpx
+from fastapi import FastAPI
+
+from config.settings import settings
+from middleware import create_claim_batch_quota
+from middleware.rate_limit import MemoryRateLimitBackend, TokenBucket
+from models.claim_event import ClaimEvent
+from models.database import dispose_async_engine
+from models.offer import Offer
+from routers import offers
+from services.code_service import CodeService
+from services.offer_reconciler import find_drift
+from services.offer_service import OfferService
+from test_claim_concurrency import app_database, make_session_factory, seed_offer
+
+PARTNER_KEYS = {"secret": "partner"}
+PARTNER = {"X-API-Key": "secret"}
+
+
+def test_claim_batch_in_one_transaction():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal_ = make_session_factory(str(Path(tmp) / "engine.db"))
+        seed_offer(SessionLocal_, "partner", 25)
+        db = SessionLocal_()
+        try:
+            codes = CodeService(db).claim_batch("partner", 20, "10.0.0.1", "partner-client")
+            assert len(codes) == len(set(codes)) == 20
+            assert db.query(ClaimEvent).count() == 20
+
+            # 剩余5个，请求10个时整批失败，不领取任何邀请码
+            try:
+                CodeService(db).claim_batch("partner", 10)
+                assert False, "数量不足时应失败"
+            except ValueError as e:
+                assert "不足" in str(e)
+            assert db.query(Offer.remaining_count).filter(Offer.name == "partner").scalar() == 5
+
+            rest = CodeService(db).claim_batch("partner", 10, allow_partial=True)
+            assert len(rest) == 5 and not set(rest) & set(codes)
+            try:
+                CodeService(db).claim_batch("partner", 1)
+                assert False, "已用完时应失败"
+            except ValueError as e:
+                assert "已用完" in str(e)
+            assert find_drift(db) == []
+        finally:
+            db.close()
+
+
+def test_token_bucket_cost():
+    backend = MemoryRateLimitBackend(TokenBucket(capacity=30, per_hour=30))
+    assert backend.hit("p", 0.0, 20)[0]
+    allowed, retry_after = backend.hit("p", 0.0, 20)
+    assert not allowed and abs(retry_after - 10 * 120) < 1e-6, retry_after
+    # 退还后可以再次领取，但令牌数不会超过容量
+    assert backend.hit("p", 0.0, -100)[0]
+    assert backend.hit("p", 0.0, 30)[0]
+    assert not backend.hit("p", 0.0, 1)[0]
+
+
+async def call_claim_batch(requests) -> list:
+    """依次发送批量领取请求 (请求体, 请求头)，返回响应列表"""
+    app = FastAPI()
+    app.include_router(offers.router, prefix=settings.api_v1_prefix)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+        responses = [
+            await c.post("/api/v1/offers/bulk/claim-batch", json=body, headers=headers)
+            for body, headers in requests
+        ]
+    await dispose_async_engine()
+    return responses
+
+
+def test_claim_batch_endpoint():
+    with tempfile.TemporaryDirectory() as tmp, app_database(
+        str(Path(tmp) / "batch.db"), claim_batch_api_keys=PARTNER_KEYS,
+        claim_batch_quota_per_hour=30, claim_batch_stream_threshold=10, claim_batch_max_size=50
+    ) as AppSessionLocal:
+        db = AppSessionLocal()
+        try:
+            OfferService(db).create_offer("bulk", "批量发放")
+            CodeService(db).import_codes("bulk", [f"BULK{i:04d}" for i in range(20)])
+        finally:
+            db.close()
+
+        # 配额在导入路由时按配置创建，这里按测试的配额重新创建
+        quota = offers.claim_batch_quota
+        offers.claim_batch_quota = create_claim_batch_quota(settings)
+        try:
+            small, large, too_many, insufficient, over_quota, partial, over_refund, empty = asyncio.run(
+                call_claim_batch([
+                    ({"count": 5}, PARTNER),
+                    ({"count": 12}, PARTNER),
+                    ({"count": 51}, PARTNER),
+                    # 只剩3个，整批失败并退还配额
+                    ({"count": 10}, PARTNER),
+                    # 配额还剩13个
+                    ({"count": 14}, PARTNER),
+                    # 只领到3个，退还其余10个配额
+                    ({"count": 13, "allow_partial": True}, dict(PARTNER, Accept="application/x-ndjson")),
+                    ({"count": 11}, PARTNER),
+                    ({"count": 10}, PARTNER),
+                ])
+            )
+        finally:
+            offers.claim_batch_quota = quota
+
+    assert small.status_code == 200 and small.json()["data"]["count"] == 5
+    assert large.headers["content-type"].startswith("application/x-ndjson")
+    assert large.headers["x-claim-count"] == "12"
+    large_codes = [json.loads(line)["code"] for line in large.text.splitlines()]
+    assert len(large_codes) == 12 and not set(large_codes) & set(small.json()["data"]["codes"])
+    assert too_many.status_code == 400 and too_many.json()["detail"]["error_code"] == "INVALID_COUNT"
+    assert insufficient.json()["detail"]["error_code"] == "INSUFFICIENT_CODES", insufficient.text
+    assert over_quota.status_code == 429, over_quota.text
+    assert over_quota.json()["detail"]["error_code"] == "QUOTA_EXCEEDED"
+    assert int(over_quota.headers["retry-after"]) > 0
+    assert partial.status_code == 200 and len(partial.text.splitlines()) == 3, partial.text
+    assert over_refund.status_code == 429, over_refund.text
+    assert empty.json()["detail"]["error_code"] == "NO_CODES_AVAILABLE", empty.text
+
+
+def test_claim_batch_requires_partner_key():
+    with tempfile.TemporaryDirectory() as tmp:
+        with app_database(str(Path(tmp) / "batch.db"), claim_batch_api_keys={}) as AppSessionLocal:
+            seed_offer(AppSessionLocal, "bulk", 5)
+            disabled, = asyncio.run(call_claim_batch([({"count": 3}, PARTNER)]))
+        with app_database(str(Path(tmp) / "batch.db"), claim_batch_api_keys=PARTNER_KEYS) as AppSessionLocal:
+            missing, invalid = asyncio.run(call_claim_batch([
+                ({"count": 3}, {}),
+                ({"count": 3}, {"X-API-Key": "guess"}),
+            ]))
+            db = AppSessionLocal()
+            try:
+                remaining = db.query(Offer.remaining_count).filter(Offer.name == "bulk").scalar()
+            finally:
+                db.close()
+
+    assert disabled.status_code == 404, disabled.text
+    assert missing.status_code == 401 and missing.json()["detail"]["error_code"] == "UNAUTHORIZED"
+    assert invalid.status_code == 401
+    assert remaining == 5
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("单事务批量领取", test_claim_batch_in_one_transaction),
+        ("按数量消耗令牌", test_token_bucket_cost),
+        ("批量领取接口", test_claim_batch_endpoint),
+        ("批量领取只对合作方开放", test_claim_batch_requires_partner_key),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 批量领取测试通过！")
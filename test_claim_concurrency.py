@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+邀请码并发领取测试
+多个线程同时领取同一个offer的邀请码，验证任何邀请码都不会被重复发放
+
+使用方法:
+python test_claim_concurrency.py
+"""
+
+import asyncio
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from config.settings import settings
+from models import database
+from models.database import Base
+from models.offer import Offer
+from models.invitation_code import InvitationCode
+from models.code_reservation import CodeReservation
+from routers.offers import router as offers_router
+from services import claim_engine
+from services import claim_pool as claim_pool_module
+from services.claim_pool import ClaimPool
+from services.code_service import ClaimResult, CodeService
+from services.offer_service import OfferService
+
+CODE_COUNT = 300
+THREAD_COUNT = 16
+
+
+def make_session_factory(db_path: str):
+    """创建指向临时数据库的会话工厂"""
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False, "timeout": 30}
+    )
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@contextmanager
+def app_database(db_path: str, **overrides):
+    """让接口和main使用的应用数据库指向临时文件，并临时覆盖settings中的配置项，结束后恢复
+
+    settings和数据库引擎在第一次导入时就已创建，测试不能依赖导入前设置环境变量。
+    """
+    previous = (settings.database_url, settings.async_database_url)
+    saved = {name: getattr(settings, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    database.use_database(f"sqlite:///{db_path}")
+    try:
+        database.create_tables()
+        yield database.SessionLocal
+    finally:
+        database.use_database(*previous)
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+
+def seed_offer(SessionLocal, offer_name: str, count: int):
+    """创建offer并导入测试邀请码"""
+    db = SessionLocal()
+    try:
+        OfferService(db).create_offer(offer_name, "并发测试", "并发领取测试")
+        CodeService(db).import_codes(offer_name, [f"CODE{i:06d}" for i in range(count)])
+    finally:
+        db.close()
+
+
+def claim_concurrently(SessionLocal, offer_name: str, claim=None) -> list:
+    """多线程领取直到邀请码用完，返回所有领取到的邀请码"""
+    claimed = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(THREAD_COUNT)
+
+    def worker(index: int):
+        db = SessionLocal()
+        claim_code = claim or CodeService(db).claim_code
+        start.wait()
+        try:
+            while True:
+                try:
+                    code = claim_code(offer_name, f"10.0.0.{index}", "ConcurrencyTest/1.0")
+                except ValueError:
+                    break
+                with lock:
+                    claimed.append(code)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREAD_COUNT)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors, f"领取过程中出现错误: {errors[0]!r}"
+    return claimed
+
+
+def check_database_state(SessionLocal, offer_name: str):
+    """验证数据库中邀请码全部发放、剩余数量为0且没有遗留预留"""
+    db = SessionLocal()
+    try:
+        offer = db.query(Offer).filter(Offer.name == offer_name).first()
+        used = db.query(InvitationCode).filter(
+            InvitationCode.is_used == True,
+            InvitationCode.used_at.isnot(None)
+        ).count()
+        assert offer.remaining_count == 0, f"剩余数量应为0，实际为 {offer.remaining_count}"
+        assert used == CODE_COUNT, f"应有 {CODE_COUNT} 条发放记录，实际 {used} 条"
+        assert db.query(CodeReservation).count() == 0, "存在未释放的预留邀请码"
+    finally:
+        db.close()
+
+
+def check_no_duplicates(strategy: str = None):
+    """验证并发领取时没有邀请码被重复发放，且剩余数量同步扣减"""
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "concurrency.db"))
+        seed_offer(SessionLocal, "burst", CODE_COUNT)
+
+        original = claim_engine.select_strategy
+        if strategy:
+            claim_engine.select_strategy = lambda dialect: strategy
+        try:
+            claimed = claim_concurrently(SessionLocal, "burst")
+        finally:
+            claim_engine.select_strategy = original
+
+        assert len(claimed) == CODE_COUNT, f"应领取 {CODE_COUNT} 个，实际 {len(claimed)} 个"
+        assert len(set(claimed)) == len(claimed), "存在被重复发放的邀请码"
+        check_database_state(SessionLocal, "burst")
+
+
+def test_claim_returning_no_duplicates():
+    check_no_duplicates()
+
+
+def test_claim_select_then_update_no_duplicates():
+    check_no_duplicates(claim_engine.STRATEGY_SQLITE_LOCKED)
+
+
+def test_claim_optimistic_no_duplicates():
+    check_no_duplicates(claim_engine.STRATEGY_OPTIMISTIC)
+
+
+def test_claim_pool_no_duplicates():
+    """领取池模式下并发领取，关闭后发放记录全部回写"""
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "pool.db"))
+        seed_offer(SessionLocal, "burst", CODE_COUNT)
+
+        pool = ClaimPool(SessionLocal, block_size=40, low_watermark=10,
+                         flush_interval_ms=20, journal_dir=str(Path(tmp) / "journal"))
+        pool.start()
+        try:
+            claimed = claim_concurrently(SessionLocal, "burst", claim=pool.claim)
+        finally:
+            pool.stop()
+
+        assert len(claimed) == CODE_COUNT, f"应领取 {CODE_COUNT} 个，实际 {len(claimed)} 个"
+        assert len(set(claimed)) == len(claimed), "存在被重复发放的邀请码"
+        check_database_state(SessionLocal, "burst")
+
+
+def test_claim_pool_crash_recovery():
+    """进程崩溃后，新进程回放日志并释放遗留预留，不会重复发放"""
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "pool.db"))
+        seed_offer(SessionLocal, "burst", CODE_COUNT)
+        journal_dir = str(Path(tmp) / "journal")
+
+        # 用一个已退出进程的进程号模拟崩溃的工作进程：发放后从不回写
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        crashed = ClaimPool(SessionLocal, block_size=50, low_watermark=0,
+                            flush_interval_ms=10 ** 7, flush_batch_size=10 ** 6,
+                            journal_dir=journal_dir)
+        host, _, nonce = crashed.worker_id.split(":")
+        crashed.worker_id = f"{host}:{dead.pid}:{nonce}"
+        crashed.start()
+        before_crash = [crashed.claim("burst") for _ in range(10)]
+
+        pool = ClaimPool(SessionLocal, block_size=40, low_watermark=10,
+                         flush_interval_ms=20, journal_dir=journal_dir)
+        pool.start()
+        try:
+            claimed = claim_concurrently(SessionLocal, "burst", claim=pool.claim)
+        finally:
+            pool.stop()
+
+        all_claimed = before_crash + claimed
+        assert len(set(all_claimed)) == len(all_claimed), "崩溃恢复后存在被重复发放的邀请码"
+        assert len(all_claimed) == CODE_COUNT, f"应领取 {CODE_COUNT} 个，实际 {len(all_claimed)} 个"
+        check_database_state(SessionLocal, "burst")
+
+
+def test_claim_pool_recovers_same_pid():
+    """容器重启后新进程号与崩溃前相同：按启动标识区分，仍能回放上一个进程的日志"""
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "pool.db"))
+        seed_offer(SessionLocal, "burst", CODE_COUNT)
+        journal_dir = str(Path(tmp) / "journal")
+
+        # 上一次启动的进程：进程号与当前进程相同，启动标识不同
+        crashed = ClaimPool(SessionLocal, block_size=50, low_watermark=0,
+                            flush_interval_ms=10 ** 7, flush_batch_size=10 ** 6,
+                            journal_dir=journal_dir)
+        host, pid, _ = crashed.worker_id.split(":")
+        crashed.worker_id = f"{host}:{pid}:previous"
+        crashed.start()
+        before_crash = [crashed.claim("burst") for _ in range(10)]
+        journals = sorted(p.name for p in Path(journal_dir).glob("*.journal"))
+        assert journals and all(name.startswith(f"{pid}.previous.") for name in journals), f"日志文件名不含启动标识: {journals}"
+
+        pool = ClaimPool(SessionLocal, block_size=40, low_watermark=10,
+                         flush_interval_ms=20, journal_dir=journal_dir)
+        assert pool.worker_id.split(":")[1] == pid
+        pool.start()
+        try:
+            assert not any(Path(journal_dir, name).exists() for name in journals), "上一个进程的日志未被回放"
+            with SessionLocal() as db:
+                issued = db.query(InvitationCode).filter(InvitationCode.used_at.isnot(None)).count()
+                leftover = db.query(CodeReservation).filter(CodeReservation.worker_id == crashed.worker_id).count()
+            assert issued == 10, f"应补写 10 条发放记录，实际 {issued} 条"
+            assert leftover == 0, f"上一个进程仍遗留 {leftover} 个预留码"
+            claimed = claim_concurrently(SessionLocal, "burst", claim=pool.claim)
+        finally:
+            pool.stop()
+
+        all_claimed = before_crash + claimed
+        assert len(set(all_claimed)) == len(all_claimed), "恢复后存在被重复发放的邀请码"
+        assert len(all_claimed) == CODE_COUNT, f"应领取 {CODE_COUNT} 个，实际 {len(all_claimed)} 个"
+        check_database_state(SessionLocal, "burst")
+
+
+def test_claim_pool_releases_expired_reservations():
+    """其他主机上的进程退出后不会重启：预留到期后由任意进程放回，持有进程续约时丢弃被回收的预留"""
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "pool.db"))
+        seed_offer(SessionLocal, "burst", CODE_COUNT)
+
+        # 另一台主机上的进程：发放并回写后崩溃，遗留未发放的预留
+        gone = ClaimPool(SessionLocal, block_size=50, low_watermark=0, flush_interval_ms=10 ** 7,
+                         journal_dir=str(Path(tmp) / "gone"), reservation_seconds=0.5)
+        gone.worker_id = "far-host:4242:gone"
+        gone.start()
+        before_crash = [gone.claim("burst") for _ in range(10)]
+        assert gone.flush()
+        gone._stopping.set()
+        gone._wake.set()
+        gone._thread.join()
+        gone._journal.close()
+
+        # 仍在运行的进程，续约间隔很长，用于模拟续约超时
+        slow = ClaimPool(SessionLocal, block_size=50, low_watermark=0, flush_interval_ms=20,
+                         journal_dir=str(Path(tmp) / "slow"), reservation_seconds=60)
+        pool = ClaimPool(SessionLocal, block_size=40, low_watermark=10, flush_interval_ms=20,
+                         journal_dir=str(Path(tmp) / "journal"), reservation_seconds=0.5)
+        pool.start()
+        try:
+            slow.start()
+            try:
+                slow_claimed = [slow.claim("burst") for _ in range(5)]
+                # 后台线程在到期后回收崩溃进程的预留，仍在续约的预留不受影响
+                deadline = time.monotonic() + 5
+                while time.monotonic() < deadline:
+                    with SessionLocal() as db:
+                        leftover = db.query(CodeReservation).filter(
+                            CodeReservation.worker_id == gone.worker_id
+                        ).count()
+                    if not leftover:
+                        break
+                    time.sleep(0.05)
+                assert leftover == 0, f"崩溃进程仍遗留 {leftover} 个预留码"
+                with SessionLocal() as db:
+                    assert db.query(CodeReservation).filter(CodeReservation.worker_id == slow.worker_id).count() == 45
+
+                # slow 的预留到期被回收后，续约时从队列中丢弃，之后重新预留
+                with SessionLocal() as db:
+                    db.query(CodeReservation).filter(CodeReservation.worker_id == slow.worker_id).update(
+                        {"expires_at": datetime.now() - timedelta(seconds=1)}
+                    )
+                    db.commit()
+                assert pool.release_expired() == 45
+                slow.renew()
+                assert slow.queued_counts() == {("burst",): 0}
+                slow_claimed.append(slow.claim("burst"))
+            finally:
+                slow.stop()
+
+            claimed = claim_concurrently(SessionLocal, "burst", claim=pool.claim)
+        finally:
+            pool.stop()
+
+        all_claimed = before_crash + slow_claimed + claimed
+        assert len(set(all_claimed)) == len(all_claimed), "回收预留后存在被重复发放的邀请码"
+        assert len(all_claimed) == CODE_COUNT, f"应领取 {CODE_COUNT} 个，实际 {len(all_claimed)} 个"
+        check_database_state(SessionLocal, "burst")
+
+
+class SlowClaimPool:
+    """每次领取都像补充预留那样在同步调用中阻塞一段时间"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.count = 0
+
+    def claim(self, offer_name, user_ip=None, user_agent=None):
+        time.sleep(self.delay)
+        self.count += 1
+        return f"SLOW{self.count:04d}"
+
+    def claim_once(self, offer_name, client_key, user_ip=None, user_agent=None):
+        return ClaimResult(self.claim(offer_name, user_ip, user_agent), False)
+
+
+def test_claim_endpoint_does_not_block_on_pool():
+    """领取池的同步调用在线程池中执行：一个请求等待补充时，其他请求照常处理"""
+    app = FastAPI()
+    app.include_router(offers_router, prefix=settings.api_v1_prefix)
+    delay = 0.3
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                c.post("/api/v1/offers/burst/claim", json={"client_token": f"client-{i}"}) for i in range(4)
+            ])
+            return responses, time.perf_counter() - start
+
+    original = claim_pool_module._claim_pool
+    claim_pool_module._claim_pool = SlowClaimPool(delay)
+    try:
+        for dedup in (True, False):
+            with app_database(":memory:", claim_dedup_enabled=dedup, claim_dedup_key="token"):
+                responses, elapsed = asyncio.run(run())
+            assert all(r.status_code == 200 for r in responses), [r.text for r in responses]
+            assert len({r.json()["data"]["code"] for r in responses}) == 4
+            assert elapsed < 4 * delay * 0.75, f"领取池调用阻塞了事件循环: 4个请求用时 {elapsed:.2f}s"
+    finally:
+        claim_pool_module._claim_pool = original
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("UPDATE ... RETURNING", test_claim_returning_no_duplicates),
+        ("SELECT + UPDATE", test_claim_select_then_update_no_duplicates),
+        ("乐观更新", test_claim_optimistic_no_duplicates),
+        ("领取池", test_claim_pool_no_duplicates),
+        ("领取池崩溃恢复", test_claim_pool_crash_recovery),
+        ("领取池同进程号恢复", test_claim_pool_recovers_same_pid),
+        ("领取池回收到期预留", test_claim_pool_releases_expired_reservations),
+        ("领取池不阻塞事件循环", test_claim_endpoint_does_not_block_on_pool),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}: {THREAD_COUNT} 个线程领取 {CODE_COUNT} 个邀请码，无重复")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 并发领取测试通过！")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+防重复申请测试
+1. 布隆过滤器没有漏判，误判率接近设定值
+2. 同一客户端重复申请返回同一个邀请码，剩余数量只扣减一次
+3. 同一客户端并发申请（过滤器判定"一定没有领取过"时依赖主键冲突兜底）只发放一个邀请码
+4. 领取池模式下同一客户端只发放一个邀请码，身份随发放记录回写数据库
+5. 默认配置下按连接IP识别客户端，同一IP换用不同的client_token也不能再领取新的邀请码
+
+使用方法:
+python test_claim_dedup.py
+"""
+
+import asyncio
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import httpx
+from fastapi import FastAPI
+
+from config.settings import Settings, settings
+from models.claimer_identity import ClaimerIdentity
+from models.database import dispose_async_engine
+from models.offer import Offer
+from services.claim_pool import ClaimPool
+from services.claimer_registry import BloomFilter, claimer_registry, make_client_key
+from services.code_service import CodeService
+from routers.offers import router as offers_router
+from test_claim_concurrency import app_database, make_session_factory, seed_offer
+
+THREAD_COUNT = 16
+
+
+def claim_same_client_concurrently(claim) -> list:
+    """多个线程以同一客户端身份同时申请，返回 (邀请码, 是否重复) 列表"""
+    results = []
+    lock = threading.Lock()
+    start = threading.Barrier(THREAD_COUNT)
+
+    def worker():
+        start.wait()
+        result = claim()
+        with lock:
+            results.append(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREAD_COUNT)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def remaining_count(SessionLocal, offer_name: str) -> int:
+    db = SessionLocal()
+    try:
+        return db.query(Offer).filter(Offer.name == offer_name).first().remaining_count
+    finally:
+        db.close()
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add(f"member-{i}")
+    assert all(f"member-{i}" in bloom for i in range(10000)), "布隆过滤器不应漏判"
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300, f"误判过多: {false_positives}"
+
+
+def test_repeat_claim_returns_same_code():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "dedup.db"))
+        seed_offer(SessionLocal, "once", 10)
+        alice = make_client_key("10.0.0.1")
+        bob = make_client_key("10.0.0.2")
+
+        db = SessionLocal()
+        try:
+            first = CodeService(db).claim_once("once", alice, "10.0.0.1")
+            again = CodeService(db).claim_once("once", alice, "10.0.0.1")
+            other = CodeService(db).claim_once("once", bob, "10.0.0.2")
+        finally:
+            db.close()
+
+        assert not first.reused and again.reused, (first, again)
+        assert again.code == first.code
+        assert other.code != first.code and not other.reused
+        assert remaining_count(SessionLocal, "once") == 8
+
+
+def test_concurrent_claims_from_same_client():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "dedup.db"))
+        seed_offer(SessionLocal, "race", 50)
+        db = SessionLocal()
+        try:
+            # 加载空的过滤器，所有线程都会先判定为"一定没有领取过"
+            claimer_registry.load(db)
+        finally:
+            db.close()
+
+        key = make_client_key("10.0.0.9")
+
+        def claim():
+            db = SessionLocal()
+            try:
+                return CodeService(db).claim_once("race", key, "10.0.0.9")
+            finally:
+                db.close()
+
+        results = claim_same_client_concurrently(claim)
+        codes = {result.code for result in results}
+        assert len(codes) == 1, f"同一客户端领取到了 {len(codes)} 个邀请码"
+        assert sum(not result.reused for result in results) == 1
+        assert remaining_count(SessionLocal, "race") == 49
+
+
+def test_claim_pool_dedup():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "dedup.db"))
+        seed_offer(SessionLocal, "pooled", 50)
+        pool = ClaimPool(SessionLocal, block_size=20, low_watermark=5,
+                         flush_interval_ms=20, journal_dir=str(Path(tmp) / "journal"))
+        pool.start()
+        key = make_client_key("10.0.0.7")
+        try:
+            results = claim_same_client_concurrently(
+                lambda: pool.claim_once("pooled", key, "10.0.0.7", "DedupTest/1.0")
+            )
+        finally:
+            pool.stop()
+
+        codes = {result.code for result in results}
+        assert len(codes) == 1, f"同一客户端领取到了 {len(codes)} 个邀请码"
+        assert remaining_count(SessionLocal, "pooled") == 49
+
+        db = SessionLocal()
+        try:
+            assert db.query(ClaimerIdentity).count() == 1
+            # 回写后，直接领取路径也能识别该客户端
+            again = CodeService(db).claim_once("pooled", key, "10.0.0.7")
+        finally:
+            db.close()
+        assert again.reused and again.code in codes
+
+
+def test_default_ignores_client_token():
+    assert Settings().claim_dedup_key == "ip", "默认应按连接IP识别客户端"
+    app = FastAPI()
+    app.include_router(offers_router, prefix=settings.api_v1_prefix)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+            responses = [
+                await c.post("/api/v1/offers/token/claim", json={"client_token": token})
+                for token in ("token-a", "token-b", "token-c")
+            ]
+        await dispose_async_engine()
+        return responses
+
+    with tempfile.TemporaryDirectory() as tmp, app_database(
+        str(Path(tmp) / "dedup.db"), claim_dedup_enabled=True, claim_dedup_key=Settings().claim_dedup_key
+    ) as SessionLocal:
+        seed_offer(SessionLocal, "token", 10)
+        responses = asyncio.run(run())
+        remaining = remaining_count(SessionLocal, "token")
+
+    assert all(r.status_code == 200 for r in responses), [r.text for r in responses]
+    codes = {r.json()["data"]["code"] for r in responses}
+    assert len(codes) == 1, f"同一IP换用令牌领取到了 {len(codes)} 个邀请码"
+    assert remaining == 9
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("布隆过滤器", test_bloom_filter),
+        ("重复申请返回同一邀请码", test_repeat_claim_returns_same_code),
+        ("同一客户端并发申请", test_concurrent_claims_from_same_client),
+        ("领取池防重复", test_claim_pool_dedup),
+        ("默认配置不信任客户端令牌", test_default_ignores_client_token),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 防重复申请测试通过！")
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+两阶段领取（租约）测试
+1. 领取后邀请码进入租约，确认后才算发放；offer的剩余/租约中计数同步增减
+2. 过期租约按批回收：邀请码放回、领取者身份删除，未过期的租约不受影响；回收查询走expires_at索引
+3. 租约过期后不能再确认，令牌只能确认一次
+4. 领取、确认、放弃和回收并发进行时邀请码不重复发放，计数与实际数量一致
+5. 迁移为已有的offers表增加 leased_count；开启租约模式时的领取和确认接口
+
+使用方法:
+python test_claim_leases.py
+"""
+
+import asyncio
+import itertools
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, inspect, text
+
+from config.settings import settings
+from models.claimer_identity import ClaimerIdentity
+from models.code_lease import CodeLease
+from models.database import dispose_async_engine
+from models.invitation_code import InvitationCode
+from models.migrations import run_migrations, schema_migrations
+from models.offer import Offer
+from routers.offers import router as offers_router
+from services.claimer_registry import make_client_key
+from services.code_service import CodeService
+from services.lease_reaper import count_expired_leases, release_expired_leases
+from services.offer_reconciler import find_drift
+from services.offer_service import OfferService
+from test_claim_concurrency import CODE_COUNT, app_database, claim_concurrently, make_session_factory, seed_offer
+
+
+def offer_counts(db, offer_name: str):
+    offer = db.query(Offer).filter(Offer.name == offer_name).first()
+    db.refresh(offer)
+    return offer.remaining_count, offer.leased_count
+
+
+def test_lease_then_confirm():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "lease.db"))
+        seed_offer(SessionLocal, "lease", 10)
+        db = SessionLocal()
+        try:
+            service = CodeService(db)
+            first = service.lease_code("lease", 60, "10.0.0.1", "LeaseTest/1.0")
+            second = service.lease_code("lease", 60, "10.0.0.2")
+            assert not first.reused and first.lease_token and first.lease_expires_at > datetime.now()
+            assert offer_counts(db, "lease") == (8, 2)
+
+            code = db.query(InvitationCode).filter(InvitationCode.code == first.code).one()
+            assert code.is_used and code.used_at is None
+
+            assert service.confirm_lease("lease", first.lease_token) == first.code
+            db.refresh(code)
+            assert code.used_at is not None
+            assert offer_counts(db, "lease") == (8, 1)
+            stats = OfferService(db).get_offer_stats("lease")
+            assert (stats["used_codes"], stats["remaining_codes"], stats["leased_codes"]) == (1, 8, 1)
+
+            for offer_name, token in [("lease", first.lease_token), ("other", second.lease_token), ("lease", "x")]:
+                try:
+                    service.confirm_lease(offer_name, token)
+                    assert False, "应拒绝无效的租约"
+                except ValueError:
+                    pass
+            assert not find_drift(db)
+        finally:
+            db.close()
+
+
+def test_reaper_releases_expired_leases():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "reap.db"))
+        seed_offer(SessionLocal, "reap", 40)
+        db = SessionLocal()
+        try:
+            service = CodeService(db)
+            key = make_client_key("10.1.0.1")
+            abandoned = service.lease_code("reap", 60, "10.1.0.1", client_key=key)
+            assert service.lease_code("reap", 60, "10.1.0.1", client_key=key) == (abandoned.code, True, None, None)
+            for i in range(24):
+                service.lease_code("reap", 60, f"10.1.1.{i}")
+            kept = [service.lease_code("reap", 600, f"10.1.2.{i}") for i in range(3)]
+            assert offer_counts(db, "reap") == (12, 28)
+
+            # 回收查询只读取expires_at索引中已过期的部分
+            plan = " ".join(str(row[-1]) for row in db.execute(text(
+                "EXPLAIN QUERY PLAN SELECT code_id FROM code_leases WHERE expires_at < :now ORDER BY expires_at LIMIT 10"
+            ), {"now": datetime.now()}))
+            assert "ix_code_leases_expires_at" in plan, plan
+
+            later = datetime.now() + timedelta(seconds=120)
+            assert count_expired_leases(db, later) == 25
+            assert release_expired_leases(db, now=later, batch_size=10) == 25
+            assert offer_counts(db, "reap") == (37, 3)
+            assert db.query(CodeLease).count() == 3
+            assert db.query(ClaimerIdentity).count() == 0
+            assert not find_drift(db)
+
+            # 过期后令牌失效，领取者可以重新领取；未过期的租约仍可确认
+            try:
+                service.confirm_lease("reap", abandoned.lease_token)
+                assert False, "已回收的租约不能确认"
+            except ValueError:
+                pass
+            again = service.lease_code("reap", 60, "10.1.0.1", client_key=key)
+            assert not again.reused
+            assert service.confirm_lease("reap", kept[0].lease_token) == kept[0].code
+        finally:
+            db.close()
+
+
+def test_expired_lease_cannot_be_confirmed():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "expired.db"))
+        seed_offer(SessionLocal, "expired", 3)
+        db = SessionLocal()
+        try:
+            leased = CodeService(db).lease_code("expired", -1)
+            try:
+                CodeService(db).confirm_lease("expired", leased.lease_token)
+                assert False, "过期的租约不能确认"
+            except ValueError:
+                pass
+            assert offer_counts(db, "expired") == (2, 1)
+            assert release_expired_leases(db) == 1
+            assert offer_counts(db, "expired") == (3, 0)
+        finally:
+            db.close()
+
+
+def test_concurrent_lease_confirm_and_reap():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "busy.db"))
+        seed_offer(SessionLocal, "busy", CODE_COUNT)
+        counter = itertools.count()
+
+        def lease_and_maybe_confirm(offer_name, user_ip, user_agent):
+            db = SessionLocal()
+            try:
+                service = CodeService(db)
+                # 每3次领取放弃一次（租约立即过期），其余立即确认
+                if next(counter) % 3 == 0:
+                    service.lease_code(offer_name, -1, user_ip, user_agent)
+                    return None
+                leased = service.lease_code(offer_name, 60, user_ip, user_agent)
+                return service.confirm_lease(offer_name, leased.lease_token)
+            finally:
+                db.close()
+
+        stop = threading.Event()
+        released = []
+
+        def reap_loop():
+            db = SessionLocal()
+            try:
+                while not stop.is_set():
+                    released.append(release_expired_leases(db, batch_size=7))
+            finally:
+                db.close()
+
+        reaper = threading.Thread(target=reap_loop)
+        reaper.start()
+        try:
+            confirmed = [code for code in claim_concurrently(SessionLocal, "busy", lease_and_maybe_confirm) if code]
+        finally:
+            stop.set()
+            reaper.join()
+
+        db = SessionLocal()
+        try:
+            release_expired_leases(db)
+            assert sum(released) > 0
+            assert len(confirmed) == len(set(confirmed)), "同一个邀请码被确认了多次"
+            issued = db.query(InvitationCode).filter(InvitationCode.used_at.isnot(None)).count()
+            free = db.query(InvitationCode).filter(InvitationCode.is_used == False).count()
+            assert issued == len(confirmed) and issued + free == CODE_COUNT
+            assert offer_counts(db, "busy") == (free, 0)
+            assert not find_drift(db)
+        finally:
+            db.close()
+
+
+def test_migration_adds_leased_count():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'migrate.db'}")
+        SessionLocal = make_session_factory(str(Path(tmp) / "migrate.db"))
+        seed_offer(SessionLocal, "old", 5)
+        run_migrations(engine)
+        # 模拟升级前的数据库
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE code_leases")
+            conn.exec_driver_sql("ALTER TABLE offers DROP COLUMN leased_count")
+            conn.execute(schema_migrations.delete().where(schema_migrations.c.version == "0004_code_leases"))
+
+        assert run_migrations(engine) == ["0004_code_leases"]
+        assert "leased_count" in {c["name"] for c in inspect(engine).get_columns("offers")}
+        assert inspect(engine).has_table("code_leases")
+        db = SessionLocal()
+        try:
+            assert offer_counts(db, "old") == (5, 0)
+            assert CodeService(db).lease_code("old", 60).code
+        finally:
+            db.close()
+
+
+def test_lease_endpoints():
+    app = FastAPI()
+    app.include_router(offers_router, prefix=settings.api_v1_prefix)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+            claimed = await c.post("/api/v1/offers/api/claim")
+            again = await c.post("/api/v1/offers/api/claim")
+            token = claimed.json()["data"]["lease_token"]
+            confirmed = await c.post("/api/v1/offers/api/claim/confirm", json={"lease_token": token})
+            twice = await c.post("/api/v1/offers/api/claim/confirm", json={"lease_token": token})
+            stats = await c.get("/api/v1/offers/api/stats")
+        await dispose_async_engine()
+        return claimed, again, confirmed, twice, stats
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            app_database(str(Path(tmp) / "leases.db"), claim_lease_enabled=True) as AppSessionLocal:
+        db = AppSessionLocal()
+        try:
+            OfferService(db).create_offer("api", "租约接口")
+            CodeService(db).import_codes("api", [f"LEASE{i:04d}" for i in range(5)])
+        finally:
+            db.close()
+        claimed, again, confirmed, twice, stats = asyncio.run(run())
+
+    assert claimed.status_code == 200, claimed.text
+    data = claimed.json()["data"]
+    assert data["code"].startswith("LEASE") and data["lease_expires_at"]
+    # 同一IP重复领取返回租约中的邀请码，不产生新的租约
+    assert again.json()["data"]["code"] == data["code"] and again.json()["data"]["lease_token"] is None
+    assert confirmed.status_code == 200 and confirmed.json()["data"]["code"] == data["code"]
+    assert twice.status_code == 400 and twice.json()["detail"]["error_code"] == "LEASE_NOT_FOUND"
+    assert stats.json()["data"]["leased_codes"] == 0 and stats.json()["data"]["used_codes"] == 1
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("租约领取与确认", test_lease_then_confirm),
+        ("回收过期租约", test_reaper_releases_expired_leases),
+        ("过期租约不能确认", test_expired_lease_cannot_be_confirmed),
+        ("并发领取、确认与回收", test_concurrent_lease_confirm_and_reap),
+        ("迁移增加租约计数", test_migration_adds_leased_count),
+        ("租约模式接口", test_lease_endpoints),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 两阶段领取测试通过！")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+多进程分区领取测试
+1. 两个工作进程租用互不重叠的分区，只在各自的分区内领取
+2. 分区领完后删除租约并租用下一个分区；所有分区都被占用时在整个offer中领取
+3. 已退出进程的租约到期后被其他进程接管，续约时丢弃已被接管的租约
+4. 并发领取时邀请码不重复、全部发放
+5. 接口领取（AsyncSession.run_sync）通过当前会话租用和删除分区租约，不另开同步会话
+
+使用方法:
+python test_claim_partitions.py
+"""
+
+import asyncio
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from models.code_partition import CodePartitionLease
+from services import claim_partitions
+from services.claim_engine import ClaimEngine
+from services.claim_partitions import ClaimPartitions
+from services.async_code_service import AsyncCodeService
+from services.code_service import CodeService
+from test_claim_concurrency import CODE_COUNT, check_database_state, claim_concurrently, make_session_factory, seed_offer
+
+
+def claim_id(SessionLocal, partitions: ClaimPartitions, offer_name: str):
+    """通过分区领取一个邀请码，返回邀请码id（没有可用邀请码时为None）"""
+    db = SessionLocal()
+    try:
+        claimed = partitions.claim(offer_name, lambda id_range: ClaimEngine(db).claim(offer_name, id_range=id_range))
+        return claimed.id if claimed else None
+    finally:
+        db.close()
+
+
+def leases(SessionLocal):
+    db = SessionLocal()
+    try:
+        return sorted((row.block, row.worker_id) for row in db.query(CodePartitionLease))
+    finally:
+        db.close()
+
+
+def test_disjoint_partitions_and_rebalance():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "partitions.db"))
+        # 邀请码id为1~25，分区大小10: 分区0为id 1~9，分区1为10~19，分区2为20~25
+        seed_offer(SessionLocal, "split", 25)
+        a = ClaimPartitions(SessionLocal, "host:1", partition_size=10)
+        b = ClaimPartitions(SessionLocal, "host:2", partition_size=10)
+
+        first_a = [claim_id(SessionLocal, a, "split") for _ in range(3)]
+        first_b = [claim_id(SessionLocal, b, "split") for _ in range(3)]
+        assert all(1 <= i < 10 for i in first_a), first_a
+        assert all(10 <= i < 20 for i in first_b), first_b
+        assert leases(SessionLocal) == [(0, "host:1"), (1, "host:2")]
+
+        # a领完分区0后租用分区2（分区1由b持有）
+        rest_a = [claim_id(SessionLocal, a, "split") for _ in range(7)]
+        assert all(1 <= i < 10 for i in rest_a[:6]) and 20 <= rest_a[6] < 30, rest_a
+        assert leases(SessionLocal) == [(1, "host:2"), (2, "host:1")]
+        assert a.drained == 1
+
+        # 分区2领完且分区1被b持有时，在整个offer中领取
+        more_a = [claim_id(SessionLocal, a, "split") for _ in range(8)]
+        assert all(20 <= i < 30 for i in more_a[:5]) and 10 <= more_a[5] < 20, more_a
+        assert a.fallbacks >= 1
+
+        a.stop()
+        b.stop()
+        assert leases(SessionLocal) == []
+
+
+def test_dead_lease_taken_over():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "partitions.db"))
+        seed_offer(SessionLocal, "takeover", 15)
+        dead = ClaimPartitions(SessionLocal, "host:dead", partition_size=10)
+        alive = ClaimPartitions(SessionLocal, "host:alive", partition_size=10)
+        assert claim_id(SessionLocal, dead, "takeover") < 10
+        assert 10 <= claim_id(SessionLocal, alive, "takeover") < 20
+
+        # 分区1领完后，dead的租约仍有效时不能接管分区0，只能在整个offer中领取
+        for _ in range(5):
+            assert 10 <= claim_id(SessionLocal, alive, "takeover") < 20
+        assert claim_id(SessionLocal, alive, "takeover") < 10
+        assert alive.stats()["leases"] == 0 and alive.fallbacks == 1
+
+        # dead进程退出，租约过期后被接管
+        db = SessionLocal()
+        try:
+            db.query(CodePartitionLease).filter(CodePartitionLease.worker_id == "host:dead").update(
+                {"expires_at": datetime.now() - timedelta(seconds=1)}
+            )
+            db.commit()
+        finally:
+            db.close()
+        assert claim_id(SessionLocal, alive, "takeover") < 10
+        assert leases(SessionLocal) == [(0, "host:alive")]
+
+        # dead恢复后续约时发现租约已被接管，下次领取重新租用
+        dead.renew()
+        assert dead.stats()["leases"] == 0
+
+
+def test_concurrent_claims_with_partitions():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "partitions.db"))
+        seed_offer(SessionLocal, "busy", CODE_COUNT)
+        claim_partitions._partitions = ClaimPartitions(SessionLocal, "host:1", partition_size=37)
+
+        def claim_code(*args):
+            db = SessionLocal()
+            try:
+                return CodeService(db).claim_code(*args)
+            finally:
+                db.close()
+
+        try:
+            claimed = claim_concurrently(SessionLocal, "busy", claim_code)
+            assert claim_partitions._partitions.acquired > 1
+        finally:
+            claim_partitions._partitions.stop()
+            claim_partitions._partitions = None
+        assert len(claimed) == len(set(claimed)) == CODE_COUNT
+        check_database_state(SessionLocal, "busy")
+
+
+def test_partition_leases_use_callers_session():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "partitions.db"
+        SessionLocal = make_session_factory(str(db_path))
+        seed_offer(SessionLocal, "async", 25)
+
+        def no_new_session():
+            raise AssertionError("接口领取时另开了同步会话")
+
+        partitions = ClaimPartitions(no_new_session, "host:1", partition_size=10)
+        claim_partitions._partitions = partitions
+
+        async def run():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+            try:
+                async with AsyncSession(engine, expire_on_commit=False) as db:
+                    return [await AsyncCodeService(db).claim_code("async") for _ in range(12)]
+            finally:
+                await engine.dispose()
+
+        try:
+            claimed = asyncio.run(run())
+        finally:
+            claim_partitions._partitions = None
+
+        # 分区0（id 1~9）领完后删除租约，租用分区1
+        assert len(set(claimed)) == 12
+        assert partitions.acquired == 2 and partitions.drained == 1 and partitions.fallbacks == 0
+        assert leases(SessionLocal) == [(1, "host:1")]
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("分区互不重叠与再平衡", test_disjoint_partitions_and_rebalance),
+        ("接管已退出进程的租约", test_dead_lease_taken_over),
+        ("并发分区领取", test_concurrent_claims_with_partitions),
+        ("接口领取使用当前会话", test_partition_leases_use_callers_session),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 分区领取测试通过！")
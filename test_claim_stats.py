@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+领取统计测试
+1. 时间分桶：按分钟/小时累计，过期槽位复用时清零，窗口外的旧数据被忽略
+2. 最近领取记录为固定长度的环形缓冲区，新记录在前
+3. 从 claim_events 预热：时间窗口内的事件计入分桶，窗口外只用于补充最近记录
+4. 预热后 /stats 的最近记录和领取曲线来自内存
+5. 未预热（多进程部署）时 /stats 的领取曲线读取共享的 claim_counts 计数，包含其他进程的领取；
+   超出时间窗口的计数被清理，迁移按审计事件回填计数
+
+使用方法:
+python test_claim_stats.py
+"""
+
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from models.claim_event import ClaimCount, ClaimEvent
+from models.migrations import _claim_counts
+from models.offer import Offer
+from services.claim_audit import ClaimAuditEvent, insert_claim_events
+from services.claim_stats import HOUR_BUCKETS, ClaimStats, TimeBuckets, claim_stats, prune_claim_counts
+from services.code_service import CodeService
+from services.offer_service import OfferService
+from test_claim_concurrency import make_session_factory, seed_offer
+
+
+def test_time_buckets():
+    buckets = TimeBuckets(60, 5)
+    base = 1_000_000 * 60.0
+    buckets.add(base)
+    buckets.add(base + 30)
+    buckets.add(base + 61)
+    series = buckets.series(base + 61)
+    assert [b["count"] for b in series] == [0, 0, 0, 2, 1]
+    assert series[-1]["start"] == datetime.fromtimestamp(base + 60)
+
+    # 5分钟后同一槽位被复用，旧计数清零
+    buckets.add(base + 5 * 60)
+    assert [b["count"] for b in buckets.series(base + 5 * 60)] == [1, 0, 0, 0, 1]
+    # 比槽位现有数据更旧的时间已超出窗口
+    buckets.add(base)
+    assert [b["count"] for b in buckets.series(base + 5 * 60)] == [1, 0, 0, 0, 1]
+
+
+def test_recent_ring_buffer():
+    stats = ClaimStats(recent_size=3)
+    now = datetime.now()
+    for i in range(5):
+        # 只使用过去的时间，最多跨越当前和上一分钟两个桶
+        stats.record(1, f"CODE{i:06d}", now - timedelta(seconds=4 - i), f"10.0.0.{i}")
+    recent = stats.recent_claims(1)
+    assert [r["user_ip"] for r in recent] == ["10.0.0.4", "10.0.0.3", "10.0.0.2"]
+    assert recent[0]["code"] == "***000004"
+    assert stats.series(1)["claims_per_minute"][-1]["count"] + \
+        stats.series(1)["claims_per_minute"][-2]["count"] == 5
+    assert stats.recent_claims(2) == []
+
+
+def test_warm_up_from_claim_events():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "stats.db"))
+        seed_offer(SessionLocal, "active", 20)
+        db = SessionLocal()
+        try:
+            OfferService(db).create_offer("quiet", "很久没有领取")
+            CodeService(db).import_codes("quiet", [f"QUIET{i}" for i in range(5)])
+            for i in range(2):
+                CodeService(db).claim_code("quiet", f"10.2.0.{i}")
+            # quiet的领取发生在3天前，超出小时分桶的窗口
+            quiet_id = db.query(Offer.id).filter(Offer.name == "quiet").scalar()
+            db.query(ClaimEvent).filter(ClaimEvent.offer_id == quiet_id).update(
+                {"claimed_at": datetime.now() - timedelta(days=3)}
+            )
+            db.commit()
+            for i in range(4):
+                CodeService(db).claim_code("active", f"10.1.0.{i}")
+            active_id = db.query(Offer.id).filter(Offer.name == "active").scalar()
+        finally:
+            db.close()
+
+        stats = ClaimStats(recent_size=3)
+        db = SessionLocal()
+        try:
+            loaded = stats.load(db)
+        finally:
+            db.close()
+
+        assert loaded == 4, f"时间窗口内应读取4条事件，实际{loaded}条"
+        assert [r["user_ip"] for r in stats.recent_claims(active_id)] == ["10.1.0.3", "10.1.0.2", "10.1.0.1"]
+        assert [r["user_ip"] for r in stats.recent_claims(quiet_id)] == ["10.2.0.1", "10.2.0.0"]
+        assert sum(b["count"] for b in stats.series(active_id)["claims_per_hour"]) == 4
+        assert sum(b["count"] for b in stats.series(quiet_id)["claims_per_hour"]) == 0
+
+
+def test_offer_stats_served_from_memory():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "stats.db"))
+        seed_offer(SessionLocal, "live", 10)
+        db = SessionLocal()
+        try:
+            claim_stats.load(db)
+            for i in range(3):
+                CodeService(db).claim_code("live", f"10.3.0.{i}")
+            # 审计事件被删除后，最近记录仍来自内存
+            db.query(ClaimEvent).delete()
+            db.commit()
+            stats = OfferService(db).get_offer_stats("live")
+        finally:
+            claim_stats.clear()
+            db.close()
+
+        assert [r["user_ip"] for r in stats["recent_claims"]] == ["10.3.0.2", "10.3.0.1", "10.3.0.0"]
+        assert len(stats["claims_per_minute"]) == 60 and len(stats["claims_per_hour"]) == 48
+        assert sum(b["count"] for b in stats["claims_per_minute"]) == 3
+
+
+def test_offer_stats_from_db_when_not_loaded():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "stats.db"))
+        seed_offer(SessionLocal, "shared", 10)
+        db = SessionLocal()
+        try:
+            for i in range(3):
+                CodeService(db).claim_code("shared", f"10.4.0.{i}")
+            # 其他进程3小时前的领取（延迟回写），写入审计事件时同时累加计数
+            offer_id = db.query(Offer.id).filter(Offer.name == "shared").scalar()
+            code_id = db.query(ClaimEvent.code_id).first()[0]
+            insert_claim_events(db, [ClaimAuditEvent(code_id, offer_id, datetime.now() - timedelta(hours=3),
+                                                     "10.5.0.1", None)])
+            db.commit()
+            # 本进程内存中没有这些领取
+            claim_stats.clear()
+            stats = OfferService(db).get_offer_stats("shared")
+
+            # 领取曲线来自计数表，不读取审计事件
+            db.query(ClaimEvent).delete()
+            db.commit()
+            series = claim_stats.series_from_db(db, offer_id)
+            # 3小时前的那条只有分钟分桶超出了时间窗口
+            assert prune_claim_counts(db) == 1
+            counts = db.query(ClaimCount).count()
+            # 时间窗口整体移过之后，所有分桶都被清理
+            assert prune_claim_counts(db, now=time.time() + HOUR_BUCKETS * 3600) == counts
+        finally:
+            claim_stats.clear()
+            db.close()
+
+        assert [r["user_ip"] for r in stats["recent_claims"]] == ["10.5.0.1", "10.4.0.2", "10.4.0.1", "10.4.0.0"]
+        assert sum(b["count"] for b in stats["claims_per_minute"]) == 3
+        assert sum(b["count"] for b in stats["claims_per_hour"]) == 4
+        assert len(stats["claims_per_minute"]) == 60 and len(stats["claims_per_hour"]) == 48
+        assert series == {k: stats[k] for k in ("claims_per_minute", "claims_per_hour")}
+
+
+def test_claim_counts_backfill():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "stats.db"))
+        seed_offer(SessionLocal, "backfill", 10)
+        db = SessionLocal()
+        try:
+            for i in range(4):
+                CodeService(db).claim_code("backfill", f"10.6.0.{i}")
+            # 一条超出时间窗口的事件不计入
+            offer_id = db.query(Offer.id).filter(Offer.name == "backfill").scalar()
+            db.query(ClaimEvent).filter(ClaimEvent.user_ip == "10.6.0.0").update(
+                {"claimed_at": datetime.now() - timedelta(hours=HOUR_BUCKETS + 2)}
+            )
+            db.commit()
+            # 计数表有残留数据（上次迁移中断）时重新回填
+            _claim_counts(db.get_bind())
+            _claim_counts(db.get_bind())
+            series = claim_stats.series_from_db(db, offer_id)
+        finally:
+            db.close()
+
+        assert sum(b["count"] for b in series["claims_per_minute"]) == 3
+        assert sum(b["count"] for b in series["claims_per_hour"]) == 3
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("时间分桶", test_time_buckets),
+        ("最近领取环形缓冲区", test_recent_ring_buffer),
+        ("从审计事件预热", test_warm_up_from_claim_events),
+        ("统计接口读取内存", test_offer_stats_served_from_memory),
+        ("未预热时从数据库读取", test_offer_stats_from_db_when_not_loaded),
+        ("迁移回填领取计数", test_claim_counts_backfill),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 领取统计测试通过！")
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+已发放邀请码归档测试
+1. 只归档发放时间早于阈值的邀请码，未使用和领取池预留中的邀请码留在原表，计数不变
+2. 最近领取记录、领取者已领取的邀请码、领取统计预热可以读到已归档的邀请码
+3. 重新导入已归档的邀请码时视为重复
+4. 归档与并发领取同时进行时邀请码不重复、不丢失
+5. 归档后再导入的邀请码不复用已归档邀请码的id；迁移修复已经冲突的id并重建表
+
+使用方法:
+python test_code_archive.py
+"""
+
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.schema import CreateTable
+
+from models.claimer_identity import ClaimerIdentity
+from models.code_archive import InvitationCodeArchive
+from models.invitation_code import InvitationCode
+from models.offer import Offer
+from services.claim_engine import ClaimEngine
+from services.claim_stats import ClaimStats, mask_code
+from services.claimer_registry import claimer_registry, make_client_key
+from services.code_archiver import archive_used_codes, count_archivable
+from services.code_service import CodeService
+from services.offer_reconciler import find_drift
+from models.migrations import has_index, run_migrations, schema_migrations
+from services.offer_service import OfferService
+from test_claim_concurrency import CODE_COUNT, claim_concurrently, make_session_factory, seed_offer
+
+
+def backdate(SessionLocal, codes, days: int):
+    """把邀请码的发放时间改到days天前"""
+    db = SessionLocal()
+    try:
+        db.query(InvitationCode).filter(InvitationCode.code.in_(codes)).update(
+            {"used_at": datetime.now() - timedelta(days=days)}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_archive_only_old_used_codes():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "archive.db"))
+        seed_offer(SessionLocal, "longrun", 30)
+        db = SessionLocal()
+        try:
+            old = [CodeService(db).claim_code("longrun") for _ in range(8)]
+            recent = [CodeService(db).claim_code("longrun") for _ in range(4)]
+            ClaimEngine(db).reserve("longrun", 5, "test-worker")
+        finally:
+            db.close()
+        backdate(SessionLocal, old, 40)
+
+        db = SessionLocal()
+        try:
+            cutoff = datetime.now() - timedelta(days=30)
+            assert count_archivable(db, cutoff) == 8
+            # 每批3个，分3批完成；重复执行不会再移动
+            assert archive_used_codes(db, cutoff, batch_size=3) == 8
+            assert archive_used_codes(db, cutoff, batch_size=3) == 0
+
+            archived = {row.code for row in db.query(InvitationCodeArchive)}
+            assert archived == set(old), archived
+            assert db.query(InvitationCode).count() == 22
+            assert db.query(InvitationCode).filter(InvitationCode.code.in_(recent)).count() == 4
+            # 总数包含归档的邀请码，剩余数量包含预留的邀请码
+            offer = db.query(Offer).filter(Offer.name == "longrun").one()
+            assert (offer.total_count, offer.remaining_count) == (30, 18)
+            assert find_drift(db) == []
+        finally:
+            db.close()
+
+
+def test_lookups_read_archive():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "archive.db"))
+        seed_offer(SessionLocal, "lookup", 10)
+        client_key = make_client_key("10.0.0.8")
+        db = SessionLocal()
+        try:
+            first = CodeService(db).claim_once("lookup", client_key, "10.0.0.8").code
+            second = CodeService(db).claim_code("lookup", "10.0.0.9")
+        finally:
+            db.close()
+        backdate(SessionLocal, [first, second], 60)
+
+        db = SessionLocal()
+        try:
+            assert archive_used_codes(db, datetime.now() - timedelta(days=30)) == 2
+            assert claimer_registry.find_code(db, "lookup", client_key) == first
+            result = CodeService(db).claim_once("lookup", client_key, "10.0.0.8")
+            assert result.code == first and result.reused
+
+            offer_id = OfferService(db).get_offer_by_name("lookup").id
+            recent = OfferService(db)._recent_claims_from_db(offer_id)
+            assert [claim["code"] for claim in recent] == [mask_code(second), mask_code(first)], recent
+
+            stats = ClaimStats(recent_size=5)
+            stats.load(db)
+            assert [claim["code"] for claim in stats.recent_claims(offer_id)] == [mask_code(second), mask_code(first)]
+
+            # 已归档的邀请码重新导入时视为重复
+            result = CodeService(db).import_codes("lookup", [first, "FRESH0001"])
+            assert (result["new_codes"], result["duplicate_codes"]) == (1, 1), result
+            assert find_drift(db) == []
+        finally:
+            db.close()
+
+
+def test_archive_during_concurrent_claims():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "archive.db"))
+        seed_offer(SessionLocal, "busy", CODE_COUNT)
+        stop = threading.Event()
+        archived = []
+
+        def archive_loop():
+            db = SessionLocal()
+            try:
+                # 阈值在未来，刚发放的邀请码也会被归档
+                while not stop.is_set():
+                    archived.append(archive_used_codes(db, datetime.now() + timedelta(days=1), batch_size=20))
+            finally:
+                db.close()
+
+        archiver = threading.Thread(target=archive_loop)
+        archiver.start()
+        try:
+            claimed = claim_concurrently(SessionLocal, "busy")
+        finally:
+            stop.set()
+            archiver.join()
+
+        db = SessionLocal()
+        try:
+            archived.append(archive_used_codes(db, datetime.now() + timedelta(days=1)))
+            assert len(claimed) == len(set(claimed)) == CODE_COUNT
+            assert sum(archived) == CODE_COUNT
+            assert db.query(InvitationCode).count() == 0
+            assert {row.code for row in db.query(InvitationCodeArchive)} == set(claimed)
+            offer = db.query(Offer).filter(Offer.name == "busy").one()
+            assert (offer.total_count, offer.remaining_count) == (CODE_COUNT, 0)
+            assert find_drift(db) == []
+        finally:
+            db.close()
+
+
+def claim_as(SessionLocal, offer_name: str, client: str):
+    db = SessionLocal()
+    try:
+        return CodeService(db).claim_once(offer_name, make_client_key(client), client)
+    finally:
+        db.close()
+
+
+def archive_all(SessionLocal) -> int:
+    db = SessionLocal()
+    try:
+        return archive_used_codes(db, datetime.now() + timedelta(days=1))
+    finally:
+        db.close()
+
+
+def test_archived_ids_not_reused():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "reuse.db"))
+        db = SessionLocal()
+        try:
+            OfferService(db).create_offer("reuse", "归档后导入")
+            CodeService(db).import_codes("reuse", ["AAA111", "BBB222"])
+        finally:
+            db.close()
+        first = claim_as(SessionLocal, "reuse", "10.0.0.1")
+        claim_as(SessionLocal, "reuse", "10.0.0.2")
+        assert archive_all(SessionLocal) == 2
+
+        db = SessionLocal()
+        try:
+            CodeService(db).import_codes("reuse", ["CCC333", "DDD444"])
+            assert min(row.id for row in db.query(InvitationCode)) > 2
+        finally:
+            db.close()
+
+        # 领取者重新申请时返回自己的邀请码，新的领取者拿到新导入的邀请码
+        assert claim_as(SessionLocal, "reuse", "10.0.0.1") == (first.code, True)
+        third = claim_as(SessionLocal, "reuse", "10.0.0.3")
+        assert not third.reused and third.code == "CCC333"
+        assert claim_as(SessionLocal, "reuse", "10.0.0.3") == (third.code, True)
+        assert archive_all(SessionLocal) == 1
+
+        db = SessionLocal()
+        try:
+            assert find_drift(db) == []
+        finally:
+            db.close()
+
+
+def test_migration_fixes_reused_ids():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'legacy.db'}")
+        SessionLocal = make_session_factory(str(Path(tmp) / "legacy.db"))
+        db = SessionLocal()
+        try:
+            OfferService(db).create_offer("legacy", "旧版数据库")
+            CodeService(db).import_codes("legacy", ["AAA111", "BBB222"])
+        finally:
+            db.close()
+        first = claim_as(SessionLocal, "legacy", "10.0.0.1")
+        claim_as(SessionLocal, "legacy", "10.0.0.2")
+        assert archive_all(SessionLocal) == 2
+        run_migrations(engine)
+
+        # 模拟升级前的数据库：邀请码表没有AUTOINCREMENT，新导入的邀请码复用了已归档的id
+        legacy_sql = str(CreateTable(InvitationCode.__table__).compile(dialect=engine.dialect))
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE invitation_codes")
+            conn.exec_driver_sql(legacy_sql.replace(" AUTOINCREMENT", ""))
+            conn.execute(schema_migrations.delete().where(schema_migrations.c.version == "0006_codes_autoincrement"))
+        db = SessionLocal()
+        try:
+            CodeService(db).import_codes("legacy", ["CCC333", "DDD444"])
+            assert sorted(row.id for row in db.query(InvitationCode)) == [1, 2]
+        finally:
+            db.close()
+        third = claim_as(SessionLocal, "legacy", "10.0.0.3")
+        assert third.code == "CCC333"
+
+        assert run_migrations(engine) == ["0006_codes_autoincrement"]
+        with engine.connect() as conn:
+            table_sql = conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'invitation_codes'"
+            ).scalar()
+        assert "AUTOINCREMENT" in table_sql
+        assert all(has_index(engine, "invitation_codes", index.name) for index in InvitationCode.__table__.indexes)
+        assert "code_hash" in {c["name"] for c in inspect(engine).get_columns("invitation_codes")}
+
+        db = SessionLocal()
+        try:
+            assert sorted(row.id for row in db.query(InvitationCode)) == [3, 4]
+            identities = {row.client_key: row.code_id for row in db.query(ClaimerIdentity)}
+            assert identities[make_client_key("10.0.0.1")] == 1
+            assert identities[make_client_key("10.0.0.3")] == 3
+        finally:
+            db.close()
+        assert claim_as(SessionLocal, "legacy", "10.0.0.1") == (first.code, True)
+        assert claim_as(SessionLocal, "legacy", "10.0.0.3") == (third.code, True)
+        # 冲突修复后可以继续归档，新导入的邀请码id从归档表的最大id之后开始
+        assert archive_all(SessionLocal) == 1
+        db = SessionLocal()
+        try:
+            CodeService(db).import_codes("legacy", ["EEE555"])
+            assert db.query(InvitationCode).filter(InvitationCode.code == "EEE555").one().id == 5
+            assert find_drift(db) == []
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("只归档超过阈值的已发放邀请码", test_archive_only_old_used_codes),
+        ("查询透明读取归档表", test_lookups_read_archive),
+        ("归档与并发领取", test_archive_during_concurrent_claims),
+        ("归档后导入不复用id", test_archived_ids_not_reused),
+        ("迁移修复复用的id", test_migration_fixes_reused_ids),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 邀请码归档测试通过！")
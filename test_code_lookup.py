@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+按邀请码核验/核销测试
+1. 导入时写入定长哈希，查询走 code_hash 索引；哈希前缀过滤器拒绝的邀请码不访问数据库
+2. 核验返回未发放/预留中/已发放/已核销状态，已归档的邀请码同样能查到
+3. 过滤器增量读入其他进程导入的邀请码，按间隔整体重建
+4. 核销只对已发放的邀请码生效，并发核销同一个邀请码只有一个成功
+5. 迁移为已有的表增加并回填 code_hash、建立索引；核验、批量核验与核销接口
+6. 接口只对合作方开放：未配置合作方密钥时返回404，匿名调用方返回401，不透露邀请码状态
+
+使用方法:
+python test_code_lookup.py
+"""
+
+import asyncio
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, inspect, text
+
+from config.settings import settings
+from models.database import dispose_async_engine
+from models.invitation_code import InvitationCode
+from models.migrations import has_index, run_migrations, schema_migrations
+from routers.codes import router as codes_router
+from services.code_archiver import archive_used_codes
+from services.code_index import CodeIndex, HashPrefixFilter, code_hash, code_index
+from services.code_service import CodeService
+from test_claim_concurrency import app_database, make_session_factory, seed_offer
+
+UNKNOWN = [f"NOPE{i:06d}" for i in range(2000)]
+
+
+def test_hash_prefix_filter():
+    assert code_hash("CODE000001") == code_hash("CODE000001") != code_hash("CODE000002")
+    assert all(-2 ** 63 <= code_hash(code) < 2 ** 63 for code in UNKNOWN)
+
+    prefix_filter = HashPrefixFilter(16)
+    assert len(prefix_filter.bits) == 8192
+    known = [code_hash(f"CODE{i:06d}") for i in range(300)]
+    for value in known:
+        prefix_filter.add(value)
+    assert all(value in prefix_filter for value in known)
+    # 300个邀请码只占 2^16 位中的很少一部分，绝大多数未知邀请码被拒绝
+    false_positives = sum(1 for code in UNKNOWN if code_hash(code) in prefix_filter)
+    assert false_positives < len(UNKNOWN) * 0.02, false_positives
+
+
+def test_verify_statuses():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "verify.db"))
+        seed_offer(SessionLocal, "verify", 20)
+        db = SessionLocal()
+        try:
+            code = db.query(InvitationCode).filter(InvitationCode.code == "CODE000003").one()
+            assert code.code_hash == code_hash("CODE000003")
+            plan = " ".join(str(row[-1]) for row in db.execute(text(
+                "EXPLAIN QUERY PLAN SELECT id FROM invitation_codes WHERE code_hash IN (1, 2) AND code IN ('a', 'b')"
+            )))
+            assert "ix_invitation_codes_code_hash" in plan, plan
+
+            service = CodeService(db)
+            issued = service.claim_code("verify")
+            leased = service.lease_code("verify", 60).code
+            old = service.claim_code("verify")
+            db.query(InvitationCode).filter(InvitationCode.code == old).update(
+                {"used_at": datetime.now() - timedelta(days=40)}
+            )
+            db.commit()
+            assert archive_used_codes(db, datetime.now() - timedelta(days=30)) == 1
+
+            assert code_index.load(db) == 20
+            found = service.verify_codes([issued, leased, old, "CODE000019", "NOPE", issued])
+            assert {code: status.status for code, status in found.items()} == {
+                issued: "issued", leased: "pending", old: "issued", "CODE000019": "available"
+            }
+            assert found[old].archived and found[old].offer == "verify" and found[issued].issued_at
+            assert not service.verify_codes(["CODE000019"], offer_name="other")
+
+            # 过滤器拒绝的邀请码不访问数据库（没有数据库会话也能回答）
+            rejected = code_index.rejected
+            assert CodeService(None).verify_codes(UNKNOWN[:50]) == {}
+            assert code_index.rejected - rejected == 50
+        finally:
+            db.close()
+
+
+def test_index_refresh():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "refresh.db"))
+        seed_offer(SessionLocal, "refresh", 10)
+        db = SessionLocal()
+        try:
+            index = CodeIndex(prefix_bits=20, reload_seconds=3600)
+            assert index.load(db) == 10 and index.last_id == 10
+            # 模拟其他进程导入：本进程的过滤器中没有这些邀请码
+            db.execute(InvitationCode.__table__.insert(), [
+                {"offer_id": 1, "code": f"LATE{i}", "code_hash": code_hash(f"LATE{i}"), "is_used": False}
+                for i in range(5)
+            ])
+            db.commit()
+            assert not index.candidates(["LATE0"])
+            assert index.refresh(db) == 5 and index.last_id == 15
+            assert set(index.candidates(["LATE0", "LATE4"])) == {"LATE0", "LATE4"}
+
+            # 最新的邀请码被归档后id不会复用，之后导入的邀请码仍能增量读入
+            db.execute(InvitationCode.__table__.delete().where(InvitationCode.id > 12))
+            db.execute(InvitationCode.__table__.insert(), [{"offer_id": 1, "code": "NEXT", "code_hash": code_hash("NEXT")}])
+            db.commit()
+            assert index.refresh(db) == 1 and index.last_id == 16
+            # 到达整体重建间隔时重新加载
+            index.reload_seconds = 0
+            reloads = index.reloads
+            index.refresh(db)
+            assert index.reloads == reloads + 1 and index.last_id == 16
+        finally:
+            db.close()
+
+
+def test_redeem():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "redeem.db"))
+        seed_offer(SessionLocal, "redeem", 50)
+        db = SessionLocal()
+        try:
+            code_index.load(db)
+            service = CodeService(db)
+            issued = [service.claim_code("redeem") for _ in range(3)]
+            redeemed = service.redeem_code(issued[0])
+            assert redeemed.status == "redeemed" and redeemed.redeemed_at
+            assert service.verify_codes([issued[0]])[issued[0]].status == "redeemed"
+
+            for code, message in [(issued[0], "已核销"), ("CODE000049", "尚未发放"), ("NOPE", "不存在")]:
+                try:
+                    service.redeem_code(code)
+                    assert False, f"{code} 不应核销成功"
+                except ValueError as e:
+                    assert message in str(e), e
+
+            # 已归档的邀请码在归档表中核销
+            db.query(InvitationCode).filter(InvitationCode.code == issued[1]).update(
+                {"used_at": datetime.now() - timedelta(days=40)}
+            )
+            db.commit()
+            archive_used_codes(db, datetime.now() - timedelta(days=30))
+            assert service.redeem_code(issued[1]).archived
+            assert service.verify_codes([issued[1]])[issued[1]].status == "redeemed"
+        finally:
+            db.close()
+
+        results = []
+        start = threading.Barrier(8)
+
+        def redeem_once():
+            session = SessionLocal()
+            try:
+                start.wait()
+                results.append(CodeService(session).redeem_code(issued[2]).code)
+            except ValueError as e:
+                results.append(str(e))
+            finally:
+                session.close()
+
+        threads = [threading.Thread(target=redeem_once) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results.count(issued[2]) == 1, results
+        assert results.count("邀请码已核销") == 7, results
+
+
+def test_migration_backfills_code_hash():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'migrate.db'}")
+        SessionLocal = make_session_factory(str(Path(tmp) / "migrate.db"))
+        seed_offer(SessionLocal, "old", 12)
+        run_migrations(engine)
+        # 模拟升级前的数据库
+        with engine.begin() as conn:
+            for table in ("invitation_codes", "invitation_codes_archive"):
+                conn.exec_driver_sql(f"DROP INDEX ix_{table}_code_hash")
+                conn.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN code_hash")
+                conn.exec_driver_sql(f"ALTER TABLE {table} DROP COLUMN redeemed_at")
+            conn.execute(schema_migrations.delete().where(schema_migrations.c.version == "0005_code_hash"))
+
+        assert run_migrations(engine) == ["0005_code_hash"]
+        assert "redeemed_at" in {c["name"] for c in inspect(engine).get_columns("invitation_codes_archive")}
+        assert has_index(engine, "invitation_codes", "ix_invitation_codes_code_hash")
+        db = SessionLocal()
+        try:
+            codes = db.query(InvitationCode).all()
+            assert len(codes) == 12 and all(code.code_hash == code_hash(code.code) for code in codes)
+            code_index.load(db)
+            assert "CODE000011" in CodeService(db).verify_codes(["CODE000011"])
+        finally:
+            db.close()
+
+
+PARTNER = {"X-API-Key": "secret"}
+
+
+def seed_code_endpoints(SessionLocal) -> str:
+    """导入5个邀请码并发放其中一个，返回发放的邀请码"""
+    db = SessionLocal()
+    try:
+        from services.offer_service import OfferService
+        OfferService(db).create_offer("api", "核验接口")
+        CodeService(db).import_codes("api", [f"API{i:04d}" for i in range(5)])
+        issued = CodeService(db).claim_code("api")
+        code_index.load(db)
+        return issued
+    finally:
+        db.close()
+
+
+async def call_code_endpoints(requests) -> list:
+    """依次发送 (方法, 路径, 请求体, 请求头)，返回响应列表"""
+    app = FastAPI()
+    app.include_router(codes_router, prefix=settings.api_v1_prefix)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+        responses = [
+            await c.request(method, f"/api/v1/codes/{path}", json=body, headers=headers)
+            for method, path, body, headers in requests
+        ]
+    await dispose_async_engine()
+    return responses
+
+
+def test_code_endpoints():
+    with tempfile.TemporaryDirectory() as tmp, app_database(
+        str(Path(tmp) / "lookup.db"), claim_batch_api_keys={"secret": "partner"}
+    ) as AppSessionLocal:
+        issued = seed_code_endpoints(AppSessionLocal)
+        found, missing, batch, too_many, redeemed, twice, not_issued, after = asyncio.run(call_code_endpoints([
+            ("GET", issued, None, PARTNER),
+            ("GET", "NOPE", None, PARTNER),
+            ("POST", "verify", {"codes": ["API0004", "NOPE", issued]}, PARTNER),
+            ("POST", "verify", {"codes": ["x"] * (settings.code_verify_max_batch + 1)}, PARTNER),
+            ("POST", f"{issued}/redeem", None, PARTNER),
+            ("POST", f"{issued}/redeem", None, PARTNER),
+            ("POST", "API0004/redeem", None, PARTNER),
+            ("GET", issued, None, PARTNER),
+        ]))
+
+    assert found.status_code == 200, found.text
+    data = found.json()["data"]
+    assert data["valid"] and data["status"] == "issued" and data["offer"] == "api" and data["issued_at"]
+    assert found.headers["cache-control"] == "no-store"
+    assert missing.status_code == 404 and missing.json()["detail"]["error_code"] == "CODE_NOT_FOUND"
+
+    results = batch.json()["data"]["results"]
+    assert [r["code"] for r in results] == ["API0004", "NOPE", issued]
+    assert [r["valid"] for r in results] == [True, False, True] and batch.json()["data"]["valid_count"] == 2
+    assert results[0]["status"] == "available" and results[1]["status"] is None
+    assert too_many.status_code == 400 and too_many.json()["detail"]["error_code"] == "INVALID_COUNT"
+
+    assert redeemed.status_code == 200 and redeemed.json()["data"]["status"] == "redeemed"
+    assert twice.status_code == 409 and twice.json()["detail"]["error_code"] == "ALREADY_REDEEMED"
+    assert not_issued.status_code == 400 and not_issued.json()["detail"]["error_code"] == "CODE_NOT_ISSUED"
+    assert after.status_code == 200 and after.json()["data"]["status"] == "redeemed"
+
+
+def test_code_endpoints_require_partner_key():
+    anonymous = [
+        ("GET", "API0004", None, {}),
+        ("POST", "verify", {"codes": ["API0004"]}, {}),
+        ("POST", "{issued}/redeem", None, {}),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        with app_database(str(Path(tmp) / "lookup.db"), claim_batch_api_keys={}) as AppSessionLocal:
+            issued = seed_code_endpoints(AppSessionLocal)
+            requests = [(method, path.format(issued=issued), body, headers) for method, path, body, headers in anonymous]
+            # 未配置合作方密钥时带任何密钥都不开放
+            disabled = asyncio.run(call_code_endpoints(
+                requests + [(method, path, body, PARTNER) for method, path, body, _ in requests]
+            ))
+        with app_database(str(Path(tmp) / "lookup.db"), claim_batch_api_keys={"secret": "partner"}):
+            unauthorized = asyncio.run(call_code_endpoints(
+                requests + [("GET", "API0004", None, {"X-API-Key": "guess"})]
+            ))
+            status, = asyncio.run(call_code_endpoints([("GET", issued, None, PARTNER)]))
+
+    assert [r.status_code for r in disabled] == [404] * 6
+    assert [r.status_code for r in unauthorized] == [401] * 4
+    assert all(r.json()["detail"]["error_code"] == "UNAUTHORIZED" for r in unauthorized)
+    assert all("available" not in r.text for r in disabled + unauthorized)
+    # 匿名核销没有生效
+    assert status.json()["data"]["status"] == "issued"
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("哈希前缀过滤器", test_hash_prefix_filter),
+        ("核验邀请码状态", test_verify_statuses),
+        ("过滤器增量刷新", test_index_refresh),
+        ("核销与并发核销", test_redeem),
+        ("迁移回填哈希", test_migration_backfills_code_hash),
+        ("核验与核销接口", test_code_endpoints),
+        ("接口只对合作方开放", test_code_endpoints_require_partner_key),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 按邀请码核验/核销测试通过！")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+热点读接口预编码响应测试
+1. fast_json 的输出与pydantic响应模型的输出一致（orjson和标准库json两种编码器）
+2. offer信息缓存保存编码好的响应体，只在offer变化后重新编码
+3. /info、/stats 返回ETag，If-None-Match一致时返回304，领取后ETag变化
+
+使用方法:
+python test_fast_responses.py
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import httpx
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+
+from config.settings import settings
+from models.database import dispose_async_engine
+from routers.offers import router as offers_router
+from schemas import StatsResponse
+from services import fast_json
+from services.code_service import CodeService
+from services.offer_cache import MODE_LAG, OfferInfoCache
+from services.offer_service import OfferService
+from test_claim_concurrency import app_database
+
+
+def test_encoders_match_pydantic():
+    stats = {
+        "total_codes": 3, "used_codes": 1, "remaining_codes": 2, "leased_codes": 0, "usage_rate": 0.333,
+        "recent_claims": [{"code": "AB****CD", "claimed_at": datetime(2024, 5, 1, 12, 30, 5, 120), "user_ip": None}],
+        "claims_per_minute": [{"start": datetime(2024, 5, 1, 12, 30), "count": 1}],
+        "claims_per_hour": []
+    }
+    expected = json.loads(json.dumps(jsonable_encoder(StatsResponse(data=stats))))
+    content = {"success": True, "message": None, "data": dict(stats, title="中文")}
+    expected["data"]["title"] = "中文"
+
+    original = fast_json.orjson
+    try:
+        for encoder in ([original, None] if original is not None else [None]):
+            fast_json.orjson = encoder
+            body = fast_json.dumps(content)
+            assert json.loads(body) == expected, body
+            assert "中文".encode("utf-8") in body
+    finally:
+        fast_json.orjson = original
+
+
+def test_etag_matching():
+    etag = fast_json.make_etag(b'{"a":1}')
+    assert etag == fast_json.make_etag(b'{"a":1}') != fast_json.make_etag(b'{"a":2}')
+    assert fast_json.etag_matches(etag, etag)
+    assert fast_json.etag_matches(f'"other", W/{etag}', etag)
+    assert fast_json.etag_matches("*", etag)
+    assert not fast_json.etag_matches(None, etag)
+    assert not fast_json.etag_matches('"other"', etag)
+
+
+def test_cache_reencodes_only_on_change():
+    cache = OfferInfoCache(mode=MODE_LAG, ttl_ms=60000)
+    body, etag = cache.put("demo", {"success": True, "data": {"remaining_count": 5}})
+    assert cache.get_encoded("demo") == (body, etag)
+    assert cache.get_encoded("demo") == (body, etag)
+    assert cache.encodes == 1
+
+    # lag模式下领取直接扣减缓存中的剩余数量，下次读取时重新编码
+    cache.on_claim("demo", 2)
+    new_body, new_etag = cache.get_encoded("demo")
+    assert json.loads(new_body)["data"]["remaining_count"] == 3 and new_etag != etag
+    assert cache.encodes == 2
+
+    cache.put("missing", None)
+    assert cache.get_encoded("missing") is None
+
+
+def test_endpoints_support_if_none_match():
+    app = FastAPI()
+    app.include_router(offers_router, prefix=settings.api_v1_prefix)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+            info_url = "/api/v1/offers/etag/info"
+            stats_url = "/api/v1/offers/etag/stats"
+            first = await c.get(info_url)
+            cached = await c.get(info_url)
+            not_modified = await c.get(info_url, headers={"If-None-Match": first.headers["etag"]})
+            await c.post("/api/v1/offers/etag/claim")
+            changed = await c.get(info_url, headers={"If-None-Match": first.headers["etag"]})
+
+            stats = await c.get(stats_url)
+            stats_again = await c.get(stats_url, headers={"If-None-Match": stats.headers["etag"]})
+            missing = await c.get("/api/v1/offers/none/info")
+        await dispose_async_engine()
+        return first, cached, not_modified, changed, stats, stats_again, missing
+
+    with tempfile.TemporaryDirectory() as tmp, app_database(str(Path(tmp) / "responses.db")) as SessionLocal:
+        db = SessionLocal()
+        try:
+            OfferService(db).create_offer("etag", "条件请求")
+            CodeService(db).import_codes("etag", [f"ETAG{i:04d}" for i in range(5)])
+        finally:
+            db.close()
+        first, cached, not_modified, changed, stats, stats_again, missing = asyncio.run(run())
+
+    assert first.status_code == 200 and first.headers["content-type"] == "application/json"
+    assert first.json()["data"]["remaining_count"] == 5 and first.json()["success"] is True
+    assert cached.content == first.content and cached.headers["etag"] == first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert not_modified.headers["etag"] == first.headers["etag"]
+    assert changed.status_code == 200 and changed.json()["data"]["remaining_count"] == 4
+    assert changed.headers["etag"] != first.headers["etag"]
+
+    assert stats.status_code == 200 and stats.json()["data"]["used_codes"] == 1
+    assert stats_again.status_code == 304, stats_again.text
+    assert missing.status_code == 404
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("编码结果与响应模型一致", test_encoders_match_pydantic),
+        ("ETag匹配", test_etag_matching),
+        ("只在变化后重新编码", test_cache_reencodes_only_on_change),
+        ("接口支持If-None-Match", test_endpoints_support_if_none_match),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 预编码响应测试通过！")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+流式导入命令测试
+1. 按行流式读取，偏移按解压后的字节计算（含空行、CRLF和多字节字符），跳过时不支持seek的流改为读取丢弃
+2. gzip文件导入中断后用 --resume 从检查点继续：已提交但未写入检查点的块重新导入时按重复跳过，
+   最终邀请码不重复、不缺失，计数与实际数量一致
+3. 检查点与文件不匹配时拒绝续传
+
+使用方法:
+python test_import_codes.py
+"""
+
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import click
+from click.testing import CliRunner
+
+from cli import import_codes
+from cli.import_codes import CodeReader, default_checkpoint_path, load_checkpoint
+from models.invitation_code import InvitationCode
+from models.offer import Offer
+from services.offer_reconciler import find_drift
+from test_claim_concurrency import app_database
+
+CODES = [f"码{i:05d}" if i % 7 == 0 else f"GZ{i:05d}" for i in range(1000)]
+
+
+class NoSeekStream(io.RawIOBase):
+    """不支持seek的输入流（如标准输入、zstd解压流）"""
+
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._data.readinto(buffer)
+
+
+def test_reader_offsets():
+    data = "A1\r\n\n  B2  \n码3\nC4".encode("utf-8")
+    reader = CodeReader(io.BytesIO(data))
+    offsets = []
+    for code in reader:
+        offsets.append((code, reader.offset))
+    # 偏移位于产出的这一行之后，空行计入下一行
+    assert offsets == [("A1", 4), ("B2", 12), ("码3", 17), ("C4", 19)], offsets
+
+    # 从某一行之后继续读取：支持seek的流直接定位，不支持的读取丢弃，结果相同
+    for stream in (io.BytesIO(data), io.BufferedReader(NoSeekStream(data), buffer_size=3)):
+        resumed = CodeReader(stream, 12)
+        assert list(resumed) == ["码3", "C4"] and resumed.offset == len(data)
+
+    try:
+        CodeReader(io.BufferedReader(NoSeekStream(data)), len(data) + 1)
+        assert False, "偏移超出输入长度时应报错"
+    except click.ClickException:
+        pass
+
+
+def test_gzip_import_resume():
+    with tempfile.TemporaryDirectory() as tmp, app_database(str(Path(tmp) / "import.db")) as SessionLocal:
+        path = Path(tmp) / "codes.txt.gz"
+        lines = []
+        for i, code in enumerate(CODES):
+            lines.append(code)
+            if i % 50 == 0:
+                lines.append("")
+        with gzip.open(path, "wt", encoding="utf-8", newline="\n") as f:
+            f.write("\n".join(lines) + "\n")
+        checkpoint_path = default_checkpoint_path("gz", str(path))
+        runner = CliRunner()
+
+        # 第2块提交后、写入检查点前中断
+        save_checkpoint = import_codes.save_checkpoint
+        saved = []
+
+        def crash_on_second_save(target, checkpoint):
+            if saved:
+                raise RuntimeError("模拟进程中断")
+            saved.append(dict(checkpoint))
+            save_checkpoint(target, checkpoint)
+
+        import_codes.save_checkpoint = crash_on_second_save
+        try:
+            interrupted = runner.invoke(import_codes.main, ["--offer", "gz", "--file", str(path), "--chunk-size", "300"])
+        finally:
+            import_codes.save_checkpoint = save_checkpoint
+
+        assert interrupted.exit_code == 1, interrupted.output
+        checkpoint = json.loads(checkpoint_path.read_text(encoding="utf-8"))
+        assert checkpoint == dict(saved[0], updated_at=checkpoint["updated_at"])
+        assert checkpoint["codes_processed"] == 300 and checkpoint["new_codes"] == 300
+        # 检查点偏移为解压后第300个邀请码所在行（含之前的空行）之后
+        decompressed = gzip.decompress(path.read_bytes())
+        assert decompressed[:checkpoint["byte_offset"]].decode("utf-8").split() == CODES[:300]
+        db = SessionLocal()
+        try:
+            assert db.query(InvitationCode).count() == 600
+        finally:
+            db.close()
+
+        resumed = runner.invoke(import_codes.main, ["--offer", "gz", "--file", str(path), "--chunk-size", "300", "--resume"])
+        assert resumed.exit_code == 0, resumed.output
+        assert f"从第 {checkpoint['byte_offset']} 字节继续导入" in resumed.output
+        # 第2块已经提交过，续传时按重复跳过
+        assert "新增邀请码: 700" in resumed.output and "重复跳过: 300" in resumed.output, resumed.output
+        assert not checkpoint_path.exists()
+
+        db = SessionLocal()
+        try:
+            codes = [row.code for row in db.query(InvitationCode.code)]
+            assert len(codes) == len(set(codes)) == len(CODES)
+            assert set(codes) == set(CODES)
+            offer = db.query(Offer).filter(Offer.name == "gz").first()
+            assert (offer.total_count, offer.remaining_count) == (len(CODES), len(CODES))
+            assert find_drift(db) == []
+        finally:
+            db.close()
+
+
+def test_checkpoint_must_match_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "codes.txt"
+        path.write_text("A\nB\n", encoding="utf-8")
+        checkpoint_path = default_checkpoint_path("demo", str(path))
+        checkpoint_path.write_text(json.dumps({
+            "offer": "demo", "file": os.path.abspath(path), "file_size": path.stat().st_size, "byte_offset": 2
+        }), encoding="utf-8")
+        assert load_checkpoint(checkpoint_path, "demo", str(path))["byte_offset"] == 2
+
+        for offer, content in (("other", "A\nB\n"), ("demo", "A\nB\nC\n")):
+            path.write_text(content, encoding="utf-8")
+            try:
+                load_checkpoint(checkpoint_path, offer, str(path))
+                assert False, "检查点不匹配时应拒绝续传"
+            except click.ClickException:
+                pass
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("流式读取与字节偏移", test_reader_offsets),
+        ("gzip导入中断后续传", test_gzip_import_resume),
+        ("检查点与文件不匹配", test_checkpoint_must_match_file),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 流式导入测试通过！")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+索引与迁移测试
+1. 在旧结构的数据库上执行迁移，验证补建了复合索引和唯一索引，并清理了重复邀请码
+2. 只执行到 0003 时不会提前增加 0004 的 leased_count，去重后的计数已经重算
+3. 用 EXPLAIN QUERY PLAN 验证领取查询和导入去重查询都走了索引
+4. 两个线程（各自的引擎，模拟多个worker）同时在旧结构的数据库上执行迁移，
+   在迁移锁内依次执行，每个迁移只执行一次
+
+使用方法:
+python test_indexes.py
+"""
+
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from models.database import Base
+from models.migrations import run_migrations, applied_versions, MIGRATIONS
+from models.offer import Offer
+from services.code_service import CodeService
+from services.offer_service import OfferService
+
+# 迁移前的表结构（只有 is_used 单列索引，没有唯一约束）
+LEGACY_SCHEMA = [
+    """CREATE TABLE offers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name VARCHAR(50) NOT NULL UNIQUE,
+        title VARCHAR(100) NOT NULL, description TEXT, total_count INTEGER,
+        remaining_count INTEGER, is_active BOOLEAN, created_at DATETIME, updated_at DATETIME)""",
+    "CREATE INDEX ix_offers_name ON offers (name)",
+    """CREATE TABLE invitation_codes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, offer_id INTEGER NOT NULL REFERENCES offers(id),
+        code VARCHAR(255) NOT NULL, is_used BOOLEAN, used_at DATETIME, user_ip VARCHAR(45),
+        user_agent TEXT, created_at DATETIME)""",
+    "CREATE INDEX ix_invitation_codes_is_used ON invitation_codes (is_used)",
+]
+
+# 与 services/claim_engine.py 中领取语句相同的选取子查询
+CLAIM_PICK_SQL = """
+    SELECT c.id FROM invitation_codes AS c
+    JOIN offers AS o ON o.id = c.offer_id
+    WHERE o.name = 'demo' AND o.is_active = 1 AND c.is_used = 0
+    LIMIT 1
+"""
+
+# 与 services/bulk_importer.py 中导入去重相同的反连接
+IMPORT_ANTI_JOIN_SQL = """
+    SELECT 1 FROM invitation_codes AS existing
+    WHERE existing.offer_id = 1 AND existing.code = 'CODE000001'
+"""
+
+
+def make_legacy_engine(db_path: str):
+    """按旧结构建表并写入包含重复邀请码的数据"""
+    engine = create_engine(f"sqlite:///{db_path}")
+    with engine.begin() as conn:
+        for sql in LEGACY_SCHEMA:
+            conn.exec_driver_sql(sql)
+        conn.exec_driver_sql(
+            "INSERT INTO offers (id, name, title, total_count, remaining_count, is_active) "
+            "VALUES (1, 'demo', 'Demo', 6, 5, 1)"
+        )
+        rows = [("CODE000001", 0), ("CODE000001", 1), ("CODE000002", 0),
+                ("CODE000002", 0), ("CODE000003", 0), ("CODE000004", 0)]
+        for code, is_used in rows:
+            conn.exec_driver_sql(
+                "INSERT INTO invitation_codes (offer_id, code, is_used) VALUES (1, ?, ?)",
+                (code, is_used)
+            )
+    return engine
+
+
+def query_plan(engine, sql: str) -> str:
+    with engine.connect() as conn:
+        return " | ".join(row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+
+
+def test_migration_adds_indexes_to_legacy_database():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_legacy_engine(str(Path(tmp) / "legacy.db"))
+        Base.metadata.create_all(bind=engine)
+        executed = run_migrations(engine)
+
+        assert executed == [m.version for m in MIGRATIONS]
+        indexes = {index["name"]: index for index in inspect(engine).get_indexes("invitation_codes")}
+        assert "ix_invitation_codes_offer_used_id" in indexes
+        assert indexes["uq_invitation_codes_offer_code"]["unique"]
+        assert "ix_invitation_codes_is_used" not in indexes
+
+        with engine.connect() as conn:
+            codes = [tuple(row) for row in conn.exec_driver_sql(
+                "SELECT code, is_used FROM invitation_codes ORDER BY code"
+            )]
+            offer = conn.exec_driver_sql("SELECT total_count, remaining_count FROM offers").first()
+        # 重复组中保留已使用的那条，计数按去重后的结果重算
+        assert codes == [("CODE000001", 1), ("CODE000002", 0), ("CODE000003", 0), ("CODE000004", 0)]
+        assert tuple(offer) == (4, 3)
+
+        # 再次执行不会重复迁移
+        assert run_migrations(engine) == []
+        assert applied_versions(engine) == {m.version for m in MIGRATIONS}
+
+
+def test_partial_migration_matches_its_version():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_legacy_engine(str(Path(tmp) / "legacy.db"))
+        Base.metadata.create_all(bind=engine)
+        for migration in MIGRATIONS[:3]:
+            migration.upgrade(engine)
+
+        # leased_count 由 0004 增加，之前的迁移不应提前修改 offers 表
+        assert "leased_count" not in {c["name"] for c in inspect(engine).get_columns("offers")}
+        with engine.connect() as conn:
+            offer = conn.exec_driver_sql("SELECT total_count, remaining_count FROM offers").first()
+        assert tuple(offer) == (4, 3)
+
+        MIGRATIONS[3].upgrade(engine)
+        assert "leased_count" in {c["name"] for c in inspect(engine).get_columns("offers")}
+
+
+def test_concurrent_migrations():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "legacy.db")
+        engine = make_legacy_engine(db_path)
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        results, errors = [], []
+        start = threading.Barrier(2)
+
+        def worker():
+            engine = create_engine(f"sqlite:///{db_path}", connect_args={"timeout": 30})
+            try:
+                start.wait()
+                results.append(run_migrations(engine))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                engine.dispose()
+
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert not errors, errors
+        # 先拿到锁的执行全部迁移，另一个等待后没有需要执行的迁移
+        assert sorted(results, key=len) == [[], [m.version for m in MIGRATIONS]], results
+        engine = create_engine(f"sqlite:///{db_path}")
+        indexes = {index["name"] for index in inspect(engine).get_indexes("invitation_codes")}
+        assert {"ix_invitation_codes_offer_used_id", "uq_invitation_codes_offer_code"} <= indexes
+        assert applied_versions(engine) == {m.version for m in MIGRATIONS}
+
+
+def test_claim_and_import_queries_use_indexes():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'plan.db'}")
+        Base.metadata.create_all(bind=engine)
+        run_migrations(engine)
+
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        db = SessionLocal()
+        try:
+            OfferService(db).create_offer("demo", "Demo")
+            CodeService(db).import_codes("demo", [f"CODE{i:06d}" for i in range(2000)])
+            for _ in range(10):
+                CodeService(db).claim_code("demo")
+        finally:
+            db.close()
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+        claim_plan = query_plan(engine, CLAIM_PICK_SQL)
+        assert "ix_invitation_codes_offer_used_id" in claim_plan, claim_plan
+        assert "SCAN c" not in claim_plan, claim_plan
+
+        import_plan = query_plan(engine, IMPORT_ANTI_JOIN_SQL)
+        assert "uq_invitation_codes_offer_code" in import_plan, import_plan
+
+
+def test_duplicate_codes_rejected_by_database():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'unique.db'}")
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO offers (id, name, title) VALUES (1, 'demo', 'Demo')")
+            conn.exec_driver_sql("INSERT INTO invitation_codes (offer_id, code) VALUES (1, 'SAME')")
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql("INSERT INTO invitation_codes (offer_id, code) VALUES (1, 'SAME')")
+        except Exception as e:
+            assert "UNIQUE" in str(e)
+        else:
+            raise AssertionError("重复邀请码应被唯一索引拒绝")
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("旧数据库迁移", test_migration_adds_indexes_to_legacy_database),
+        ("部分迁移与版本一致", test_partial_migration_matches_its_version),
+        ("并发执行迁移", test_concurrent_migrations),
+        ("查询计划使用索引", test_claim_and_import_queries_use_indexes),
+        ("唯一索引", test_duplicate_codes_rejected_by_database),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 索引与迁移测试通过！")
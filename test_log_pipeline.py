@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+异步日志测试
+1. 日志放入队列时不格式化消息，队列满时丢弃新日志而不阻塞
+2. 带 sample 标记的成功日志按比例采样，警告和错误总是保留
+3. 后台线程批量写入，stop() 写完队列中的全部日志
+4. JSON格式输出extra字段和异常
+
+使用方法:
+python test_log_pipeline.py
+"""
+
+import io
+import json
+import logging
+import sys
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from services.log_pipeline import LogPipeline
+
+
+class CountingArg:
+    """记录被格式化的次数"""
+
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "arg"
+
+
+def make_record(msg, *args, level=logging.INFO, **extra):
+    record = logging.LogRecord("test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_enqueue_is_lazy_and_never_blocks():
+    pipeline = LogPipeline(queue_size=5)
+    arg = CountingArg()
+    for _ in range(10):
+        pipeline.handler.handle(make_record("value=%s", arg))
+    assert arg.formatted == 0
+    assert pipeline.queue.qsize() == 5 and pipeline.handler.dropped == 5
+
+    pipeline._stream = io.StringIO()
+    pipeline.flush()
+    assert arg.formatted == 5 and pipeline._stream.getvalue().count("value=arg") == 5
+
+
+def test_sampling():
+    pipeline = LogPipeline(sample_rates={"claim_success": 0.25, "noisy": 0, "full": 1.0})
+    for _ in range(100):
+        pipeline.handler.handle(make_record("ok", sample="claim_success"))
+        pipeline.handler.handle(make_record("noise", sample="noisy"))
+        pipeline.handler.handle(make_record("all", sample="full"))
+    pipeline.handler.handle(make_record("failed", level=logging.WARNING, sample="noisy"))
+    pipeline.handler.handle(make_record("plain"))
+    assert pipeline.queue.qsize() == 25 + 100 + 2
+    assert pipeline.sampler.dropped == 75 + 100
+
+
+def test_batched_writes_flushed_on_stop():
+    stream = io.StringIO()
+    pipeline = LogPipeline(batch_size=50, flush_interval_ms=50)
+    pipeline.start(stream=stream)
+    try:
+        logger = logging.getLogger("test.pipeline")
+        for i in range(120):
+            logger.info("第%d条", i)
+        logger.debug("不输出")
+    finally:
+        pipeline.stop()
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 120 and lines[-1].endswith("test.pipeline: 第119条")
+    assert pipeline.written == 120 and 3 <= pipeline.batches < 120
+    assert pipeline.handler not in logging.getLogger().handlers
+    assert not pipeline.running
+
+
+def test_json_format():
+    pipeline = LogPipeline(fmt="json")
+    pipeline._stream = io.StringIO()
+    try:
+        raise ValueError("坏数据")
+    except ValueError:
+        record = make_record("领取 %s", "fellou", level=logging.ERROR, offer="fellou", sample="claim_success")
+        record.exc_info = sys.exc_info()
+    pipeline.handler.handle(record)
+    pipeline.flush()
+    entry = json.loads(pipeline._stream.getvalue())
+    assert entry["message"] == "领取 fellou" and entry["level"] == "ERROR"
+    assert entry["offer"] == "fellou" and "sample" not in entry
+    assert "ValueError: 坏数据" in entry["exception"]
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("放入队列不格式化、不阻塞", test_enqueue_is_lazy_and_never_blocks),
+        ("成功日志采样", test_sampling),
+        ("批量写入并在停止时写完", test_batched_writes_flushed_on_stop),
+        ("JSON格式", test_json_format),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 异步日志测试通过！")
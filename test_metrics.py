@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+指标测试
+1. 多线程记录的计数和直方图在导出时正确合并
+2. 输出符合Prometheus文本格式（累计分桶、_sum/_count、标签转义）
+3. 领取后抓取 /metrics：请求耗时按路由模板打标签，数据库和序列化分项耗时、
+   连接池等待时间（instrument_engine）和offer剩余数量都已记录
+
+使用方法:
+python test_metrics.py
+"""
+
+import asyncio
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import httpx
+
+from models.database import dispose_async_engine
+from services.code_service import CodeService
+from services.metrics import MetricsRegistry
+from services.offer_service import OfferService
+from test_claim_concurrency import app_database
+
+THREAD_COUNT = 8
+PER_THREAD = 5000
+
+
+def test_sharded_recording_merges_across_threads():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "请求数", ("outcome",))
+    latency = registry.histogram("latency_seconds", "耗时", (), buckets=(0.01, 0.1))
+
+    def worker():
+        for i in range(PER_THREAD):
+            requests.inc(("success",))
+            latency.observe(0.05 if i % 2 else 0.005)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREAD_COUNT)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    lines = registry.render().splitlines()
+    total = THREAD_COUNT * PER_THREAD
+    assert f'requests_total{{outcome="success"}} {total}' in lines, lines
+    assert f'latency_seconds_bucket{{le="0.01"}} {total // 2}' in lines, lines
+    assert f'latency_seconds_bucket{{le="0.1"}} {total}' in lines, lines
+    assert f'latency_seconds_bucket{{le="+Inf"}} {total}' in lines, lines
+    assert f"latency_seconds_count {total}" in lines, lines
+
+
+def test_exposition_format():
+    registry = MetricsRegistry()
+    gauge = registry.gauge("offer_remaining_codes", "剩余数量", ("offer",))
+    gauge.replace({('say "hi"',): 3, ("demo",): 10})
+
+    text = registry.render()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    assert lines[0] == "# HELP offer_remaining_codes 剩余数量"
+    assert lines[1] == "# TYPE offer_remaining_codes gauge"
+    assert 'offer_remaining_codes{offer="demo"} 10' in lines
+    assert 'offer_remaining_codes{offer="say \\"hi\\""} 3' in lines, lines
+
+
+def scrape(text: str) -> dict:
+    """解析Prometheus文本格式，返回 {序列: 数值}"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            samples[series] = float(value)
+    return samples
+
+
+def test_metrics_endpoint_after_claim():
+    from main import app
+
+    claim_route = '/api/v1/offers/{offer_name}/claim'
+    request_count = f'http_request_duration_seconds_count{{method="POST",route="{claim_route}",status="200"}}'
+    db_sum = f'http_request_db_seconds_sum{{route="{claim_route}"}}'
+    db_count = f'http_request_db_seconds_count{{route="{claim_route}"}}'
+    serialization_sum = f'response_serialization_seconds_sum{{route="{claim_route}"}}'
+    serialization_count = f'response_serialization_seconds_count{{route="{claim_route}"}}'
+    pool_wait_count = 'db_pool_checkout_seconds_count{engine="async"}'
+    pool_wait_bucket = 'db_pool_checkout_seconds_bucket{engine="async",le="+Inf"}'
+    claimed = 'claim_requests_total{outcome="success"}'
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+            before = scrape((await c.get("/metrics")).text)
+            claim = await c.post("/api/v1/offers/metrics/claim")
+            response = await c.get("/metrics")
+        await dispose_async_engine()
+        return before, claim, response
+
+    with tempfile.TemporaryDirectory() as tmp, app_database(str(Path(tmp) / "metrics.db")) as SessionLocal:
+        db = SessionLocal()
+        try:
+            OfferService(db).create_offer("metrics", "指标")
+            CodeService(db).import_codes("metrics", [f"MET{i:04d}" for i in range(5)])
+        finally:
+            db.close()
+        before, claim, response = asyncio.run(run())
+
+    assert claim.status_code == 200, claim.text
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    after = scrape(response.text)
+
+    # 路由模板作为标签，原始路径（offer名称）不出现在标签中
+    assert after[request_count] == before.get(request_count, 0) + 1, response.text
+    assert not [series for series in after if "/offers/metrics/" in series]
+
+    # 领取请求内的数据库和序列化耗时
+    assert after[db_count] == before.get(db_count, 0) + 1
+    assert after[db_sum] > before.get(db_sum, 0)
+    assert after[serialization_count] == before.get(serialization_count, 0) + 1
+    assert after[serialization_sum] > before.get(serialization_sum, 0)
+
+    # instrument_engine 记录的异步引擎连接池等待时间
+    assert after[pool_wait_count] > before.get(pool_wait_count, 0)
+    assert after[pool_wait_bucket] == after[pool_wait_count]
+
+    assert after[claimed] == before.get(claimed, 0) + 1
+    assert after['offer_remaining_codes{offer="metrics"}'] == 4
+    assert after['offer_total_codes{offer="metrics"}'] == 5
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("多线程分片合并", test_sharded_recording_merges_across_threads),
+        ("文本格式", test_exposition_format),
+        ("领取后抓取指标接口", test_metrics_endpoint_after_claim),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 指标测试通过！")
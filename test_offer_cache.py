@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+offer信息缓存测试
+1. strict模式下领取和修改立即使缓存失效，invalidate() 可以使全部条目失效
+2. 回源期间发生领取或失效时，put() 丢弃回源前读到的旧数据
+3. 不存在的offer按负缓存TTL缓存，过期后重新回源
+4. lag模式下领取直接扣减缓存中的剩余数量，不低于0
+
+使用方法:
+python test_offer_cache.py
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from services.offer_cache import MISS, MODE_LAG, MODE_STRICT, OfferInfoCache
+
+
+def payload(remaining: int) -> dict:
+    return {"success": True, "data": {"name": "demo", "remaining_count": remaining}}
+
+
+def test_strict_invalidation():
+    cache = OfferInfoCache(mode=MODE_STRICT, ttl_ms=60000)
+    cache.put("demo", payload(5))
+    cache.put("other", payload(1))
+    assert cache.get("demo") == payload(5)
+
+    cache.on_claim("demo")
+    assert cache.get("demo") is MISS and cache.get("other") == payload(1)
+
+    cache.put("demo", payload(4))
+    cache.on_change("demo")
+    assert cache.get("demo") is MISS
+
+    cache.put("demo", payload(4))
+    cache.invalidate()
+    assert cache.get("demo") is MISS and cache.get("other") is MISS
+    assert cache.invalidations == 3
+
+
+def test_stale_put_is_dropped():
+    for mode in (MODE_STRICT, MODE_LAG):
+        cache = OfferInfoCache(mode=mode, ttl_ms=60000)
+
+        # 回源读到5个之后、写入缓存之前发生了一次领取
+        version = cache.version("demo")
+        cache.on_claim("demo")
+        encoded = cache.put("demo", payload(5), version)
+        assert encoded is not None, "丢弃写入时仍返回编码结果"
+        assert cache.get("demo") is MISS, mode
+        assert cache.stale_puts == 1
+
+        # 重新回源后的写入正常生效，其他offer不受影响
+        other_version = cache.version("other")
+        version = cache.version("demo")
+        cache.put("demo", payload(4), version)
+        assert cache.get("demo") == payload(4)
+
+        # 全部失效同样使回源前的版本号作废
+        cache.invalidate()
+        cache.put("other", payload(1), other_version)
+        assert cache.get("other") is MISS and cache.stale_puts == 2
+
+        # 不传版本号时直接写入
+        cache.put("other", payload(1))
+        assert cache.get("other") == payload(1)
+
+
+def test_negative_ttl():
+    cache = OfferInfoCache(ttl_ms=60000, negative_ttl_ms=50)
+    cache.put("missing", None)
+    assert cache.get("missing") is None and cache.get_encoded("missing") is None
+    time.sleep(0.1)
+    assert cache.get("missing") is MISS and cache.get_encoded("missing") is MISS
+
+    # 负缓存的条目在offer创建后立即失效
+    cache.put("missing", None)
+    cache.on_change("missing")
+    assert cache.get("missing") is MISS
+
+
+def test_lag_mode_decrement():
+    cache = OfferInfoCache(mode=MODE_LAG, ttl_ms=60000)
+    cache.put("demo", payload(3))
+    cache.on_claim("demo")
+    assert cache.get("demo")["data"]["remaining_count"] == 2
+    cache.on_claim("demo", 5)
+    assert cache.get("demo")["data"]["remaining_count"] == 0
+
+    # 负缓存和未缓存的offer不受领取影响
+    cache.put("missing", None)
+    cache.on_claim("missing")
+    cache.on_claim("unknown")
+    assert cache.get("missing") is None and cache.get("unknown") is MISS
+    assert cache.invalidations == 0
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("strict模式失效", test_strict_invalidation),
+        ("丢弃过期写入", test_stale_put_is_dropped),
+        ("负缓存TTL", test_negative_ttl),
+        ("lag模式就地扣减", test_lag_mode_decrement),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 offer信息缓存测试通过！")
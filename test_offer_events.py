@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+offer剩余数量实时推送测试
+1. 订阅后立即收到当前数据，发布后收到最新数据；两次读取之间的多次变化合并为一次
+2. 没有变化时按心跳间隔产出心跳，最后一个订阅者断开后频道被移除
+3. 发布协程只查询有订阅者的offer，数值不变时不推送
+4. SSE接口：未知offer返回404，已知offer先推送当前数量，领取后推送新的剩余数量
+
+使用方法:
+python test_offer_events.py
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from fastapi import FastAPI
+
+from config.settings import settings
+from models.database import dispose_async_engine
+from routers.offers import router as offers_router
+from services.code_service import CodeService
+from services.offer_events import OfferEventHub, format_sse, offer_event_hub
+from services.offer_service import OfferService
+from test_claim_concurrency import app_database
+
+
+def payload(remaining: int, total: int = 10) -> dict:
+    return {"name": "demo", "total_count": total, "remaining_count": remaining, "is_active": True}
+
+
+class StaticHub(OfferEventHub):
+    """从字典读取计数的推送中心，用于测试发布逻辑"""
+
+    def __init__(self, counts: dict, **kwargs):
+        super().__init__(**kwargs)
+        self.counts = counts
+        self.fetched = []
+
+    async def _fetch(self, names):
+        self.fetched.append(sorted(names))
+        return {name: self.counts[name] for name in names if name in self.counts}
+
+
+def test_publish_and_coalesce():
+    async def run():
+        hub = OfferEventHub(heartbeat_seconds=5)
+        stream = hub.stream("demo", payload(10))
+        first = await stream.__anext__()
+        # 订阅者读取前发生的多次变化只推送最新的一次
+        hub.publish("demo", payload(9))
+        hub.publish("demo", payload(8))
+        hub.publish("demo", payload(8))
+        second = await asyncio.wait_for(stream.__anext__(), 1)
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.05)
+        assert not pending.done(), "没有变化时不应推送"
+        hub.publish("demo", payload(7))
+        third = await asyncio.wait_for(pending, 1)
+        await stream.aclose()
+        await hub.stop()
+        return first, second, third, hub
+
+    first, second, third, hub = asyncio.run(run())
+    assert [p["remaining_count"] for p in (first, second, third)] == [10, 8, 7]
+    assert hub.published == 3
+    assert hub.stats()["subscribers"] == 0 and hub.stats()["channels"] == 0
+
+
+def test_heartbeat_and_subscriber_limit():
+    async def run():
+        hub = OfferEventHub(heartbeat_seconds=0.05, max_subscribers=1)
+        stream = hub.stream("demo", payload(10))
+        await stream.__anext__()
+        heartbeat = await asyncio.wait_for(stream.__anext__(), 1)
+        assert hub.is_full()
+        await stream.aclose()
+        assert not hub.is_full()
+        await hub.stop()
+        return heartbeat
+
+    assert asyncio.run(run()) is None
+    assert format_sse(None) == b": ping\n\n"
+    message = format_sse(payload(3), 4).decode("utf-8")
+    assert message.startswith("event: remaining\nid: 4\ndata: ") and message.endswith("\n\n")
+
+
+def test_poll_only_subscribed_offers():
+    async def run():
+        counts = {"demo": payload(10), "other": payload(5)}
+        hub = StaticHub(counts, heartbeat_seconds=5)
+        await hub.poll_once()
+        assert hub.fetched == [], "没有订阅者时不应查询"
+
+        stream = hub.stream("demo", payload(10))
+        await stream.__anext__()
+        await hub.poll_once()
+        assert hub.published == 0, "数值不变时不应推送"
+        counts["demo"] = payload(6)
+        await hub.poll_once()
+        update = await asyncio.wait_for(stream.__anext__(), 1)
+        await stream.aclose()
+        await hub.stop()
+        return hub, update
+
+    hub, update = asyncio.run(run())
+    assert hub.fetched == [["demo"], ["demo"]]
+    assert update["remaining_count"] == 6
+
+
+async def read_events(app, path: str, count: int, on_open=None):
+    """直接调用ASGI应用读取事件流的前count个事件，然后模拟客户端断开"""
+    messages = asyncio.Queue()
+    disconnected = asyncio.Event()
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await messages.put(message)
+
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"test")], "client": ("127.0.0.1", 1234), "server": ("test", 80)
+    }
+    task = asyncio.ensure_future(app(scope, receive, send))
+    start = await asyncio.wait_for(messages.get(), 5)
+    events, buffer = [], b""
+    if start["status"] == 200:
+        if on_open:
+            await on_open()
+        while len(events) < count:
+            buffer += (await asyncio.wait_for(messages.get(), 5)).get("body", b"")
+            *blocks, buffer = buffer.split(b"\n\n")
+            for block in blocks:
+                lines = block.decode("utf-8").split("\n")
+                data = [line[len("data: "):] for line in lines if line.startswith("data: ")]
+                if data:
+                    events.append(json.loads(data[0]))
+    disconnected.set()
+    await asyncio.wait_for(task, 5)
+    return start, events
+
+
+def test_sse_endpoint():
+    app = FastAPI()
+    app.include_router(offers_router, prefix=settings.api_v1_prefix)
+
+    async def claim_two():
+        db = SessionLocal()
+        try:
+            CodeService(db).claim_code("live")
+            CodeService(db).claim_code("live")
+        finally:
+            db.close()
+
+    async def run():
+        missing, _ = await read_events(app, "/api/v1/offers/nope/events", 0)
+        start, events = await read_events(app, "/api/v1/offers/live/events", 2, on_open=claim_two)
+        await offer_event_hub.stop()
+        await dispose_async_engine()
+        return missing, start, events
+
+    # 推送频率在创建全局hub时按配置确定，测试中调快以免等待
+    interval = offer_event_hub.interval
+    offer_event_hub.interval = 1.0 / 20
+    try:
+        with tempfile.TemporaryDirectory() as tmp, app_database(str(Path(tmp) / "events.db")) as SessionLocal:
+            db = SessionLocal()
+            try:
+                OfferService(db).create_offer("live", "实时推送")
+                CodeService(db).import_codes("live", [f"LIVE{i:04d}" for i in range(5)])
+            finally:
+                db.close()
+            missing, start, events = asyncio.run(run())
+    finally:
+        offer_event_hub.interval = interval
+
+    assert missing["status"] == 404
+    headers = dict(start["headers"])
+    assert headers[b"content-type"].startswith(b"text/event-stream")
+    assert headers[b"cache-control"] == b"no-cache"
+    assert [e["remaining_count"] for e in events] == [5, 3], events
+    assert offer_event_hub.stats()["subscribers"] == 0
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("发布与合并", test_publish_and_coalesce),
+        ("心跳与连接数上限", test_heartbeat_and_subscriber_limit),
+        ("只查询有订阅者的offer", test_poll_only_subscribed_offers),
+        ("SSE接口", test_sse_endpoint),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 实时推送测试通过！")
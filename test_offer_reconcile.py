@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+offer计数对账测试
+1. 导入和领取增量维护的计数与实际数量一致，对账不报告偏差
+2. 计数被改乱后，对账按实际数量修正（领取池预留的邀请码计入剩余数量）
+3. 对账期间发生的领取不会被修正覆盖
+4. 命令行工具 --dry-run 只报告偏差，不修改
+
+使用方法:
+python test_offer_reconcile.py
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+
+# 添加backend目录到路径
+sys.path.insert(0, str(BACKEND_DIR))
+
+from models.offer import Offer
+from services import offer_reconciler
+from services.claim_engine import ClaimEngine
+from services.code_service import CodeService
+from services.offer_reconciler import find_drift, reconcile_offer_counts
+from test_claim_concurrency import make_session_factory, seed_offer
+
+
+def offer_counts(SessionLocal, name: str):
+    db = SessionLocal()
+    try:
+        offer = db.query(Offer).filter(Offer.name == name).one()
+        return offer.total_count, offer.remaining_count
+    finally:
+        db.close()
+
+
+def corrupt(SessionLocal, name: str, total: int, remaining: int):
+    db = SessionLocal()
+    try:
+        db.query(Offer).filter(Offer.name == name).update({"total_count": total, "remaining_count": remaining})
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_incremental_counters_have_no_drift():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "reconcile.db"))
+        seed_offer(SessionLocal, "steady", 50)
+        db = SessionLocal()
+        try:
+            CodeService(db).import_codes("steady", [f"EXTRA{i}" for i in range(10)])
+            for _ in range(7):
+                CodeService(db).claim_code("steady")
+            assert find_drift(db) == []
+        finally:
+            db.close()
+        assert offer_counts(SessionLocal, "steady") == (60, 53)
+
+
+def test_drift_fixed_including_reservations():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "reconcile.db"))
+        seed_offer(SessionLocal, "drifted", 40)
+        db = SessionLocal()
+        try:
+            for _ in range(5):
+                CodeService(db).claim_code("drifted")
+            # 预留的邀请码已标记is_used，但尚未发放，仍应计入剩余数量
+            ClaimEngine(db).reserve("drifted", 10, "test-worker")
+        finally:
+            db.close()
+
+        corrupt(SessionLocal, "drifted", 0, 999)
+        db = SessionLocal()
+        try:
+            drifts = reconcile_offer_counts(db)
+            assert len(drifts) == 1
+            assert (drifts[0].expected_total, drifts[0].expected_remaining) == (40, 35)
+            assert find_drift(db) == []
+        finally:
+            db.close()
+        assert offer_counts(SessionLocal, "drifted") == (40, 35)
+
+
+def test_concurrent_claim_not_overwritten():
+    with tempfile.TemporaryDirectory() as tmp:
+        SessionLocal = make_session_factory(str(Path(tmp) / "reconcile.db"))
+        seed_offer(SessionLocal, "busy", 20)
+        corrupt(SessionLocal, "busy", 20, 25)
+
+        original = offer_reconciler.find_drift
+
+        def find_then_claim(db, offer_ids=None):
+            drifts = original(db, offer_ids)
+            db.rollback()
+            # 统计之后、修正之前有一次领取提交
+            other = SessionLocal()
+            try:
+                CodeService(other).claim_code("busy")
+            finally:
+                other.close()
+            return drifts
+
+        offer_reconciler.find_drift = find_then_claim
+        db = SessionLocal()
+        try:
+            reconcile_offer_counts(db)
+        finally:
+            offer_reconciler.find_drift = original
+            db.close()
+        assert offer_counts(SessionLocal, "busy") == (20, 19)
+
+
+def test_cli_dry_run():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "cli.db"
+        SessionLocal = make_session_factory(str(db_path))
+        seed_offer(SessionLocal, "cli", 10)
+        corrupt(SessionLocal, "cli", 3, 3)
+
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+        command = [sys.executable, "-m", "cli.reconcile"]
+        dry = subprocess.run(command + ["--dry-run"], cwd=str(BACKEND_DIR), env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        assert dry.returncode == 1, dry.stdout
+        assert "cli" in dry.stdout
+        assert offer_counts(SessionLocal, "cli") == (3, 3)
+
+        fixed = subprocess.run(command, cwd=str(BACKEND_DIR), env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        assert fixed.returncode == 0, fixed.stdout
+        assert offer_counts(SessionLocal, "cli") == (10, 10)
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("增量计数无偏差", test_incremental_counters_have_no_drift),
+        ("修正偏差（含预留）", test_drift_fixed_including_reservations),
+        ("并发领取不被覆盖", test_concurrent_claim_not_overwritten),
+        ("命令行 --dry-run", test_cli_dry_run),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 offer计数对账测试通过！")
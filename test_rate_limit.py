@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+按IP限流测试
+1. 内存令牌桶：超过容量后拒绝，按速率补充，空闲键被淘汰且总键数有上限
+2. SQLite共享存储：两个后端实例（模拟两个worker）共用同一份计数
+3. 中间件：被拒绝的请求返回429，不会进入后面的应用（不访问数据库）
+4. 应用中CORS位于限流外层，跨域请求被限流时429响应同样带CORS头，浏览器能读到限流提示
+
+使用方法:
+python test_rate_limit.py
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import httpx
+
+from middleware.rate_limit import (
+    MemoryRateLimitBackend, RateLimitMiddleware, SQLiteRateLimitBackend, TokenBucket
+)
+
+
+def test_memory_bucket_limits_and_refills():
+    backend = MemoryRateLimitBackend(TokenBucket(capacity=3, per_hour=3600))
+    now = 1000.0
+    results = [backend.hit("1.1.1.1", now)[0] for _ in range(4)]
+    assert results == [True, True, True, False], results
+
+    allowed, retry_after = backend.hit("1.1.1.1", now)
+    assert not allowed and 0 < retry_after <= 1.0, retry_after
+    # 其他IP不受影响
+    assert backend.hit("2.2.2.2", now)[0]
+    # 每秒补充一个令牌
+    assert backend.hit("1.1.1.1", now + 1.0)[0]
+    assert not backend.hit("1.1.1.1", now + 1.0)[0]
+
+
+def test_memory_bucket_evicts_idle_and_caps_keys():
+    bucket = TokenBucket(capacity=2, per_hour=3600)
+    backend = MemoryRateLimitBackend(bucket, max_keys=100)
+    for i in range(50):
+        backend.hit(f"10.0.0.{i}", 0.0)
+    assert len(backend) == 50
+    # 超过idle_ttl后，再有请求时从队头淘汰空闲的键
+    backend.hit("new", bucket.idle_ttl + 1)
+    assert len(backend) < 50, len(backend)
+
+    for i in range(500):
+        backend.hit(f"10.1.{i // 256}.{i % 256}", 10000.0)
+    assert len(backend) <= 100, len(backend)
+
+
+def test_sqlite_backend_shared_between_workers():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "rate_limit.db")
+        bucket = TokenBucket(capacity=4, per_hour=1)
+        worker_a = SQLiteRateLimitBackend(bucket, path)
+        worker_b = SQLiteRateLimitBackend(bucket, path)
+        try:
+            results = [(worker_a if i % 2 else worker_b).hit("1.1.1.1", 1000.0)[0] for i in range(6)]
+            assert results == [True, True, True, True, False, False], results
+        finally:
+            worker_a.close()
+            worker_b.close()
+
+
+def test_middleware_rejects_before_app():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    limited = RateLimitMiddleware(
+        app, MemoryRateLimitBackend(TokenBucket(capacity=2, per_hour=10)),
+        path_pattern=r"^/api/v1/offers/[^/]+/claim$"
+    )
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=limited), base_url="http://t") as c:
+            statuses = [(await c.post("/api/v1/offers/demo/claim")).status_code for _ in range(5)]
+            rejected = await c.post("/api/v1/offers/demo/claim")
+            # 其他路由不限流
+            info = [(await c.get("/api/v1/offers/demo/info")).status_code for _ in range(5)]
+            return statuses, rejected, info
+
+    statuses, rejected, info = asyncio.run(run())
+    assert statuses == [200, 200, 429, 429, 429], statuses
+    assert rejected.json()["detail"]["error_code"] == "RATE_LIMITED"
+    assert int(rejected.headers["retry-after"]) > 0
+    assert info == [200] * 5
+    assert calls.count("/api/v1/offers/demo/claim") == 2, calls
+
+
+def test_rate_limited_response_has_cors_headers():
+    from main import app, rate_limit_backend
+    from config.settings import settings
+
+    assert rate_limit_backend is not None, "默认应开启限流"
+    client = "203.0.113.80"
+    origin = settings.cors_origins[0]
+    # 用完该IP的令牌，下一次申请直接被限流中间件拒绝
+    while rate_limit_backend.hit(client, time.time())[0]:
+        pass
+
+    async def run():
+        transport = httpx.ASGITransport(app=app, client=(client, 40000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            return await c.post("/api/v1/offers/demo/claim", headers={"Origin": origin})
+
+    rejected = asyncio.run(run())
+    assert rejected.status_code == 429, rejected.text
+    assert rejected.headers.get("access-control-allow-origin") == origin, dict(rejected.headers)
+    assert rejected.json()["detail"]["error_code"] == "RATE_LIMITED"
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("内存令牌桶限流与补充", test_memory_bucket_limits_and_refills),
+        ("空闲键淘汰与容量上限", test_memory_bucket_evicts_idle_and_caps_keys),
+        ("SQLite共享计数", test_sqlite_backend_shared_between_workers),
+        ("中间件在进入应用前拒绝", test_middleware_rejects_before_app),
+        ("限流响应带CORS头", test_rate_limited_response_has_cors_headers),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 限流测试通过！")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+SQLite生产配置测试
+1. 新建连接上生效的PRAGMA（WAL、synchronous=NORMAL、busy_timeout等）和连接池类型
+2. 写锁被其他连接长时间占用时，database is locked 会按退避策略重试并最终成功
+3. 非锁冲突的错误不重试，重试次数用尽后抛出原始错误
+
+使用方法:
+python test_sqlite_profile.py
+"""
+
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+from config.settings import settings
+from models.database import create_db_engine, is_database_locked, retry_on_locked
+
+
+def _locked_error(message: str = "database is locked") -> OperationalError:
+    return OperationalError("UPDATE invitation_codes ...", {}, sqlite3.OperationalError(message))
+
+
+def test_pragmas_applied_on_connect():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{tmp}/profile.db", "test")
+        try:
+            assert isinstance(engine.pool, QueuePool), f"连接池类型错误: {type(engine.pool)}"
+            with engine.connect() as conn:
+                pragma = lambda name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                assert pragma("journal_mode") == "wal"
+                assert pragma("synchronous") == 1, "synchronous应为NORMAL"
+                assert pragma("busy_timeout") == settings.sqlite_busy_timeout_ms
+                assert pragma("cache_size") == settings.sqlite_cache_size
+                assert pragma("temp_store") == 2, "temp_store应为MEMORY"
+        finally:
+            engine.dispose()
+
+
+def test_retry_until_lock_released():
+    original_timeout = settings.sqlite_busy_timeout_ms
+    # busy_timeout调低，让锁冲突尽快以 database is locked 的形式暴露出来
+    settings.sqlite_busy_timeout_ms = 10
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/locked.db"
+            engine = create_db_engine(f"sqlite:///{path}", "test")
+            with engine.begin() as conn:
+                conn.exec_driver_sql("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+
+            holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            holder.execute("BEGIN IMMEDIATE")
+            release = threading.Timer(0.15, lambda: holder.execute("COMMIT"))
+            release.start()
+
+            attempts = []
+
+            def write():
+                attempts.append(time.perf_counter())
+                with engine.begin() as conn:
+                    conn.exec_driver_sql("INSERT INTO t DEFAULT VALUES")
+
+            try:
+                retry_on_locked(write)
+            finally:
+                release.join()
+                holder.close()
+
+            with engine.connect() as conn:
+                assert conn.exec_driver_sql("SELECT COUNT(*) FROM t").scalar() == 1
+            assert len(attempts) > 1, "应在写锁释放前至少重试一次"
+            engine.dispose()
+    finally:
+        settings.sqlite_busy_timeout_ms = original_timeout
+
+
+def test_non_lock_errors_and_exhausted_retries():
+    assert is_database_locked(_locked_error())
+    assert not is_database_locked(_locked_error("no such table: offers"))
+
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise _locked_error("no such table: offers")
+
+    try:
+        retry_on_locked(broken)
+    except OperationalError:
+        pass
+    assert len(calls) == 1, "非锁冲突错误不应重试"
+
+    original = settings.db_lock_retries, settings.db_lock_retry_base_ms
+    settings.db_lock_retries, settings.db_lock_retry_base_ms = 2, 1
+    calls.clear()
+
+    def always_locked():
+        calls.append(1)
+        raise _locked_error()
+
+    try:
+        retry_on_locked(always_locked)
+    except OperationalError as e:
+        assert is_database_locked(e)
+    else:
+        raise AssertionError("重试次数用尽后应抛出原始错误")
+    finally:
+        settings.db_lock_retries, settings.db_lock_retry_base_ms = original
+    assert len(calls) == 3, f"应尝试3次，实际{len(calls)}次"
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("连接PRAGMA与连接池", test_pragmas_applied_on_connect),
+        ("写锁释放后重试成功", test_retry_until_lock_released),
+        ("重试边界", test_non_lock_errors_and_exhausted_retries),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 SQLite生产配置测试通过！")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+offer页面服务端渲染测试
+1. 模板拆分后填入标题、描述、剩余数量和内嵌的 /info 响应，内容做HTML转义
+2. 同一offer重复请求不重新渲染，领取后offer信息变化才重新渲染
+3. 渲染结果支持304，返回较短的共享缓存时间；offer不存在时返回原始页面
+
+使用方法:
+python test_ssr_offer_page.py
+"""
+
+import asyncio
+import json
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加backend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import httpx
+
+from models.database import dispose_async_engine
+from services.code_service import CodeService
+from services.offer_page import OfferPageTemplate
+from services.offer_service import OfferService
+from test_claim_concurrency import app_database
+
+INLINE_INFO = re.compile(r"<script>window\.__OFFER_INFO__ = (.*?);</script>")
+
+
+def test_template_render():
+    page = (Path(__file__).parent / "frontend" / "index.html").read_text(encoding="utf-8")
+    template = OfferPageTemplate(page)
+    assert set(template.slots) == {"page_title", "title", "description", "progress", "remaining", "total", "info"}
+
+    info = {"name": "demo", "title": "<b>内测</b>", "description": None, "total_count": 8, "remaining_count": 2}
+    body = json.dumps({"success": True, "data": dict(info, description="</script>")}).encode("utf-8")
+    html = template.render(info, body).decode("utf-8")
+
+    assert "<title>&lt;b&gt;内测&lt;/b&gt; - 邀请码领取</title>" in html
+    assert 'id="offerTitle">&lt;b&gt;内测&lt;/b&gt;<' in html
+    assert "获取您的专属邀请码" in html
+    assert 'id="remainingCount">2<' in html and 'id="totalCount">8<' in html
+    assert 'style="width: 25%"' in html
+    inline = INLINE_INFO.search(html).group(1)
+    assert "</script>" not in inline and json.loads(inline)["data"]["description"] == "</script>"
+
+
+def test_rendered_page_cached_until_offer_changes():
+    from main import app, offer_pages
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+            first = await c.get("/offer/ssr", headers={"Accept-Encoding": "gzip"})
+            renders = offer_pages.renders
+            again = await c.get("/offer/ssr", headers={"Accept-Encoding": "gzip",
+                                                       "If-None-Match": first.headers["etag"]})
+            renders_after_repeat = offer_pages.renders
+            await c.post("/api/v1/offers/ssr/claim")
+            changed = await c.get("/offer/ssr", headers={"If-None-Match": first.headers["etag"]})
+            missing = await c.get("/offer/none")
+        await dispose_async_engine()
+        return first, renders, again, renders_after_repeat, changed, missing
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            app_database(str(Path(tmp) / "ssr.db"), offer_page_ssr=True) as SessionLocal:
+        db = SessionLocal()
+        try:
+            OfferService(db).create_offer("ssr", "服务端渲染", "渲染测试")
+            CodeService(db).import_codes("ssr", [f"SSR{i:04d}" for i in range(5)])
+        finally:
+            db.close()
+        first, renders, again, renders_after_repeat, changed, missing = asyncio.run(run())
+
+    assert first.status_code == 200 and first.headers["content-encoding"] == "gzip"
+    assert 'id="offerTitle">服务端渲染<' in first.text and 'id="remainingCount">5<' in first.text
+    assert json.loads(INLINE_INFO.search(first.text).group(1))["data"]["remaining_count"] == 5
+    assert "s-maxage=5" in first.headers["cache-control"]
+
+    assert again.status_code == 304 and renders_after_repeat == renders == 1
+
+    assert changed.status_code == 200 and 'id="remainingCount">4<' in changed.text
+    assert changed.headers["etag"] != first.headers["etag"] and offer_pages.renders == 2
+
+    assert missing.status_code == 200 and INLINE_INFO.search(missing.text) is None
+    assert missing.headers["cache-control"] == "no-cache"
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("模板渲染与转义", test_template_render),
+        ("渲染结果缓存到offer变化", test_rendered_page_cached_until_offer_changes),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 offer页面服务端渲染测试通过！")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+前端静态文件服务测试
+1. 内存缓存：预压缩版本、ETag/Last-Modified条件请求、带哈希文件名的长期缓存、文件修改后重新加载
+2. 后端 /offer/{name} 与 /static/* 从缓存返回并支持304
+3. frontend/server.py 多线程处理请求：一个未发完请求的连接不会阻塞其他请求
+
+使用方法:
+python test_static_assets.py
+"""
+
+import asyncio
+import gzip
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+# 添加backend和frontend目录到路径
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent / "frontend"))
+
+import httpx
+
+from services.static_assets import CACHE_CONTROL_IMMUTABLE, CACHE_CONTROL_REVALIDATE, StaticAssetCache
+
+PAGE = "<html><body>" + "邀请码发放 " * 200 + "</body></html>"
+
+
+def test_cache_compression_and_conditional_requests():
+    with tempfile.TemporaryDirectory() as tmp:
+        Path(tmp, "index.html").write_text(PAGE, encoding="utf-8")
+        Path(tmp, "app.3f9a8b7c01.js").write_text("console.log('hi');" * 50)
+        cache = StaticAssetCache(tmp, check_interval=60)
+
+        asset = cache.get("/index.html")
+        assert cache.get("index.html") is asset and cache.get("./a/../index.html") is asset
+        assert cache.loads == 1
+
+        status, headers, body = asset.respond({"accept-encoding": "gzip, deflate"})
+        assert status == 200 and headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(body).decode("utf-8") == PAGE
+        assert headers["Cache-Control"] == CACHE_CONTROL_REVALIDATE
+        assert headers["Content-Type"] == "text/html; charset=utf-8"
+
+        status, plain_headers, body = asset.respond({})
+        assert status == 200 and "Content-Encoding" not in plain_headers and body.decode("utf-8") == PAGE
+        assert plain_headers["ETag"] != headers["ETag"]
+
+        # ETag与所选压缩版本一致时返回304，没有If-None-Match时按Last-Modified判断
+        status, _, body = asset.respond({"accept-encoding": "gzip", "if-none-match": headers["ETag"]})
+        assert status == 304 and body == b""
+        assert asset.respond({"if-none-match": headers["ETag"]})[0] == 200
+        assert asset.respond({"if-modified-since": headers["Last-Modified"]})[0] == 304
+        assert asset.respond({"if-modified-since": "Mon, 01 Jan 2001 00:00:00 GMT"})[0] == 200
+        assert asset.respond({"accept-encoding": "gzip;q=0"})[1].get("Content-Encoding") is None
+
+        hashed = cache.get("app.3f9a8b7c01.js")
+        assert hashed.respond({})[1]["Cache-Control"] == CACHE_CONTROL_IMMUTABLE
+
+        # 目录外的文件和不存在的文件
+        assert cache.get("../" + Path(tmp).name + "/index.html") is None
+        assert cache.get("missing.html") is None
+
+
+def test_reload_after_change():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = Path(tmp, "index.html")
+        index.write_text("v1")
+        cache = StaticAssetCache(tmp, check_interval=0.05)
+        first = cache.get("index.html")
+        index.write_text("version 2")
+        os.utime(index, (time.time() + 10, time.time() + 10))
+        assert cache.get("index.html") is first
+        time.sleep(0.1)
+        assert cache.get("index.html").respond({})[2] == b"version 2"
+        assert cache.loads == 2
+
+
+def test_backend_serves_from_cache():
+    from main import app
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+            page = await c.get("/offer/fellou", headers={"Accept-Encoding": "gzip"})
+            again = await c.get("/offer/other", headers={"Accept-Encoding": "gzip",
+                                                          "If-None-Match": page.headers["etag"]})
+            head = await c.head("/offer/fellou")
+            static = await c.get("/static/index.html")
+            missing = await c.get("/static/missing.js")
+            escape = await c.get("/static/..%2Fbackend%2Fmain.py")
+        return page, again, head, static, missing, escape
+
+    page, again, head, static, missing, escape = asyncio.run(run())
+    assert page.status_code == 200 and page.headers["content-encoding"] == "gzip"
+    assert "<html" in page.text.lower()
+    assert again.status_code == 304 and again.content == b""
+    assert head.status_code == 200 and head.content == b"" and int(head.headers["content-length"]) > 0
+    assert static.status_code == 200 and static.headers["etag"]
+    assert missing.status_code == 404 and escape.status_code == 404
+
+
+def test_frontend_server_is_concurrent():
+    import server
+
+    httpd = server.ThreadingHTTPServer(("127.0.0.1", 0), server.SinglePageAppHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    port = httpd.server_address[1]
+    slow = socket.create_connection(("127.0.0.1", port))
+    try:
+        # 只发送一半请求头，单线程服务器会一直等待这个连接
+        slow.sendall(b"GET /offer/fellou HTTP/1.1\r\nHost: t\r\n")
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/offer/fellou",
+                                         headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            assert response.status == 200
+            assert response.headers["Content-Encoding"] == "gzip"
+            etag = response.headers["ETag"]
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/index.html",
+                                         headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        try:
+            urllib.request.urlopen(request, timeout=5)
+            assert False, "应返回304"
+        except urllib.error.HTTPError as e:
+            assert e.code == 304
+    finally:
+        slow.close()
+        httpd.shutdown()
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    for name, test in [
+        ("缓存、压缩与条件请求", test_cache_compression_and_conditional_requests),
+        ("文件修改后重新加载", test_reload_after_change),
+        ("后端页面从缓存返回", test_backend_serves_from_cache),
+        ("前端服务器并发处理请求", test_frontend_server_is_concurrent),
+    ]:
+        try:
+            test()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            print(f"❌ {name}: {e}")
+            sys.exit(1)
+    print("\n🎉 静态文件服务测试通过！")